@@ -0,0 +1 @@
+# Radice del repository nel sys.path: i test importano il pacchetto glicogeno senza installarlo
@@ -0,0 +1,6 @@
+"""
+Moduli di supporto del Glycogen Simulator Pro (archivio, cache, servizi).
+"""
+
+# URL SQLAlchemy dell'archivio / cache condivisa (opzionale)
+DB_URL_ENV = "GLICOGENO_DB_URL"
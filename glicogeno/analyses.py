@@ -0,0 +1,102 @@
+"""
+Analisi lunghe suddivise in task indipendenti per glicogeno.jobs.
+
+Ogni funzione `*_tasks` restituisce una lista di (funzione, argomenti) eseguibili
+in un processo separato; le funzioni di chunk sono a livello di modulo (picklabili).
+"""
+from dataclasses import replace
+
+import numpy as np
+
+from glicogeno.engine import ActivityParams, calculate_hourly_tapering, simulate_metabolism
+from glicogeno.scenario import bonk_minute
+
+# Dispersione delle variabili nel Monte Carlo (deviazione standard relativa)
+MC_INTENSITY_SD = 0.05   # potenza / FC / velocità media
+MC_INTAKE_SD = 0.10      # CHO effettivamente assunti (porzioni saltate o extra)
+MC_TAU_SD = 0.20         # cinetica di assorbimento
+MC_TANK_SD = 0.05        # serbatoio di partenza
+# Efficienza di ossidazione dei CHO ingeriti (Podlogar et al., 2025: 58-83%)
+MC_OXIDATION_RANGE = (0.58, 0.83)
+
+MC_CHUNK_SIZE = 25
+
+
+def monte_carlo_chunk(tank_data, subject, race, seed, n_runs):
+    """
+    n_runs simulazioni con parametri perturbati; un dizionario di esito per run.
+    `race` contiene gli argomenti di simulate_metabolism (tranne serbatoio e soggetto).
+    Con un piano a eventi (race['feeding_plan']) la perturbazione dei CHO assunti scala
+    i grammi di ogni evento; con race['gut_model'] l'assorbimento usa il modello a compartimenti.
+    """
+    rng = np.random.default_rng(seed)
+    base_act = ActivityParams.coerce(race['activity_params'])
+    base_plan = race.get('feeding_plan')
+    outcomes = []
+    for _ in range(n_runs):
+        intensity_k = max(0.5, rng.normal(1.0, MC_INTENSITY_SD))
+        act = replace(base_act, avg_watts=base_act.avg_watts * intensity_k, avg_hr=base_act.avg_hr * intensity_k,
+                      speed_kmh=base_act.speed_kmh * intensity_k,
+                      intensity_factor=base_act.intensity_factor * intensity_k)
+
+        tank_k = max(0.5, rng.normal(1.0, MC_TANK_SD))
+        tank = dict(tank_data)
+        tank['muscle_glycogen_g'] = tank_data['muscle_glycogen_g'] * tank_k
+        tank['liver_glycogen_g'] = tank_data['liver_glycogen_g'] * tank_k
+        tank['actual_available_g'] = tank['muscle_glycogen_g'] + tank['liver_glycogen_g']
+
+        intake_k = max(0.0, rng.normal(1.0, MC_INTAKE_SD))
+        intake = race['carb_intake'] * intake_k
+        plan = None
+        if base_plan is not None:
+            plan = replace(base_plan, grams=tuple(g * intake_k for g in base_plan.grams))
+            intake = plan.average_g_h(race['duration'])
+        tau = max(5.0, race['tau_absorption'] * rng.normal(1.0, MC_TAU_SD))
+        oxidation = rng.uniform(*MC_OXIDATION_RANGE)
+
+        df, stats = simulate_metabolism(
+            tank, race['duration'], intake, race['cho_per_unit'], race['crossover'], tau,
+            subject, act,
+            oxidation_efficiency_input=oxidation,
+            custom_max_exo_rate=race['custom_max_exo_rate'],
+            mix_type_input=race['mix_type'],
+            intensity_series=race['intensity_series'],
+            feeding_plan=plan,
+            gut_model=race.get('gut_model'),
+        )
+        outcomes.append({
+            'final_glycogen': stats['final_glycogen'],
+            'final_liver': stats['final_liver'],
+            'bonk_min': bonk_minute(df),
+            'intensity_k': intensity_k,
+            'intake_g_h': intake,
+            'oxidation_efficiency': oxidation,
+        })
+    return outcomes
+
+
+def monte_carlo_tasks(tank_data, subject, race, n_runs, seed=0, chunk_size=MC_CHUNK_SIZE):
+    seeds = np.random.SeedSequence(seed).spawn((n_runs + chunk_size - 1) // chunk_size)
+    tasks = []
+    for i, child in enumerate(seeds):
+        n = min(chunk_size, n_runs - i * chunk_size)
+        tasks.append((monte_carlo_chunk, (tank_data, subject, race, int(child.generate_state(1)[0]), n)))
+    return tasks
+
+
+def cho_scaling_point(subject, days, start_state_factor, factor):
+    """
+    Serbatoio finale del diario con i CHO giornalieri moltiplicati per factor.
+    """
+    scaled = [dict(day, cho_in=day['cho_in'] * factor) for day in days]
+    _, tank = calculate_hourly_tapering(subject, scaled, start_state_factor=start_state_factor)
+    return {
+        'factor': factor,
+        'fill_pct': tank['fill_pct'],
+        'muscle_glycogen_g': tank['muscle_glycogen_g'],
+        'liver_glycogen_g': tank['liver_glycogen_g'],
+    }
+
+
+def cho_scaling_tasks(subject, days, start_state_factor, factors):
+    return [(cho_scaling_point, (subject, days, start_state_factor, f)) for f in factors]
@@ -0,0 +1,237 @@
+"""
+Archivio degli oggetti voluminosi delle sessioni Streamlit (traiettorie, file
+interpretati, curve) con budget di memoria per sessione e globale.
+
+Ogni voce è un *input* (mai rimosso: dati inseriti dall'utente, non ricalcolabili)
+oppure un *derivato* con la ricetta per ricalcolarlo (fn, args, kwargs). Oltre il
+budget della sessione, o oltre quello globale, i derivati usati meno di recente
+vengono scartati: alla lettura successiva la ricetta li ricalcola (di solito
+passando dalla cache dei risultati, quindi senza ripetere la simulazione).
+
+Un'istanza per processo (st.cache_resource) serve tutte le sessioni; quelle
+inattive da più di `idle_s` vengono dimenticate, perché Streamlit non segnala la
+chiusura di una sessione.
+"""
+import io
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+SESSION_BUDGET_ENV = "GLICOGENO_SESSION_MB"
+GLOBAL_BUDGET_ENV = "GLICOGENO_ARTIFACTS_MB"
+
+DEFAULT_SESSION_BYTES = 64 * 1024 * 1024
+DEFAULT_GLOBAL_BYTES = 512 * 1024 * 1024
+DEFAULT_IDLE_S = 2 * 3600
+
+# Ogni quante scritture si dimenticano le sessioni inattive
+_SWEEP_EVERY = 50
+
+
+def sizeof(value, _seen=None):
+    """
+    Stima della memoria occupata (byte): DataFrame/Series con memory_usage(deep=True),
+    array numpy con nbytes, file in memoria con il loro buffer, contenitori in modo ricorsivo.
+    """
+    _seen = set() if _seen is None else _seen
+    if id(value) in _seen:
+        return 0
+    _seen.add(id(value))
+    memory_usage = getattr(value, "memory_usage", None)
+    if callable(memory_usage):
+        usage = memory_usage(deep=True, index=True)
+        return int(usage.sum()) if hasattr(usage, "sum") else int(usage)
+    if hasattr(value, "nbytes") and hasattr(value, "dtype"):
+        return int(value.nbytes)
+    if isinstance(value, io.BytesIO):
+        # File caricati (UploadedFile): il buffer senza copiarlo
+        with value.getbuffer() as view:
+            return sys.getsizeof(value) + view.nbytes
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(sizeof(k, _seen) + sizeof(v, _seen) for k, v in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(sizeof(v, _seen) for v in value)
+    return size
+
+
+class _Entry:
+    __slots__ = ("key", "value", "size", "recipe", "resident")
+
+    def __init__(self, key, value, size, recipe):
+        self.key = key
+        self.value = value
+        self.size = size
+        self.recipe = recipe
+        self.resident = True
+
+
+class ArtifactStore:
+    """
+    Voci per (sessione, nome), in un unico ordine LRU tra tutte le sessioni.
+    """
+
+    def __init__(self, session_budget=DEFAULT_SESSION_BYTES, global_budget=DEFAULT_GLOBAL_BYTES,
+                 idle_s=DEFAULT_IDLE_S):
+        self.session_budget = session_budget
+        self.global_budget = global_budget
+        self.idle_s = idle_s
+        self._entries = OrderedDict()   # (sessione, nome) -> _Entry, dal meno recente
+        self._session_bytes = {}
+        self._last_seen = {}
+        self._bytes = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "recomputes": 0, "evictions": 0, "evicted_bytes": 0,
+                      "expired_sessions": 0}
+
+    @classmethod
+    def from_env(cls):
+        """
+        Budget in MB da GLICOGENO_SESSION_MB e GLICOGENO_ARTIFACTS_MB (default 64 e 512).
+        """
+        session_mb = os.environ.get(SESSION_BUDGET_ENV)
+        global_mb = os.environ.get(GLOBAL_BUDGET_ENV)
+        return cls(
+            session_budget=int(float(session_mb) * 1024 * 1024) if session_mb else DEFAULT_SESSION_BYTES,
+            global_budget=int(float(global_mb) * 1024 * 1024) if global_mb else DEFAULT_GLOBAL_BYTES,
+        )
+
+    # --- CONTABILITÀ (con il lock già acquisito) ---
+
+    def _account(self, session_id, delta):
+        self._session_bytes[session_id] = self._session_bytes.get(session_id, 0) + delta
+        self._bytes += delta
+
+    def _release(self, entry, session_id):
+        if entry.resident:
+            self._account(session_id, -entry.size)
+
+    def _evict(self, session_id=None):
+        """
+        Scarta i derivati meno recenti finché la sessione (o, senza sessione, il processo)
+        non rientra nel budget. La voce più recente della sessione non è mai scartata.
+        """
+        if session_id is None:
+            over = lambda: self._bytes > self.global_budget
+        else:
+            over = lambda: self._session_bytes.get(session_id, 0) > self.session_budget
+        if not over():
+            return
+        newest = next(reversed(self._entries), None)
+        for (sid, name), entry in list(self._entries.items()):
+            if not over():
+                break
+            if (sid, name) == newest or not entry.resident or entry.recipe is None:
+                continue
+            if session_id is not None and sid != session_id:
+                continue
+            self._account(sid, -entry.size)
+            self.stats["evictions"] += 1
+            self.stats["evicted_bytes"] += entry.size
+            entry.value = None
+            entry.resident = False
+
+    def _sweep(self, now):
+        idle = [sid for sid, seen in self._last_seen.items() if now - seen > self.idle_s]
+        for sid in idle:
+            self._drop(sid)
+            self.stats["expired_sessions"] += 1
+
+    def _drop(self, session_id):
+        for key in [k for k in self._entries if k[0] == session_id]:
+            self._release(self._entries.pop(key), session_id)
+        self._session_bytes.pop(session_id, None)
+        self._last_seen.pop(session_id, None)
+
+    # --- API ---
+
+    def put(self, session_id, name, value, key=None, recipe=None):
+        """
+        Registra una voce. recipe = (fn, args, kwargs) la rende un derivato scartabile;
+        key identifica gli input da cui è stata ottenuta (vedi get_or_compute).
+        """
+        size = sizeof(value)
+        now = time.time()
+        with self._lock:
+            old = self._entries.pop((session_id, name), None)
+            if old is not None:
+                self._release(old, session_id)
+            self._entries[(session_id, name)] = _Entry(key, value, size, recipe)
+            self._account(session_id, size)
+            self._last_seen[session_id] = now
+            self._evict(session_id)
+            self._evict()
+            self._writes += 1
+            if self._writes % _SWEEP_EVERY == 0:
+                self._sweep(now)
+        return value
+
+    def get(self, session_id, name, default=None):
+        """
+        Valore della voce; un derivato scartato viene ricalcolato con la sua ricetta.
+        """
+        with self._lock:
+            self._last_seen[session_id] = time.time()
+            entry = self._entries.get((session_id, name))
+            if entry is None:
+                self.stats["misses"] += 1
+                return default
+            self._entries.move_to_end((session_id, name))
+            if entry.resident:
+                self.stats["hits"] += 1
+                return entry.value
+            key, recipe = entry.key, entry.recipe
+            self.stats["recomputes"] += 1
+        fn, args, kwargs = recipe
+        return self.put(session_id, name, fn(*args, **kwargs), key=key, recipe=recipe)
+
+    def key(self, session_id, name):
+        with self._lock:
+            entry = self._entries.get((session_id, name))
+            return entry.key if entry is not None else None
+
+    def get_or_compute(self, session_id, name, key, fn, *args, **kwargs):
+        """
+        Derivato calcolato da fn(*args, **kwargs): riusato finché la chiave degli input
+        non cambia, altrimenti ricalcolato e sostituito.
+        """
+        if self.key(session_id, name) == key:
+            return self.get(session_id, name)
+        return self.put(session_id, name, fn(*args, **kwargs), key=key, recipe=(fn, args, kwargs))
+
+    def pop(self, session_id, name):
+        with self._lock:
+            entry = self._entries.pop((session_id, name), None)
+            if entry is not None:
+                self._release(entry, session_id)
+
+    def drop_session(self, session_id):
+        with self._lock:
+            self._drop(session_id)
+
+    def session_bytes(self, session_id):
+        with self._lock:
+            return self._session_bytes.get(session_id, 0)
+
+    def metrics(self):
+        """
+        Occupazione corrente (totale, input/derivati, per sessione) e contatori.
+        """
+        with self._lock:
+            input_bytes = sum(e.size for e in self._entries.values() if e.resident and e.recipe is None)
+            sessions = sorted(self._session_bytes.items(), key=lambda kv: kv[1], reverse=True)
+            return {
+                "sessions": len(self._last_seen),
+                "entries": len(self._entries),
+                "resident_entries": sum(e.resident for e in self._entries.values()),
+                "bytes": self._bytes,
+                "input_bytes": input_bytes,
+                "derived_bytes": self._bytes - input_bytes,
+                "session_budget": self.session_budget,
+                "global_budget": self.global_budget,
+                "largest_sessions": sessions[:5],
+                **self.stats,
+            }
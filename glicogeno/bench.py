@@ -0,0 +1,308 @@
+"""
+Benchmark riproducibili del motore e dei parser.
+
+    python -m glicogeno.bench                        # esegue e confronta con la baseline
+    python -m glicogeno.bench --filter simulate      # solo i workload che contengono "simulate"
+    python -m glicogeno.bench --save-baseline        # aggiorna la baseline salvata
+
+Per ogni workload: latenza p50/p95/p99 (ms), throughput (chiamate/s) e picco di
+memoria allocata (tracemalloc, misurato in un'esecuzione separata). Un workload è
+una regressione se p50 o picco di memoria superano la baseline oltre la tolleranza.
+Gli input sono sintetici e deterministici (seed fisso).
+"""
+import argparse
+import datetime
+import io
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from glicogeno.engine import (
+    ChoMixType, FeedingPlan, GutParams, Sex, SportType, Subject, calculate_hourly_tapering, calculate_tank,
+    calculate_weekly_balance, simulate_metabolism,
+)
+from glicogeno.labfit import fit_lab_curve
+from glicogeno.parsers import parse_metabolic_report, parse_zwo_file
+from glicogeno.stagerace import Stage, simulate_stage_race
+from glicogeno.sweep import intake_intensity_sweep
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_baseline.json")
+
+DEFAULT_TOLERANCE = 0.25
+# Tempo minimo di misura per workload (s) e limiti sul numero di ripetizioni
+MIN_TIME_S = 1.0
+MIN_REPEAT = 5
+MAX_REPEAT = 200
+
+SEED = 2025
+
+
+# --- INPUT SINTETICI ---
+
+def bench_subject():
+    return Subject(weight_kg=74.0, height_cm=187.0, body_fat_pct=0.11, sex=Sex.MALE,
+                   glycogen_conc_g_kg=22.0, sport=SportType.CYCLING, vo2max_absolute_l_min=4.4)
+
+
+def lab_curve():
+    watts = np.arange(80, 420, 20)
+    cho = 20 + 0.0025 * (watts - 60) ** 2
+    fat = np.clip(45 - 0.12 * (watts - 80), 2, None)
+    return pd.DataFrame({"Watt": watts.astype(float), "CHO": cho, "FAT": fat})
+
+
+ACTIVITY_PARAMS = {
+    "cycling": {"mode": "cycling", "ftp_watts": 265, "avg_watts": 200, "efficiency": 22.0},
+    "running": {"mode": "running", "speed_kmh": 12.0, "avg_hr": 155, "threshold_hr": 172},
+    "lab": {"mode": "cycling", "ftp_watts": 265, "avg_watts": 200, "efficiency": 22.0,
+            "use_lab_data": True, "metabolic_curve_df": lab_curve(), "metabolic_x_col": "Watt"},
+}
+
+
+def taper_days(n_days):
+    rng = np.random.default_rng(SEED)
+    start = datetime.date(2025, 1, 1)
+    days = []
+    for i in range(n_days):
+        kind = ["Riposo", "Ciclismo", "Corsa/Altro"][i % 3]
+        days.append({
+            "date_obj": start + datetime.timedelta(days=i),
+            "type": kind,
+            "val": 0 if kind == "Riposo" else int(rng.integers(140, 260)),
+            "duration": 0 if kind == "Riposo" else int(rng.integers(30, 180)),
+            "calculated_if": 0.0 if kind == "Riposo" else float(rng.uniform(0.55, 0.95)),
+            "cho_in": int(rng.integers(250, 700)),
+            "sleep_factor": 0.95,
+            "sleep_start": datetime.time(23, 0),
+            "sleep_end": datetime.time(7, 0),
+            "workout_start": datetime.time(18, 0),
+        })
+    return days
+
+
+def feeding_plan(duration_min):
+    """
+    Gel ogni 20 min, borraccia 2:1 a flusso continuo per ogni ora e una barretta a metà gara.
+    """
+    events = [{"minute": m, "grams": 25, "label": "Gel"} for m in range(20, duration_min, 20)]
+    events += [{"minute": h, "grams": 40, "duration_min": 60, "mix": "MIX_2_1", "label": "Borraccia"}
+               for h in range(0, duration_min, 60)]
+    events.append({"minute": duration_min // 2, "grams": 45, "label": "Barretta"})
+    return FeedingPlan.from_events(events)
+
+
+def weekly_schedule():
+    intensities = ["Bassa (Z1-Z2)", "Media (Z3)", "Alta (Z4+)"]
+    return [{"activity": "Riposo" if i in (0, 4) else "Ciclismo", "duration": 0 if i in (0, 4) else 90,
+             "intensity": intensities[i % 3], "cho_in": 350 + 40 * i} for i in range(7)]
+
+
+def zwo_bytes(n_segments=3000):
+    rng = np.random.default_rng(SEED)
+    segments = "".join(
+        f'<SteadyState Duration="{int(rng.integers(30, 600))}" Power="{rng.uniform(0.4, 1.2):.3f}"/>'
+        for _ in range(n_segments)
+    )
+    return (f"<workout_file><sportType>bike</sportType><workout>{segments}</workout></workout_file>").encode("utf-8")
+
+
+def metabolic_csv_bytes(n_rows=5000):
+    rng = np.random.default_rng(SEED)
+    watts = np.linspace(60, 450, n_rows)
+    lines = ["Report Metabolimetro;Test incrementale", "Atleta;Benchmark", ""]
+    lines.append("TIME;WATT;HR;VO2;VCO2;CHO;FAT")
+    for i, w in enumerate(watts):
+        cho = 0.3 + 0.0009 * w * (1 + rng.normal(0, 0.02))
+        fat = max(0.02, 0.7 - 0.0014 * w)
+        lines.append(f"{i * 5};{w:.0f};{100 + w / 4:.0f};{1.1 + w / 120:.2f};{1.0 + w / 110:.2f};"
+                     f"{cho:.3f}".replace(".", ",") + ";" + f"{fat:.3f}".replace(".", ","))
+    return "\n".join(lines).encode("latin-1")
+
+
+def breath_curve(n_rows=5000):
+    """
+    Curva breath-by-breath rumorosa (g/h) con l'1% di respiri anomali.
+    """
+    rng = np.random.default_rng(SEED)
+    watts = np.round(np.linspace(60, 450, n_rows))
+    cho = (0.3 + 0.0009 * watts) * 60 * (1 + rng.normal(0, 0.08, n_rows))
+    fat = np.maximum(0.02, 0.7 - 0.0014 * watts) * 60 * (1 + rng.normal(0, 0.08, n_rows))
+    outliers = rng.choice(n_rows, n_rows // 100, replace=False)
+    cho[outliers] *= 4
+    return pd.DataFrame({"Watt": watts, "CHO": cho, "FAT": fat})
+
+
+def _named_buffer(data, name):
+    buffer = io.BytesIO(data)
+    buffer.name = name
+    return buffer
+
+
+# --- WORKLOAD ---
+
+def build_workloads():
+    """
+    Dizionario nome -> funzione senza argomenti da misurare.
+    """
+    subject = bench_subject()
+    tank = calculate_tank(subject)
+    workloads = {}
+
+    for mode, params in ACTIVITY_PARAMS.items():
+        for duration in (60, 240, 720, 1440):
+            workloads[f"simulate_metabolism/{mode}/{duration}min"] = (
+                lambda d=duration, p=params: simulate_metabolism(
+                    tank, d, 60, 25, 70, 20.0, subject, p, mix_type_input=ChoMixType.GLUCOSE_ONLY)
+            )
+
+    plan = feeding_plan(240)
+    workloads["simulate_metabolism/plan/240min"] = lambda: simulate_metabolism(
+        tank, 240, 0, 25, 70, 20.0, subject, ACTIVITY_PARAMS["cycling"], feeding_plan=plan)
+    workloads["simulate_metabolism/gut_model/240min"] = lambda: simulate_metabolism(
+        tank, 240, 0, 25, 70, 20.0, subject, ACTIVITY_PARAMS["cycling"], feeding_plan=plan, gut_model=GutParams())
+
+    intake_grid, if_grid = np.linspace(0, 120, 50), np.linspace(0.55, 1.0, 50)
+    workloads["intake_intensity_sweep/50x50/300min"] = lambda: intake_intensity_sweep(
+        tank, 300, intake_grid, if_grid, 25, 20.0, subject, ACTIVITY_PARAMS["cycling"])
+
+    stages = [Stage(duration_min=300, intensity_factor=0.7, carb_intake_g_h=80, recovery_cho_g=900)] * 21
+    workloads["simulate_stage_race/21x300min"] = lambda: simulate_stage_race(
+        tank, subject, stages, ACTIVITY_PARAMS["cycling"])
+
+    for n_days in (3, 14, 90):
+        days = taper_days(n_days)
+        workloads[f"calculate_hourly_tapering/{n_days}d"] = (
+            lambda d=days: calculate_hourly_tapering(subject, d, start_state_factor=0.6)
+        )
+
+    schedule = weekly_schedule()
+    workloads["calculate_weekly_balance/7d"] = lambda: calculate_weekly_balance(
+        300.0, 80.0, tank["max_capacity_g"] - 100, 100.0, schedule, subject.weight_kg, 60.0)
+
+    zwo = zwo_bytes()
+    workloads["parse_zwo_file/3000seg"] = lambda: parse_zwo_file(
+        _named_buffer(zwo, "bench.zwo"), 265, 172, SportType.CYCLING, report=lambda level, msg: None)
+
+    csv_data = metabolic_csv_bytes()
+    workloads["parse_metabolic_report/csv5000"] = lambda: parse_metabolic_report(
+        _named_buffer(csv_data, "bench.csv"))
+
+    breaths = breath_curve()
+    workloads["fit_lab_curve/breath5000"] = lambda: fit_lab_curve(breaths, "Watt").table()
+
+    return workloads
+
+
+# --- MISURA ---
+
+def measure(fn, min_time_s=MIN_TIME_S, min_repeat=MIN_REPEAT, max_repeat=MAX_REPEAT):
+    fn()  # warm-up (import pigri, cache di pandas)
+    times = []
+    t_start = time.perf_counter()
+    while len(times) < max_repeat and (len(times) < min_repeat or time.perf_counter() - t_start < min_time_s):
+        t0 = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - t0) * 1000.0)
+
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    times = np.array(times)
+    return {
+        "n": len(times),
+        "p50_ms": float(np.percentile(times, 50)),
+        "p95_ms": float(np.percentile(times, 95)),
+        "p99_ms": float(np.percentile(times, 99)),
+        "mean_ms": float(times.mean()),
+        "throughput_per_s": float(1000.0 / times.mean()),
+        "peak_mem_kib": peak / 1024.0,
+    }
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """
+    Regressioni rispetto alla baseline: lista di (workload, metrica, baseline, attuale).
+    """
+    regressions = []
+    for name, current in results.items():
+        ref = baseline.get("results", {}).get(name)
+        if ref is None:
+            continue
+        for metric in ("p50_ms", "peak_mem_kib"):
+            if current[metric] > ref[metric] * (1 + tolerance):
+                regressions.append((name, metric, ref[metric], current[metric]))
+    return regressions
+
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m glicogeno.bench", description="Benchmark motore e parser")
+    parser.add_argument("--filter", default="", help="esegue solo i workload che contengono questa stringa")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="file JSON della baseline")
+    parser.add_argument("--save-baseline", action="store_true", help="salva i risultati come nuova baseline")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="tolleranza relativa (0.25 = +25%%)")
+    parser.add_argument("--min-time", type=float, default=MIN_TIME_S, help="secondi di misura per workload")
+    parser.add_argument("--json", help="scrive anche i risultati in questo file")
+    args = parser.parse_args(argv)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    ref_results = baseline.get("results", {})
+
+    results = {}
+    print(f"{'Workload':<42}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'op/s':>10}{'picco KiB':>12}{'vs base':>9}")
+    for name, fn in build_workloads().items():
+        if args.filter not in name:
+            continue
+        r = measure(fn, min_time_s=args.min_time)
+        results[name] = r
+        ref = ref_results.get(name)
+        delta = f"{(r['p50_ms'] / ref['p50_ms'] - 1) * 100:+.0f}%" if ref else "-"
+        print(f"{name:<42}{r['p50_ms']:>10.2f}{r['p95_ms']:>10.2f}{r['p99_ms']:>10.2f}"
+              f"{r['throughput_per_s']:>10.1f}{r['peak_mem_kib']:>12.0f}{delta:>9}")
+
+    report = {"environment": environment(), "results": results}
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    if args.save_baseline:
+        # Aggiorna solo i workload misurati, conservando gli altri
+        merged = dict(ref_results, **results)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({"environment": report["environment"], "results": merged}, f, indent=2, sort_keys=True)
+        print(f"Baseline salvata in {args.baseline}")
+        return 0
+
+    if not ref_results:
+        print("Nessuna baseline: eseguire con --save-baseline per crearla.")
+        return 0
+
+    regressions = compare(results, baseline, args.tolerance)
+    for name, metric, ref, current in regressions:
+        print(f"REGRESSIONE {name} {metric}: {ref:.2f} -> {current:.2f}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
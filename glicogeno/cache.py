@@ -0,0 +1,120 @@
+"""
+Cache dei risultati a due livelli condivisa tra i worker Streamlit.
+
+1. LRU in-process (oggetti già deserializzati, per il singolo processo).
+2. Tabella `result_cache` nel database SQL (stessa GLICOGENO_DB_URL dell'archivio),
+   chiave = hash SHA-256 dei parametri, con scadenza (TTL) ed eviction per dimensione.
+
+Una simulazione calcolata da un worker viene così servita a tutti gli altri.
+Il modulo SQL (glicogeno.storage) viene importato solo se il livello DB è attivo.
+"""
+import copy
+import hashlib
+import threading
+from collections import OrderedDict
+
+from glicogeno.serialization import params_to_json
+
+# Incrementare quando cambia la fisiologia o il formato delle voci: invalida le voci esistenti
+CACHE_VERSION = 2
+
+DEFAULT_TTL_S = 7 * 24 * 3600
+DEFAULT_MAX_DB_BYTES = 256 * 1024 * 1024
+DEFAULT_MAX_MEMORY_ENTRIES = 64
+
+# Ogni quante scritture si esegue la pulizia della tabella
+_EVICT_EVERY = 20
+
+
+def make_key(name, *args, **kwargs):
+    """
+    Hash stabile dei parametri di una chiamata (Subject, Enum, DataFrame inclusi).
+    """
+    raw = params_to_json({"v": CACHE_VERSION, "fn": name, "args": args, "kwargs": kwargs})
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class TieredResultCache:
+    """
+    Cache (DataFrame, stats) con LRU locale davanti alla tabella condivisa.
+    Con engine=None lavora solo in memoria.
+    """
+
+    def __init__(self, engine=None, ttl_s=DEFAULT_TTL_S, max_db_bytes=DEFAULT_MAX_DB_BYTES,
+                 max_memory_entries=DEFAULT_MAX_MEMORY_ENTRIES):
+        self.engine = engine
+        self.ttl_s = ttl_s
+        self.max_db_bytes = max_db_bytes
+        self.max_memory_entries = max_memory_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.stats = {"memory_hits": 0, "db_hits": 0, "misses": 0}
+        self._storage = None
+        if engine is not None:
+            from glicogeno import storage
+            storage.result_cache.create(engine, checkfirst=True)
+            self._storage = storage
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    # --- LIVELLO 1: MEMORIA ---
+
+    def _memory_get(self, key):
+        with self._lock:
+            if key not in self._memory:
+                return None
+            self._memory.move_to_end(key)
+            return self._memory[key]
+
+    def _memory_put(self, key, value):
+        with self._lock:
+            self._memory[key] = value
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_memory_entries:
+                self._memory.popitem(last=False)
+
+    # --- LIVELLO 2: DATABASE ---
+
+    def _db_put(self, key, df, stats):
+        if not self._storage.cache_put(self.engine, key, df, stats, self.ttl_s):
+            # Un altro worker ha già scritto lo stesso risultato
+            return
+        self._writes += 1
+        if self._writes % _EVICT_EVERY == 0:
+            self.evict()
+
+    def evict(self):
+        """
+        Rimuove le voci scadute e, oltre il budget, le meno usate di recente.
+        """
+        if self.engine is not None:
+            self._storage.cache_evict(self.engine, self.max_db_bytes)
+
+    # --- API ---
+
+    def get_or_compute(self, key, compute_fn):
+        """
+        Restituisce (DataFrame, stats) dalla cache o calcolandoli con compute_fn().
+        DataFrame e stats restituiti sono sempre copie (profonde) modificabili dal chiamante.
+        """
+        hit = self._memory_get(key)
+        if hit is not None:
+            self._count("memory_hits")
+            return hit[0].copy(), copy.deepcopy(hit[1])
+
+        if self.engine is not None:
+            hit = self._storage.cache_get(self.engine, key)
+            if hit is not None:
+                self._count("db_hits")
+                self._memory_put(key, hit)
+                return hit[0].copy(), copy.deepcopy(hit[1])
+
+        self._count("misses")
+        df, stats = compute_fn()
+        self._memory_put(key, (df.copy(), copy.deepcopy(stats)))
+        if self.engine is not None:
+            self._db_put(key, df, stats)
+        return df, stats
@@ -0,0 +1,458 @@
+"""
+Calibrazione per atleta di tau di assorbimento, efficienza di ossidazione,
+crossover e concentrazione di glicogeno da uscite passate.
+
+    python -m glicogeno.calibration atleta.json --out calibrazione.json
+    python -m glicogeno.calibration atleta.json --scenario gara.json --scenario-out gara_calibrata.json
+
+Schema dell'input:
+
+    {
+      "subject": {...},                          # come negli scenari (glicogeno.scenario)
+      "activity": {"mode": "cycling", "ftp_watts": 265, ...},   # default per uscite e test
+      "mix_type": "GLUCOSE_ONLY",
+      "lab": [{"watts": 200, "cho_g_h": 150, "fat_g_h": 30}],  # oppure "hr" al posto di "watts"
+      "rides": [
+        {"id": "gf-2024", "duration_min": 240, "filling_factor": 1.0,
+         "power": [...],                         # Watt (o "hr": bpm) minuto per minuto
+         "intake": [{"min": 30, "g": 25}],       # oppure carb_intake_g_h + cho_per_unit_g
+         "bonk_min": 205,                        # null = nessuna crisi
+         "cgm": [{"min": 0, "mg_dl": 95}, ...]}  # opzionale
+      ]
+    }
+
+Il simulatore `simulate_ride_batch` è GlycogenModel a passi di 60 s riscritto
+su array: ogni minuto aggiorna in un colpo tutti i candidati della popolazione.
+L'ottimizzatore è un metodo a entropia incrociata (campiona, tiene i migliori,
+restringe la distribuzione) su una perdita ai minimi quadrati con prior
+gaussiani sui parametri (stima MAP). L'incertezza è la deviazione standard di
+tutti i candidati valutati pesati con exp(-perdita/2) (posteriore approssimata).
+
+Il kernel riproduce i residui di simulate_metabolism (integrazione costante, senza
+dati di laboratorio): `python -m glicogeno.equivalence --target calibration`.
+Le uscite con carb_intake_g_h usano la stessa cinetica costante; con le assunzioni
+registrate ("intake") l'ossidazione esogena è attiva entro FEEDING_WINDOW_MIN dall'ultima.
+Il risultato contiene in "scenario" le voci da copiare in uno scenario
+(subject.glycogen_conc_g_kg, race.tau_absorption/oxidation_efficiency/crossover_pct);
+con --scenario vengono applicate direttamente a un file di scenario.
+"""
+import argparse
+import json
+import math
+import sys
+import time
+from dataclasses import replace
+
+import numpy as np
+import pandas as pd
+
+from glicogeno.engine import (
+    BONK_LIVER_G, BONK_MUSCLE_G, FEEDING_WINDOW_MIN, ActivityParams, ChoMixType, IntakeParams, calculate_tank,
+    estimate_max_exogenous_oxidation, rer_polynomial,
+)
+from glicogeno.live import RacePlan, model_input
+from glicogeno.scenario import parse_enum, subject_from_dict
+
+PARAMS = ("tau_absorption", "oxidation_efficiency", "crossover_pct", "glycogen_conc_g_kg")
+
+BOUNDS = {
+    "tau_absorption": (5.0, 60.0),
+    "oxidation_efficiency": (0.50, 0.95),
+    "crossover_pct": (50.0, 90.0),
+    "glycogen_conc_g_kg": (12.0, 28.0),
+}
+
+# Prior (media, deviazione standard); None = valore attuale del soggetto
+PRIORS = {
+    "tau_absorption": (20.0, 10.0),
+    "oxidation_efficiency": (0.75, 0.10),
+    "crossover_pct": (70.0, 10.0),
+    "glycogen_conc_g_kg": (None, 4.0),
+}
+
+# Incertezza delle osservazioni
+EVENT_SD_MIN = 15.0     # minuto di crisi / ipoglicemia
+LAB_SD_G_H = 15.0       # ossidazione CHO/FAT al metabolimetro
+
+CGM_HYPO_MG_DL = 70.0
+HYPO_LIVER_G = 20.0     # stessa soglia dello stato "CRITICO (Ipoglicemia)"
+
+DEFAULT_POPULATION = 64
+DEFAULT_ITERATIONS = 40
+ELITE_FRAC = 0.2
+SMOOTHING = 0.7
+
+
+# --- PREPARAZIONE DELLE USCITE ---
+
+def _per_minute(values, duration, default):
+    """
+    Valori per i minuti 1..duration (il primo valore è il minuto 1); mancanti = ultimo noto.
+    """
+    out = np.full(duration, float(default))
+    if values:
+        n = min(len(values), duration)
+        out[:n] = values[:n]
+        out[n:] = values[n - 1]
+    return out
+
+
+def prepare_ride(ride, base_activity, mix_type):
+    """
+    Converte un'uscita in array per minuto indipendenti dai parametri da calibrare.
+    """
+    activity = ActivityParams.from_dict({**base_activity, **ride.get("activity", {}), "use_lab_data": False})
+    duration = int(ride["duration_min"])
+    key = "power" if activity.mode == "cycling" else "hr"
+    x = _per_minute(ride.get(key), duration, model_input(activity, activity.intensity_factor))
+
+    intake = np.zeros(duration + 1)
+    if "intake" in ride:
+        # Assunzioni registrate: ossidazione esogena entro la finestra dall'ultima
+        for event in ride["intake"]:
+            minute = int(event["min"])
+            if 0 < minute <= duration:
+                intake[minute] += float(event["g"])
+        feeding = feeding_window(intake, duration)
+    else:
+        # Integrazione costante: stessa cinetica di simulate_metabolism (e di kernel_reserves),
+        # dove i parametri calibrati verranno applicati
+        plan = RacePlan(duration, activity, IntakeParams(ride.get("carb_intake_g_h", 0),
+                                                         ride.get("cho_per_unit_g", 25), mix_type))
+        interval = plan.intake_interval_min()
+        if interval:
+            intake[interval::interval] = plan.intake.cho_per_unit_g
+        feeding = constant_feeding(plan.intake.carb_intake_g_h, duration)
+
+    hypo_obs = None
+    if ride.get("cgm"):
+        low = [p["min"] for p in ride["cgm"] if p["mg_dl"] < CGM_HYPO_MG_DL]
+        hypo_obs = (min(low) if low else None, max(p["min"] for p in ride["cgm"]))
+
+    return {
+        "id": ride.get("id"),
+        "activity": activity,
+        "duration": duration,
+        "x": x,
+        "intake": intake,
+        "feeding": feeding,
+        "filling_factor": float(ride.get("filling_factor", 1.0)),
+        "bonk_obs": ride.get("bonk_min", None) if "bonk_min" in ride else False,
+        "hypo_obs": hypo_obs,
+    }
+
+
+def feeding_window(intake, duration):
+    """
+    Minuti (0..duration) entro FEEDING_WINDOW_MIN dall'ultima assunzione, come GlycogenModel senza piano.
+    """
+    feeding = np.zeros(duration + 1, dtype=bool)
+    last = -math.inf
+    for minute in range(1, duration + 1):
+        if intake[minute] > 0:
+            last = minute
+        feeding[minute] = minute - last <= FEEDING_WINDOW_MIN
+    return feeding
+
+
+def constant_feeding(carb_intake_g_h, duration):
+    """
+    Integrazione costante: ossidazione esogena attiva dal minuto 1 se l'intake non è nullo
+    (constant_rate_kinetics).
+    """
+    feeding = np.full(duration + 1, carb_intake_g_h != 0)
+    feeding[0] = False
+    return feeding
+
+
+def demand(activity, subject, x, t):
+    """
+    Intensità e domanda (kcal/min) per valori x (Watt o FC) ai minuti t, come GlycogenModel.step.
+    """
+    if_ref = activity.intensity_factor
+    if activity.mode == "cycling":
+        intensity = x / activity.ftp_watts if activity.ftp_watts > 0 else np.full_like(x, if_ref)
+        eff = np.where(t > 60, np.maximum(15.0, activity.efficiency - (t - 60) * 0.02), activity.efficiency)
+        return intensity, (x * 60) / 4184 / (eff / 100.0)
+    if activity.mode == "running":
+        base = 1.0 * subject.weight_kg * activity.speed_kmh / 60.0
+    else:
+        base = subject.vo2max_absolute_l_min * if_ref * 5.0
+    scaling = x / activity.avg_hr if activity.avg_hr > 0 else np.ones_like(x)
+    drift = np.where(t > 60, 1.0 + (t - 60) * 0.0005, 1.0)
+    return if_ref * scaling, base * drift * scaling
+
+
+def cho_ratio(intensity, t, crossover_pct):
+    """
+    Quota CHO per candidati (righe) e minuti (colonne).
+    """
+    effective_if = np.maximum(intensity[None, :] + (75.0 - crossover_pct[:, None]) / 100.0, 0.3)
+    rer = np.clip(rer_polynomial(effective_if), 0.70, 1.15)
+    ratio = np.clip((rer - 0.70) * 3.45, 0.0, 1.0)
+    shift = np.where((intensity < 0.85) & (t > 60), 0.05 * (np.maximum(t - 60, 0) / 60.0) ** 1.2, 0.0)
+    return np.where(shift > 0, np.maximum(0.05, ratio - shift), ratio)
+
+
+# --- SIMULATORE VETTORIALE ---
+
+def simulate_ride_batch(ride, subject, mix_type, params, trace=None):
+    """
+    Simula un'uscita per n candidati (params: nome -> array (n,)).
+    Restituisce (minuto di crisi, minuto di ipoglicemia); NaN se l'evento non avviene.
+    Con `trace` (lista) vi aggiunge (muscolo, fegato) dopo ogni minuto.
+    """
+    activity = ride["activity"]
+    duration = ride["duration"]
+    n = len(params["tau_absorption"])
+    t = np.arange(1, duration + 1, dtype=float)
+    intensity, kcal = demand(activity, subject, ride["x"], t)
+    cho_g_min = kcal[None, :] * cho_ratio(intensity, t, params["crossover_pct"]) / 4.1
+
+    muscle0 = np.empty(n)
+    liver = np.empty(n)
+    for i, conc in enumerate(params["glycogen_conc_g_kg"]):
+        tank = calculate_tank(replace(subject, glycogen_conc_g_kg=float(conc),
+                                      filling_factor=ride["filling_factor"]))
+        muscle0[i], liver[i] = tank["muscle_glycogen_g"], tank["liver_glycogen_g"]
+    muscle = muscle0.copy()
+
+    max_exo = estimate_max_exogenous_oxidation(subject.height_cm, subject.weight_kg, activity.ftp_watts, mix_type)
+    target = max_exo * params["oxidation_efficiency"]
+    alpha = 1 - np.exp(-1.0 / params["tau_absorption"])
+
+    feeding = ride["feeding"]
+    ox = np.zeros(n)
+    bonk = np.full(n, np.nan)
+    hypo = np.full(n, np.nan)
+    safe_muscle0 = np.where(muscle0 > 0, muscle0, 1.0)
+    for minute in range(1, duration + 1):
+        ox = ox + alpha * (target - ox) if feeding[minute] else ox * (1 - alpha)
+        np.maximum(ox, 0.0, out=ox)
+
+        cho = cho_g_min[:, minute - 1]
+        fill = np.where(muscle0 > 0, muscle / safe_muscle0, 0.0)
+        muscle_rate = np.where(muscle > 0, cho * fill ** 0.6, 0.0)
+        blood = cho - muscle_rate
+        from_exo = np.minimum(blood, ox)
+        liver_rate = np.where(liver > 0, np.minimum(blood - from_exo, 1.2), 0.0)
+        muscle = np.maximum(muscle - muscle_rate, 0.0)
+        liver = np.maximum(liver - liver_rate, 0.0)
+
+        bonk[np.isnan(bonk) & ((liver <= BONK_LIVER_G) | (muscle <= BONK_MUSCLE_G))] = minute
+        hypo[np.isnan(hypo) & (liver < HYPO_LIVER_G)] = minute
+        if trace is not None:
+            trace.append((muscle.copy(), liver.copy()))
+    return bonk, hypo
+
+
+def kernel_reserves(subject_data, duration_min, constant_carb_intake_g_h, cho_per_unit_g, crossover_pct,
+                    tau_absorption, subject_obj, activity_params, oxidation_efficiency_input=0.80,
+                    mix_type_input=ChoMixType.GLUCOSE_ONLY, intensity_series=None):
+    """
+    Il kernel di simulate_ride_batch con gli argomenti di simulate_metabolism (integrazione
+    costante, senza dati di laboratorio): residui muscolare ed epatico minuto per minuto.
+    Candidato di `python -m glicogeno.equivalence --target calibration`. Il serbatoio
+    è ricalcolato dal soggetto come nella calibrazione, quindi subject_data è ignorato.
+    """
+    activity = replace(ActivityParams.coerce(activity_params), crossover_pct=crossover_pct)
+    duration = int(duration_min)
+    series = intensity_series if intensity_series is not None else ()
+    x = np.array([model_input(activity, series[m] if m < len(series) else activity.intensity_factor)
+                  for m in range(1, duration + 1)], dtype=float)
+    ride = {"activity": activity, "duration": duration, "x": x,
+            "feeding": constant_feeding(constant_carb_intake_g_h, duration),
+            "filling_factor": subject_obj.filling_factor}
+    params = {"tau_absorption": np.array([float(tau_absorption)]),
+              "oxidation_efficiency": np.array([float(oxidation_efficiency_input)]),
+              "crossover_pct": np.array([float(crossover_pct)]),
+              "glycogen_conc_g_kg": np.array([subject_obj.glycogen_conc_g_kg])}
+    trace = []
+    simulate_ride_batch(ride, subject_obj, mix_type_input, params, trace)
+    tank = calculate_tank(subject_obj)
+    muscle = [tank["muscle_glycogen_g"]] + [float(m[0]) for m, _ in trace]
+    liver = [tank["liver_glycogen_g"]] + [float(l[0]) for _, l in trace]
+    return pd.DataFrame({"Time (min)": np.arange(duration + 1), "Residuo Muscolare": muscle,
+                         "Residuo Epatico": liver})
+
+
+def lab_prediction(lab_row, activity, subject, crossover_pct):
+    """
+    CHO e FAT (g/h) previsti per un punto del test da laboratorio (prima ora, senza deriva).
+    """
+    x = np.array([float(lab_row["watts"] if activity.mode == "cycling" else lab_row["hr"])])
+    t = np.zeros(1)
+    intensity, kcal = demand(activity, subject, x, t)
+    ratio = cho_ratio(intensity, t, crossover_pct)[:, 0]
+    return kcal[0] * ratio / 4.1 * 60, kcal[0] * (1 - ratio) / 9.0 * 60
+
+
+# --- PERDITA E OTTIMIZZATORE ---
+
+def _event_residual(predicted, observed, horizon):
+    """
+    Residuo normalizzato di un evento (minuto); oltre l'orizzonte la previsione è censurata.
+    """
+    predicted = np.where(np.isnan(predicted), horizon, predicted)
+    if observed is None:
+        return (horizon - predicted) / EVENT_SD_MIN
+    return (predicted - observed) / EVENT_SD_MIN
+
+
+class Calibration:
+    """
+    Dati di un atleta pronti per valutare popolazioni di parametri.
+    """
+
+    def __init__(self, data):
+        self.subject = subject_from_dict(data["subject"])
+        self.mix_type = parse_enum(ChoMixType, data.get("mix_type", "GLUCOSE_ONLY"))
+        base_activity = data.get("activity", {})
+        self.activity = ActivityParams.from_dict({**base_activity, "use_lab_data": False})
+        self.rides = [prepare_ride(r, base_activity, self.mix_type) for r in data.get("rides", [])]
+        self.lab = data.get("lab", [])
+        self.priors = {name: (self.subject.glycogen_conc_g_kg if mean is None else mean, sd)
+                       for name, (mean, sd) in PRIORS.items()}
+
+    def loss(self, params):
+        """
+        Somma dei residui quadratici (osservazioni + prior) per ciascun candidato.
+        """
+        total = sum(((params[name] - mean) / sd) ** 2 for name, (mean, sd) in self.priors.items())
+        for ride in self.rides:
+            bonk, hypo = simulate_ride_batch(ride, self.subject, self.mix_type, params)
+            if ride["bonk_obs"] is not False:
+                total = total + _event_residual(bonk, ride["bonk_obs"], ride["duration"]) ** 2
+            if ride["hypo_obs"] is not None:
+                observed, horizon = ride["hypo_obs"]
+                total = total + _event_residual(np.minimum(hypo, horizon), observed, horizon) ** 2
+        for row in self.lab:
+            cho, fat = lab_prediction(row, self.activity, self.subject, params["crossover_pct"])
+            if "cho_g_h" in row:
+                total = total + ((cho - row["cho_g_h"]) / LAB_SD_G_H) ** 2
+            if "fat_g_h" in row:
+                total = total + ((fat - row["fat_g_h"]) / LAB_SD_G_H) ** 2
+        return total
+
+    def fit(self, iterations=DEFAULT_ITERATIONS, population=DEFAULT_POPULATION, seed=0, report=None):
+        """
+        Entropia incrociata con vincoli: restituisce migliori parametri, incertezza e diagnostica.
+        """
+        rng = np.random.default_rng(seed)
+        mean = np.array([self.priors[p][0] for p in PARAMS])
+        sd = np.array([self.priors[p][1] for p in PARAMS])
+        low = np.array([BOUNDS[p][0] for p in PARAMS])
+        high = np.array([BOUNDS[p][1] for p in PARAMS])
+        mean = np.clip(mean, low, high)
+        n_elite = max(2, int(population * ELITE_FRAC))
+
+        best_x, best_loss = None, np.inf
+        all_samples, all_losses = [], []
+        t0 = time.perf_counter()
+        for it in range(iterations):
+            samples = np.clip(rng.normal(mean, sd, size=(population, len(PARAMS))), low, high)
+            if best_x is not None:
+                samples[0] = best_x
+            losses = self.loss({p: samples[:, i] for i, p in enumerate(PARAMS)})
+            all_samples.append(samples)
+            all_losses.append(losses)
+            order = np.argsort(losses)
+            if losses[order[0]] < best_loss:
+                best_loss, best_x = float(losses[order[0]]), samples[order[0]].copy()
+            elite = samples[order[:n_elite]]
+            mean = SMOOTHING * elite.mean(axis=0) + (1 - SMOOTHING) * mean
+            sd = SMOOTHING * elite.std(axis=0) + (1 - SMOOTHING) * sd
+            if report is not None:
+                report(it, best_loss)
+
+        samples, losses = np.vstack(all_samples), np.concatenate(all_losses)
+        weights = np.exp(-(losses - best_loss) / 2)
+        spread = np.sqrt(np.average((samples - best_x) ** 2, axis=0, weights=weights))
+        return {
+            "params": {p: float(best_x[i]) for i, p in enumerate(PARAMS)},
+            "uncertainty": {p: float(spread[i]) for i, p in enumerate(PARAMS)},
+            "loss": best_loss,
+            "evaluations": iterations * population,
+            "seconds": time.perf_counter() - t0,
+        }
+
+    def predictions(self, params):
+        """
+        Confronto osservato/previsto per uscita con un singolo set di parametri.
+        """
+        single = {p: np.array([params[p]]) for p in PARAMS}
+        rows = []
+        for ride in self.rides:
+            bonk, hypo = simulate_ride_batch(ride, self.subject, self.mix_type, single)
+            rows.append({
+                "id": ride["id"],
+                "bonk_obs": None if ride["bonk_obs"] is False else ride["bonk_obs"],
+                "bonk_pred": None if np.isnan(bonk[0]) else int(bonk[0]),
+                "hypo_obs": ride["hypo_obs"][0] if ride["hypo_obs"] else None,
+                "hypo_pred": None if np.isnan(hypo[0]) else int(hypo[0]),
+            })
+        return rows
+
+
+def scenario_overrides(params):
+    """
+    Voci di uno scenario (glicogeno.scenario) corrispondenti ai parametri calibrati.
+    """
+    return {
+        "subject": {"glycogen_conc_g_kg": params["glycogen_conc_g_kg"]},
+        "race": {"tau_absorption": params["tau_absorption"],
+                 "oxidation_efficiency": params["oxidation_efficiency"],
+                 "crossover_pct": params["crossover_pct"]},
+    }
+
+
+def apply_to_scenario(scenario, params):
+    """
+    Copia dello scenario con i parametri calibrati; "race" solo se lo scenario ne ha una.
+    """
+    out = dict(scenario)
+    for section, values in scenario_overrides(params).items():
+        if section == "subject" or section in scenario:
+            out[section] = {**scenario.get(section, {}), **values}
+    return out
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m glicogeno.calibration", description="Calibrazione per atleta")
+    parser.add_argument("input", help="JSON con soggetto, uscite e test di laboratorio")
+    parser.add_argument("--iterations", type=int, default=DEFAULT_ITERATIONS)
+    parser.add_argument("--population", type=int, default=DEFAULT_POPULATION)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="file JSON del risultato (default: stdout)")
+    parser.add_argument("--scenario", help="scenario (o lista di scenari) a cui applicare i parametri calibrati")
+    parser.add_argument("--scenario-out", help="file dello scenario calibrato (default: sovrascrive --scenario)")
+    args = parser.parse_args(argv)
+
+    with open(args.input, encoding="utf-8") as f:
+        calibration = Calibration(json.load(f))
+    result = calibration.fit(args.iterations, args.population, args.seed,
+                             report=lambda it, loss: print(f"iterazione {it + 1}: perdita {loss:.3f}", file=sys.stderr))
+    result["rides"] = calibration.predictions(result["params"])
+    result["scenario"] = scenario_overrides(result["params"])
+
+    if args.scenario:
+        with open(args.scenario, encoding="utf-8") as f:
+            scenario = json.load(f)
+        if isinstance(scenario, list):
+            scenario = [apply_to_scenario(s, result["params"]) for s in scenario]
+        else:
+            scenario = apply_to_scenario(scenario, result["params"])
+        with open(args.scenario_out or args.scenario, "w", encoding="utf-8") as f:
+            f.write(json.dumps(scenario, indent=2) + "\n")
+
+    text = json.dumps(result, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,130 @@
+"""
+Esecuzione batch di scenari da riga di comando (senza Streamlit).
+
+    python -m glicogeno.cli scenari.json --out risultati.jsonl --workers 4
+
+Formati di input:
+- .json  : un oggetto scenario o una lista di scenari
+- .jsonl : uno scenario per riga
+- .csv   : una riga per scenario, colonne con nomi puntati
+           (es. subject.weight_kg, race.activity.ftp_watts, race.duration_min)
+
+I risultati (vedi glicogeno.scenario.run_scenario) vengono scritti come JSONL
+nell'ordine di input, riga per riga appena disponibili.
+"""
+import argparse
+import csv
+import json
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from glicogeno.scenario import run_scenario
+
+
+def _coerce(value):
+    """
+    Tipo di un valore CSV: vuoto -> None, true/false, numeri, JSON ([..], {..}), stringa.
+    """
+    text = value.strip()
+    if text == "":
+        return None
+    if text.lower() in ("true", "false"):
+        return text.lower() == "true"
+    for cast in (int, float):
+        try:
+            return cast(text)
+        except ValueError:
+            pass
+    if text[0] in "[{":
+        return json.loads(text)
+    return text
+
+
+def _nest(row):
+    scenario = {}
+    for column, value in row.items():
+        value = _coerce(value or "")
+        if value is None:
+            continue
+        node = scenario
+        *parents, leaf = column.split(".")
+        for part in parents:
+            node = node.setdefault(part, {})
+        node[leaf] = value
+    return scenario
+
+
+def read_scenarios(path):
+    """
+    Generatore degli scenari contenuti nel file (json, jsonl o csv).
+    """
+    if path.endswith(".csv"):
+        with open(path, newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                yield _nest(row)
+    elif path.endswith(".jsonl"):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    else:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        yield from (data if isinstance(data, list) else [data])
+
+
+def _run_safe(scenario):
+    try:
+        return run_scenario(scenario)
+    except Exception as e:
+        return {"id": scenario.get("id"), "error": f"{type(e).__name__}: {e}"}
+
+
+def run_batch(scenarios, out, workers=1, series=False):
+    """
+    Esegue gli scenari e scrive una riga JSON per risultato. Restituisce il numero di errori.
+    """
+    def prepared():
+        for i, scenario in enumerate(scenarios):
+            scenario.setdefault("id", i)
+            if series:
+                scenario.setdefault("output", {})["series"] = True
+            yield scenario
+
+    errors = 0
+    if workers > 1:
+        pool = ProcessPoolExecutor(max_workers=workers)
+        results = pool.map(_run_safe, prepared(), chunksize=4)
+    else:
+        pool = None
+        results = map(_run_safe, prepared())
+    try:
+        for result in results:
+            errors += "error" in result
+            out.write(json.dumps(result, default=float) + "\n")
+            out.flush()
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    return errors
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m glicogeno.cli", description="Simulazioni batch")
+    parser.add_argument("input", help="file di scenari (.json, .jsonl, .csv)")
+    parser.add_argument("--out", help="file JSONL di output (default: stdout)")
+    parser.add_argument("--workers", type=int, default=1, help="processi paralleli")
+    parser.add_argument("--series", action="store_true", help="includi le serie minuto per minuto")
+    args = parser.parse_args(argv)
+
+    out = open(args.out, "w", encoding="utf-8") if args.out else sys.stdout
+    try:
+        errors = run_batch(read_scenarios(args.input), out, workers=args.workers, series=args.series)
+    finally:
+        if args.out:
+            out.close()
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,87 @@
+"""
+Decimazione dei dati per i grafici (min/max per bucket).
+
+Le simulazioni lunghe (12-24h) producono decine di migliaia di righe per grafico.
+Per ogni bucket sull'asse X si conservano le righe con minimo e massimo di ciascuna
+serie, più le righe marcate come "da preservare" (crisi, picco gut load, vertici
+dell'intake cumulativo). Si selezionano righe intere, quindi le serie impilate restano allineate.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+# Larghezze (px) dei contenitori Streamlit in layout "wide", passate come width_px. Il server
+# non conosce la larghezza reale del browser: default 1200 (massimo del layout), per schermi
+# più larghi si imposta GLICOGENO_CHART_WIDTH_PX
+CHART_WIDTH_ENV = "GLICOGENO_CHART_WIDTH_PX"
+CHART_WIDTH_FULL_PX = int(os.environ.get(CHART_WIDTH_ENV) or 1200)
+CHART_WIDTH_HALF_PX = CHART_WIDTH_FULL_PX // 2
+
+# Righe per pixel: una coppia min/max ogni 4 px è indistinguibile dalla serie completa
+POINTS_PER_PX = 0.5
+
+
+def points_for_width(width_px):
+    return int(width_px * POINTS_PER_PX)
+
+
+def simulation_keep_mask(df):
+    """
+    Righe di `simulate_metabolism` che devono sopravvivere alla decimazione:
+    primo e ultimo minuto, primo minuto di crisi epatica/muscolare, picco del
+    gut load, cambi di stato e vertici dell'intake cumulativo (inizio e fine di ogni
+    tratto a flusso costante, riga prima e dopo ogni bolo). Un flusso continuo conserva
+    solo i suoi estremi: la spezzata tra i vertici è identica alla serie completa.
+    """
+    keep = np.zeros(len(df), dtype=bool)
+    if len(df) == 0:
+        return keep
+    keep[0] = keep[-1] = True
+
+    for crit in (df['Residuo Epatico'].to_numpy() <= 0, df['Residuo Muscolare'].to_numpy() <= 20):
+        if crit.any():
+            keep[int(np.argmax(crit))] = True
+
+    keep[int(np.argmax(df['Gut Load'].to_numpy()))] = True
+
+    stato = df['Stato'].to_numpy()
+    keep[1:] |= stato[1:] != stato[:-1]
+
+    # rate[j] è il flusso tra le righe j e j+1: la riga j è un vertice se il flusso cambia
+    rate = np.diff(df['Intake Cumulativo (g)'].to_numpy(dtype=float))
+    keep[1:-1] |= ~np.isclose(rate[1:], rate[:-1], rtol=1e-6, atol=1e-9)
+    return keep
+
+
+def decimate_frame(df, value_cols, max_points, keep_mask=None):
+    """
+    Riduce df a circa max_points righe con min/max per bucket su value_cols.
+    Le righe con keep_mask=True vengono sempre mantenute.
+    """
+    n = len(df)
+    if n <= max_points or max_points <= 0:
+        return df
+
+    n_buckets = max(1, max_points // 2)
+    bucket = (np.arange(n) * n_buckets) // n
+
+    values = pd.DataFrame({c: df[c].to_numpy(dtype=float) for c in value_cols})
+    grouped = values.groupby(bucket)
+    idx = [grouped.idxmin().to_numpy().ravel(), grouped.idxmax().to_numpy().ravel()]
+    if keep_mask is not None:
+        idx.append(np.flatnonzero(keep_mask))
+    idx.append(np.array([0, n - 1]))
+
+    rows = np.unique(np.concatenate(idx).astype(np.int64))
+    return df.iloc[rows]
+
+
+def decimate_simulation(df, value_cols, width_px):
+    """
+    Decimazione di un frame di `simulate_metabolism` per un grafico largo width_px
+    (vedi CHART_WIDTH_FULL_PX / CHART_WIDTH_HALF_PX).
+    """
+    if len(df) <= points_for_width(width_px):
+        return df
+    return decimate_frame(df, value_cols, points_for_width(width_px), keep_mask=simulation_keep_mask(df))
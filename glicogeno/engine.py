@@ -0,0 +1,1330 @@
+"""
+Motore fisiologico del Glycogen Simulator Pro (senza dipendenze da Streamlit).
+
+Contiene i parametri fisiologici, il calcolo del serbatoio di glicogeno, la
+simulazione minuto per minuto sotto sforzo e i bilanci orario/settimanale.
+Può essere importato da script, job batch e servizi senza avviare la UI.
+"""
+import bisect
+import math
+from dataclasses import dataclass, replace
+from enum import Enum
+
+import numpy as np
+import pandas as pd
+
+from glicogeno.gut import GutParams, compartment_kinetics
+
+# --- 1. PARAMETRI FISIOLOGICI ---
+
+class Sex(Enum):
+    MALE = "Uomo"
+    FEMALE = "Donna"
+
+class TrainingStatus(Enum):
+    SEDENTARY = (13.0, "Sedentario / Principiante")
+    RECREATIONAL = (16.0, "Attivo / Amatore")
+    TRAINED = (19.0, "Allenato (Intermedio)")
+    ADVANCED = (22.0, "Avanzato / Competitivo")
+    ELITE = (25.0, "Elite / Pro")
+
+    def __init__(self, val, label):
+        self.val = val
+        self.label = label
+
+class SportType(Enum):
+    CYCLING = (0.63, "Ciclismo (Prevalenza arti inferiori)")
+    RUNNING = (0.75, "Corsa (Arti inferiori + Core)")
+    TRIATHLON = (0.85, "Triathlon (Multidisciplinare)")
+    XC_SKIING = (0.95, "Sci di Fondo (Whole Body)")
+    SWIMMING = (0.80, "Nuoto (Arti sup. + inf.)")
+
+    def __init__(self, val, label):
+        self.val = val
+        self.label = label
+
+# --- PARAMETRI STATO FISIOLOGICO ---
+class DietType(Enum):
+    HIGH_CARB = (1.25, "Carico Carboidrati (Supercompensazione)", 8.0)
+    NORMAL = (1.00, "Regime Normocalorico Misto (Baseline)", 5.0)
+    LOW_CARB = (0.50, "Restrizione Glucidica / Low Carb", 2.5)
+
+    def __init__(self, factor, label, ref_value):
+        self.factor = factor
+        self.label = label
+        self.ref_value = ref_value
+
+class FatigueState(Enum):
+    RESTED = (1.0, "Riposo / Tapering (Pieno Recupero)")
+    ACTIVE = (0.9, "Carico di lavoro moderato (24h prec.)")
+    TIRED = (0.60, "Alto carico o Danno Muscolare (EIMD)")
+
+    def __init__(self, factor, label):
+        self.factor = factor
+        self.label = label
+
+class SleepQuality(Enum):
+    GOOD = (1.0, "Ottimale (>7h, ristoratore)")
+    AVERAGE = (0.95, "Sufficiente (6-7h)")
+    POOR = (0.85, "Insufficiente / Disturbato (<6h)")
+
+    def __init__(self, factor, label):
+        self.factor = factor
+        self.label = label
+
+class MenstrualPhase(Enum):
+    NONE = (1.0, "Non applicabile")
+    FOLLICULAR = (1.0, "Fase Follicolare")
+    LUTEAL = (0.95, "Fase Luteale (Premestruale)")
+
+    def __init__(self, factor, label):
+        self.factor = factor
+        self.label = label
+
+class ChoMixType(Enum):
+    GLUCOSE_ONLY = (1.0, 60.0, "Solo Glucosio/Maltodestrine (Standard)")
+    MIX_2_1 = (1.5, 90.0, "Mix 2:1 (Maltodestrine:Fruttosio)")
+    MIX_1_08 = (1.7, 105.0, "Mix 1:0.8 (High Frructose)")
+
+    def __init__(self, ox_factor, max_rate_gh, label):
+        self.ox_factor = ox_factor 
+        self.max_rate_gh = max_rate_gh 
+        self.label = label
+
+@dataclass
+class Subject:
+    weight_kg: float
+    height_cm: float 
+    body_fat_pct: float
+    sex: Sex
+    glycogen_conc_g_kg: float
+    sport: SportType
+    liver_glycogen_g: float = 100.0
+    filling_factor: float = 1.0 
+    uses_creatine: bool = False
+    menstrual_phase: MenstrualPhase = MenstrualPhase.NONE
+    glucose_mg_dl: float = None
+    vo2max_absolute_l_min: float = 3.5 
+    muscle_mass_kg: float = None 
+
+    @property
+    def lean_body_mass(self) -> float:
+        return self.weight_kg * (1.0 - self.body_fat_pct)
+
+    @property
+    def muscle_fraction(self) -> float:
+        base = 0.50 if self.sex == Sex.MALE else 0.42
+        if self.glycogen_conc_g_kg >= 22.0:
+            base += 0.03
+        return base
+
+# --- PARAMETRI DI SIMULAZIONE (IMMUTABILI, HASHABILI) ---
+# Sostituiscono il dizionario `activity_params`: si costruiscono una volta, si possono
+# usare come chiavi di cache e si confrontano per valore. I default sono quelli
+# storicamente usati da simulate_metabolism per le chiavi mancanti.
+
+@dataclass(frozen=True, slots=True)
+class LabCurve:
+    """
+    Curva CHO/FAT (g/h) del metabolimetro, ordinata per l'asse X (Watt, HR o Speed).
+    """
+    x_col: str
+    x: tuple
+    cho: tuple
+    fat: tuple
+
+    @classmethod
+    def from_frame(cls, curve_df, x_col='Watt'):
+        if curve_df is None or curve_df.empty:
+            return None
+        df = curve_df.sort_values(x_col)
+        return cls(x_col, tuple(df[x_col].astype(float)), tuple(df['CHO'].astype(float)),
+                   tuple(df['FAT'].astype(float)))
+
+    def to_frame(self):
+        return pd.DataFrame({self.x_col: self.x, 'CHO': self.cho, 'FAT': self.fat})
+
+@dataclass(frozen=True, slots=True)
+class ActivityParams:
+    mode: str = 'cycling'               # 'cycling', 'running' o 'other'
+    ftp_watts: float = 250
+    avg_watts: float = 200
+    efficiency: float = 22.0            # efficienza meccanica lorda (%)
+    avg_hr: float = 150
+    max_hr: float = 185
+    threshold_hr: float = None
+    speed_kmh: float = 10.0
+    intensity_factor: float = 0.8
+    crossover_pct: float = 70
+    use_lab_data: bool = False
+    lab_cho_g_h: float = 0
+    lab_fat_g_h: float = 0
+    lab_curve: LabCurve = None
+
+    @classmethod
+    def from_dict(cls, params):
+        """
+        Conversione dal vecchio dizionario activity_params (stesse chiavi).
+        """
+        params = dict(params)
+        curve_df = params.pop('metabolic_curve_df', None)
+        x_col = params.pop('metabolic_x_col', 'Watt')
+        if curve_df is not None:
+            params['lab_curve'] = LabCurve.from_frame(curve_df, x_col)
+        return cls(**params)
+
+    @classmethod
+    def coerce(cls, params):
+        return params if isinstance(params, cls) else cls.from_dict(params)
+
+@dataclass(frozen=True, slots=True)
+class IntakeParams:
+    carb_intake_g_h: float = 60.0
+    cho_per_unit_g: float = 25.0
+    mix_type: ChoMixType = ChoMixType.GLUCOSE_ONLY
+
+@dataclass(frozen=True, slots=True)
+class AbsorptionParams:
+    tau_min: float = 20.0
+    oxidation_efficiency: float = 0.80
+    max_exo_rate_g_min: float = None    # None = stima da antropometria e mix
+    gut_model: GutParams = None         # None = filtro del primo ordine, altrimenti modello a compartimenti
+
+def intake_interval_min(carb_intake_g_h, cho_per_unit_g, duration_min):
+    """
+    Minuti tra due porzioni per un'integrazione costante (None se non si assume nulla
+    entro la durata). Regola unica per simulazione e cronotabella.
+    """
+    if carb_intake_g_h <= 0 or cho_per_unit_g <= 0:
+        return None
+    interval = round(60 / (carb_intake_g_h / cho_per_unit_g))
+    if interval < 1 or interval > duration_min:
+        return None
+    return interval
+
+@dataclass(frozen=True, slots=True)
+class FeedingPlan:
+    """
+    Piano di integrazione a eventi, come array sparsi (un valore per evento):
+    porzioni al minuto indicato (durata 0) o flussi continui distribuiti su
+    `duration_min` minuti (borraccia). `mix` è il nome di un ChoMixType o None
+    (mix della simulazione).
+    """
+    minute: tuple = ()
+    grams: tuple = ()
+    duration_min: tuple = ()
+    mix: tuple = ()
+    label: tuple = ()
+
+    @classmethod
+    def from_events(cls, events):
+        """
+        Da dizionari {"minute", "grams", "duration_min", "mix", "label"} (ordine qualsiasi).
+        """
+        rows = sorted(events, key=lambda e: float(e["minute"]))
+        mixes = []
+        for e in rows:
+            mix = e.get("mix")
+            mixes.append(mix.name if isinstance(mix, ChoMixType) else (ChoMixType[mix].name if mix else None))
+        return cls(
+            tuple(float(e["minute"]) for e in rows),
+            tuple(float(e["grams"]) for e in rows),
+            tuple(float(e.get("duration_min") or 0.0) for e in rows),
+            tuple(mixes),
+            tuple(e.get("label") or "" for e in rows),
+        )
+
+    @classmethod
+    def constant_rate(cls, carb_intake_g_h, cho_per_unit_g, duration_min):
+        """
+        Le porzioni dell'integrazione costante (stesso calendario di simulate_metabolism).
+        Stesso calendario, non stessa cinetica: simulato come piano a eventi assorbe solo i
+        grammi ingeriti (vedi constant_rate_kinetics).
+        """
+        interval = intake_interval_min(carb_intake_g_h, cho_per_unit_g, duration_min)
+        if interval is None:
+            return cls()
+        minutes = tuple(float(m) for m in range(interval, int(duration_min) + 1, interval))
+        n = len(minutes)
+        return cls(minutes, (float(cho_per_unit_g),) * n, (0.0,) * n, (None,) * n, ("",) * n)
+
+    @property
+    def total_g(self):
+        return float(sum(self.grams))
+
+    def to_events(self):
+        return [{"minute": m, "grams": g, "duration_min": d, "mix": x, "label": l}
+                for m, g, d, x, l in zip(self.minute, self.grams, self.duration_min, self.mix, self.label)]
+
+    def average_g_h(self, duration_min):
+        """
+        CHO medi (g/h) effettivamente ingeriti entro la durata.
+        """
+        if duration_min <= 0:
+            return 0.0
+        vectors = self.intake_vectors(duration_min, ChoMixType.GLUCOSE_ONLY)
+        return sum(float(v.sum()) for v in vectors.values()) * 60 / duration_min
+
+    def intake_vectors(self, duration_min, default_mix):
+        """
+        {ChoMixType: grammi ingeriti per minuto 0..duration}. I flussi sono distribuiti
+        uniformemente e troncati a fine gara.
+        """
+        n = int(duration_min) + 1
+        start = np.rint(np.asarray(self.minute, dtype=float)).astype(int)
+        grams = np.asarray(self.grams, dtype=float)
+        length = np.maximum(np.rint(np.asarray(self.duration_min, dtype=float)).astype(int), 1)
+        resolved = np.array([ChoMixType[m] if m else default_mix for m in self.mix], dtype=object)
+
+        vectors = {}
+        for mix in dict.fromkeys(resolved.tolist()):
+            sel = (resolved == mix) & (start >= 0) & (start < n)
+            # Differenze: +rate all'inizio, -rate alla fine del flusso, poi somma cumulata
+            diff = np.zeros(n + 1)
+            np.add.at(diff, start[sel], grams[sel] / length[sel])
+            np.add.at(diff, np.minimum(start[sel] + length[sel], n), -grams[sel] / length[sel])
+            vectors[mix] = np.cumsum(diff[:n])
+        return vectors
+
+# --- 2. LOGICA DI CALCOLO ---
+
+# Soglie di crisi: fegato esaurito o muscolo sotto la quota minima
+BONK_LIVER_G = 0.0
+BONK_MUSCLE_G = 20.0
+
+def calculate_hourly_tapering(subject, days_data, start_state_factor=0.6):
+    """
+    Simula l'andamento orario delle riserve per N giorni (Tapering Avanzato).
+    """
+    # 1. Inizializzazione Serbatoi
+    tank = calculate_tank(subject)
+    MAX_MUSCLE = tank['max_capacity_g'] - 100 
+    MAX_LIVER = 100.0
+    
+    # Start level basato sul fattore di input (es. Normale=0.6)
+    # Se start_state_factor è un Enum, estrai .factor, altrimenti usa float
+    try:
+        factor = start_state_factor.factor
+    except:
+        factor = start_state_factor if isinstance(start_state_factor, float) else 0.6
+
+    curr_muscle = min(MAX_MUSCLE * factor, MAX_MUSCLE)
+    curr_liver = min(MAX_LIVER * factor, MAX_LIVER)
+    
+    hourly_log = []
+    
+    # Costanti Fisiologiche Orarie
+    LIVER_DRAIN_H = 4.0 # Consumo cervello/organi (g/h)
+    NEAT_DRAIN_H = (1.0 * subject.weight_kg) / 16.0 # NEAT spalmato sulle 16h di veglia (g/h)
+    
+    # Ciclo sui Giorni
+    for day_idx, day in enumerate(days_data):
+        date_label = day['date_obj'].strftime("%d/%m")
+        
+        # Parsing Orari
+        sleep_start = day['sleep_start'].hour + (day['sleep_start'].minute/60)
+        sleep_end = day['sleep_end'].hour + (day['sleep_end'].minute/60)
+        
+        work_start = day['workout_start'].hour + (day['workout_start'].minute/60)
+        work_dur_h = day['duration'] / 60.0
+        work_end = work_start + work_dur_h
+        
+        total_cho_input = day['cho_in']
+        
+        # Calcolo Ore di Veglia (Feeding Window) per distribuire il cibo
+        waking_hours = 0
+        for h in range(24):
+            is_sleeping = False
+            if sleep_start > sleep_end: # Scavalca notte
+                if h >= sleep_start or h < sleep_end: is_sleeping = True
+            else:
+                if sleep_start <= h < sleep_end: is_sleeping = True
+            
+            is_working = (work_start <= h < work_end)
+            if not is_sleeping and not is_working:
+                waking_hours += 1
+        
+        cho_rate_h = total_cho_input / waking_hours if waking_hours > 0 else 0
+        
+        # Ciclo sulle 24 ore del giorno
+        for h in range(24):
+            status = "REST"
+            is_sleeping = False
+            
+            # Check Sonno
+            if sleep_start > sleep_end:
+                if h >= sleep_start or h < sleep_end: is_sleeping = True
+            else:
+                if sleep_start <= h < sleep_end: is_sleeping = True
+            
+            if is_sleeping: status = "SLEEP"
+            
+            # Check Allenamento
+            if work_start <= h < work_end:
+                status = "WORK"
+            
+            # --- BILANCIO ORARIO ---
+            hourly_in = 0
+            hourly_out_liver = LIVER_DRAIN_H # Sempre attivo (cervello)
+            hourly_out_muscle = 0
+            
+            if status == "SLEEP":
+                hourly_in = 0 
+            
+            elif status == "WORK":
+                hourly_in = 0 
+                # Calcolo consumo lavoro
+                intensity_if = day.get('calculated_if', 0)
+                # Stima Kcal/h lavoro
+                # Se ciclismo use 22% eff, se corsa 1kcal/kg/km approx
+                kcal_work = 600 * intensity_if # Fallback generico se non abbiamo watt
+                if day.get('val', 0) > 0 and day.get('type') == 'Ciclismo':
+                     kcal_work = (day.get('val') * 60) / 4.184 / 0.22
+                
+                # CHO usage durante lavoro
+                cho_pct = max(0, (intensity_if - 0.5) * 2.5) 
+                cho_pct = min(1.0, cho_pct)
+                g_cho_work = (kcal_work * cho_pct) / 4.1
+                
+                liver_share = 0.15 
+                hourly_out_muscle = g_cho_work * (1 - liver_share)
+                hourly_out_liver += g_cho_work * liver_share
+                
+            elif status == "REST":
+                hourly_in = cho_rate_h
+                hourly_out_muscle = NEAT_DRAIN_H 
+            
+            # --- CALCOLO NETTO ---
+            net_flow = hourly_in - (hourly_out_liver + hourly_out_muscle)
+            
+            # Applicazione ai serbatoi
+            if net_flow > 0:
+                # REFILLING
+                efficiency = day.get('sleep_factor', 0.95)
+                real_storage = net_flow * efficiency
+                
+                to_muscle = real_storage * 0.7
+                to_liver = real_storage * 0.3
+                
+                # Overflow
+                if curr_muscle + to_muscle > MAX_MUSCLE:
+                    overflow = (curr_muscle + to_muscle) - MAX_MUSCLE
+                    to_muscle -= overflow
+                    to_liver += overflow 
+                
+                curr_muscle = min(MAX_MUSCLE, curr_muscle + to_muscle)
+                curr_liver = min(MAX_LIVER, curr_liver + to_liver)
+                
+            else:
+                # DRAINING
+                abs_deficit = abs(net_flow)
+                
+                if status == "WORK":
+                    curr_liver -= (hourly_out_liver) # Il fegato paga il suo
+                    curr_muscle -= hourly_out_muscle # Il muscolo paga il suo
+                else:
+                    # Deficit a riposo (Liver drain + NEAT)
+                    curr_liver -= (abs_deficit * 0.8)
+                    curr_muscle -= (abs_deficit * 0.2)
+
+            # Clamping
+            curr_muscle = max(0, curr_muscle)
+            curr_liver = max(0, curr_liver)
+            
+            # Timestamp
+            ts = pd.Timestamp(day['date_obj']) + pd.Timedelta(hours=h)
+            
+            hourly_log.append({
+                "Timestamp": ts,
+                "Giorno": date_label,
+                "Ora": h,
+                "Status": status,
+                "Muscolare": curr_muscle,
+                "Epatico": curr_liver,
+                "Totale": curr_muscle + curr_liver
+            })
+
+    final_tank = tank.copy()
+    final_tank['muscle_glycogen_g'] = curr_muscle
+    final_tank['liver_glycogen_g'] = curr_liver
+    final_tank['actual_available_g'] = curr_muscle + curr_liver
+    final_tank['fill_pct'] = (curr_muscle + curr_liver) / (MAX_MUSCLE + MAX_LIVER) * 100
+    
+    return pd.DataFrame(hourly_log), final_tank
+
+def get_concentration_from_vo2max(vo2_max):
+    conc = 13.0 + (vo2_max - 30.0) * 0.24
+    if conc < 12.0: conc = 12.0
+    if conc > 26.0: conc = 26.0
+    return conc
+
+def calculate_depletion_factor(steps, activity_min, s_fatigue):
+    steps_base = 10000 
+    steps_factor = (steps - steps_base) / 5000 * 0.1 * 0.4
+    
+    activity_base = 120 
+    if activity_min < 60: 
+        activity_factor = (1 - (activity_min / 60)) * 0.05 * 0.6
+    else:
+        activity_factor = (activity_min - activity_base) / 60 * -0.1 * 0.6
+        
+    depletion_impact = steps_factor + activity_factor
+    
+    estimated_depletion_factor = max(0.6, min(1.0, 1.0 + depletion_impact))
+    
+    if steps == 0 and activity_min == 0:
+        return s_fatigue.factor
+    else:
+        return estimated_depletion_factor
+
+def calculate_filling_factor_from_diet(weight_kg, cho_day_minus_1_g, cho_day_minus_2_g, s_fatigue, s_sleep, steps_m1, min_act_m1, steps_m2, min_act_m2):
+    CHO_BASE_GK = 5.0
+    CHO_MAX_GK = 10.0
+    CHO_MIN_GK = 2.5
+    
+    cho_day_minus_1_g = max(cho_day_minus_1_g, 1.0) 
+    cho_day_minus_2_g = max(cho_day_minus_2_g, 1.0) 
+    
+    cho_day_minus_1_gk = cho_day_minus_1_g / weight_kg
+    cho_day_minus_2_gk = cho_day_minus_2_g / weight_kg
+    
+    depletion_m1_factor = calculate_depletion_factor(steps_m1, min_act_m1, s_fatigue)
+    depletion_m2_factor = calculate_depletion_factor(steps_m2, min_act_m2, s_fatigue)
+    
+    recovery_factor = (depletion_m1_factor * 0.7) + (depletion_m2_factor * 0.3)
+    
+    avg_cho_gk = (cho_day_minus_1_gk * 0.7) + (cho_day_minus_2_gk * 0.3)
+    
+    if avg_cho_gk >= CHO_MAX_GK:
+        diet_factor_base = 1.25
+    elif avg_cho_gk >= CHO_BASE_GK:
+        diet_factor_base = 1.0 + (avg_cho_gk - CHO_BASE_GK) * (0.25 / (CHO_MAX_GK - CHO_BASE_GK))
+    elif avg_cho_gk > CHO_MIN_GK:
+        diet_factor_base = 0.5 + (avg_cho_gk - CHO_MIN_GK) * (0.5 / (CHO_BASE_GK - CHO_MIN_GK))
+        diet_factor_base = max(0.5, diet_factor_base)
+    else: 
+        diet_factor_base = 0.5
+    
+    diet_factor_base = min(1.25, max(0.5, diet_factor_base)) 
+    
+    final_diet_depletion_factor = diet_factor_base * recovery_factor 
+    combined_filling = final_diet_depletion_factor * s_sleep.factor
+    
+    return combined_filling, final_diet_depletion_factor, avg_cho_gk, cho_day_minus_1_gk, cho_day_minus_2_gk
+
+
+def calculate_tank(subject: Subject):
+    if subject.muscle_mass_kg is not None and subject.muscle_mass_kg > 0:
+        total_muscle = subject.muscle_mass_kg
+        muscle_source_note = "Massa Muscolare Totale (SMM) fornita dall'utente."
+    else:
+        lbm = subject.lean_body_mass
+        total_muscle = lbm * subject.muscle_fraction
+        muscle_source_note = "Massa Muscolare Totale stimata da Peso/BF/Sesso."
+
+    active_muscle = total_muscle * subject.sport.val
+    
+    creatine_multiplier = 1.10 if subject.uses_creatine else 1.0
+    base_muscle_glycogen = active_muscle * subject.glycogen_conc_g_kg
+    max_total_capacity = (base_muscle_glycogen * 1.25 * creatine_multiplier) + 100.0
+    
+    final_filling_factor = subject.filling_factor * subject.menstrual_phase.factor
+    current_muscle_glycogen = base_muscle_glycogen * creatine_multiplier * final_filling_factor
+    
+    max_physiological_limit = active_muscle * 35.0
+    if current_muscle_glycogen > max_physiological_limit:
+        current_muscle_glycogen = max_physiological_limit
+    
+    liver_fill_factor = 1.0
+    liver_correction_note = None
+    
+    if subject.filling_factor <= 0.6: 
+        liver_fill_factor = 0.6
+        
+    if subject.glucose_mg_dl is not None:
+        if subject.glucose_mg_dl < 70:
+            liver_fill_factor = 0.2
+            liver_correction_note = "Criticità Epatica (Glicemia < 70 mg/dL)"
+        elif subject.glucose_mg_dl < 85:
+            liver_fill_factor = min(liver_fill_factor, 0.5)
+            liver_correction_note = "Riduzione Epatica (Glicemia 70-85 mg/dL)"
+    
+    current_liver_glycogen = subject.liver_glycogen_g * liver_fill_factor
+    total_actual_glycogen = current_muscle_glycogen + current_liver_glycogen
+
+    return {
+        "active_muscle_kg": active_muscle,
+        "max_capacity_g": max_total_capacity,         
+        "actual_available_g": total_actual_glycogen,   
+        "muscle_glycogen_g": current_muscle_glycogen,
+        "liver_glycogen_g": current_liver_glycogen,
+        "concentration_used": subject.glycogen_conc_g_kg,
+        "fill_pct": (total_actual_glycogen / max_total_capacity) * 100 if max_total_capacity > 0 else 0,
+        "creatine_bonus": subject.uses_creatine,
+        "liver_note": liver_correction_note,
+        "muscle_source_note": muscle_source_note
+    }
+
+def estimate_max_exogenous_oxidation(height_cm, weight_kg, ftp_watts, mix_type: ChoMixType):
+    base_rate = 0.8 
+    
+    if height_cm > 170:
+        base_rate += (height_cm - 170) * 0.015
+    if ftp_watts > 200:
+        base_rate += (ftp_watts - 200) * 0.0015
+    
+    ox_factor = mix_type.ox_factor
+    max_rate_gh = mix_type.max_rate_gh
+    
+    estimated_rate_gh = base_rate * 60 * ox_factor
+    
+    final_rate_g_min = min(estimated_rate_gh / 60, max_rate_gh / 60)
+    
+    return final_rate_g_min
+
+def rer_polynomial(intensity_factor):
+    """
+    Polinomio RER(IF) senza limiti; accetta anche array numpy.
+    """
+    if_val = intensity_factor
+    return (
+        -0.000000149 * (if_val**6) + 
+        141.538462237 * (if_val**5) - 
+        565.128206259 * (if_val**4) + 
+        890.333333976 * (if_val**3) - 
+        691.67948706 * (if_val**2) + 
+        265.460857558 * if_val - 
+        39.525121144
+    )
+
+def calculate_rer_polynomial(intensity_factor):
+    rer = rer_polynomial(intensity_factor)
+    return max(0.70, min(1.15, rer))
+
+# --- CINETICA DI ASSORBIMENTO (VETTORIALE) ---
+
+def absorption_filter(drive, tau_min):
+    """
+    Filtro del primo ordine y[t] = y[t-1] + alpha * (drive[t] - y[t-1]) con y[-1] = 0,
+    calcolato come convoluzione con il nucleo esponenziale (troncato sotto 1e-15).
+    """
+    drive = np.asarray(drive, dtype=float)
+    alpha = 1 - np.exp(-1.0 / tau_min)
+    if alpha >= 1.0:
+        return drive.copy()
+    n_kernel = min(len(drive), int(math.ceil(math.log(1e-15) / math.log(1 - alpha))) + 1)
+    kernel = alpha * (1 - alpha) ** np.arange(n_kernel)
+    return np.convolve(drive, kernel)[:len(drive)]
+
+def constant_rate_kinetics(duration_min, carb_intake_g_h, cho_per_unit_g, tau_min, oxidation_efficiency,
+                           max_exo_rate_g_min):
+    """
+    Integrazione costante: (g ingeriti per minuto, ossidazione esogena g/min), minuti 0..duration.
+    Modello storico, mantenuto per continuità con le stime precedenti (mappa, tabelle di
+    popolazione, calibrazione): con integrazione attiva l'ossidazione tende al limite
+    (max * efficienza) dal minuto 1, indipendentemente dai grammi ingeriti. Non coincide con
+    plan_kinetics sullo stesso calendario: a 30 g/h per 240 min ossida 176 g contro 74 g
+    (100 g ingeriti).
+    """
+    n = int(duration_min) + 1
+    intake_g = np.zeros(n)
+    interval = intake_interval_min(carb_intake_g_h, cho_per_unit_g, duration_min)
+    if interval is not None:
+        intake_g[interval::interval] = cho_per_unit_g
+    if carb_intake_g_h == 0:
+        return intake_g, np.zeros(n)
+    drive = np.full(n, max_exo_rate_g_min * oxidation_efficiency)
+    drive[0] = 0.0
+    return intake_g, absorption_filter(drive, tau_min)
+
+def plan_kinetics(plan, duration_min, tau_min, oxidation_efficiency, max_exo_rate_for, default_mix):
+    """
+    Piano a eventi: l'assorbimento è il filtro del primo ordine applicato ai CHO ingeriti
+    (per mix), limitato dalla capacità di ossidazione media dei mix in assorbimento.
+    max_exo_rate_for(mix) -> g/min. Restituisce (g ingeriti per minuto, ossidazione g/min).
+    """
+    n = int(duration_min) + 1
+    intake_g = np.zeros(n)
+    absorbed = np.zeros(n)
+    capacity = np.zeros(n)
+    for mix, grams in plan.intake_vectors(duration_min, default_mix).items():
+        ox_mix = absorption_filter(grams * oxidation_efficiency, tau_min)
+        intake_g += grams
+        absorbed += ox_mix
+        capacity += ox_mix * max_exo_rate_for(mix) * oxidation_efficiency
+    limit = np.divide(capacity, absorbed, out=np.zeros(n), where=absorbed > 0)
+    return intake_g, np.minimum(absorbed, limit)
+
+def muscle_exo_capacity(subject_obj, ftp_watts, custom_max_exo_rate=None):
+    """
+    Capacità di ossidazione esogena del muscolo (g/min) per il modello a compartimenti:
+    il limite intestinale del mix è già nei trasportatori, quindi si usa il mix più favorevole.
+    """
+    if custom_max_exo_rate is not None:
+        return custom_max_exo_rate
+    best_mix = max(ChoMixType, key=lambda m: m.max_rate_gh)
+    return estimate_max_exogenous_oxidation(subject_obj.height_cm, subject_obj.weight_kg, ftp_watts, best_mix)
+
+def gut_load_series(intake_g, exo_oxidation_g_min, oxidation_efficiency):
+    """
+    Carico intestinale: somma cumulata di (ingerito * efficienza - ossidato) riflessa in zero,
+    cioè gut[t] = max(0, gut[t-1] + entrate - uscite).
+    """
+    walk = np.cumsum(intake_g * oxidation_efficiency - exo_oxidation_g_min)
+    return walk - np.minimum(np.minimum.accumulate(walk), 0.0)
+
+def simulate_metabolism(
+    subject_data, 
+    duration_min, 
+    constant_carb_intake_g_h, 
+    cho_per_unit_g, 
+    crossover_pct, 
+    tau_absorption, 
+    subject_obj, 
+    activity_params,
+    oxidation_efficiency_input=0.80, 
+    custom_max_exo_rate=None,
+    mix_type_input=ChoMixType.GLUCOSE_ONLY,
+    intensity_series=None,
+    feeding_plan=None,
+    gut_model=None
+):
+    """
+    Simulazione minuto per minuto. Con `feeding_plan` (FeedingPlan) l'integrazione segue
+    gli eventi del piano e constant_carb_intake_g_h è ignorato; la cinetica del piano
+    (plan_kinetics) differisce da quella dell'integrazione costante (constant_rate_kinetics). Con `gut_model` (GutParams)
+    l'assorbimento usa il modello a compartimenti di glicogeno.gut (stats["gut_model"]).
+    `crossover_pct`, se non è None, sostituisce activity_params.crossover_pct.
+    """
+    tank_g = subject_data['actual_available_g']
+    results = []
+    
+    initial_muscle_glycogen = subject_data['muscle_glycogen_g']
+    initial_liver_glycogen = subject_data['liver_glycogen_g']
+    
+    current_muscle_glycogen = initial_muscle_glycogen
+    current_liver_glycogen = initial_liver_glycogen
+    
+    activity = ActivityParams.coerce(activity_params)
+    if crossover_pct is not None and crossover_pct != activity.crossover_pct:
+        activity = replace(activity, crossover_pct=crossover_pct)
+    mode = activity.mode
+    gross_efficiency = activity.efficiency
+    
+    avg_power = activity.avg_watts
+    ftp_watts = activity.ftp_watts
+    avg_hr = activity.avg_hr
+    max_hr = activity.max_hr
+    
+    intensity_factor_reference = activity.intensity_factor
+    
+    if mode == 'cycling':
+        kcal_per_min_base = (avg_power * 60) / 4184 / (gross_efficiency / 100.0)
+    elif mode == 'running':
+        speed_kmh = activity.speed_kmh
+        weight = subject_obj.weight_kg
+        kcal_per_hour = 1.0 * weight * speed_kmh
+        kcal_per_min_base = kcal_per_hour / 60.0
+    else:
+        vo2_operating = subject_obj.vo2max_absolute_l_min * intensity_factor_reference
+        kcal_per_min_base = vo2_operating * 5.0
+        
+    is_lab_data = activity.use_lab_data
+    lab_cho_rate = activity.lab_cho_g_h / 60.0
+    lab_fat_rate = activity.lab_fat_g_h / 60.0
+    
+    # Curva di laboratorio già ordinata: array pronti per l'interpolazione nel ciclo
+    lab_curve = activity.lab_curve
+    if lab_curve is not None:
+        curve_x, curve_cho, curve_fat = np.array(lab_curve.x), np.array(lab_curve.cho), np.array(lab_curve.fat)
+    x_col = lab_curve.x_col if lab_curve is not None else 'Watt'
+    
+    crossover_pct = activity.crossover_pct
+    crossover_if = crossover_pct / 100.0
+    
+    if custom_max_exo_rate is not None:
+        max_exo_rate_g_min = custom_max_exo_rate 
+    else:
+        max_exo_rate_g_min = estimate_max_exogenous_oxidation(
+            subject_obj.height_cm, 
+            subject_obj.weight_kg, 
+            ftp_watts,
+            mix_type_input
+        )
+    
+    oxidation_efficiency = oxidation_efficiency_input
+    
+    total_fat_burned_g = 0.0
+    
+    total_muscle_used = 0.0
+    total_liver_used = 0.0
+    total_exo_used = 0.0
+    
+    # Ingestione, ossidazione esogena e carico intestinale non dipendono dal glicogeno:
+    # calcolati una volta per tutta la gara (stesso costo per piani costanti o a eventi)
+    gut_stats = None
+    if gut_model is not None:
+        plan = feeding_plan if feeding_plan is not None else FeedingPlan.constant_rate(
+            constant_carb_intake_g_h, cho_per_unit_g, duration_min)
+        max_exo_rate_g_min = muscle_exo_capacity(subject_obj, ftp_watts, custom_max_exo_rate)
+        intake_g, exo_oxidation, gut_series, gut_stats = compartment_kinetics(
+            plan, duration_min, tau_absorption, oxidation_efficiency, max_exo_rate_g_min, mix_type_input, gut_model)
+        if feeding_plan is not None:
+            constant_carb_intake_g_h = float(intake_g.sum()) * 60 / duration_min if duration_min > 0 else 0.0
+    elif feeding_plan is not None:
+        def max_exo_rate_for(mix):
+            if custom_max_exo_rate is not None:
+                return custom_max_exo_rate
+            return estimate_max_exogenous_oxidation(subject_obj.height_cm, subject_obj.weight_kg, ftp_watts, mix)
+        intake_g, exo_oxidation = plan_kinetics(feeding_plan, duration_min, tau_absorption, oxidation_efficiency,
+                                                max_exo_rate_for, mix_type_input)
+        constant_carb_intake_g_h = float(intake_g.sum()) * 60 / duration_min if duration_min > 0 else 0.0
+    else:
+        intake_g, exo_oxidation = constant_rate_kinetics(duration_min, constant_carb_intake_g_h, cho_per_unit_g,
+                                                         tau_absorption, oxidation_efficiency, max_exo_rate_g_min)
+    if gut_model is None:
+        gut_series = gut_load_series(intake_g, exo_oxidation, oxidation_efficiency)
+    gut_series = gut_series.tolist()
+    intake_cumulative = np.cumsum(intake_g).tolist()
+    exo_oxidation_cumulative = np.cumsum(exo_oxidation).tolist()
+    exo_oxidation = exo_oxidation.tolist()
+    
+    for t in range(int(duration_min) + 1):
+        
+        current_intensity_factor = intensity_factor_reference
+        if intensity_series is not None and t < len(intensity_series):
+            current_intensity_factor = intensity_series[t]
+        
+        current_kcal_demand = 0.0
+        
+        if mode == 'cycling':
+            instant_power = current_intensity_factor * ftp_watts
+            current_eff = gross_efficiency
+            if t > 60: 
+                loss = (t - 60) * 0.02
+                current_eff = max(15.0, gross_efficiency - loss)
+            current_kcal_demand = (instant_power * 60) / 4184 / (current_eff / 100.0)
+            
+        else: 
+            demand_scaling = current_intensity_factor / intensity_factor_reference if intensity_factor_reference > 0 else 1.0
+            
+            drift_factor = 1.0
+            if t > 60:
+                drift_factor += (t - 60) * 0.0005 
+            
+            current_kcal_demand = kcal_per_min_base * drift_factor * demand_scaling
+        
+        current_exo_oxidation_g_min = exo_oxidation[t]
+        gut_accumulation_total = gut_series[t]
+        total_intake_cumulative = intake_cumulative[t]
+        total_exo_oxidation_cumulative = exo_oxidation_cumulative[t]
+        
+        if is_lab_data:
+            # Determina il valore X corrente (Watt, HR o Speed)
+            current_x_val = 0
+            if x_col == 'Watt':
+                # Power corrente (se c'è una serie, usala, altrimenti usa la media)
+                current_x_val = current_intensity_factor * ftp_watts if mode == 'cycling' else avg_power
+            elif x_col == 'HR':
+                # Stima HR lineare se non abbiamo dati precisi, o usa avg
+                current_x_val = avg_hr * current_intensity_factor / intensity_factor_reference if intensity_factor_reference > 0 else avg_hr
+            elif x_col == 'Speed':
+                current_x_val = activity.speed_kmh # Fallback semplice
+            
+            # Interpola dalla curva caricata
+            if lab_curve is None:
+                cho_rate_now, fat_rate_now = 0, 0
+            else:
+                cho_rate_now = np.interp(current_x_val, curve_x, curve_cho)
+                fat_rate_now = np.interp(current_x_val, curve_x, curve_fat)
+            
+            # Applica drift fatica se la durata è lunga (> 60 min)
+            fatigue_drift = 1.0 + ((t - 60) * 0.001) if t > 60 else 1.0
+            
+            total_cho_demand = (cho_rate_now / 60.0) * fatigue_drift # g/min
+            current_fat_g_min = (fat_rate_now / 60.0) # g/min
+            
+            kcal_cho_demand = total_cho_demand * 4.1
+            
+            # RER fittizio per output
+            tot_sub = total_cho_demand + current_fat_g_min
+            cho_ratio = total_cho_demand / tot_sub if tot_sub > 0 else 1.0
+            rer = 0.7 + (0.3 * cho_ratio) 
+        
+        else:
+            effective_if_for_rer = current_intensity_factor + ((75.0 - crossover_pct) / 100.0)
+            if effective_if_for_rer < 0.3: effective_if_for_rer = 0.3
+            
+            rer = calculate_rer_polynomial(effective_if_for_rer)
+            base_cho_ratio = (rer - 0.70) * 3.45
+            base_cho_ratio = max(0.0, min(1.0, base_cho_ratio))
+            
+            current_cho_ratio = base_cho_ratio
+            if current_intensity_factor < 0.85 and t > 60:
+                hours_past = (t - 60) / 60.0
+                metabolic_shift = 0.05 * (hours_past ** 1.2) 
+                current_cho_ratio = max(0.05, base_cho_ratio - metabolic_shift)
+            
+            cho_ratio = current_cho_ratio
+            fat_ratio = 1.0 - cho_ratio
+            
+            kcal_cho_demand = current_kcal_demand * cho_ratio
+        
+        total_cho_g_min = kcal_cho_demand / 4.1
+        kcal_from_exo = current_exo_oxidation_g_min * 3.75 
+        
+        muscle_fill_state = current_muscle_glycogen / initial_muscle_glycogen if initial_muscle_glycogen > 0 else 0
+        muscle_contribution_factor = math.pow(muscle_fill_state, 0.6) 
+        
+        muscle_usage_g_min = total_cho_g_min * muscle_contribution_factor
+        if current_muscle_glycogen <= 0: muscle_usage_g_min = 0
+        
+        blood_glucose_demand_g_min = total_cho_g_min - muscle_usage_g_min
+        
+        from_exogenous = min(blood_glucose_demand_g_min, current_exo_oxidation_g_min)
+        
+        remaining_blood_demand = blood_glucose_demand_g_min - from_exogenous
+        max_liver_output = 1.2 
+        from_liver = min(remaining_blood_demand, max_liver_output)
+        if current_liver_glycogen <= 0: from_liver = 0
+        
+        if t > 0:
+            current_muscle_glycogen -= muscle_usage_g_min
+            current_liver_glycogen -= from_liver
+            
+            if current_muscle_glycogen < 0: current_muscle_glycogen = 0
+            if current_liver_glycogen < 0: current_liver_glycogen = 0
+            
+            if not is_lab_data:
+                fat_ratio_used = 1.0 - cho_ratio
+                total_fat_burned_g += (current_kcal_demand * fat_ratio_used) / 9.0
+            else:
+                total_fat_burned_g += lab_fat_rate
+            
+            total_muscle_used += muscle_usage_g_min
+            total_liver_used += from_liver
+            total_exo_used += from_exogenous
+            
+        status_label = "Ottimale"
+        if current_liver_glycogen < 20: status_label = "CRITICO (Ipoglicemia)"
+        elif current_muscle_glycogen < 100: status_label = "Warning (Gambe Vuote)"
+            
+        exo_oxidation_g_h = from_exogenous * 60
+        
+        g_muscle = muscle_usage_g_min
+        g_liver = from_liver
+        g_exo = from_exogenous
+        fat_ratio_used_local = 1.0 - cho_ratio if not is_lab_data else (lab_fat_rate / 60 * 9.0) / current_kcal_demand if current_kcal_demand > 0 else 0.0
+        g_fat = (current_kcal_demand * fat_ratio_used_local / 9.0)
+        
+        total_g_min = g_muscle + g_liver + g_exo + g_fat
+        if total_g_min == 0: total_g_min = 1.0 
+        
+        results.append({
+            "Time (min)": t,
+            "Glicogeno Muscolare (g)": muscle_usage_g_min * 60, 
+            "Glicogeno Epatico (g)": from_liver * 60,
+            "Carboidrati Esogeni (g)": exo_oxidation_g_h, 
+            "Ossidazione Lipidica (g)": lab_fat_rate * 60 if is_lab_data else ((current_kcal_demand * (1.0 - cho_ratio)) / 9.0) * 60,
+            
+            "Pct_Muscle": f"{(g_muscle / total_g_min * 100):.1f}%",
+            "Pct_Liver": f"{(g_liver / total_g_min * 100):.1f}%",
+            "Pct_Exo": f"{(g_exo / total_g_min * 100):.1f}%",
+            "Pct_Fat": f"{(g_fat / total_g_min * 100):.1f}%",
+
+            "Residuo Muscolare": current_muscle_glycogen,
+            "Residuo Epatico": current_liver_glycogen,
+            "Residuo Totale": current_muscle_glycogen + current_liver_glycogen, 
+            "Target Intake (g/h)": constant_carb_intake_g_h, 
+            "Gut Load": gut_accumulation_total,
+            "Stato": status_label,
+            "CHO %": cho_ratio * 100,
+            "Intake Cumulativo (g)": total_intake_cumulative,
+            "Ossidazione Cumulativa (g)": total_exo_oxidation_cumulative,
+            "Intensity Factor (IF)": current_intensity_factor 
+        })
+        
+    total_kcal_final = current_kcal_demand * 60 
+    
+    final_total_glycogen = current_muscle_glycogen + current_liver_glycogen
+
+    stats = {
+        "final_muscle": current_muscle_glycogen,
+        "final_liver": current_liver_glycogen,
+        "final_glycogen": final_total_glycogen, 
+        "total_muscle_used": total_muscle_used,
+        "total_liver_used": total_liver_used,
+        "total_exo_used": total_exo_used,
+        "fat_total_g": total_fat_burned_g,
+        "kcal_total_h": total_kcal_final,
+        "gut_accumulation": (gut_accumulation_total / duration_min) * 60 if duration_min > 0 else 0,
+        "max_exo_capacity": max_exo_rate_g_min * 60,
+        "intensity_factor": intensity_factor_reference,
+        "avg_rer": rer,
+        "gross_efficiency": gross_efficiency,
+        "intake_g_h": constant_carb_intake_g_h,
+        "cho_pct": cho_ratio * 100
+    }
+    if gut_stats is not None:
+        stats["gut_model"] = gut_stats
+
+    return pd.DataFrame(results), stats
+
+def simulate_race(subject_data, subject_obj, duration_min, activity, intake, absorption, intensity_series=None,
+                  feeding_plan=None):
+    """
+    simulate_metabolism con i parametri raggruppati (ActivityParams, IntakeParams, AbsorptionParams).
+    """
+    return simulate_metabolism(
+        subject_data, duration_min, intake.carb_intake_g_h, intake.cho_per_unit_g,
+        activity.crossover_pct, absorption.tau_min, subject_obj, activity,
+        oxidation_efficiency_input=absorption.oxidation_efficiency,
+        custom_max_exo_rate=absorption.max_exo_rate_g_min,
+        mix_type_input=intake.mix_type,
+        intensity_series=intensity_series,
+        feeding_plan=feeding_plan,
+        gut_model=absorption.gut_model,
+    )
+
+def interpolate_from_curve(current_val, curve_df, x_col):
+    """
+    Interpolazione lineare per trovare CHO/FAT a una data intensità.
+    """
+    if curve_df is None or curve_df.empty: return 0, 0
+    
+    # Ordina per asse X
+    df = curve_df.sort_values(x_col)
+    
+    cho = np.interp(current_val, df[x_col], df['CHO'])
+    fat = np.interp(current_val, df[x_col], df['FAT'])
+    
+    return cho, fat # g/h
+
+# --- MODELLO INCREMENTALE (DATI LIVE) ---
+
+# Senza un piano di integrazione, l'ossidazione esogena resta attiva fino a
+# questo tempo dall'ultima assunzione, poi decade con la costante di assorbimento
+FEEDING_WINDOW_MIN = 90.0
+
+def _interp_sorted(x, xs, ys):
+    """
+    np.interp su tuple ordinate, senza allocare array (estremi saturati).
+    """
+    if x <= xs[0]: return ys[0]
+    if x >= xs[-1]: return ys[-1]
+    i = bisect.bisect_right(xs, x)
+    x0, x1 = xs[i - 1], xs[i]
+    return ys[i - 1] + (ys[i] - ys[i - 1]) * (x - x0) / (x1 - x0)
+
+class GlycogenModel:
+    """
+    Stato di glicogeno muscolare/epatico e carico intestinale aggiornato a ogni
+    campione live (potenza o FC), con la stessa fisiologia di simulate_metabolism.
+
+    `step` costa O(1) e non crea strutture: lo stato vive in attributi a slot.
+    Con `planned_intake_g_h` l'ossidazione esogena segue il piano come nella
+    simulazione (passi da 60 s riproducono i minuti di simulate_metabolism);
+    senza, è attiva solo entro FEEDING_WINDOW_MIN dall'ultima assunzione.
+    """
+    __slots__ = (
+        'activity', 'initial_muscle_g', 'initial_liver_g', 'kcal_min_base', 'max_exo_rate_g_min',
+        'oxidation_efficiency', 'tau_min', 'planned_intake_g_h', 'elapsed_min', 'muscle_g', 'liver_g',
+        'gut_load_g', 'exo_oxidation_g_min', 'last_intake_min', 'intensity_factor', 'kcal_min',
+        'cho_ratio', 'cho_g_min', 'total_intake_g', 'total_exo_oxidation_g', 'total_muscle_used',
+        'total_liver_used', 'total_exo_used', 'fat_total_g',
+    )
+
+    def __init__(self, subject_data, subject_obj, activity, absorption=AbsorptionParams(),
+                 mix_type=ChoMixType.GLUCOSE_ONLY, planned_intake_g_h=None):
+        activity = ActivityParams.coerce(activity)
+        self.activity = activity
+        self.initial_muscle_g = subject_data['muscle_glycogen_g']
+        self.initial_liver_g = subject_data['liver_glycogen_g']
+
+        if activity.mode == 'cycling':
+            self.kcal_min_base = (activity.avg_watts * 60) / 4184 / (activity.efficiency / 100.0)
+        elif activity.mode == 'running':
+            self.kcal_min_base = 1.0 * subject_obj.weight_kg * activity.speed_kmh / 60.0
+        else:
+            self.kcal_min_base = subject_obj.vo2max_absolute_l_min * activity.intensity_factor * 5.0
+
+        if absorption.max_exo_rate_g_min is not None:
+            self.max_exo_rate_g_min = absorption.max_exo_rate_g_min
+        else:
+            self.max_exo_rate_g_min = estimate_max_exogenous_oxidation(
+                subject_obj.height_cm, subject_obj.weight_kg, activity.ftp_watts, mix_type)
+        self.oxidation_efficiency = absorption.oxidation_efficiency
+        self.tau_min = absorption.tau_min
+        self.planned_intake_g_h = planned_intake_g_h
+
+        self.elapsed_min = 0.0
+        self.muscle_g = self.initial_muscle_g
+        self.liver_g = self.initial_liver_g
+        self.gut_load_g = 0.0
+        self.exo_oxidation_g_min = 0.0
+        self.last_intake_min = -math.inf
+        self.intensity_factor = activity.intensity_factor
+        self.kcal_min = 0.0
+        self.cho_ratio = 0.0
+        self.cho_g_min = 0.0
+        self.total_intake_g = 0.0
+        self.total_exo_oxidation_g = 0.0
+        self.total_muscle_used = 0.0
+        self.total_liver_used = 0.0
+        self.total_exo_used = 0.0
+        self.fat_total_g = 0.0
+
+    @property
+    def total_g(self):
+        return self.muscle_g + self.liver_g
+
+    @property
+    def status(self):
+        if self.liver_g < 20: return "CRITICO (Ipoglicemia)"
+        if self.muscle_g < 100: return "Warning (Gambe Vuote)"
+        return "Ottimale"
+
+    def step(self, dt, power_or_hr, intake_g=0.0):
+        """
+        Avanza di dt secondi con il campione corrente: Watt in ciclismo, FC
+        (bpm) negli altri sport. intake_g = CHO ingeriti nell'intervallo.
+        """
+        dt_min = dt / 60.0
+        if dt_min <= 0:
+            return
+        act = self.activity
+        t = self.elapsed_min + dt_min
+        self.elapsed_min = t
+        if_ref = act.intensity_factor
+
+        # Intensità e domanda energetica (kcal/min)
+        if act.mode == 'cycling':
+            power = power_or_hr
+            intensity = power / act.ftp_watts if act.ftp_watts > 0 else if_ref
+            eff = act.efficiency
+            if t > 60:
+                eff = max(15.0, eff - (t - 60) * 0.02)
+            kcal_min = (power * 60) / 4184 / (eff / 100.0)
+        else:
+            scaling = power_or_hr / act.avg_hr if act.avg_hr > 0 else 1.0
+            intensity = if_ref * scaling
+            drift = 1.0 + (t - 60) * 0.0005 if t > 60 else 1.0
+            kcal_min = self.kcal_min_base * drift * scaling
+
+        # Assorbimento: l'ossidazione esogena tende al limite mentre ci si alimenta
+        if intake_g > 0:
+            self.last_intake_min = t
+        if self.planned_intake_g_h is not None:
+            feeding = self.planned_intake_g_h != 0
+        else:
+            feeding = t - self.last_intake_min <= FEEDING_WINDOW_MIN
+        alpha = 1 - math.exp(-dt_min / self.tau_min)
+        ox = self.exo_oxidation_g_min
+        if feeding:
+            ox += alpha * (self.max_exo_rate_g_min * self.oxidation_efficiency - ox)
+        else:
+            ox *= (1 - alpha)
+        if ox < 0: ox = 0.0
+        self.exo_oxidation_g_min = ox
+
+        gut = self.gut_load_g + intake_g * self.oxidation_efficiency - ox * dt_min
+        self.gut_load_g = gut if gut > 0 else 0.0
+        self.total_intake_g += intake_g
+        self.total_exo_oxidation_g += ox * dt_min
+
+        # Ripartizione CHO / grassi
+        curve = act.lab_curve
+        if act.use_lab_data:
+            if curve is None:
+                cho_rate, fat_rate = 0.0, 0.0
+            else:
+                if curve.x_col == 'Watt':
+                    x_val = power if act.mode == 'cycling' else act.avg_watts
+                elif curve.x_col == 'HR':
+                    x_val = power_or_hr if act.mode != 'cycling' else (
+                        act.avg_hr * intensity / if_ref if if_ref > 0 else act.avg_hr)
+                else:
+                    x_val = act.speed_kmh
+                cho_rate = _interp_sorted(x_val, curve.x, curve.cho)
+                fat_rate = _interp_sorted(x_val, curve.x, curve.fat)
+            fatigue_drift = 1.0 + ((t - 60) * 0.001) if t > 60 else 1.0
+            cho_g_min = (cho_rate / 60.0) * fatigue_drift
+            fat_g_min = fat_rate / 60.0
+            tot_sub = cho_g_min + fat_g_min
+            cho_ratio = cho_g_min / tot_sub if tot_sub > 0 else 1.0
+        else:
+            effective_if = intensity + ((75.0 - act.crossover_pct) / 100.0)
+            if effective_if < 0.3: effective_if = 0.3
+            cho_ratio = max(0.0, min(1.0, (calculate_rer_polynomial(effective_if) - 0.70) * 3.45))
+            if intensity < 0.85 and t > 60:
+                cho_ratio = max(0.05, cho_ratio - 0.05 * (((t - 60) / 60.0) ** 1.2))
+            cho_g_min = kcal_min * cho_ratio / 4.1
+            fat_g_min = kcal_min * (1.0 - cho_ratio) / 9.0
+
+        # Prelievo: muscolo in proporzione al riempimento, poi esogeni, poi fegato
+        fill = self.muscle_g / self.initial_muscle_g if self.initial_muscle_g > 0 else 0
+        muscle_rate = cho_g_min * math.pow(fill, 0.6) if self.muscle_g > 0 else 0.0
+        blood_demand = cho_g_min - muscle_rate
+        from_exo = min(blood_demand, ox)
+        liver_rate = min(blood_demand - from_exo, 1.2) if self.liver_g > 0 else 0.0
+
+        muscle = self.muscle_g - muscle_rate * dt_min
+        liver = self.liver_g - liver_rate * dt_min
+        self.muscle_g = muscle if muscle > 0 else 0.0
+        self.liver_g = liver if liver > 0 else 0.0
+        self.total_muscle_used += muscle_rate * dt_min
+        self.total_liver_used += liver_rate * dt_min
+        self.total_exo_used += from_exo * dt_min
+        self.fat_total_g += fat_g_min * dt_min
+
+        self.intensity_factor = intensity
+        self.kcal_min = kcal_min
+        self.cho_ratio = cho_ratio
+        self.cho_g_min = cho_g_min
+
+    def copy(self):
+        """
+        Copia indipendente dello stato (per proiezioni senza toccare il modello live).
+        """
+        clone = GlycogenModel.__new__(GlycogenModel)
+        for name in GlycogenModel.__slots__:
+            setattr(clone, name, getattr(self, name))
+        return clone
+
+    def snapshot(self):
+        """
+        Stato corrente come dizionario (per log e UI, fuori dal ciclo caldo).
+        """
+        return {
+            "elapsed_min": self.elapsed_min,
+            "muscle_g": self.muscle_g,
+            "liver_g": self.liver_g,
+            "total_g": self.total_g,
+            "gut_load_g": self.gut_load_g,
+            "exo_oxidation_g_h": self.exo_oxidation_g_min * 60,
+            "intensity_factor": self.intensity_factor,
+            "kcal_h": self.kcal_min * 60,
+            "cho_pct": self.cho_ratio * 100,
+            "intake_total_g": self.total_intake_g,
+            "fat_total_g": self.fat_total_g,
+            "status": self.status,
+        }
+
+# --- FUNZIONI PER LE ZONE DI ALLENAMENTO ---
+
+def calculate_zones_cycling(ftp):
+    return [
+        {"Zona": "Z1 - Recupero Attivo", "Range %": "< 55%", "Valore": f"< {int(ftp*0.55)} W"},
+        {"Zona": "Z2 - Endurance (Fondo Lento)", "Range %": "56 - 75%", "Valore": f"{int(ftp*0.56)} - {int(ftp*0.75)} W"},
+        {"Zona": "Z3 - Tempo (Medio)", "Range %": "76 - 90%", "Valore": f"{int(ftp*0.76)} - {int(ftp*0.90)} W"},
+        {"Zona": "Z4 - Soglia (FTP)", "Range %": "91 - 105%", "Valore": f"{int(ftp*0.91)} - {int(ftp*1.05)} W"},
+        {"Zona": "Z5 - VO2max", "Range %": "106 - 120%", "Valore": f"{int(ftp*1.06)} - {int(ftp*1.20)} W"},
+        {"Zona": "Z6 - Capacità Anaerobica", "Range %": "121 - 150%", "Valore": f"{int(ftp*1.21)} - {int(ftp*1.50)} W"},
+        {"Zona": "Z7 - Potenza Neuromuscolare", "Range %": "> 150%", "Valore": f"> {int(ftp*1.50)} W"}
+    ]
+
+def calculate_zones_running_hr(thr):
+    return [
+        {"Zona": "Z1 - Recupero", "Range %": "< 85% LTHR", "Valore": f"< {int(thr*0.85)} bpm"},
+        {"Zona": "Z2 - Aerobico (Fondo Lento)", "Range %": "85 - 89% LTHR", "Valore": f"{int(thr*0.85)} - {int(thr*0.89)} bpm"},
+        {"Zona": "Z3 - Tempo (Medio)", "Range %": "90 - 94% LTHR", "Valore": f"{int(thr*0.90)} - {int(thr*0.94)} bpm"},
+        {"Zona": "Z4 - Sub-Soglia", "Range %": "95 - 99% LTHR", "Valore": f"{int(thr*0.95)} - {int(thr*0.99)} bpm"},
+        {"Zona": "Z5a - Super-Soglia (FTP)", "Range %": "100 - 102% LTHR", "Valore": f"{int(thr*1.00)} - {int(thr*1.02)} bpm"},
+        {"Zona": "Z5b - Capacità Aerobica", "Range %": "103 - 106% LTHR", "Valore": f"{int(thr*1.03)} - {int(thr*1.06)} bpm"},
+        {"Zona": "Z5c - Potenza Anaerobica", "Range %": "> 106% LTHR", "Valore": f"> {int(thr*1.06)} bpm"}
+    ]
+
+# --- FUNZIONE DI CALCOLO SETTIMANALE ---
+def calculate_weekly_balance(initial_muscle, initial_liver, max_muscle, max_liver, weekly_schedule, subject_weight, vo2max):
+    
+    LIVER_DRAIN_RATE = 4.5 
+    DAILY_NEAT_CHO = 1.2 * subject_weight
+    
+    SYNTHESIS_EFFICIENCY = 0.95
+    
+    daily_status = []
+    
+    current_muscle = initial_muscle
+    current_liver = initial_liver
+    
+    days = ["Lunedì", "Martedì", "Mercoledì", "Giovedì", "Venerdì", "Sabato", "Domenica"]
+    
+    for i, day in enumerate(days):
+        day_data = weekly_schedule[i]
+        
+        activity_type = day_data['activity']
+        duration = day_data['duration']
+        intensity = day_data['intensity'] 
+        cho_in = day_data['cho_in']
+        
+        total_basal_drain = (24 * LIVER_DRAIN_RATE) + DAILY_NEAT_CHO
+        
+        exercise_drain_muscle = 0
+        exercise_drain_liver = 0
+        
+        if activity_type != "Riposo" and duration > 0:
+            if intensity == "Bassa (Z1-Z2)":
+                rel_intensity = 0.5
+                cho_pct = 0.25 
+            elif intensity == "Media (Z3)":
+                rel_intensity = 0.7
+                cho_pct = 0.65 
+            else: 
+                rel_intensity = 0.85
+                cho_pct = 0.95 
+                
+            kcal_min = (vo2max * rel_intensity * subject_weight / 1000) * 5.0
+            total_kcal = kcal_min * duration
+            total_cho_burned = (total_kcal * cho_pct) / 4.0 
+            
+            liver_fraction = 0.15 
+            
+            exercise_drain_liver = total_cho_burned * liver_fraction
+            exercise_drain_muscle = total_cho_burned * (1 - liver_fraction)
+            
+        total_daily_consumption = total_basal_drain + exercise_drain_liver + exercise_drain_muscle
+        net_balance = cho_in * SYNTHESIS_EFFICIENCY - total_daily_consumption
+        
+        effective_input = cho_in * SYNTHESIS_EFFICIENCY
+        
+        drain_liver_total = total_basal_drain + exercise_drain_liver
+        drain_muscle_total = exercise_drain_muscle
+        
+        if effective_input >= drain_liver_total:
+            surplus_after_liver_needs = effective_input - drain_liver_total
+            current_liver = current_liver 
+            
+            liver_space = max_liver - current_liver
+            if surplus_after_liver_needs >= liver_space:
+                current_liver = max_liver
+                surplus_for_muscle = surplus_after_liver_needs - liver_space
+            else:
+                current_liver += surplus_after_liver_needs
+                surplus_for_muscle = 0
+                
+        else:
+            deficit = drain_liver_total - effective_input
+            current_liver -= deficit
+            surplus_for_muscle = 0 
+            
+        current_muscle -= drain_muscle_total 
+        current_muscle += surplus_for_muscle 
+        
+        if current_muscle > max_muscle: current_muscle = max_muscle
+        if current_liver > max_liver: current_liver = max_liver
+        
+        if current_muscle < 0: current_muscle = 0
+        if current_liver < 0: current_liver = 0
+            
+        daily_status.append({
+            "Giorno": day,
+            "Glicogeno Muscolare": round(current_muscle),
+            "Glicogeno Epatico": round(current_liver),
+            "Totale": round(current_muscle + current_liver),
+            "Allenamento": f"{activity_type} ({duration} min)" if activity_type != "Riposo" else "Riposo",
+            "CHO In": cho_in,
+            "Consumo Stimato": round(total_daily_consumption),
+            "Bilancio Netto": round(net_balance)
+        })
+        
+    return pd.DataFrame(daily_status)
@@ -0,0 +1,294 @@
+"""
+Confronto tra l'implementazione di riferimento e una versione ottimizzata.
+
+    python -m glicogeno.equivalence --target simulate
+    python -m glicogeno.equivalence --target simulate --candidate pacchetto.modulo:funzione
+    python -m glicogeno.equivalence --target taper --cases 100 --seed 7
+    python -m glicogeno.equivalence --target calibration
+
+Genera input casuali ma fisiologicamente validi (Subject, activity_params,
+strategia di integrazione, diario), esegue riferimento e candidato sugli stessi
+argomenti e riporta per ogni colonna (e per ogni voce di stats / serbatoio) la
+massima deviazione assoluta e relativa, più lo speedup sul tempo totale.
+Il riferimento è la copia congelata di glicogeno.reference; senza --candidate
+si verifica il motore corrente (glicogeno.engine) oppure, per --target
+calibration, il kernel vettoriale di glicogeno.calibration sui residui muscolare
+ed epatico.
+"""
+import argparse
+import copy
+import datetime
+import importlib
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from glicogeno import reference
+from glicogeno.engine import ChoMixType, MenstrualPhase, Sex, SportType, Subject, calculate_tank
+
+DEFAULT_CASES = 50
+DEFAULT_ABS_TOL = 1e-6
+DEFAULT_REL_TOL = 1e-9
+
+
+def simulate_reserves(*args, **kwargs):
+    """
+    simulate_metabolism ridotto alle colonne riprodotte dal kernel di calibrazione.
+    """
+    df, _ = reference.simulate_metabolism(*args, **kwargs)
+    return df[["Time (min)", "Residuo Muscolare", "Residuo Epatico"]]
+
+
+REFERENCES = {
+    "simulate": reference.simulate_metabolism,
+    "taper": reference.calculate_hourly_tapering,
+    "calibration": simulate_reserves,
+}
+
+# Candidato di default (modulo:funzione) quando --candidate non è indicato
+DEFAULT_CANDIDATES = {
+    "simulate": "glicogeno.engine:simulate_metabolism",
+    "taper": "glicogeno.engine:calculate_hourly_tapering",
+    "calibration": "glicogeno.calibration:kernel_reserves",
+}
+
+
+# --- GENERATORI DI INPUT ---
+
+def random_subject(rng):
+    sex = Sex.FEMALE if rng.random() < 0.35 else Sex.MALE
+    weight = float(rng.uniform(50, 95))
+    return Subject(
+        weight_kg=weight,
+        height_cm=float(rng.uniform(155, 198)),
+        body_fat_pct=float(rng.uniform(0.06, 0.30)),
+        sex=sex,
+        glycogen_conc_g_kg=float(rng.uniform(13, 26)),
+        sport=rng.choice(list(SportType)),
+        filling_factor=float(rng.uniform(0.5, 1.25)),
+        uses_creatine=bool(rng.random() < 0.3),
+        menstrual_phase=rng.choice(list(MenstrualPhase)) if sex == Sex.FEMALE else MenstrualPhase.NONE,
+        vo2max_absolute_l_min=weight * float(rng.uniform(40, 75)) / 1000,
+        muscle_mass_kg=float(rng.uniform(25, 40)) if rng.random() < 0.2 else None,
+    )
+
+
+def random_lab_curve(rng, x_col):
+    lo, hi, step = {"Watt": (80, 420, 20), "HR": (100, 190, 5), "Speed": (8, 20, 1)}[x_col]
+    x = np.arange(lo, hi, step, dtype=float)
+    rel = (x - lo) / (hi - lo)
+    cho = 20 + rng.uniform(150, 260) * rel ** rng.uniform(1.3, 2.2)
+    fat = np.clip(rng.uniform(35, 60) * (1 - rel) ** 1.5, 1, None)
+    return pd.DataFrame({x_col: x, "CHO": cho, "FAT": fat})
+
+
+def random_activity(rng, subject):
+    if subject.sport == SportType.CYCLING:
+        ftp = float(rng.uniform(170, 380))
+        act = {"mode": "cycling", "ftp_watts": ftp, "avg_watts": ftp * float(rng.uniform(0.5, 1.0)),
+               "efficiency": float(rng.uniform(18, 25))}
+        act["intensity_factor"] = act["avg_watts"] / ftp
+        x_col = "Watt"
+    elif subject.sport == SportType.RUNNING:
+        thr = float(rng.uniform(155, 185))
+        act = {"mode": "running", "speed_kmh": float(rng.uniform(8, 17)),
+               "avg_hr": thr * float(rng.uniform(0.7, 1.0)), "threshold_hr": thr}
+        act["intensity_factor"] = act["avg_hr"] / thr
+        x_col = "HR"
+    else:
+        max_hr = float(rng.uniform(170, 200))
+        act = {"mode": "other", "avg_hr": max_hr * float(rng.uniform(0.6, 0.9)), "max_hr": max_hr}
+        act["intensity_factor"] = act["avg_hr"] / max_hr
+        x_col = "HR"
+    if rng.random() < 0.2:
+        act.update({"use_lab_data": True, "metabolic_curve_df": random_lab_curve(rng, x_col), "metabolic_x_col": x_col})
+    return act
+
+
+def random_intensity_series(rng, duration):
+    series = []
+    while len(series) < duration + 1:
+        series.extend([float(rng.uniform(0.4, 1.2))] * int(rng.integers(1, 30)))
+    return series[:duration + 1]
+
+
+def random_simulate_case(rng):
+    """
+    (args, kwargs) di simulate_metabolism.
+    """
+    subject = random_subject(rng)
+    tank = calculate_tank(subject)
+    duration = int(rng.integers(30, 600))
+    act = random_activity(rng, subject)
+    # Il riferimento legge il crossover da activity_params: stesso valore nei due posti
+    act["crossover_pct"] = float(rng.uniform(60, 80))
+    intake = float(rng.choice([0, rng.uniform(20, 120)]))
+    args = (tank, duration, intake, float(rng.uniform(15, 40)), act["crossover_pct"],
+            float(rng.uniform(8, 40)), subject, act)
+    kwargs = {
+        "oxidation_efficiency_input": float(rng.uniform(0.58, 0.83)),
+        "custom_max_exo_rate": float(rng.uniform(0.6, 1.6)) if rng.random() < 0.3 else None,
+        "mix_type_input": rng.choice(list(ChoMixType)),
+        "intensity_series": random_intensity_series(rng, duration) if rng.random() < 0.3 else None,
+    }
+    return args, kwargs
+
+
+def random_calibration_case(rng):
+    """
+    (args, kwargs) di simulate_metabolism nel dominio del kernel di calibrazione:
+    integrazione costante, niente dati di laboratorio né limite esogeno personalizzato.
+    """
+    args, kwargs = random_simulate_case(rng)
+    act = {k: v for k, v in args[7].items() if k not in ("use_lab_data", "metabolic_curve_df", "metabolic_x_col")}
+    del kwargs["custom_max_exo_rate"]
+    return args[:7] + (act,), kwargs
+
+
+def random_taper_case(rng):
+    """
+    (args, kwargs) di calculate_hourly_tapering.
+    """
+    subject = random_subject(rng)
+    start = datetime.date(2025, 1, 1) + datetime.timedelta(days=int(rng.integers(0, 365)))
+    days = []
+    for i in range(int(rng.integers(2, 15))):
+        kind = rng.choice(["Riposo", "Ciclismo", "Corsa/Altro"])
+        active = kind != "Riposo"
+        days.append({
+            "date_obj": start + datetime.timedelta(days=i),
+            "type": str(kind),
+            "val": int(rng.integers(120, 300)) if active else 0,
+            "duration": int(rng.integers(20, 240)) if active else 0,
+            "calculated_if": float(rng.uniform(0.5, 1.0)) if active else 0.0,
+            "cho_in": int(rng.integers(150, 900)),
+            "sleep_factor": float(rng.choice([1.0, 0.95, 0.85])),
+            "sleep_start": datetime.time(int(rng.integers(21, 24)), int(rng.choice([0, 30]))),
+            "sleep_end": datetime.time(int(rng.integers(5, 9)), int(rng.choice([0, 30]))),
+            "workout_start": datetime.time(int(rng.integers(6, 20)), 0),
+        })
+    return (subject, days), {"start_state_factor": float(rng.uniform(0.4, 0.85))}
+
+
+CASE_GENERATORS = {
+    "simulate": random_simulate_case,
+    "taper": random_taper_case,
+    "calibration": random_calibration_case,
+}
+
+
+# --- CONFRONTO ---
+
+def _numeric_items(result):
+    """
+    Colonne numeriche e voci scalari di un risultato (DataFrame, dict) come array.
+    """
+    items = {}
+    for part in result if isinstance(result, tuple) else (result,):
+        if isinstance(part, pd.DataFrame):
+            for col in part.columns:
+                if pd.api.types.is_numeric_dtype(part[col]) and not pd.api.types.is_bool_dtype(part[col]):
+                    items[col] = part[col].to_numpy(dtype=float)
+                else:
+                    items[col] = part[col].astype(str).to_numpy()
+        elif isinstance(part, dict):
+            for key, value in part.items():
+                if isinstance(value, (int, float, np.number)) and not isinstance(value, bool):
+                    items[f"[{key}]"] = np.array([float(value)])
+    return items
+
+
+def deviations(reference, candidate):
+    """
+    Per ogni colonna/voce: (max dev. assoluta, max dev. relativa); stringhe: (n. differenze, nan).
+    """
+    ref_items, cand_items = _numeric_items(reference), _numeric_items(candidate)
+    out = {}
+    for name, ref in ref_items.items():
+        cand = cand_items.get(name)
+        if cand is None or cand.shape != ref.shape:
+            out[name] = (np.inf, np.inf)
+        elif ref.dtype.kind in "fc":
+            diff = np.abs(cand.astype(float) - ref)
+            both_nan = np.isnan(ref) & np.isnan(cand.astype(float))
+            diff[both_nan] = 0.0
+            rel = diff / np.maximum(np.abs(ref), 1e-12)
+            out[name] = (float(np.nanmax(diff, initial=0.0)), float(np.nanmax(rel, initial=0.0)))
+        else:
+            out[name] = (float(np.sum(ref != cand)), np.nan)
+    return out
+
+
+def run_harness(target, candidate, n_cases=DEFAULT_CASES, seed=0):
+    """
+    Esegue riferimento e candidato su n_cases input casuali.
+    Restituisce (DataFrame delle deviazioni per colonna, tempo riferimento s, tempo candidato s).
+    """
+    reference = REFERENCES[target]
+    generator = CASE_GENERATORS[target]
+    rng = np.random.default_rng(seed)
+
+    worst = {}
+    t_ref = t_cand = 0.0
+    for case in range(n_cases):
+        args, kwargs = generator(rng)
+        # Copie indipendenti: un'implementazione non deve vedere le modifiche dell'altra
+        cand_args, cand_kwargs = copy.deepcopy((args, kwargs))
+
+        t0 = time.perf_counter()
+        ref_result = reference(*args, **kwargs)
+        t_ref += time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        cand_result = candidate(*cand_args, **cand_kwargs)
+        t_cand += time.perf_counter() - t0
+
+        for name, (abs_dev, rel_dev) in deviations(ref_result, cand_result).items():
+            prev = worst.get(name)
+            if prev is None or abs_dev > prev["max_abs"]:
+                worst[name] = {"max_abs": abs_dev, "max_rel": rel_dev, "worst_case": case}
+            elif not np.isnan(rel_dev) and rel_dev > prev["max_rel"]:
+                prev["max_rel"] = rel_dev
+
+    report = pd.DataFrame.from_dict(worst, orient="index")
+    report.index.name = "colonna"
+    return report, t_ref, t_cand
+
+
+def load_callable(spec):
+    module_name, _, attr = spec.partition(":")
+    return getattr(importlib.import_module(module_name), attr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m glicogeno.equivalence",
+                                     description="Equivalenza riferimento vs implementazione ottimizzata")
+    parser.add_argument("--target", choices=sorted(REFERENCES), default="simulate")
+    parser.add_argument("--candidate", help="implementazione da verificare, nel formato modulo:funzione")
+    parser.add_argument("--cases", type=int, default=DEFAULT_CASES)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--abs-tol", type=float, default=DEFAULT_ABS_TOL)
+    parser.add_argument("--rel-tol", type=float, default=DEFAULT_REL_TOL)
+    args = parser.parse_args(argv)
+
+    candidate = load_callable(args.candidate or DEFAULT_CANDIDATES[args.target])
+    report, t_ref, t_cand = run_harness(args.target, candidate, args.cases, args.seed)
+
+    report["ok"] = (report["max_abs"] <= args.abs_tol) | (report["max_rel"] <= args.rel_tol)
+    with pd.option_context("display.max_rows", None, "display.width", 140):
+        print(report.to_string(float_format=lambda v: f"{v:.3g}"))
+    print(f"\nCasi: {args.cases}  riferimento: {t_ref:.3f} s  candidato: {t_cand:.3f} s  "
+          f"speedup: {t_ref / t_cand if t_cand > 0 else float('inf'):.2f}x")
+
+    failed = report.index[~report["ok"]].tolist()
+    if failed:
+        print(f"NON EQUIVALENTE su: {', '.join(failed)}")
+        return 1
+    print("Equivalente entro le tolleranze.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,210 @@
+"""
+Esportazione a blocchi di simulazioni, diari orari e risultati batch.
+
+    python -m glicogeno.export risultati.jsonl --format xlsx --out risultati.xlsx
+
+I writer ricevono un iterabile di DataFrame (blocchi) e li scrivono uno alla
+volta: CSV in append, Parquet con un row group per blocco (pyarrow), Excel con
+openpyxl in modalità write-only. Le sorgenti (`frame_chunks`, `record_chunks`,
+`jsonl_chunks`) producono blocchi senza costruire l'intera tabella in memoria.
+"""
+import argparse
+import io
+import json
+import sys
+import tempfile
+from itertools import islice
+
+import pandas as pd
+
+FORMATS = ("csv", "parquet", "xlsx")
+
+MIME_TYPES = {
+    "csv": "text/csv",
+    "parquet": "application/vnd.apache.parquet",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+
+CHUNK_ROWS = 5000
+# Oltre questa dimensione il file temporaneo di esportazione passa su disco
+SPOOL_MAX_BYTES = 16 * 1024 * 1024
+
+EXCEL_MAX_ROWS = 1048576
+
+
+# --- SORGENTI A BLOCCHI ---
+
+def frame_chunks(df, chunk_rows=CHUNK_ROWS):
+    """
+    Blocchi di righe di un DataFrame già in memoria (viste, senza copie formattate).
+    """
+    for start in range(0, len(df), chunk_rows):
+        yield df.iloc[start:start + chunk_rows]
+
+
+def _flat_value(value):
+    return json.dumps(value, default=float) if isinstance(value, (list, dict)) else value
+
+
+def flatten_record(record, prefix=""):
+    """
+    Dizionari annidati -> colonne puntate (stats.final_glycogen); liste come JSON.
+    """
+    flat = {}
+    for key, value in record.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict) and value:
+            flat.update(flatten_record(value, name + "."))
+        else:
+            flat[name] = _flat_value(value)
+    return flat
+
+
+def record_chunks(records, chunk_rows=CHUNK_ROWS):
+    """
+    Blocchi da un iterabile di dizionari (risultati batch, esiti Monte Carlo).
+    Le colonne sono fissate dal primo blocco; quelle nuove nei blocchi successivi sono ignorate.
+    """
+    records = iter(records)
+    columns = None
+    while True:
+        batch = [flatten_record(r) for r in islice(records, chunk_rows)]
+        if not batch:
+            return
+        df = pd.DataFrame(batch)
+        if columns is None:
+            # Colonne tutte vuote nel primo blocco: numeriche (es. bonk_min), per uno schema Parquet stabile
+            empty = [c for c in df.columns if df[c].isna().all()]
+            df[empty] = df[empty].astype(float)
+            columns = list(df.columns)
+        yield df.reindex(columns=columns)
+
+
+def jsonl_chunks(path, chunk_rows=CHUNK_ROWS):
+    def records():
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    return record_chunks(records(), chunk_rows)
+
+
+# --- WRITER ---
+
+def write_csv(chunks, out):
+    """
+    out: file binario aperto. Intestazione solo col primo blocco.
+    """
+    text = io.TextIOWrapper(out, encoding="utf-8", newline="", write_through=True)
+    rows = 0
+    try:
+        for i, chunk in enumerate(chunks):
+            chunk.to_csv(text, header=i == 0, index=False)
+            rows += len(chunk)
+    finally:
+        text.detach()
+    return rows
+
+
+def write_parquet(chunks, out):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError("L'esportazione Parquet richiede pyarrow (pip install pyarrow).") from e
+
+    writer = None
+    rows = 0
+    try:
+        for chunk in chunks:
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(out, table.schema)
+            else:
+                table = table.cast(writer.schema)
+            writer.write_table(table)
+            rows += len(chunk)
+    finally:
+        if writer is not None:
+            writer.close()
+    return rows
+
+
+def write_xlsx(chunks, out, sheet_name="Dati"):
+    """
+    Workbook openpyxl write-only: le righe vanno su disco man mano, senza celle in memoria.
+    """
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(sheet_name)
+    rows = 0
+    try:
+        for i, chunk in enumerate(chunks):
+            if i == 0:
+                sheet.append([str(c) for c in chunk.columns])
+            # EXCEL_MAX_ROWS comprende l'intestazione
+            if rows + len(chunk) > EXCEL_MAX_ROWS - 1:
+                raise ValueError(f"Excel supporta al massimo {EXCEL_MAX_ROWS} righe: usare CSV o Parquet.")
+            # tolist() converte i tipi numpy in tipi Python; NaN/NA diventano celle vuote
+            values = chunk.astype(object).where(chunk.notna(), None).to_numpy().tolist()
+            for row in values:
+                sheet.append(row)
+            rows += len(values)
+    except BaseException:
+        # Chiude il file temporaneo del foglio write-only (il workbook non viene salvato)
+        sheet.close()
+        raise
+    workbook.save(out)
+    return rows
+
+
+WRITERS = {
+    "csv": write_csv,
+    "parquet": write_parquet,
+    "xlsx": write_xlsx,
+}
+
+
+def export_chunks(chunks, fmt, out):
+    """
+    Scrive i blocchi nel formato richiesto su un file binario aperto; restituisce le righe scritte.
+    """
+    return WRITERS[fmt](chunks, out)
+
+
+def export_to_spool(chunks, fmt):
+    """
+    Esporta in un file temporaneo (in memoria fino a SPOOL_MAX_BYTES, poi su disco), riavvolto.
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+    export_chunks(chunks, fmt, spool)
+    spool.seek(0)
+    return spool
+
+
+def export_bytes(chunks, fmt):
+    """
+    Contenuto del file esportato in bytes, per st.download_button (che non accetta
+    file temporanei): i blocchi passano comunque dallo spool, non da un DataFrame unico.
+    """
+    with export_to_spool(chunks, fmt) as spool:
+        return spool.read()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m glicogeno.export", description="Esportazione risultati batch")
+    parser.add_argument("input", help="risultati JSONL (python -m glicogeno.cli ... --out)")
+    parser.add_argument("--format", choices=FORMATS, default="csv")
+    parser.add_argument("--out", required=True, help="file di destinazione")
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS)
+    args = parser.parse_args(argv)
+
+    with open(args.out, "wb") as out:
+        rows = export_chunks(jsonl_chunks(args.input, args.chunk_rows), args.format, out)
+    print(f"{rows} righe esportate in {args.out}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
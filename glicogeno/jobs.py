@@ -0,0 +1,312 @@
+"""
+Pool di processi condiviso per i calcoli pesanti delle sessioni Streamlit.
+
+Un event loop asyncio gira in un thread dedicato. Due modi di usare il pool:
+- job in background (Monte Carlo, sensibilità del diario, report): una lista di
+  task indipendenti (funzione importabile + argomenti); i risultati parziali sono
+  disponibili man mano che i task terminano, senza bloccare la sessione;
+- `call`: un calcolo interattivo (simulazione, diario, parsing di file grandi)
+  eseguito in un processo del pool; solo il thread della sessione che lo chiede
+  attende il risultato, senza contendere il GIL alle altre sessioni.
+
+I task non vanno direttamente al pool: restano in una coda per sessione e il
+dispatcher ne manda in esecuzione al massimo `workers` alla volta, prendendo a
+turno dalle sessioni in attesa. Un job lungo di una sessione non blocca le
+altre, che ottengono il primo worker libero; le `call` passano davanti ai task
+in background della stessa sessione.
+
+I worker partono con forkserver (spawn dove non disponibile), mai con fork dal
+server Streamlit multithread. Se un worker muore (crash, OOM) il pool si rompe:
+falliscono solo i task che erano in esecuzione, il pool viene ricreato e la coda
+prosegue. Una `call` attende al massimo `call_timeout_s`.
+"""
+import asyncio
+import functools
+import itertools
+import multiprocessing
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import context
+
+# Stati di un job
+QUEUED, RUNNING, DONE, CANCELLED, FAILED = "queued", "running", "done", "cancelled", "failed"
+FINISHED_STATES = (DONE, CANCELLED, FAILED)
+
+# Dopo quanto tempo (s) i job terminati vengono dimenticati
+JOB_RETENTION_S = 3600
+# Attesa massima (s) di una call interattiva
+CALL_TIMEOUT_S = 300
+
+
+class _TaskModuleMain:
+    """
+    Avvio di un worker con __main__ = questo modulo. Streamlit registra lo script della
+    pagina come __main__ (senza __spec__): un processo avviato con spawn/forkserver
+    rieseguirebbe l'intera pagina invece di importare un modulo senza effetti collaterali.
+    """
+
+    def start(self):
+        page_main = sys.modules["__main__"]
+        sys.modules["__main__"] = sys.modules[__name__]
+        try:
+            super().start()
+        finally:
+            # Non sovrascrivere un __main__ installato nel frattempo da un'altra esecuzione
+            if sys.modules["__main__"] is sys.modules[__name__]:
+                sys.modules["__main__"] = page_main
+
+
+class _ForkServerWorker(_TaskModuleMain, context.ForkServerProcess):
+    pass
+
+
+class _SpawnWorker(_TaskModuleMain, context.SpawnProcess):
+    pass
+
+
+class _ForkServerContext(context.ForkServerContext):
+    Process = _ForkServerWorker
+
+
+class _SpawnContext(context.SpawnContext):
+    Process = _SpawnWorker
+
+
+def _worker_context():
+    # forkserver dove disponibile: mai fork dal server Streamlit multithread
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        return _ForkServerContext()
+    return _SpawnContext()
+
+
+class Job:
+    """
+    Stato di un job, letto dai thread di Streamlit e aggiornato dall'event loop.
+    """
+
+    def __init__(self, job_id, name, n_tasks, meta=None, session=None):
+        self.id = job_id
+        self.name = name
+        self.session = session
+        self.meta = meta or {}
+        self.n_tasks = n_tasks
+        self.status = QUEUED
+        self.partials = []  # (indice del task, risultato) in ordine di completamento
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+        self._task = None
+        self._lock = threading.Lock()
+
+    @property
+    def progress(self):
+        return len(self.partials) / self.n_tasks if self.n_tasks else 1.0
+
+    @property
+    def is_finished(self):
+        return self.status in FINISHED_STATES
+
+    def results(self):
+        """
+        Risultati disponibili, nell'ordine dei task.
+        """
+        with self._lock:
+            return [result for _, result in sorted(self.partials, key=lambda p: p[0])]
+
+    def _add_partial(self, index, result):
+        with self._lock:
+            self.partials.append((index, result))
+
+
+class JobRunner:
+    """
+    Event loop asyncio in background con pool di processi condiviso e code per sessione.
+    `max_parallel` limita i task in coda o in esecuzione contemporanea per singolo job.
+    """
+
+    def __init__(self, workers=2, max_parallel=None, call_timeout_s=CALL_TIMEOUT_S):
+        self.workers = workers
+        self.max_parallel = max_parallel or workers
+        self.call_timeout_s = call_timeout_s
+        self._mp_context = _worker_context()
+        self._executor = self._new_executor()
+        self._jobs = {}
+        self._ids = itertools.count(1)
+        # Code dei task per sessione, nell'ordine di turno (la prima è servita per prima);
+        # accedute solo dal thread dell'event loop
+        self._queues = OrderedDict()
+        self._in_flight = 0
+        self.stats = {"dispatched": 0, "completed": 0, "failed": 0, "calls": 0, "pool_restarts": 0}
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="glicogeno-jobs", daemon=True)
+        self._thread.start()
+
+    def _new_executor(self):
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=self._mp_context)
+
+    def _restart_pool(self, broken):
+        """
+        Sostituisce il pool rotto (una sola volta per istanza rotta).
+        """
+        if broken is not self._executor:
+            return
+        self._executor = self._new_executor()
+        self.stats["pool_restarts"] += 1
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    # --- CODA EQUA TRA LE SESSIONI (thread dell'event loop) ---
+
+    def _enqueue(self, session, fn, args, urgent=False):
+        future = self._loop.create_future()
+        queue = self._queues.setdefault(session, deque())
+        if urgent:
+            queue.appendleft((fn, args, future))
+        else:
+            queue.append((fn, args, future))
+        self._dispatch()
+        return future
+
+    def _dispatch(self):
+        while self._in_flight < self.workers and self._queues:
+            session, queue = next(iter(self._queues.items()))
+            fn, args, future = queue.popleft()
+            # La sessione appena servita passa in fondo al turno
+            del self._queues[session]
+            if queue:
+                self._queues[session] = queue
+            if future.cancelled():
+                continue
+            executor = self._executor
+            try:
+                try:
+                    pool_future = executor.submit(fn, *args)
+                except BrokenProcessPool:
+                    # Il pool si è rotto prima che arrivasse la notifica: nuovo pool e un secondo tentativo
+                    self._restart_pool(executor)
+                    executor = self._executor
+                    pool_future = executor.submit(fn, *args)
+            except Exception as e:
+                future.set_exception(e)
+                continue
+            self._in_flight += 1
+            self.stats["dispatched"] += 1
+            pool_future.add_done_callback(
+                lambda f, future=future, executor=executor:
+                    self._loop.call_soon_threadsafe(self._finished, f, future, executor))
+
+    def _finished(self, pool_future, future, executor):
+        self._in_flight -= 1
+        error = pool_future.exception() if not pool_future.cancelled() else asyncio.CancelledError()
+        self.stats["failed" if error else "completed"] += 1
+        if isinstance(error, BrokenProcessPool):
+            # Falliscono solo i task che erano in esecuzione sul pool rotto
+            self._restart_pool(executor)
+        if not future.cancelled():
+            if error:
+                future.set_exception(error)
+            else:
+                future.set_result(pool_future.result())
+        self._dispatch()
+
+    async def _run(self, job, tasks):
+        slots = asyncio.Semaphore(self.max_parallel)
+        job.status = RUNNING
+
+        async def run_one(index, fn, args):
+            async with slots:
+                result = await self._enqueue(job.session, fn, args)
+            job._add_partial(index, result)
+
+        pending = [asyncio.ensure_future(run_one(i, fn, args)) for i, (fn, args) in enumerate(tasks)]
+        try:
+            await asyncio.gather(*pending)
+            job.status = DONE
+        except asyncio.CancelledError:
+            for p in pending:
+                p.cancel()
+            job.status = CANCELLED
+        except Exception as e:
+            for p in pending:
+                p.cancel()
+            job.error = f"{type(e).__name__}: {e}"
+            job.status = FAILED
+        finally:
+            job.finished = time.time()
+
+    def submit(self, name, tasks, meta=None, session=None):
+        """
+        Avvia un job; tasks è una lista di (funzione, tupla di argomenti) picklabili.
+        """
+        self._prune()
+        job = Job(next(self._ids), name, len(tasks), meta, session)
+        self._jobs[job.id] = job
+
+        def start():
+            job._task = self._loop.create_task(self._run(job, tasks))
+
+        self._loop.call_soon_threadsafe(start)
+        return job
+
+    def cancel(self, job_id):
+        """
+        Annulla i task non ancora terminati (quelli in corso completano il calcolo
+        corrente ma il loro risultato viene scartato).
+        """
+        job = self._jobs.get(job_id)
+        if job is None or job.is_finished:
+            return
+
+        def cancel():
+            if job._task is not None:
+                job._task.cancel()
+
+        self._loop.call_soon_threadsafe(cancel)
+
+    def call(self, session, fn, *args, **kwargs):
+        """
+        Esegue fn(*args, **kwargs) in un processo del pool e ne restituisce il risultato
+        (o solleva la sua eccezione). fn e argomenti devono essere picklabili.
+        Oltre call_timeout_s solleva TimeoutError e il risultato viene scartato.
+        """
+        if kwargs:
+            fn = functools.partial(fn, **kwargs)
+
+        async def run():
+            self.stats["calls"] += 1
+            return await self._enqueue(session, fn, args, urgent=True)
+
+        pending = asyncio.run_coroutine_threadsafe(run(), self._loop)
+        try:
+            return pending.result(timeout=self.call_timeout_s)
+        except TimeoutError:
+            pending.cancel()
+            raise TimeoutError(f"{getattr(fn, '__name__', fn)} non ha risposto entro {self.call_timeout_s:g} s")
+
+    def queue_stats(self):
+        """
+        Worker occupati, task in attesa (totali e per sessione) e contatori.
+        """
+        async def snapshot():
+            waiting = {session: len(queue) for session, queue in self._queues.items()}
+            return {"workers": self.workers, "in_flight": self._in_flight, "queued": sum(waiting.values()),
+                    "waiting_sessions": waiting, **self.stats}
+
+        return asyncio.run_coroutine_threadsafe(snapshot(), self._loop).result()
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def _prune(self):
+        now = time.time()
+        for job_id, job in list(self._jobs.items()):
+            if job.is_finished and now - job.finished > JOB_RETENTION_S:
+                del self._jobs[job_id]
+
+    def close(self):
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=5)
+        self._executor.shutdown(cancel_futures=True)
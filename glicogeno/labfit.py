@@ -0,0 +1,210 @@
+"""
+Fit robusto delle curve di substrato del metabolimetro.
+
+I dati di `parse_metabolic_report` sono spesso breath-by-breath: migliaia di righe
+rumorose, con respiri anomali. Il fit li riduce a pochi nodi:
+
+1. fasce di intensità (i gradini del test, o fasce a quantili per i dati
+   breath-by-breath), con la mediana di X, CHO e FAT per fascia (robusta ai
+   respiri anomali);
+2. CHO vincolato non decrescente con l'intensità (regressione isotonica pesata),
+   FAT unimodale: sale fino al FATmax e poi scende (due regressioni isotoniche);
+3. tra i nodi, interpolazione cubica monotona (PCHIP, Fritsch-Carlson), che non
+   oscilla e non crea nuovi massimi.
+
+`LabFit.table()` campiona il fit su una griglia uniforme densa e restituisce una
+`LabCurve` di dimensione fissa, usata dal simulatore al posto dei dati grezzi.
+
+    fit = fit_lab_curve(df_curve, "Watt")
+    activity = ActivityParams(use_lab_data=True, lab_curve=fit.table())
+"""
+from dataclasses import dataclass
+
+import numpy as np
+
+from glicogeno.engine import LabCurve
+
+DEFAULT_KNOTS = 12
+TABLE_POINTS = 121
+
+
+# --- REGRESSIONE VINCOLATA ---
+
+def isotonic(y, w, increasing=True):
+    """
+    Regressione isotonica pesata (pool adjacent violators).
+    """
+    y = np.asarray(y, dtype=float)
+    w = np.asarray(w, dtype=float)
+    if not increasing:
+        return -isotonic(-y, w)
+    # Blocchi come (media, peso, numero di punti)
+    means, weights, sizes = [], [], []
+    for value, weight in zip(y, w):
+        means.append(value)
+        weights.append(weight)
+        sizes.append(1)
+        while len(means) > 1 and means[-2] > means[-1]:
+            total = weights[-2] + weights[-1]
+            means[-2] = (means[-2] * weights[-2] + means[-1] * weights[-1]) / total
+            weights[-2] = total
+            sizes[-2] += sizes[-1]
+            del means[-1], weights[-1], sizes[-1]
+    return np.repeat(means, sizes)
+
+
+def unimodal(y, w):
+    """
+    Miglior fit crescente fino a un picco e decrescente dopo (minimi quadrati pesati).
+    """
+    y = np.asarray(y, dtype=float)
+    w = np.asarray(w, dtype=float)
+    best, best_sse = y, np.inf
+    for peak in range(1, len(y) + 1):
+        fitted = np.concatenate([isotonic(y[:peak], w[:peak]), isotonic(y[peak:], w[peak:], increasing=False)])
+        sse = float(np.sum(w * (fitted - y) ** 2))
+        if sse < best_sse:
+            best, best_sse = fitted, sse
+    return best
+
+
+# --- INTERPOLAZIONE CUBICA MONOTONA ---
+
+def pchip_slopes(x, y):
+    """
+    Derivate nei nodi che preservano la forma (Fritsch-Carlson, come PCHIP).
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    if len(x) < 2:
+        return np.zeros_like(y)
+    h = np.diff(x)
+    delta = np.diff(y) / h
+    if len(x) == 2:
+        return np.array([delta[0], delta[0]])
+
+    slopes = np.zeros_like(y)
+    w1 = 2 * h[1:] + h[:-1]
+    w2 = h[1:] + 2 * h[:-1]
+    same_sign = delta[:-1] * delta[1:] > 0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        harmonic = (w1 + w2) / (w1 / delta[:-1] + w2 / delta[1:])
+    slopes[1:-1] = np.where(same_sign, harmonic, 0.0)
+    slopes[0] = _edge_slope(h[0], h[1], delta[0], delta[1])
+    slopes[-1] = _edge_slope(h[-1], h[-2], delta[-1], delta[-2])
+    return slopes
+
+
+def _edge_slope(h0, h1, d0, d1):
+    # Formula a tre punti non centrata, limitata per non invertire la pendenza
+    slope = ((2 * h0 + h1) * d0 - h0 * d1) / (h0 + h1)
+    if np.sign(slope) != np.sign(d0):
+        return 0.0
+    if np.sign(d0) != np.sign(d1) and abs(slope) > abs(3 * d0):
+        return 3 * d0
+    return slope
+
+
+def pchip_eval(x, y, slopes, xq):
+    """
+    Valuta l'interpolante di Hermite nei punti xq (valori costanti fuori dai nodi).
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    xq = np.asarray(xq, dtype=float)
+    if len(x) < 2:
+        return np.full_like(xq, y[0] if len(y) else 0.0)
+    xq = np.clip(xq, x[0], x[-1])
+    i = np.clip(np.searchsorted(x, xq, side="right") - 1, 0, len(x) - 2)
+    h = x[i + 1] - x[i]
+    s = (xq - x[i]) / h
+    h00 = (1 + 2 * s) * (1 - s) ** 2
+    h10 = s * (1 - s) ** 2
+    h01 = s ** 2 * (3 - 2 * s)
+    h11 = s ** 2 * (s - 1)
+    return h00 * y[i] + h10 * h * slopes[i] + h01 * y[i + 1] + h11 * h * slopes[i + 1]
+
+
+# --- FIT ---
+
+def bin_medians(x, cho, fat, n_knots=DEFAULT_KNOTS):
+    """
+    Mediane per fascia di intensità e numero di campioni per fascia. Con pochi valori
+    distinti di X (test a gradini) ogni gradino è una fascia, altrimenti fasce a quantili.
+    """
+    levels = np.unique(x)
+    if len(levels) <= n_knots:
+        idx = np.searchsorted(levels, x)
+    else:
+        edges = np.quantile(x, np.linspace(0, 1, n_knots + 1))
+        idx = np.searchsorted(edges[1:-1], x, side="right")
+    rows = []
+    for b in range(min(n_knots, len(levels))):
+        mask = idx == b
+        if mask.any():
+            rows.append((np.median(x[mask]), np.median(cho[mask]), np.median(fat[mask]), int(mask.sum())))
+    return [np.array(col) for col in zip(*rows)]
+
+
+@dataclass(frozen=True, slots=True)
+class LabFit:
+    """
+    Curva CHO/FAT (g/h) compressa in pochi nodi; tra i nodi interpolazione PCHIP.
+    """
+    x_col: str
+    x: tuple
+    cho: tuple
+    fat: tuple
+    n_samples: int = 0
+
+    def evaluate(self, xq):
+        """
+        (CHO, FAT) in g/h nei punti xq.
+        """
+        cho = pchip_eval(self.x, self.cho, pchip_slopes(self.x, self.cho), xq)
+        fat = pchip_eval(self.x, self.fat, pchip_slopes(self.x, self.fat), xq)
+        return np.maximum(cho, 0.0), np.maximum(fat, 0.0)
+
+    def table(self, n_points=TABLE_POINTS):
+        """
+        Tabella densa su griglia uniforme tra il primo e l'ultimo nodo, come LabCurve.
+        """
+        grid = np.linspace(self.x[0], self.x[-1], n_points if self.x[-1] > self.x[0] else 1)
+        cho, fat = self.evaluate(grid)
+        return LabCurve(self.x_col, tuple(grid.tolist()), tuple(cho.tolist()), tuple(fat.tolist()))
+
+    def to_dict(self):
+        return {"x_col": self.x_col, "x": list(self.x), "cho": list(self.cho), "fat": list(self.fat),
+                "n_samples": self.n_samples}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["x_col"], tuple(map(float, data["x"])), tuple(map(float, data["cho"])),
+                   tuple(map(float, data["fat"])), int(data.get("n_samples", 0)))
+
+
+def fit_lab_curve(curve_df, x_col="Watt", n_knots=DEFAULT_KNOTS):
+    """
+    LabFit dalla curva grezza (colonne x_col, CHO, FAT); None se non ci sono dati validi.
+    """
+    if curve_df is None or curve_df.empty or x_col not in curve_df:
+        return None
+    df = curve_df[[x_col, "CHO", "FAT"]].dropna()
+    df = df[df[x_col] > 0]
+    if df.empty:
+        return None
+
+    x = df[x_col].to_numpy(dtype=float)
+    knots_x, cho, fat, counts = bin_medians(x, df["CHO"].to_numpy(dtype=float),
+                                            df["FAT"].to_numpy(dtype=float), n_knots)
+    cho = np.maximum(isotonic(cho, counts), 0.0)
+    fat = np.maximum(unimodal(fat, counts), 0.0)
+    return LabFit(x_col, tuple(knots_x.tolist()), tuple(cho.tolist()), tuple(fat.tolist()), int(len(df)))
+
+
+def fitted_curve(curve_df, x_col="Watt", n_knots=DEFAULT_KNOTS, n_points=TABLE_POINTS):
+    """
+    fit_lab_curve + table in un passo: LabCurve densa (None se non ci sono dati validi).
+    """
+    fit = fit_lab_curve(curve_df, x_col, n_knots)
+    return fit.table(n_points) if fit is not None else None
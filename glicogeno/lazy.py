@@ -0,0 +1,64 @@
+"""
+Import differiti: il modulo viene caricato al primo accesso a un suo attributo.
+"""
+import importlib.util
+import sys
+import time
+
+# Moduli richiesti (True se restituiti come stub differito) e costo (ms) del caricamento al primo utilizzo
+REQUESTED = {}
+LOAD_MS = {}
+
+
+class _TimedLoader:
+    """
+    Loader che misura l'esecuzione del modulo (il caricamento reale, al primo accesso).
+    """
+
+    def __init__(self, loader):
+        self.loader = loader
+
+    def __getattr__(self, name):
+        return getattr(self.loader, name)
+
+    def create_module(self, spec):
+        return self.loader.create_module(spec)
+
+    def exec_module(self, module):
+        t0 = time.perf_counter()
+        try:
+            self.loader.exec_module(module)
+        finally:
+            LOAD_MS.setdefault(module.__name__, (time.perf_counter() - t0) * 1000.0)
+
+
+def lazy_import(name):
+    """
+    Restituisce il modulo `name` senza eseguirlo subito (importlib LazyLoader).
+    Se è già importato restituisce quello esistente.
+    """
+    if name in sys.modules:
+        REQUESTED.setdefault(name, False)
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ImportError(f"Modulo non trovato: {name}")
+    loader = importlib.util.LazyLoader(_TimedLoader(spec.loader))
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    REQUESTED[name] = True
+    return module
+
+
+def load_report():
+    """
+    Per ogni modulo richiesto: "differito" con il costo del primo utilizzo (None se non
+    ancora usato) oppure "già importato" se era in memoria quando è stato richiesto.
+    """
+    return [
+        {"module": name, "state": "differito" if deferred else "già importato",
+         "first_use_ms": LOAD_MS.get(name)}
+        for name, deferred in REQUESTED.items()
+    ]
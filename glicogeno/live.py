@@ -0,0 +1,352 @@
+"""
+Telemetria live: campioni a 1 Hz da file in crescita o da socket locale.
+
+    python -m glicogeno.live scenario.json --file uscita.csv --follow
+    python -m glicogeno.live scenario.json --file uscita.csv --speed 10    # replay 10x
+    python -m glicogeno.live scenario.json --socket 127.0.0.1:5555 --every 15
+
+I campioni (righe JSON {"t": s, "power": W, "hr": bpm, "intake_g": g} oppure CSV
+con intestazione) vengono aggregati al passo del modello (--step, default 60 s) e
+applicati a un `GlycogenModel`. Ogni --every secondi di dati il resto del piano
+gara dello scenario viene simulato dallo stato corrente per stimare il tempo alla
+crisi; ogni proiezione è scritta come una riga JSON.
+"""
+import argparse
+import csv
+import json
+import math
+import socket
+import sys
+import time
+from dataclasses import dataclass
+
+import numpy as np
+
+from glicogeno.engine import (
+    BONK_LIVER_G, BONK_MUSCLE_G, AbsorptionParams, ActivityParams, FeedingPlan, GlycogenModel, IntakeParams,
+    intake_interval_min,
+)
+from glicogeno.scenario import race_kwargs, scenario_tank, subject_from_dict
+
+DEFAULT_STEP_S = 60
+DEFAULT_EVERY_S = 30
+FOLLOW_POLL_S = 0.2
+
+# Nomi di colonna accettati per ciascun campo del campione
+FIELD_ALIASES = {
+    "t": ("t", "time", "time_s", "timestamp", "elapsed_s", "secs"),
+    "power": ("power", "watts", "watt", "power_w"),
+    "hr": ("hr", "heart_rate", "heartrate", "bpm"),
+    "intake_g": ("intake_g", "cho_g", "intake", "carbs_g"),
+}
+
+
+@dataclass(frozen=True, slots=True)
+class Sample:
+    t: float                # secondi dall'inizio
+    power: float = None
+    hr: float = None
+    intake_g: float = 0.0
+
+
+@dataclass(frozen=True, slots=True)
+class RacePlan:
+    """
+    Resto della gara da proiettare: durata, intensità prevista e strategia di integrazione.
+    Con `feeding_plan` le assunzioni seguono gli eventi del piano invece dell'integrazione costante.
+    """
+    duration_min: int
+    activity: ActivityParams
+    intake: IntakeParams
+    intensity_series: tuple = None
+    feeding_plan: FeedingPlan = None
+
+    def intensity_at(self, minute):
+        if self.intensity_series is not None and minute < len(self.intensity_series):
+            return self.intensity_series[minute]
+        return self.activity.intensity_factor
+
+    def intake_interval_min(self):
+        """
+        Minuti tra due porzioni (stessa regola di simulate_metabolism), None se non si assume nulla.
+        """
+        return intake_interval_min(self.intake.carb_intake_g_h, self.intake.cho_per_unit_g, self.duration_min)
+
+    def intake_schedule(self):
+        """
+        CHO (g) assunti in ciascun minuto 0..duration_min.
+        """
+        if self.feeding_plan is not None:
+            vectors = self.feeding_plan.intake_vectors(self.duration_min, self.intake.mix_type)
+            return sum(vectors.values(), np.zeros(self.duration_min + 1)).tolist()
+        interval = self.intake_interval_min()
+        return [self.intake.cho_per_unit_g if interval and minute % interval == 0 else 0.0
+                for minute in range(self.duration_min + 1)]
+
+
+def model_input(activity, intensity_factor):
+    """
+    Valore da passare a GlycogenModel.step per un IF: Watt in ciclismo, FC altrimenti.
+    """
+    if activity.mode == 'cycling':
+        return intensity_factor * activity.ftp_watts
+    ref = activity.intensity_factor
+    return activity.avg_hr * intensity_factor / ref if ref > 0 else activity.avg_hr
+
+
+def is_bonked(model):
+    return model.liver_g <= BONK_LIVER_G or model.muscle_g <= BONK_MUSCLE_G
+
+
+def project_bonk(model, plan):
+    """
+    Simula il resto del piano a passi di 1 minuto da una copia dello stato corrente.
+    """
+    t0 = time.perf_counter()
+    elapsed = model.elapsed_min
+    sim = model.copy()
+    # Piano a eventi: ossidazione esogena legata alle assunzioni (finestra), come per l'intake registrato
+    sim.planned_intake_g_h = plan.intake.carb_intake_g_h if plan.feeding_plan is None else None
+    schedule = plan.intake_schedule()
+
+    bonk_min = elapsed if is_bonked(sim) else None
+    minute = int(math.floor(elapsed))
+    # Primo passo fino al prossimo minuto intero, poi minuti pieni come nella simulazione
+    first_dt = (minute + 1 - elapsed) * 60.0
+    while bonk_min is None and minute < plan.duration_min:
+        minute += 1
+        dt = first_dt if first_dt > 0 else 60.0
+        first_dt = 0.0
+        intake_g = schedule[minute]
+        sim.step(dt, model_input(plan.activity, plan.intensity_at(minute)), intake_g)
+        if is_bonked(sim):
+            bonk_min = minute
+
+    return {
+        "elapsed_min": elapsed,
+        "muscle_g": model.muscle_g,
+        "liver_g": model.liver_g,
+        "gut_load_g": model.gut_load_g,
+        "bonk_min": bonk_min,
+        "time_to_bonk_min": None if bonk_min is None else bonk_min - elapsed,
+        "projected_final_g": sim.total_g,
+        "projection_ms": (time.perf_counter() - t0) * 1000.0,
+    }
+
+
+class StepAggregator:
+    """
+    Media dei campioni su finestre di step_s secondi; somma dei CHO assunti.
+    Finestre senza campioni (buchi nella telemetria) ripetono l'ultimo valore.
+    """
+
+    def __init__(self, step_s=DEFAULT_STEP_S):
+        self.step_s = step_s
+        self.window_end = step_s
+        self.value_sum = 0.0
+        self.n_values = 0
+        self.intake_g = 0.0
+        self.last_value = None
+
+    def add(self, t, value, intake_g=0.0):
+        """
+        Aggiunge un campione; restituisce la lista dei passi (dt, valore medio, CHO) completati.
+        """
+        steps = []
+        while t >= self.window_end:
+            steps.append(self._close())
+        if value is not None:
+            self.value_sum += value
+            self.n_values += 1
+        self.intake_g += intake_g
+        return steps
+
+    def _close(self):
+        if self.n_values:
+            self.last_value = self.value_sum / self.n_values
+        step = (self.step_s, self.last_value or 0.0, self.intake_g)
+        self.window_end += self.step_s
+        self.value_sum = 0.0
+        self.n_values = 0
+        self.intake_g = 0.0
+        return step
+
+
+class LivePipeline:
+    """
+    Campioni -> aggregazione al passo del modello -> proiezione ogni every_s secondi.
+    """
+
+    def __init__(self, model, plan, step_s=DEFAULT_STEP_S, every_s=DEFAULT_EVERY_S):
+        self.model = model
+        self.plan = plan
+        self.aggregator = StepAggregator(step_s)
+        self.every_s = every_s
+        self.next_projection_s = every_s
+        self.use_power = model.activity.mode == 'cycling'
+
+    def feed(self, sample):
+        """
+        Applica un campione; restituisce una proiezione se è scaduto l'intervallo, altrimenti None.
+        """
+        value = sample.power if self.use_power else sample.hr
+        for dt, mean_value, intake_g in self.aggregator.add(sample.t, value, sample.intake_g):
+            self.model.step(dt, mean_value, intake_g)
+        if sample.t < self.next_projection_s:
+            return None
+        while self.next_projection_s <= sample.t:
+            self.next_projection_s += self.every_s
+        projection = project_bonk(self.model, self.plan)
+        projection["t_s"] = sample.t
+        return projection
+
+
+# --- SORGENTI DI CAMPIONI ---
+
+def _field(record, name):
+    for alias in FIELD_ALIASES[name]:
+        value = record.get(alias)
+        if value not in (None, ""):
+            return float(value)
+    return None
+
+
+class SampleParser:
+    """
+    Righe JSON o CSV (la prima riga non JSON è l'intestazione) -> Sample.
+    Senza tempo esplicito i campioni sono considerati a 1 Hz.
+    """
+
+    def __init__(self):
+        self.header = None
+        self.count = 0
+
+    def parse(self, line):
+        line = line.strip()
+        if not line:
+            return None
+        if line.startswith("{"):
+            record = json.loads(line)
+        elif self.header is None:
+            self.header = [h.strip().lower() for h in next(csv.reader([line]))]
+            return None
+        else:
+            record = dict(zip(self.header, next(csv.reader([line]))))
+        t = _field(record, "t")
+        self.count += 1
+        return Sample(t=t if t is not None else float(self.count - 1), power=_field(record, "power"),
+                      hr=_field(record, "hr"), intake_g=_field(record, "intake_g") or 0.0)
+
+
+def tail_lines(path, follow=False, poll_s=FOLLOW_POLL_S):
+    """
+    Righe complete di un file; con follow attende le righe aggiunte in seguito.
+    """
+    with open(path, encoding="utf-8") as f:
+        pending = ""
+        while True:
+            chunk = f.readline()
+            if chunk:
+                pending += chunk
+                if pending.endswith("\n"):
+                    yield pending
+                    pending = ""
+                continue
+            if not follow:
+                if pending:
+                    yield pending
+                return
+            time.sleep(poll_s)
+
+
+def socket_lines(address):
+    host, _, port = address.rpartition(":")
+    with socket.create_connection((host or "127.0.0.1", int(port))) as conn, \
+            conn.makefile("r", encoding="utf-8") as stream:
+        yield from stream
+
+
+def read_samples(lines, speed=0.0):
+    """
+    Campioni dalle righe; con speed > 0 il replay rispetta i tempi (speed = fattore di accelerazione).
+    """
+    parser = SampleParser()
+    wall_start = time.monotonic()
+    for line in lines:
+        sample = parser.parse(line)
+        if sample is None:
+            continue
+        if speed > 0:
+            delay = sample.t / speed - (time.monotonic() - wall_start)
+            if delay > 0:
+                time.sleep(delay)
+        yield sample
+
+
+def pipeline_from_scenario(scenario, step_s=DEFAULT_STEP_S, every_s=DEFAULT_EVERY_S):
+    """
+    Pipeline per il piano gara dello scenario. Il piano a eventi guida la proiezione;
+    il modello intestinale a compartimenti non ha una versione incrementale ed è rifiutato.
+    """
+    subject = subject_from_dict(scenario["subject"])
+    tank, _ = scenario_tank(subject, scenario.get("taper"))
+    kwargs = race_kwargs(scenario.get("race", {}))
+    if kwargs["gut_model"] is not None:
+        raise ValueError("Il modello live usa il filtro del primo ordine: rimuovere gut_model dallo scenario.")
+    activity = kwargs["activity_params"]
+    mix_type = kwargs["mix_type_input"]
+    model = GlycogenModel(
+        tank, subject, activity,
+        AbsorptionParams(kwargs["tau_absorption"], kwargs["oxidation_efficiency_input"],
+                         kwargs["custom_max_exo_rate"]),
+        mix_type,
+    )
+    series = kwargs["intensity_series"]
+    plan = RacePlan(
+        duration_min=int(kwargs["duration_min"]),
+        activity=activity,
+        intake=IntakeParams(kwargs["constant_carb_intake_g_h"], kwargs["cho_per_unit_g"], mix_type),
+        intensity_series=tuple(series) if series is not None else None,
+        feeding_plan=kwargs["feeding_plan"],
+    )
+    return LivePipeline(model, plan, step_s=step_s, every_s=every_s)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m glicogeno.live", description="Telemetria live e proiezione della crisi")
+    parser.add_argument("scenario", help="scenario JSON (soggetto, diario, piano gara)")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--file", help="file di campioni (CSV o JSON lines)")
+    source.add_argument("--socket", help="feed TCP locale host:porta (una riga per campione)")
+    parser.add_argument("--follow", action="store_true", help="continua a leggere le righe aggiunte al file")
+    parser.add_argument("--speed", type=float, default=0.0, help="replay del file a tempo reale x speed (0 = subito)")
+    parser.add_argument("--step", type=float, default=DEFAULT_STEP_S, help="passo del modello (s)")
+    parser.add_argument("--every", type=float, default=DEFAULT_EVERY_S, help="intervallo tra le proiezioni (s)")
+    parser.add_argument("--out", help="file JSONL delle proiezioni (default: stdout)")
+    args = parser.parse_args(argv)
+
+    with open(args.scenario, encoding="utf-8") as f:
+        scenario = json.load(f)
+    try:
+        pipeline = pipeline_from_scenario(scenario, step_s=args.step, every_s=args.every)
+    except ValueError as e:
+        parser.error(str(e))
+    lines = socket_lines(args.socket) if args.socket else tail_lines(args.file, follow=args.follow)
+
+    out = open(args.out, "w", encoding="utf-8") if args.out else sys.stdout
+    try:
+        for sample in read_samples(lines, speed=args.speed if args.file else 0.0):
+            projection = pipeline.feed(sample)
+            if projection is not None:
+                out.write(json.dumps(projection) + "\n")
+                out.flush()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if args.out:
+            out.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,117 @@
+"""
+Client di carico per il servizio locale (glicogeno.service).
+
+    python -m glicogeno.loadtest --concurrency 16 --requests 1000
+    python -m glicogeno.loadtest --scenarios scenari.jsonl --endpoint /batch --batch-size 8
+
+Misura throughput, latenze p50/p95/p99 lato client e risposte 503 (backpressure),
+poi riporta le statistiche del servizio (/stats).
+"""
+import argparse
+import itertools
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+
+from glicogeno.cli import read_scenarios
+from glicogeno.service import DEFAULT_PORT, percentile
+
+# Scenario usato se non viene passato un file
+SAMPLE_SCENARIO = {
+    "subject": {"weight_kg": 74, "height_cm": 187, "body_fat_pct": 0.11, "glycogen_conc_g_kg": 22.0},
+    "race": {"duration_min": 240, "carb_intake_g_h": 60,
+             "activity": {"mode": "cycling", "ftp_watts": 265, "avg_watts": 210}},
+}
+
+
+def post_json(url, payload, timeout=120):
+    """
+    (status HTTP, corpo decodificato) di una POST JSON.
+    """
+    data = json.dumps(payload).encode("utf-8")
+    req = urllib.request.Request(url, data=data, headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            return resp.status, json.loads(resp.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read() or b"null")
+
+
+def run_load(base_url, scenarios, n_requests, concurrency, endpoint="/simulate", batch_size=1):
+    """
+    Invia n_requests richieste con `concurrency` thread; restituisce il riepilogo.
+    """
+    source = itertools.cycle(scenarios)
+    source_lock = threading.Lock()
+    counter = itertools.count()
+    latencies, statuses = [], {}
+    result_lock = threading.Lock()
+
+    def next_payload():
+        with source_lock:
+            if endpoint == "/batch":
+                return [dict(next(source)) for _ in range(batch_size)]
+            return dict(next(source))
+
+    def worker():
+        while next(counter) < n_requests:
+            payload = next_payload()
+            t0 = time.perf_counter()
+            try:
+                status, _ = post_json(base_url + endpoint, payload)
+            except OSError:
+                status = "conn_error"
+            elapsed = (time.perf_counter() - t0) * 1000.0
+            with result_lock:
+                statuses[status] = statuses.get(status, 0) + 1
+                if status == 200:
+                    latencies.append(elapsed)
+
+    t_start = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall_s = time.perf_counter() - t_start
+
+    latencies.sort()
+    ok = statuses.get(200, 0)
+    return {
+        "requests": n_requests,
+        "concurrency": concurrency,
+        "wall_s": wall_s,
+        "throughput_rps": ok / wall_s if wall_s > 0 else 0.0,
+        "scenarios_per_s": ok * (batch_size if endpoint == "/batch" else 1) / wall_s if wall_s > 0 else 0.0,
+        "statuses": statuses,
+        "latency_ms": {
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "max": latencies[-1] if latencies else None,
+        },
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m glicogeno.loadtest", description="Test di carico del servizio")
+    parser.add_argument("--url", default=f"http://127.0.0.1:{DEFAULT_PORT}")
+    parser.add_argument("--scenarios", help="file di scenari (.json, .jsonl, .csv)")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--endpoint", default="/simulate", choices=["/simulate", "/batch", "/tank"])
+    parser.add_argument("--batch-size", type=int, default=8, help="scenari per richiesta con /batch")
+    args = parser.parse_args(argv)
+
+    scenarios = list(read_scenarios(args.scenarios)) if args.scenarios else [SAMPLE_SCENARIO]
+    summary = run_load(args.url, scenarios, args.requests, args.concurrency,
+                       endpoint=args.endpoint, batch_size=args.batch_size)
+    with urllib.request.urlopen(args.url + "/stats") as resp:
+        summary["server"] = json.loads(resp.read())
+    print(json.dumps(summary, indent=2, default=str))
+
+
+if __name__ == "__main__":
+    main()
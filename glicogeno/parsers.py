@@ -0,0 +1,250 @@
+"""
+Parser dei file di input: allenamenti strutturati (.zwo), registrazioni (.fit)
+e report del metabolimetro (CSV/Excel). Nessuna dipendenza da Streamlit:
+gli avvisi per l'utente sono passati a una callback `report`.
+"""
+import io
+import logging
+import math
+
+import pandas as pd
+
+from glicogeno.engine import SportType
+
+logger = logging.getLogger(__name__)
+
+
+def parse_bytes(parse_fn, name, data):
+    """
+    parse_fn su un file in memoria con il nome originale. Gli argomenti sono
+    picklabili, quindi il parsing può girare in un processo del pool (glicogeno.jobs).
+    """
+    buffer = io.BytesIO(data)
+    buffer.name = name
+    return parse_fn(buffer)
+
+
+# --- LOGICA DI PARSING ZWO ---
+
+def _log_report(level, message):
+    getattr(logger, level)(message)
+
+def parse_zwo_file(uploaded_file, ftp_watts, thr_hr, sport_type, max_hr=185, report=_log_report):
+    """
+    Estrae la serie di IF minuto per minuto da un allenamento Zwift (.zwo).
+    I messaggi per l'utente passano da report(level, message), level in {'error', 'warning'}.
+    """
+    import xml.etree.ElementTree as ET
+    
+    try:
+        xml_content = uploaded_file.getvalue().decode('utf-8')
+        root = ET.fromstring(xml_content)
+    except ET.ParseError:
+        report('error', "Errore di parsing: il file ZWO non è un XML valido.")
+        return [], 0, 0, 0
+    except Exception as e:
+        report('error', f"Errore nella lettura del file: {e}")
+        return [], 0, 0, 0
+
+    zwo_sport_tag = root.findtext('sportType')
+    
+    if zwo_sport_tag:
+        if zwo_sport_tag.lower() == 'bike' and sport_type != SportType.CYCLING:
+            report('warning', f"⚠️ ATTENZIONE: Hai selezionato {sport_type.label} nel Tab 1, ma il file ZWO è per BICI. I calcoli useranno la soglia di {sport_type.label}, ma potrebbero essere imprecisi.")
+        elif zwo_sport_tag.lower() == 'run' and sport_type != SportType.RUNNING:
+            report('warning', f"⚠️ ATTENZIONE: Hai selezionato {sport_type.label} nel Tab 1, ma il file ZWO è per CORSA. I calcoli useranno la soglia di {sport_type.label}, ma potrebbero essere imprecisi.")
+
+    
+    intensity_series = [] 
+    total_duration_sec = 0
+    total_weighted_if = 0
+    
+    for steady_state in root.findall('.//SteadyState'):
+        try:
+            duration_sec = int(steady_state.get('Duration'))
+            power_ratio = float(steady_state.get('Power'))
+            
+            duration_min_segment = math.ceil(duration_sec / 60)
+            
+            intensity_factor = power_ratio 
+            
+            for _ in range(duration_min_segment):
+                intensity_series.append(intensity_factor)
+            
+            total_duration_sec += duration_sec
+            total_weighted_if += intensity_factor * (duration_sec / 60) 
+
+        except Exception as e:
+            report('error', f"Errore durante l'analisi di un segmento SteadyState: {e}")
+            continue
+
+    total_duration_min = math.ceil(total_duration_sec / 60)
+    
+    if total_duration_min > 0:
+        avg_if = total_weighted_if / total_duration_min
+        
+        if sport_type == SportType.CYCLING:
+            avg_power = avg_if * ftp_watts
+            avg_hr = 0
+        elif sport_type == SportType.RUNNING:
+            avg_hr = avg_if * thr_hr
+            avg_power = 0
+        else: 
+            avg_hr = avg_if * max_hr * 0.85 
+            avg_power = 0
+            
+        return intensity_series, total_duration_min, avg_power, avg_hr
+    
+    return [], 0, 0, 0
+
+# --- PARSER FIT ---
+def parse_fit_file(uploaded_file):
+    """
+    Legge i record (timestamp, potenza, FC) di un file .fit Garmin/Wahoo.
+    """
+    from fitparse import FitFile
+    
+    uploaded_file.seek(0)
+    rows = []
+    for record in FitFile(uploaded_file).get_messages('record'):
+        values = record.get_values()
+        rows.append({
+            'timestamp': values.get('timestamp'),
+            'power': values.get('power'),
+            'heart_rate': values.get('heart_rate'),
+        })
+    # Colonne assenti nel file (es. nessun misuratore di potenza) vengono rimosse
+    return pd.DataFrame(rows).dropna(axis=1, how='all')
+
+# --- PARSER METABOLICO (NUOVO) ---
+def parse_metabolic_report(uploaded_file):
+    """
+    Legge file CSV/Excel da metabolimetro (Versione Lite Fix).
+    """
+    try:
+        df_raw = None
+        # Reset assoluto del puntatore (fondamentale in Streamlit)
+        uploaded_file.seek(0)
+        
+        filename = uploaded_file.name.lower()
+
+        # --- 1. LETTURA FILE ---
+        if filename.endswith(('.xls', '.xlsx')):
+            try:
+                # Forza engine openpyxl (richiede pip install openpyxl)
+                df_raw = pd.read_excel(uploaded_file, header=None, dtype=str, engine='openpyxl')
+            except ImportError:
+                # Fallback se manca openpyxl (prova default)
+                uploaded_file.seek(0)
+                df_raw = pd.read_excel(uploaded_file, header=None, dtype=str)
+            except Exception as e:
+                return None, None, f"Errore lettura Excel: {e}"
+        
+        elif filename.endswith(('.csv', '.txt')):
+            # Prova vari encoding e separatori
+            encodings = ['latin-1', 'utf-8', 'cp1252']
+            separators = [None, ';', ','] # None lascia fare a Python sniffer
+            
+            for enc in encodings:
+                for sep in separators:
+                    if df_raw is None:
+                        try:
+                            uploaded_file.seek(0)
+                            df_temp = pd.read_csv(uploaded_file, header=None, sep=sep, engine='python', encoding=enc, dtype=str)
+                            # Se ha più di 1 colonna, probabilmente è buono
+                            if df_temp.shape[1] > 1:
+                                df_raw = df_temp
+                                break
+                        except:
+                            continue
+                if df_raw is not None: break
+
+        if df_raw is None or df_raw.empty: 
+            return None, None, "File vuoto o formato sconosciuto."
+
+        # --- DEBUG VISIVO (Opzionale: togliere in produzione) ---
+        # Se vuoi vedere cosa legge lo script, scommenta la riga sotto:
+        # st.write("Anteprima dati grezzi:", df_raw.head(10))
+
+        # --- 2. RICERCA HEADER ---
+        header_idx = None
+        # Lista estesa e maiuscola
+        targets = ["CHO", "FAT", "CARBO", "LIPID", "VCO2", "VO2", "QCHO", "QFAT"]
+        intensities = ["WATT", "LOAD", "POWER", "POW", "WR", "HR", "BPM", "HEART", "FC", "SPEED", "VEL", "KM/H"]
+
+        for i, row in df_raw.head(300).iterrows():
+            # Crea una stringa pulita della riga
+            row_text = " ".join([str(x).upper() for x in row.values if pd.notna(x)])
+            
+            # Cerca intersezioni
+            has_metabolic = any(t in row_text for t in targets)
+            has_intensity = any(i in row_text for i in intensities)
+            
+            if has_metabolic and has_intensity:
+                header_idx = i
+                break
+        
+        if header_idx is None: 
+            # Mostra cosa ha letto per capire l'errore (utile per debug)
+            preview = df_raw.head(5).to_string()
+            return None, None, f"Intestazione non trovata. Prime righe lette:\n{preview}"
+
+        # --- 3. SLICING & CLEANING ---
+        df_raw.columns = df_raw.iloc[header_idx] 
+        df = df_raw.iloc[header_idx + 1:].reset_index(drop=True)
+        df.columns = [str(c).strip().upper() for c in df.columns]
+        
+        cols = df.columns.tolist()
+
+        def find_col(keys):
+            for col in cols:
+                for k in keys:
+                    if k == col or (k in col): return col
+            return None
+
+        c_cho = find_col(['CHO', 'CARBOHYDRATES', 'QCHO'])
+        c_fat = find_col(['FAT', 'LIPIDS', 'QFAT'])
+        
+        c_watt = find_col(['WATT', 'POWER', 'POW', 'LOAD', 'WR'])
+        c_hr = find_col(['HR', 'HEART', 'BPM', 'FC'])
+        c_speed = find_col(['SPEED', 'VEL', 'KM/H'])
+
+        if not (c_cho and c_fat): 
+            return None, None, f"Colonne CHO/FAT non trovate. Colonne rilevate: {cols}"
+
+        # --- 4. CONVERSIONE ---
+        def to_float(series):
+            s = series.astype(str)
+            s = s.str.replace(',', '.', regex=False)
+            # Regex robusta che cattura float anche dentro testo
+            s = s.str.extract(r'([-+]?\d*\.?\d+)')[0]
+            return pd.to_numeric(s, errors='coerce')
+
+        clean_df = pd.DataFrame()
+        clean_df['CHO'] = to_float(df[c_cho])
+        clean_df['FAT'] = to_float(df[c_fat])
+        
+        available_metrics = []
+        if c_watt: 
+            clean_df['Watt'] = to_float(df[c_watt])
+            if clean_df['Watt'].max() > 0: available_metrics.append('Watt')
+        if c_hr: 
+            clean_df['HR'] = to_float(df[c_hr])
+            if clean_df['HR'].max() > 0: available_metrics.append('HR')
+        if c_speed: 
+            clean_df['Speed'] = to_float(df[c_speed])
+            if clean_df['Speed'].max() > 0: available_metrics.append('Speed')
+
+        clean_df.dropna(subset=['CHO', 'FAT'], inplace=True)
+        
+        if not clean_df.empty and clean_df['CHO'].max() < 10.0:
+            clean_df['CHO'] *= 60
+            clean_df['FAT'] *= 60
+            
+        if not available_metrics: return None, None, "Nessun dato intensità valido."
+        
+        clean_df = clean_df.sort_values(by=available_metrics[0]).reset_index(drop=True)
+
+        return clean_df, available_metrics, None
+
+    except Exception as e: return None, None, str(e)
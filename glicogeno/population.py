@@ -0,0 +1,378 @@
+"""
+Tabelle di popolazione precalcolate: risposte approssimate immediate per i profili tipici.
+
+Due tabelle, costruite offline e salvate insieme in un file .npz versionato:
+
+- serbatoio: `calculate_tank` per sesso x TrainingStatus x SportType x peso x altezza
+  (massa grassa tipica per sesso, serbatoio a riposo e pieno);
+- gara: `sweep.simulate_grid` (ciclismo, parametri di riferimento) per glicogeno
+  muscolare ed epatico di partenza x FTP x picco di ossidazione esogena x IF x
+  integrazione (g/h): minuto di crisi e residuo totale a minuti fissi.
+
+La stima interpola linearmente negli assi numerici (estremi bloccati, `in_range`
+False fuori griglia); il minuto di crisi, assente (NaN) in parte dei vertici,
+prende il valore del vertice più vicino. Il file registra la firma del modello
+(assi, parametri di riferimento, alcune simulazioni campione): se il motore
+cambia, `PopulationTable.load` lo scarta e si ricade sulla simulazione esatta.
+
+    python -m glicogeno.population --build --workers 4
+    python -m glicogeno.population --check 200
+"""
+import argparse
+import datetime
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from glicogeno.engine import (
+    ActivityParams, ChoMixType, Sex, SportType, Subject, TrainingStatus, calculate_tank,
+    estimate_max_exogenous_oxidation, simulate_metabolism,
+)
+from glicogeno.scenario import parse_enum
+from glicogeno.serialization import params_to_json
+from glicogeno.sweep import simulate_grid
+
+FORMAT_VERSION = 1
+TABLE_ENV = "GLICOGENO_POPULATION_TABLE"
+DEFAULT_PATH = Path(__file__).with_name("population_table.npz")
+
+# --- ASSI ---
+
+SEXES = tuple(Sex)
+TRAINING = tuple(TrainingStatus)
+SPORTS = tuple(SportType)
+WEIGHTS_KG = (50.0, 60.0, 70.0, 80.0, 90.0, 100.0, 110.0, 120.0)
+HEIGHTS_CM = (150.0, 160.0, 170.0, 180.0, 190.0, 200.0)
+TYPICAL_BODY_FAT = {Sex.MALE: 0.15, Sex.FEMALE: 0.24}
+TANK_FIELDS = ("active_muscle_kg", "max_capacity_g", "actual_available_g", "muscle_glycogen_g", "liver_glycogen_g")
+
+MUSCLE_G = (100.0, 175.0, 250.0, 325.0, 400.0, 475.0, 550.0, 650.0, 750.0, 900.0)
+LIVER_G = (20.0, 60.0, 100.0)
+FTP_W = (150.0, 200.0, 250.0, 300.0, 350.0, 400.0)
+MAX_EXO_G_MIN = (0.8, 1.0, 1.25, 1.5, 1.75)
+IF_VALUES = (0.5, 0.55, 0.6, 0.65, 0.7, 0.75, 0.8, 0.85, 0.9, 0.95, 1.0)
+INTAKE_G_H = (0.0, 20.0, 40.0, 60.0, 80.0, 100.0, 120.0)
+CHECKPOINTS_MIN = (0, 30, 60, 90, 120, 150, 180, 240, 300, 360, 420)
+
+# Parametri fissi delle simulazioni in tabella (default della UI)
+REFERENCE = {
+    "mode": "cycling",
+    "efficiency": 22.0,
+    "crossover_pct": 70.0,
+    "cho_per_unit_g": 25.0,
+    "tau_min": 20.0,
+    "oxidation_efficiency": 0.80,
+}
+
+
+def typical_subject(sex, training, sport, weight_kg, height_cm):
+    """
+    Subject del profilo tipico: massa grassa per sesso, riposato, serbatoio pieno.
+    """
+    return Subject(weight_kg=weight_kg, height_cm=height_cm, body_fat_pct=TYPICAL_BODY_FAT[sex], sex=sex,
+                   glycogen_conc_g_kg=training.val, sport=sport)
+
+
+def reference_activity(ftp_watts):
+    return ActivityParams(mode=REFERENCE["mode"], ftp_watts=ftp_watts, efficiency=REFERENCE["efficiency"],
+                          crossover_pct=REFERENCE["crossover_pct"])
+
+
+def race_state_grid(muscle_g, liver_g, ftp_watts, max_exo_g_min):
+    """
+    simulate_grid per uno stato di partenza: array (intake, IF, 1 + checkpoint) con il
+    minuto di crisi (NaN se assente entro l'ultimo checkpoint) e i residui totali.
+    """
+    tank = {"muscle_glycogen_g": muscle_g, "liver_glycogen_g": liver_g}
+    # Il soggetto serve solo alla stima del picco esogeno, qui fornito esplicitamente
+    grid = simulate_grid(tank, CHECKPOINTS_MIN[-1], INTAKE_G_H, IF_VALUES, REFERENCE["cho_per_unit_g"],
+                         REFERENCE["tau_min"], None, reference_activity(ftp_watts),
+                         REFERENCE["oxidation_efficiency"], max_exo_g_min, checkpoints=CHECKPOINTS_MIN)
+    return np.concatenate([grid["bonk_min"][..., None], grid["total_at"]], axis=-1)
+
+
+def _race_block(muscle_g):
+    # Task del pool: tutte le combinazioni di fegato, FTP e picco esogeno per un valore di muscolo
+    return np.stack([
+        np.stack([
+            np.stack([race_state_grid(muscle_g, liver, ftp, exo) for exo in MAX_EXO_G_MIN])
+            for ftp in FTP_W])
+        for liver in LIVER_G])
+
+
+def tank_grid():
+    """
+    calculate_tank su tutti i profili tipici: array (sesso, livello, sport, peso, altezza, campo).
+    """
+    out = np.zeros((len(SEXES), len(TRAINING), len(SPORTS), len(WEIGHTS_KG), len(HEIGHTS_CM), len(TANK_FIELDS)))
+    for index in np.ndindex(out.shape[:-1]):
+        s, l, p, w, h = index
+        tank = calculate_tank(typical_subject(SEXES[s], TRAINING[l], SPORTS[p], WEIGHTS_KG[w], HEIGHTS_CM[h]))
+        out[index] = [tank[field] for field in TANK_FIELDS]
+    return out
+
+
+def axes_meta():
+    return {
+        "sexes": [s.name for s in SEXES],
+        "training": [t.name for t in TRAINING],
+        "sports": [s.name for s in SPORTS],
+        "weights_kg": list(WEIGHTS_KG),
+        "heights_cm": list(HEIGHTS_CM),
+        "typical_body_fat": {s.name: v for s, v in TYPICAL_BODY_FAT.items()},
+        "tank_fields": list(TANK_FIELDS),
+        "muscle_g": list(MUSCLE_G),
+        "liver_g": list(LIVER_G),
+        "ftp_w": list(FTP_W),
+        "max_exo_g_min": list(MAX_EXO_G_MIN),
+        "if_values": list(IF_VALUES),
+        "intake_g_h": list(INTAKE_G_H),
+        "checkpoints_min": list(CHECKPOINTS_MIN),
+        "reference": REFERENCE,
+    }
+
+
+def model_signature():
+    """
+    Firma del modello corrente: assi, parametri di riferimento e alcune simulazioni
+    campione. Cambia se cambiano la griglia o il comportamento del motore, compreso
+    simulate_metabolism (il calcolo esatto che la tabella approssima).
+    """
+    probe_subject = typical_subject(Sex.FEMALE, TrainingStatus.TRAINED, SportType.RUNNING, 63.0, 168.0)
+    probe_tank = calculate_tank(probe_subject)
+    df, _ = simulate_metabolism(probe_tank, 240, 60.0, REFERENCE["cho_per_unit_g"], REFERENCE["crossover_pct"],
+                                REFERENCE["tau_min"], probe_subject, reference_activity(260.0),
+                                REFERENCE["oxidation_efficiency"], 1.1)
+    probes = [
+        [round(probe_tank[field], 6) for field in TANK_FIELDS],
+        np.round(race_state_grid(350.0, 80.0, 260.0, 1.1), 6).tolist(),
+        np.round(df["Residuo Totale"].to_numpy()[::30], 6).tolist(),
+    ]
+    # Hash proprio, non cache.make_key: la versione della cache dei risultati non riguarda la tabella
+    raw = params_to_json({"format": FORMAT_VERSION, "axes": axes_meta(), "probes": probes})
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+# --- INTERPOLAZIONE ---
+
+def _bracket(axis, value):
+    """
+    Indice del nodo inferiore, peso del superiore e se il valore è dentro l'asse.
+    """
+    axis = np.asarray(axis, dtype=float)
+    inside = axis[0] <= value <= axis[-1]
+    value = min(max(float(value), axis[0]), axis[-1])
+    i = int(np.clip(np.searchsorted(axis, value, side="right") - 1, 0, len(axis) - 2))
+    return i, (value - axis[i]) / (axis[i + 1] - axis[i]), inside
+
+
+def _lerp(a, b, w):
+    # Dove un solo estremo è NaN (crisi assente) vale il vertice più vicino
+    mixed = a * (1 - w) + b * w
+    nearest = a if w < 0.5 else b
+    return np.where(np.isnan(a) ^ np.isnan(b), nearest, mixed)
+
+
+def interpolate(array, axes, values):
+    """
+    Interpolazione multilineare sui primi len(axes) assi di array: (valore, tutti dentro la griglia).
+    """
+    block, inside = array, True
+    for axis, value in zip(axes, values):
+        i, w, ok = _bracket(axis, value)
+        block = _lerp(block[i], block[i + 1], w)
+        inside &= ok
+    return block, inside
+
+
+def _member_index(members, enum_cls, value):
+    return members.index(parse_enum(enum_cls, value))
+
+
+class PopulationTable:
+    """
+    Tabelle di serbatoio e di gara con i metadati di costruzione (versione, firma, assi).
+    """
+
+    def __init__(self, tank, race, meta):
+        self.tank = tank
+        self.race = race
+        self.meta = meta
+
+    @classmethod
+    def build(cls, workers=1):
+        t0 = time.perf_counter()
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                blocks = list(pool.map(_race_block, MUSCLE_G))
+        else:
+            blocks = [_race_block(m) for m in MUSCLE_G]
+        meta = {
+            "format_version": FORMAT_VERSION,
+            "signature": model_signature(),
+            "built_at": datetime.datetime.now().isoformat(timespec="seconds"),
+            "build_s": None,
+            **axes_meta(),
+        }
+        tank = tank_grid()
+        race = np.stack(blocks)
+        meta["build_s"] = round(time.perf_counter() - t0, 1)
+        return cls(tank, race, meta)
+
+    def save(self, path=DEFAULT_PATH):
+        # Residui al decimo di grammo: il file resta piccolo e si comprime bene
+        np.savez_compressed(path, tank=self.tank.astype(np.float32), race=np.round(self.race, 1).astype(np.float32),
+                            meta=np.array(json.dumps(self.meta)))
+
+    @classmethod
+    def load(cls, path=None, verify=True):
+        """
+        Tabella da file (default: GLICOGENO_POPULATION_TABLE o quella del pacchetto).
+        None se il file manca o è di un'altra versione o di un altro modello.
+        """
+        path = path or os.environ.get(TABLE_ENV) or DEFAULT_PATH
+        if not os.path.exists(path):
+            return None
+        with np.load(path, allow_pickle=False) as data:
+            meta = json.loads(str(data["meta"]))
+            if meta.get("format_version") != FORMAT_VERSION:
+                return None
+            if verify and meta.get("signature") != model_signature():
+                return None
+            return cls(data["tank"].astype(float), data["race"].astype(float), meta)
+
+    # --- STIME ---
+
+    def tank_estimate(self, sex, training, sport, weight_kg, height_cm):
+        """
+        Serbatoio del profilo tipico (campi di TANK_FIELDS) e se peso/altezza sono in griglia.
+        """
+        block = self.tank[_member_index(SEXES, Sex, sex), _member_index(TRAINING, TrainingStatus, training),
+                          _member_index(SPORTS, SportType, sport)]
+        values, inside = interpolate(block, (WEIGHTS_KG, HEIGHTS_CM), (weight_kg, height_cm))
+        return {**dict(zip(TANK_FIELDS, values.tolist())), "in_range": bool(inside)}
+
+    def race_estimate(self, muscle_g, liver_g, ftp_watts, max_exo_g_min, intensity_factor, carb_intake_g_h,
+                      duration_min):
+        """
+        Minuto di crisi (None se assente entro la durata) e residuo totale a fine gara.
+        """
+        values, inside = interpolate(
+            self.race, (MUSCLE_G, LIVER_G, FTP_W, MAX_EXO_G_MIN, INTAKE_G_H, IF_VALUES),
+            (muscle_g, liver_g, ftp_watts, max_exo_g_min, carb_intake_g_h, intensity_factor))
+        checkpoints = np.asarray(CHECKPOINTS_MIN, dtype=float)
+        inside &= 0 <= duration_min <= checkpoints[-1]
+        bonk = values[0]
+        bonk = None if np.isnan(bonk) or bonk > duration_min else float(bonk)
+        final_total = float(np.interp(duration_min, checkpoints, values[1:]))
+        return {"bonk_min": bonk, "final_total_g": max(final_total, 0.0), "in_range": bool(inside)}
+
+    def covers(self, activity, cho_per_unit_g, tau_min, oxidation_efficiency):
+        """
+        True se la simulazione usa i parametri di riferimento della tabella
+        (ciclismo senza curva di laboratorio, unità, assorbimento, efficienze).
+        """
+        ref = self.meta["reference"]
+        return (activity.mode == ref["mode"] and not activity.use_lab_data
+                and activity.efficiency == ref["efficiency"] and activity.crossover_pct == ref["crossover_pct"]
+                and cho_per_unit_g == ref["cho_per_unit_g"] and tau_min == ref["tau_min"]
+                and oxidation_efficiency == ref["oxidation_efficiency"])
+
+    def simulation_estimate(self, subject_data, subject_obj, duration_min, carb_intake_g_h, cho_per_unit_g, tau_min,
+                            activity, oxidation_efficiency=0.80, custom_max_exo_rate=None,
+                            mix_type=ChoMixType.GLUCOSE_ONLY):
+        """
+        Stima di simulate_metabolism (integrazione costante, IF costante) dal serbatoio
+        effettivo; None se i parametri non sono quelli della tabella o sono fuori griglia.
+        """
+        activity = ActivityParams.coerce(activity)
+        if not self.covers(activity, cho_per_unit_g, tau_min, oxidation_efficiency):
+            return None
+        if custom_max_exo_rate is not None:
+            max_exo = custom_max_exo_rate
+        else:
+            max_exo = estimate_max_exogenous_oxidation(subject_obj.height_cm, subject_obj.weight_kg,
+                                                       activity.ftp_watts, mix_type)
+        race = self.race_estimate(subject_data["muscle_glycogen_g"], subject_data["liver_glycogen_g"],
+                                  activity.ftp_watts, max_exo, activity.intensity_factor, carb_intake_g_h, duration_min)
+        return race if race["in_range"] else None
+
+    def estimate(self, sex, training, sport, weight_kg, height_cm, ftp_watts, intensity_factor, carb_intake_g_h,
+                 duration_min, mix_type=ChoMixType.GLUCOSE_ONLY):
+        """
+        Profilo tipico -> serbatoio -> gara, senza simulare (parametri di riferimento).
+        """
+        tank = self.tank_estimate(sex, training, sport, weight_kg, height_cm)
+        max_exo = estimate_max_exogenous_oxidation(height_cm, weight_kg, ftp_watts, parse_enum(ChoMixType, mix_type))
+        race = self.race_estimate(tank["muscle_glycogen_g"], tank["liver_glycogen_g"], ftp_watts, max_exo,
+                                  intensity_factor, carb_intake_g_h, duration_min)
+        return {"tank": tank, **race, "in_range": tank["in_range"] and race["in_range"]}
+
+
+# --- CONTROLLO ---
+
+def check_table(table, cases=100, seed=0):
+    """
+    Confronta la tabella con simulate_grid su stati casuali interni alla griglia.
+    """
+    rng = np.random.default_rng(seed)
+    total_err, bonk_err, bonk_agree = [], [], 0
+    for _ in range(cases):
+        muscle, liver = rng.uniform(MUSCLE_G[0], MUSCLE_G[-1]), rng.uniform(LIVER_G[0], LIVER_G[-1])
+        ftp, exo = rng.uniform(FTP_W[0], FTP_W[-1]), rng.uniform(MAX_EXO_G_MIN[0], MAX_EXO_G_MIN[-1])
+        if_val, intake = rng.uniform(IF_VALUES[0], IF_VALUES[-1]), float(rng.choice(np.arange(0, 121, 10)))
+        duration = int(rng.integers(30, CHECKPOINTS_MIN[-1] + 1))
+        exact = simulate_grid({"muscle_glycogen_g": muscle, "liver_glycogen_g": liver}, duration, [intake], [if_val],
+                              REFERENCE["cho_per_unit_g"], REFERENCE["tau_min"], None, reference_activity(ftp),
+                              REFERENCE["oxidation_efficiency"], exo)
+        est = table.race_estimate(muscle, liver, ftp, exo, if_val, intake, duration)
+        total_err.append(abs(est["final_total_g"] - exact["final_total"][0, 0]))
+        exact_bonk = exact["bonk_min"][0, 0]
+        exact_bonk = None if np.isnan(exact_bonk) else float(exact_bonk)
+        bonk_agree += (est["bonk_min"] is None) == (exact_bonk is None)
+        if est["bonk_min"] is not None and exact_bonk is not None:
+            bonk_err.append(abs(est["bonk_min"] - exact_bonk))
+    return {
+        "cases": cases,
+        "total_mae_g": float(np.mean(total_err)),
+        "total_max_g": float(np.max(total_err)),
+        "bonk_agreement": bonk_agree / cases,
+        "bonk_mae_min": float(np.mean(bonk_err)) if bonk_err else None,
+        "bonk_max_min": float(np.max(bonk_err)) if bonk_err else None,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m glicogeno.population", description="Tabelle di popolazione")
+    parser.add_argument("--build", action="store_true", help="ricostruisci la tabella")
+    parser.add_argument("--out", default=None, help=f"file .npz (default: {DEFAULT_PATH.name} nel pacchetto)")
+    parser.add_argument("--workers", type=int, default=1, help="processi paralleli per la costruzione")
+    parser.add_argument("--check", type=int, default=0, metavar="N", help="confronta N stati casuali con la simulazione")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    path = args.out or os.environ.get(TABLE_ENV) or DEFAULT_PATH
+    if args.build:
+        table = PopulationTable.build(workers=args.workers)
+        table.save(path)
+        print(f"Tabella scritta in {path}: {table.tank.shape[:-1]} profili, {table.race.shape[:-1]} celle di gara, "
+              f"{table.meta['build_s']} s, {os.path.getsize(path) / 1024:.0f} KB")
+    else:
+        table = PopulationTable.load(path)
+        if table is None:
+            print(f"Tabella assente o non aggiornata ({path}): ricostruire con --build", file=sys.stderr)
+            return 1
+        print(f"Tabella {path}: versione {table.meta['format_version']}, costruita il {table.meta['built_at']}")
+    if args.check:
+        print(json.dumps(check_table(table, args.check, args.seed), indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,134 @@
+"""
+Span di tempo leggeri per rerun (tank, diario, simulazioni, grafici, parsing).
+
+Ogni esecuzione dello script o di un fragment apre un `RunProfile`; le fasi
+misurate con `span(name)` vi vengono aggiunte. I profili recenti della sessione
+sono conservati in un `ProfileLog` ed esportabili come JSON lines. Se è
+impostata GLICOGENO_PERF_LOG, ogni profilo viene anche accodato a quel file.
+"""
+import datetime
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+
+# File JSONL su cui accodare i profili (opzionale, per le sessioni in produzione)
+PERF_LOG_ENV = "GLICOGENO_PERF_LOG"
+
+DEFAULT_MAX_PROFILES = 50
+
+_file_lock = threading.Lock()
+
+
+class RunProfile:
+    """
+    Fasi misurate in una singola esecuzione (script completo o fragment).
+    """
+
+    def __init__(self, scope, session_id=None):
+        self.scope = scope
+        self.session_id = session_id
+        self.started = datetime.datetime.now().isoformat(timespec="milliseconds")
+        self.t0 = time.perf_counter()
+        self.spans = []
+        self.closed = False
+
+    @contextmanager
+    def span(self, name, **meta):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.spans.append({
+                "name": name,
+                "start_ms": (start - self.t0) * 1000.0,
+                "duration_ms": (time.perf_counter() - start) * 1000.0,
+                **meta,
+            })
+
+    def total_ms(self):
+        return (time.perf_counter() - self.t0) * 1000.0
+
+    def to_record(self):
+        return {
+            "scope": self.scope,
+            "session": self.session_id,
+            "started": self.started,
+            "total_ms": self.total_ms() if not self.closed else self._total_ms,
+            "spans": list(self.spans),
+        }
+
+    def close(self):
+        if not self.closed:
+            self._total_ms = self.total_ms()
+            self.closed = True
+
+
+class ProfileLog:
+    """
+    Ultimi profili di una sessione.
+
+    I profili aperti formano una pila: `span(name)` registra nel profilo più
+    interno, oppure (rerun isolato di un fragment, pila vuota) apre un profilo
+    a sé con scope = name.
+    """
+
+    def __init__(self, session_id=None, max_profiles=DEFAULT_MAX_PROFILES):
+        self.session_id = session_id or uuid.uuid4().hex[:8]
+        self.profiles = deque(maxlen=max_profiles)
+        self._stack = []
+
+    def begin(self, scope):
+        # Un profilo dello stesso scope ancora aperto appartiene a un rerun interrotto
+        for i, open_profile in enumerate(self._stack):
+            if open_profile.scope == scope:
+                for stale in self._stack[i:]:
+                    self._finish(stale)
+                del self._stack[i:]
+                break
+        profile = RunProfile(scope, self.session_id)
+        self._stack.append(profile)
+        return profile
+
+    def end(self, scope):
+        for i in range(len(self._stack) - 1, -1, -1):
+            if self._stack[i].scope == scope:
+                for profile in self._stack[i:]:
+                    self._finish(profile)
+                del self._stack[i:]
+                return
+
+    @contextmanager
+    def span(self, name, **meta):
+        if self._stack:
+            with self._stack[-1].span(name, **meta):
+                yield
+            return
+        profile = self.begin(name)
+        try:
+            with profile.span(name, **meta):
+                yield
+        finally:
+            self.end(name)
+
+    def _finish(self, profile):
+        profile.close()
+        self.profiles.append(profile)
+        path = os.environ.get(PERF_LOG_ENV)
+        if path:
+            append_jsonl(path, [profile.to_record()])
+
+    def records(self):
+        return [p.to_record() for p in self.profiles]
+
+    def to_jsonl(self):
+        return "".join(json.dumps(r) + "\n" for r in self.records())
+
+
+def append_jsonl(path, records):
+    with _file_lock, open(path, "a", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
@@ -0,0 +1,550 @@
+"""
+Copia congelata del motore di riferimento (glicogeno.engine come era all'introduzione
+di glicogeno.equivalence): `calculate_hourly_tapering`, `simulate_metabolism` e le
+funzioni che usano. Non va modificata: è il termine di paragone con cui l'harness di
+equivalenza verifica che il motore corrente (o una sua riscrittura) non si discosti
+dai numeri originali. I tipi di dato (Subject, Enum) sono quelli di glicogeno.engine.
+"""
+import math
+
+import numpy as np
+import pandas as pd
+
+from glicogeno.engine import ChoMixType, Subject
+
+
+def calculate_hourly_tapering(subject, days_data, start_state_factor=0.6):
+    """
+    Simula l'andamento orario delle riserve per N giorni (Tapering Avanzato).
+    """
+    # 1. Inizializzazione Serbatoi
+    tank = calculate_tank(subject)
+    MAX_MUSCLE = tank['max_capacity_g'] - 100 
+    MAX_LIVER = 100.0
+    
+    # Start level basato sul fattore di input (es. Normale=0.6)
+    # Se start_state_factor è un Enum, estrai .factor, altrimenti usa float
+    try:
+        factor = start_state_factor.factor
+    except:
+        factor = start_state_factor if isinstance(start_state_factor, float) else 0.6
+
+    curr_muscle = min(MAX_MUSCLE * factor, MAX_MUSCLE)
+    curr_liver = min(MAX_LIVER * factor, MAX_LIVER)
+    
+    hourly_log = []
+    
+    # Costanti Fisiologiche Orarie
+    LIVER_DRAIN_H = 4.0 # Consumo cervello/organi (g/h)
+    NEAT_DRAIN_H = (1.0 * subject.weight_kg) / 16.0 # NEAT spalmato sulle 16h di veglia (g/h)
+    
+    # Ciclo sui Giorni
+    for day_idx, day in enumerate(days_data):
+        date_label = day['date_obj'].strftime("%d/%m")
+        
+        # Parsing Orari
+        sleep_start = day['sleep_start'].hour + (day['sleep_start'].minute/60)
+        sleep_end = day['sleep_end'].hour + (day['sleep_end'].minute/60)
+        
+        work_start = day['workout_start'].hour + (day['workout_start'].minute/60)
+        work_dur_h = day['duration'] / 60.0
+        work_end = work_start + work_dur_h
+        
+        total_cho_input = day['cho_in']
+        
+        # Calcolo Ore di Veglia (Feeding Window) per distribuire il cibo
+        waking_hours = 0
+        for h in range(24):
+            is_sleeping = False
+            if sleep_start > sleep_end: # Scavalca notte
+                if h >= sleep_start or h < sleep_end: is_sleeping = True
+            else:
+                if sleep_start <= h < sleep_end: is_sleeping = True
+            
+            is_working = (work_start <= h < work_end)
+            if not is_sleeping and not is_working:
+                waking_hours += 1
+        
+        cho_rate_h = total_cho_input / waking_hours if waking_hours > 0 else 0
+        
+        # Ciclo sulle 24 ore del giorno
+        for h in range(24):
+            status = "REST"
+            is_sleeping = False
+            
+            # Check Sonno
+            if sleep_start > sleep_end:
+                if h >= sleep_start or h < sleep_end: is_sleeping = True
+            else:
+                if sleep_start <= h < sleep_end: is_sleeping = True
+            
+            if is_sleeping: status = "SLEEP"
+            
+            # Check Allenamento
+            if work_start <= h < work_end:
+                status = "WORK"
+            
+            # --- BILANCIO ORARIO ---
+            hourly_in = 0
+            hourly_out_liver = LIVER_DRAIN_H # Sempre attivo (cervello)
+            hourly_out_muscle = 0
+            
+            if status == "SLEEP":
+                hourly_in = 0 
+            
+            elif status == "WORK":
+                hourly_in = 0 
+                # Calcolo consumo lavoro
+                intensity_if = day.get('calculated_if', 0)
+                # Stima Kcal/h lavoro
+                # Se ciclismo use 22% eff, se corsa 1kcal/kg/km approx
+                kcal_work = 600 * intensity_if # Fallback generico se non abbiamo watt
+                if day.get('val', 0) > 0 and day.get('type') == 'Ciclismo':
+                     kcal_work = (day.get('val') * 60) / 4.184 / 0.22
+                
+                # CHO usage durante lavoro
+                cho_pct = max(0, (intensity_if - 0.5) * 2.5) 
+                cho_pct = min(1.0, cho_pct)
+                g_cho_work = (kcal_work * cho_pct) / 4.1
+                
+                liver_share = 0.15 
+                hourly_out_muscle = g_cho_work * (1 - liver_share)
+                hourly_out_liver += g_cho_work * liver_share
+                
+            elif status == "REST":
+                hourly_in = cho_rate_h
+                hourly_out_muscle = NEAT_DRAIN_H 
+            
+            # --- CALCOLO NETTO ---
+            net_flow = hourly_in - (hourly_out_liver + hourly_out_muscle)
+            
+            # Applicazione ai serbatoi
+            if net_flow > 0:
+                # REFILLING
+                efficiency = day.get('sleep_factor', 0.95)
+                real_storage = net_flow * efficiency
+                
+                to_muscle = real_storage * 0.7
+                to_liver = real_storage * 0.3
+                
+                # Overflow
+                if curr_muscle + to_muscle > MAX_MUSCLE:
+                    overflow = (curr_muscle + to_muscle) - MAX_MUSCLE
+                    to_muscle -= overflow
+                    to_liver += overflow 
+                
+                curr_muscle = min(MAX_MUSCLE, curr_muscle + to_muscle)
+                curr_liver = min(MAX_LIVER, curr_liver + to_liver)
+                
+            else:
+                # DRAINING
+                abs_deficit = abs(net_flow)
+                
+                if status == "WORK":
+                    curr_liver -= (hourly_out_liver) # Il fegato paga il suo
+                    curr_muscle -= hourly_out_muscle # Il muscolo paga il suo
+                else:
+                    # Deficit a riposo (Liver drain + NEAT)
+                    curr_liver -= (abs_deficit * 0.8)
+                    curr_muscle -= (abs_deficit * 0.2)
+
+            # Clamping
+            curr_muscle = max(0, curr_muscle)
+            curr_liver = max(0, curr_liver)
+            
+            # Timestamp
+            ts = pd.Timestamp(day['date_obj']) + pd.Timedelta(hours=h)
+            
+            hourly_log.append({
+                "Timestamp": ts,
+                "Giorno": date_label,
+                "Ora": h,
+                "Status": status,
+                "Muscolare": curr_muscle,
+                "Epatico": curr_liver,
+                "Totale": curr_muscle + curr_liver
+            })
+
+    final_tank = tank.copy()
+    final_tank['muscle_glycogen_g'] = curr_muscle
+    final_tank['liver_glycogen_g'] = curr_liver
+    final_tank['actual_available_g'] = curr_muscle + curr_liver
+    final_tank['fill_pct'] = (curr_muscle + curr_liver) / (MAX_MUSCLE + MAX_LIVER) * 100
+    
+    return pd.DataFrame(hourly_log), final_tank
+
+
+def calculate_tank(subject: Subject):
+    if subject.muscle_mass_kg is not None and subject.muscle_mass_kg > 0:
+        total_muscle = subject.muscle_mass_kg
+        muscle_source_note = "Massa Muscolare Totale (SMM) fornita dall'utente."
+    else:
+        lbm = subject.lean_body_mass
+        total_muscle = lbm * subject.muscle_fraction
+        muscle_source_note = "Massa Muscolare Totale stimata da Peso/BF/Sesso."
+
+    active_muscle = total_muscle * subject.sport.val
+    
+    creatine_multiplier = 1.10 if subject.uses_creatine else 1.0
+    base_muscle_glycogen = active_muscle * subject.glycogen_conc_g_kg
+    max_total_capacity = (base_muscle_glycogen * 1.25 * creatine_multiplier) + 100.0
+    
+    final_filling_factor = subject.filling_factor * subject.menstrual_phase.factor
+    current_muscle_glycogen = base_muscle_glycogen * creatine_multiplier * final_filling_factor
+    
+    max_physiological_limit = active_muscle * 35.0
+    if current_muscle_glycogen > max_physiological_limit:
+        current_muscle_glycogen = max_physiological_limit
+    
+    liver_fill_factor = 1.0
+    liver_correction_note = None
+    
+    if subject.filling_factor <= 0.6: 
+        liver_fill_factor = 0.6
+        
+    if subject.glucose_mg_dl is not None:
+        if subject.glucose_mg_dl < 70:
+            liver_fill_factor = 0.2
+            liver_correction_note = "Criticità Epatica (Glicemia < 70 mg/dL)"
+        elif subject.glucose_mg_dl < 85:
+            liver_fill_factor = min(liver_fill_factor, 0.5)
+            liver_correction_note = "Riduzione Epatica (Glicemia 70-85 mg/dL)"
+    
+    current_liver_glycogen = subject.liver_glycogen_g * liver_fill_factor
+    total_actual_glycogen = current_muscle_glycogen + current_liver_glycogen
+
+    return {
+        "active_muscle_kg": active_muscle,
+        "max_capacity_g": max_total_capacity,         
+        "actual_available_g": total_actual_glycogen,   
+        "muscle_glycogen_g": current_muscle_glycogen,
+        "liver_glycogen_g": current_liver_glycogen,
+        "concentration_used": subject.glycogen_conc_g_kg,
+        "fill_pct": (total_actual_glycogen / max_total_capacity) * 100 if max_total_capacity > 0 else 0,
+        "creatine_bonus": subject.uses_creatine,
+        "liver_note": liver_correction_note,
+        "muscle_source_note": muscle_source_note
+    }
+
+def estimate_max_exogenous_oxidation(height_cm, weight_kg, ftp_watts, mix_type: ChoMixType):
+    base_rate = 0.8 
+    
+    if height_cm > 170:
+        base_rate += (height_cm - 170) * 0.015
+    if ftp_watts > 200:
+        base_rate += (ftp_watts - 200) * 0.0015
+    
+    ox_factor = mix_type.ox_factor
+    max_rate_gh = mix_type.max_rate_gh
+    
+    estimated_rate_gh = base_rate * 60 * ox_factor
+    
+    final_rate_g_min = min(estimated_rate_gh / 60, max_rate_gh / 60)
+    
+    return final_rate_g_min
+
+def calculate_rer_polynomial(intensity_factor):
+    if_val = intensity_factor
+    rer = (
+        -0.000000149 * (if_val**6) + 
+        141.538462237 * (if_val**5) - 
+        565.128206259 * (if_val**4) + 
+        890.333333976 * (if_val**3) - 
+        691.67948706 * (if_val**2) + 
+        265.460857558 * if_val - 
+        39.525121144
+    )
+    return max(0.70, min(1.15, rer))
+
+def simulate_metabolism(
+    subject_data, 
+    duration_min, 
+    constant_carb_intake_g_h, 
+    cho_per_unit_g, 
+    crossover_pct, 
+    tau_absorption, 
+    subject_obj, 
+    activity_params,
+    oxidation_efficiency_input=0.80, 
+    custom_max_exo_rate=None,
+    mix_type_input=ChoMixType.GLUCOSE_ONLY,
+    intensity_series=None
+):
+    tank_g = subject_data['actual_available_g']
+    results = []
+    
+    initial_muscle_glycogen = subject_data['muscle_glycogen_g']
+    initial_liver_glycogen = subject_data['liver_glycogen_g']
+    
+    current_muscle_glycogen = initial_muscle_glycogen
+    current_liver_glycogen = initial_liver_glycogen
+    
+    mode = activity_params.get('mode', 'cycling')
+    gross_efficiency = activity_params.get('efficiency', 22.0)
+    
+    avg_power = activity_params.get('avg_watts', 200)
+    ftp_watts = activity_params.get('ftp_watts', 250) 
+    avg_hr = activity_params.get('avg_hr', 150)
+    max_hr = activity_params.get('max_hr', 185)
+    
+    intensity_factor_reference = activity_params.get('intensity_factor', 0.8)
+    
+    if mode == 'cycling':
+        kcal_per_min_base = (avg_power * 60) / 4184 / (gross_efficiency / 100.0)
+    elif mode == 'running':
+        speed_kmh = activity_params.get('speed_kmh', 10.0)
+        weight = subject_obj.weight_kg
+        kcal_per_hour = 1.0 * weight * speed_kmh
+        kcal_per_min_base = kcal_per_hour / 60.0
+    else:
+        vo2_operating = subject_obj.vo2max_absolute_l_min * intensity_factor_reference
+        kcal_per_min_base = vo2_operating * 5.0
+        
+    is_lab_data = activity_params.get('use_lab_data', False)
+    lab_cho_rate = activity_params.get('lab_cho_g_h', 0) / 60.0
+    lab_fat_rate = activity_params.get('lab_fat_g_h', 0) / 60.0
+    
+    crossover_pct = activity_params.get('crossover_pct', 70)
+    crossover_if = crossover_pct / 100.0
+    
+    if custom_max_exo_rate is not None:
+        max_exo_rate_g_min = custom_max_exo_rate 
+    else:
+        max_exo_rate_g_min = estimate_max_exogenous_oxidation(
+            subject_obj.height_cm, 
+            subject_obj.weight_kg, 
+            ftp_watts,
+            mix_type_input
+        )
+    
+    oxidation_efficiency = oxidation_efficiency_input
+    
+    total_fat_burned_g = 0.0
+    gut_accumulation_total = 0.0
+    current_exo_oxidation_g_min = 0.0 
+    
+    alpha = 1 - np.exp(-1.0 / tau_absorption)
+    
+    total_muscle_used = 0.0
+    total_liver_used = 0.0
+    total_exo_used = 0.0
+    
+    total_intake_cumulative = 0.0
+    total_exo_oxidation_cumulative = 0.0
+    
+    units_per_hour = constant_carb_intake_g_h / cho_per_unit_g if cho_per_unit_g > 0 else 0
+    intake_interval_min = round(60 / units_per_hour) if units_per_hour > 0 else duration_min + 1
+    
+    is_input_zero = constant_carb_intake_g_h == 0
+    
+    for t in range(int(duration_min) + 1):
+        
+        current_intensity_factor = intensity_factor_reference
+        if intensity_series is not None and t < len(intensity_series):
+            current_intensity_factor = intensity_series[t]
+        
+        current_kcal_demand = 0.0
+        
+        if mode == 'cycling':
+            instant_power = current_intensity_factor * ftp_watts
+            current_eff = gross_efficiency
+            if t > 60: 
+                loss = (t - 60) * 0.02
+                current_eff = max(15.0, gross_efficiency - loss)
+            current_kcal_demand = (instant_power * 60) / 4184 / (current_eff / 100.0)
+            
+        else: 
+            demand_scaling = current_intensity_factor / intensity_factor_reference if intensity_factor_reference > 0 else 1.0
+            
+            drift_factor = 1.0
+            if t > 60:
+                drift_factor += (t - 60) * 0.0005 
+            
+            current_kcal_demand = kcal_per_min_base * drift_factor * demand_scaling
+        
+        instantaneous_input_g_min = 0.0 
+        
+        if not is_input_zero and intake_interval_min <= duration_min and t > 0 and t % intake_interval_min == 0:
+            instantaneous_input_g_min = cho_per_unit_g 
+        
+        target_exo_oxidation_limit_g_min = max_exo_rate_g_min * oxidation_efficiency
+        
+        if t > 0:
+            if is_input_zero:
+                current_exo_oxidation_g_min *= (1 - alpha) 
+            else:
+                current_exo_oxidation_g_min += alpha * (target_exo_oxidation_limit_g_min - current_exo_oxidation_g_min)
+            
+            if current_exo_oxidation_g_min < 0:
+                current_exo_oxidation_g_min = 0.0
+        else:
+            current_exo_oxidation_g_min = 0.0
+            
+        if t > 0:
+            gut_accumulation_total += (instantaneous_input_g_min * oxidation_efficiency) - current_exo_oxidation_g_min
+            if gut_accumulation_total < 0: gut_accumulation_total = 0 
+
+            total_intake_cumulative += instantaneous_input_g_min 
+            total_exo_oxidation_cumulative += current_exo_oxidation_g_min
+        
+        if is_lab_data:
+            curve_df = activity_params.get('metabolic_curve_df')
+            x_col = activity_params.get('metabolic_x_col', 'Watt')
+            
+            # Determina il valore X corrente (Watt, HR o Speed)
+            current_x_val = 0
+            if x_col == 'Watt':
+                # Power corrente (se c'è una serie, usala, altrimenti usa la media)
+                current_x_val = current_intensity_factor * ftp_watts if mode == 'cycling' else avg_power
+            elif x_col == 'HR':
+                # Stima HR lineare se non abbiamo dati precisi, o usa avg
+                current_x_val = avg_hr * current_intensity_factor / intensity_factor_reference if intensity_factor_reference > 0 else avg_hr
+            elif x_col == 'Speed':
+                current_x_val = activity_params.get('speed_kmh', 10) # Fallback semplice
+            
+            # Interpola dalla curva caricata
+            cho_rate_now, fat_rate_now = interpolate_from_curve(current_x_val, curve_df, x_col)
+            
+            # Applica drift fatica se la durata è lunga (> 60 min)
+            fatigue_drift = 1.0 + ((t - 60) * 0.001) if t > 60 else 1.0
+            
+            total_cho_demand = (cho_rate_now / 60.0) * fatigue_drift # g/min
+            current_fat_g_min = (fat_rate_now / 60.0) # g/min
+            
+            kcal_cho_demand = total_cho_demand * 4.1
+            
+            # RER fittizio per output
+            tot_sub = total_cho_demand + current_fat_g_min
+            cho_ratio = total_cho_demand / tot_sub if tot_sub > 0 else 1.0
+            rer = 0.7 + (0.3 * cho_ratio) 
+        
+        else:
+            effective_if_for_rer = current_intensity_factor + ((75.0 - crossover_pct) / 100.0)
+            if effective_if_for_rer < 0.3: effective_if_for_rer = 0.3
+            
+            rer = calculate_rer_polynomial(effective_if_for_rer)
+            base_cho_ratio = (rer - 0.70) * 3.45
+            base_cho_ratio = max(0.0, min(1.0, base_cho_ratio))
+            
+            current_cho_ratio = base_cho_ratio
+            if current_intensity_factor < 0.85 and t > 60:
+                hours_past = (t - 60) / 60.0
+                metabolic_shift = 0.05 * (hours_past ** 1.2) 
+                current_cho_ratio = max(0.05, base_cho_ratio - metabolic_shift)
+            
+            cho_ratio = current_cho_ratio
+            fat_ratio = 1.0 - cho_ratio
+            
+            kcal_cho_demand = current_kcal_demand * cho_ratio
+        
+        total_cho_g_min = kcal_cho_demand / 4.1
+        kcal_from_exo = current_exo_oxidation_g_min * 3.75 
+        
+        muscle_fill_state = current_muscle_glycogen / initial_muscle_glycogen if initial_muscle_glycogen > 0 else 0
+        muscle_contribution_factor = math.pow(muscle_fill_state, 0.6) 
+        
+        muscle_usage_g_min = total_cho_g_min * muscle_contribution_factor
+        if current_muscle_glycogen <= 0: muscle_usage_g_min = 0
+        
+        blood_glucose_demand_g_min = total_cho_g_min - muscle_usage_g_min
+        
+        from_exogenous = min(blood_glucose_demand_g_min, current_exo_oxidation_g_min)
+        
+        remaining_blood_demand = blood_glucose_demand_g_min - from_exogenous
+        max_liver_output = 1.2 
+        from_liver = min(remaining_blood_demand, max_liver_output)
+        if current_liver_glycogen <= 0: from_liver = 0
+        
+        if t > 0:
+            current_muscle_glycogen -= muscle_usage_g_min
+            current_liver_glycogen -= from_liver
+            
+            if current_muscle_glycogen < 0: current_muscle_glycogen = 0
+            if current_liver_glycogen < 0: current_liver_glycogen = 0
+            
+            if not is_lab_data:
+                fat_ratio_used = 1.0 - cho_ratio
+                total_fat_burned_g += (current_kcal_demand * fat_ratio_used) / 9.0
+            else:
+                total_fat_burned_g += lab_fat_rate
+            
+            total_muscle_used += muscle_usage_g_min
+            total_liver_used += from_liver
+            total_exo_used += from_exogenous
+            
+        status_label = "Ottimale"
+        if current_liver_glycogen < 20: status_label = "CRITICO (Ipoglicemia)"
+        elif current_muscle_glycogen < 100: status_label = "Warning (Gambe Vuote)"
+            
+        exo_oxidation_g_h = from_exogenous * 60
+        
+        g_muscle = muscle_usage_g_min
+        g_liver = from_liver
+        g_exo = from_exogenous
+        fat_ratio_used_local = 1.0 - cho_ratio if not is_lab_data else (lab_fat_rate / 60 * 9.0) / current_kcal_demand if current_kcal_demand > 0 else 0.0
+        g_fat = (current_kcal_demand * fat_ratio_used_local / 9.0)
+        
+        total_g_min = g_muscle + g_liver + g_exo + g_fat
+        if total_g_min == 0: total_g_min = 1.0 
+        
+        results.append({
+            "Time (min)": t,
+            "Glicogeno Muscolare (g)": muscle_usage_g_min * 60, 
+            "Glicogeno Epatico (g)": from_liver * 60,
+            "Carboidrati Esogeni (g)": exo_oxidation_g_h, 
+            "Ossidazione Lipidica (g)": lab_fat_rate * 60 if is_lab_data else ((current_kcal_demand * (1.0 - cho_ratio)) / 9.0) * 60,
+            
+            "Pct_Muscle": f"{(g_muscle / total_g_min * 100):.1f}%",
+            "Pct_Liver": f"{(g_liver / total_g_min * 100):.1f}%",
+            "Pct_Exo": f"{(g_exo / total_g_min * 100):.1f}%",
+            "Pct_Fat": f"{(g_fat / total_g_min * 100):.1f}%",
+
+            "Residuo Muscolare": current_muscle_glycogen,
+            "Residuo Epatico": current_liver_glycogen,
+            "Residuo Totale": current_muscle_glycogen + current_liver_glycogen, 
+            "Target Intake (g/h)": constant_carb_intake_g_h, 
+            "Gut Load": gut_accumulation_total,
+            "Stato": status_label,
+            "CHO %": cho_ratio * 100,
+            "Intake Cumulativo (g)": total_intake_cumulative,
+            "Ossidazione Cumulativa (g)": total_exo_oxidation_cumulative,
+            "Intensity Factor (IF)": current_intensity_factor 
+        })
+        
+    total_kcal_final = current_kcal_demand * 60 
+    
+    final_total_glycogen = current_muscle_glycogen + current_liver_glycogen
+
+    stats = {
+        "final_muscle": current_muscle_glycogen,
+        "final_liver": current_liver_glycogen,
+        "final_glycogen": final_total_glycogen, 
+        "total_muscle_used": total_muscle_used,
+        "total_liver_used": total_liver_used,
+        "total_exo_used": total_exo_used,
+        "fat_total_g": total_fat_burned_g,
+        "kcal_total_h": total_kcal_final,
+        "gut_accumulation": (gut_accumulation_total / duration_min) * 60 if duration_min > 0 else 0,
+        "max_exo_capacity": max_exo_rate_g_min * 60,
+        "intensity_factor": intensity_factor_reference,
+        "avg_rer": rer,
+        "gross_efficiency": gross_efficiency,
+        "intake_g_h": constant_carb_intake_g_h,
+        "cho_pct": cho_ratio * 100
+    }
+
+    return pd.DataFrame(results), stats
+
+def interpolate_from_curve(current_val, curve_df, x_col):
+    """
+    Interpolazione lineare per trovare CHO/FAT a una data intensità.
+    """
+    if curve_df is None or curve_df.empty: return 0, 0
+    
+    # Ordina per asse X
+    df = curve_df.sort_values(x_col)
+    
+    cho = np.interp(current_val, df[x_col], df['CHO'])
+    fat = np.interp(current_val, df[x_col], df['FAT'])
+    
+    return cho, fat # g/h
@@ -0,0 +1,222 @@
+"""
+Report gara stampabile (PNG/PDF): curva del glicogeno, accumulo intestinale e
+cronotabella di integrazione.
+
+Il rendering usa solo l'API a oggetti di matplotlib (Figure + canvas Agg/PDF,
+niente pyplot), quindi può girare in un processo del JobRunner. I file prodotti
+sono conservati in un `ReportCache` indicizzato dall'hash dello scenario: due
+richieste identiche condividono lo stesso rendering.
+"""
+import io
+import threading
+from collections import OrderedDict
+
+from glicogeno.cache import make_key
+from glicogeno.engine import ChoMixType, FeedingPlan
+
+FORMATS = ("pdf", "png")
+MIME_TYPES = {"pdf": "application/pdf", "png": "image/png"}
+
+# Pagina A4 verticale (pollici) e righe di cronotabella per pagina
+PAGE_SIZE_IN = (8.27, 11.69)
+PNG_DPI = 150
+SCHEDULE_ROWS_FIRST_PAGE = 18
+SCHEDULE_ROWS_PER_PAGE = 45
+
+DEFAULT_CACHE_BYTES = 64 * 1024 * 1024
+
+SCHEDULE_COLUMNS = ["Minuto", "Azione", "Totale Ingerito"]
+
+
+def plan_schedule(plan):
+    """
+    Righe della "Cronotabella di Integrazione" per un FeedingPlan (un evento per riga).
+    """
+    schedule = []
+    total_cho_ingested = 0
+    for event in plan.to_events():
+        total_cho_ingested += event["grams"]
+        label = event["label"] or ("Borraccia" if event["duration_min"] > 0 else None)
+        if label is None:
+            action = f"Assumere 1 unità ({event['grams']:g}g CHO)"
+        elif event["duration_min"] > 0:
+            action = f"{label}: {event['grams']:g}g CHO in {event['duration_min']:g} min"
+        else:
+            action = f"{label}: {event['grams']:g}g CHO"
+        if event["mix"]:
+            action += f" [{ChoMixType[event['mix']].label}]"
+        schedule.append({
+            "Minuto": int(round(event["minute"])),
+            "Azione": action,
+            "Totale Ingerito": f"{total_cho_ingested:g}g",
+        })
+    return schedule
+
+
+def intake_schedule(duration, carb_intake, cho_per_unit):
+    """
+    Cronotabella dell'integrazione costante: le stesse porzioni dosate da simulate_metabolism.
+    """
+    return plan_schedule(FeedingPlan.constant_rate(carb_intake, cho_per_unit, duration))
+
+
+def report_data(title, summary, df_sim, df_no_cho, schedule, risk_threshold):
+    """
+    Contenuto del report come dizionario di liste (piccolo, picklabile, hashabile con make_key).
+    """
+    return {
+        "title": title,
+        "summary": list(summary),
+        "time": df_sim["Time (min)"].tolist(),
+        "total": df_sim["Residuo Totale"].tolist(),
+        "muscle": df_sim["Residuo Muscolare"].tolist(),
+        "liver": df_sim["Residuo Epatico"].tolist(),
+        "total_fasting": df_no_cho["Residuo Totale"].tolist(),
+        "gut_load": df_sim["Gut Load"].tolist(),
+        "intake_cum": df_sim["Intake Cumulativo (g)"].tolist(),
+        "oxidation_cum": df_sim["Ossidazione Cumulativa (g)"].tolist(),
+        "schedule": [[row[c] for c in SCHEDULE_COLUMNS] for row in schedule],
+        "risk_threshold": risk_threshold,
+    }
+
+
+def report_key(data, fmt):
+    return make_key("race_report", data, fmt)
+
+
+# --- RENDERING ---
+
+def _draw_table(ax, rows, title):
+    ax.axis("off")
+    ax.set_title(title, loc="left", fontsize=11, fontweight="bold")
+    if not rows:
+        ax.text(0, 0.9, "Nessuna integrazione pianificata.", fontsize=9, transform=ax.transAxes)
+        return
+    table = ax.table(cellText=rows, colLabels=SCHEDULE_COLUMNS, loc="upper left", cellLoc="left",
+                     colWidths=[0.15, 0.55, 0.25])
+    table.auto_set_font_size(False)
+    table.set_fontsize(8)
+    table.scale(1, 1.15)
+
+
+def _first_page(figure_cls, data):
+    fig = figure_cls(figsize=PAGE_SIZE_IN)
+    grid = fig.add_gridspec(4, 1, height_ratios=[0.45, 1.6, 1.1, 1.5], hspace=0.45,
+                            left=0.09, right=0.91, top=0.96, bottom=0.03)
+
+    header = fig.add_subplot(grid[0])
+    header.axis("off")
+    header.text(0, 0.95, data["title"], fontsize=15, fontweight="bold", va="top")
+    header.text(0, 0.55, "\n".join(data["summary"]), fontsize=9, va="top")
+
+    t = data["time"]
+    ax = fig.add_subplot(grid[1])
+    ax.plot(t, data["total"], color="#1E88E5", lw=2, label="Totale (strategia)")
+    ax.plot(t, data["total_fasting"], color="#E53935", lw=1.5, ls="--", label="Totale (digiuno)")
+    ax.plot(t, data["muscle"], color="#43A047", lw=1, label="Muscolare")
+    ax.plot(t, data["liver"], color="#FB8C00", lw=1, label="Epatico")
+    ax.set_title("Glicogeno Residuo", loc="left", fontsize=11, fontweight="bold")
+    ax.set_xlabel("Tempo (min)")
+    ax.set_ylabel("g")
+    ax.set_ylim(bottom=0)
+    ax.grid(alpha=0.3)
+    ax.legend(fontsize=8, loc="upper right")
+
+    gut = fig.add_subplot(grid[2])
+    gut.fill_between(t, data["gut_load"], color="#8D6E63", alpha=0.7, label="Accumulo intestinale")
+    gut.axhline(data["risk_threshold"], color="#F44336", ls="--", lw=1.2, label="Soglia di rischio GI")
+    gut.set_title("Accumulo Intestinale (Rischio GI)", loc="left", fontsize=11, fontweight="bold")
+    gut.set_xlabel("Tempo (min)")
+    gut.set_ylabel("g")
+    gut.grid(alpha=0.3)
+    cum = gut.twinx()
+    cum.step(t, data["intake_cum"], where="post", color="#1E88E5", lw=1, label="Ingerito cumulativo")
+    cum.plot(t, data["oxidation_cum"], color="#43A047", lw=1, label="Ossidato cumulativo")
+    cum.set_ylabel("g cumulativi")
+    handles = gut.get_legend_handles_labels()[0] + cum.get_legend_handles_labels()[0]
+    gut.legend(handles=handles, fontsize=7, loc="upper left")
+
+    rows = data["schedule"][:SCHEDULE_ROWS_FIRST_PAGE]
+    _draw_table(fig.add_subplot(grid[3]), rows, "Cronotabella di Integrazione")
+    return fig
+
+
+def _schedule_pages(figure_cls, data):
+    rest = data["schedule"][SCHEDULE_ROWS_FIRST_PAGE:]
+    for start in range(0, len(rest), SCHEDULE_ROWS_PER_PAGE):
+        fig = figure_cls(figsize=PAGE_SIZE_IN)
+        ax = fig.add_axes([0.09, 0.03, 0.82, 0.93])
+        _draw_table(ax, rest[start:start + SCHEDULE_ROWS_PER_PAGE], "Cronotabella di Integrazione (segue)")
+        yield fig
+
+
+def render_report(data, fmt="pdf"):
+    """
+    Report in bytes. PDF: una pagina per grafici e inizio tabella, poi la cronotabella
+    restante; PNG: solo la prima pagina.
+    """
+    from matplotlib.backends.backend_pdf import PdfPages
+    from matplotlib.figure import Figure
+
+    buffer = io.BytesIO()
+    if fmt == "png":
+        _first_page(Figure, data).savefig(buffer, format="png", dpi=PNG_DPI)
+    else:
+        with PdfPages(buffer, metadata={"Title": data["title"]}) as pdf:
+            pdf.savefig(_first_page(Figure, data))
+            for page in _schedule_pages(Figure, data):
+                pdf.savefig(page)
+    return buffer.getvalue()
+
+
+def report_tasks(data, fmt):
+    """
+    Task per glicogeno.jobs.JobRunner (un solo rendering).
+    """
+    return [(render_report, (data, fmt))]
+
+
+# --- CACHE ---
+
+class ReportCache:
+    """
+    LRU dei report renderizzati, limitata in byte, con i rendering in corso per chiave
+    (richieste identiche da più sessioni attendono lo stesso job).
+    """
+
+    def __init__(self, max_bytes=DEFAULT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._items = OrderedDict()
+        self._size = 0
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._items:
+                return None
+            self._items.move_to_end(key)
+            return self._items[key]
+
+    def put(self, key, content):
+        with self._lock:
+            self._pending.pop(key, None)
+            if key in self._items:
+                return
+            self._items[key] = content
+            self._size += len(content)
+            while self._size > self.max_bytes and len(self._items) > 1:
+                _, evicted = self._items.popitem(last=False)
+                self._size -= len(evicted)
+
+    def pending(self, key):
+        with self._lock:
+            return self._pending.get(key)
+
+    def set_pending(self, key, job_id):
+        with self._lock:
+            self._pending[key] = job_id
+
+    def clear_pending(self, key):
+        with self._lock:
+            self._pending.pop(key, None)
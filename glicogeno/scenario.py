@@ -0,0 +1,230 @@
+"""
+Scenari di simulazione descritti come dizionari JSON (senza Streamlit).
+
+Schema di uno scenario:
+
+    {
+      "id": "gf-2025",
+      "subject": {"weight_kg": 74, "height_cm": 187, "body_fat_pct": 0.11,
+                  "sex": "MALE", "sport": "CYCLING",
+                  "glycogen_conc_g_kg": 22.0            # oppure "vo2max_ml_kg_min": 60
+                  "filling_factor": 1.0, "uses_creatine": false, "muscle_mass_kg": null},
+      "taper": {"start_state_factor": 0.6,
+                "days": [{"date": "2025-05-01", "type": "Ciclismo", "val": 200, "duration": 60,
+                          "calculated_if": 0.75, "cho_in": 400, "sleep_factor": 0.95,
+                          "sleep_start": "23:00", "sleep_end": "07:00", "workout_start": "18:00"}]},
+      "race": {"duration_min": 240, "carb_intake_g_h": 60, "cho_per_unit_g": 25,
+               "crossover_pct": 70, "tau_absorption": 20, "oxidation_efficiency": 0.8,
+               "custom_max_exo_rate": null, "mix_type": "GLUCOSE_ONLY",
+               "activity": {"mode": "cycling", "ftp_watts": 265, "avg_watts": 200, "efficiency": 22.0,
+                            "metabolic_curve": null,    # righe della curva di laboratorio
+                            "fit_curve": false,          # fit robusto della curva (glicogeno.labfit)
+                            "metabolic_fit": null},     # oppure nodi già fittati (LabFit.to_dict)
+               "intensity_series": null,
+               "feeding_plan": null,     # eventi [{"minute": 20, "grams": 25, "duration_min": 0,
+                                         #          "mix": "MIX_2_1", "label": "Gel"}, ...]
+               "gut_model": null},       # true o costanti di GutParams: modello intestinale a compartimenti
+      "stages": null,     # gara a tappe: [{"duration_min": 300, "start": "12:00", "intensity_factor": 0.7,
+                          #   "carb_intake_g_h": 80, "recovery_cho_g": 800, "sleep_start": "22:30",
+                          #   "sleep_end": "06:30"}, ...]; i valori mancanti vengono da "race"
+      "output": {"series": false}
+    }
+
+Gli Enum si possono indicare per nome (MALE, CYCLING) o per etichetta ("Uomo").
+Senza "taper" il serbatoio di partenza è quello di `calculate_tank(subject)`.
+"""
+import datetime
+
+import numpy as np
+import pandas as pd
+
+from glicogeno.engine import (
+    BONK_LIVER_G, BONK_MUSCLE_G, AbsorptionParams, ActivityParams, ChoMixType, FeedingPlan, IntakeParams,
+    MenstrualPhase, Sex, SportType, Subject, calculate_hourly_tapering, calculate_tank, get_concentration_from_vo2max,
+    simulate_metabolism,
+)
+from glicogeno.gut import GutParams
+from glicogeno.labfit import LabFit, fitted_curve
+from glicogeno.stagerace import simulate_stage_race, stage_from_dict, stage_records
+
+# Colonne restituite con output.series = true
+SERIES_COLUMNS = ["Time (min)", "Residuo Muscolare", "Residuo Epatico", "Residuo Totale", "Gut Load"]
+
+
+def parse_enum(enum_cls, value):
+    if isinstance(value, enum_cls):
+        return value
+    for member in enum_cls:
+        if value in (member.name, member.value, getattr(member, "label", None)):
+            return member
+    raise ValueError(f"Valore non valido per {enum_cls.__name__}: {value!r}")
+
+
+def subject_from_dict(data):
+    """
+    Costruisce un `Subject` da un dizionario (vedi schema nel docstring del modulo).
+    """
+    weight = float(data["weight_kg"])
+    if "glycogen_conc_g_kg" in data:
+        conc = float(data["glycogen_conc_g_kg"])
+    else:
+        conc = get_concentration_from_vo2max(float(data.get("vo2max_ml_kg_min", 60)))
+
+    vo2max_abs = data.get("vo2max_absolute_l_min")
+    if vo2max_abs is None:
+        vo2max_abs = float(data.get("vo2max_ml_kg_min", 60)) * weight / 1000
+
+    return Subject(
+        weight_kg=weight,
+        height_cm=float(data["height_cm"]),
+        body_fat_pct=float(data["body_fat_pct"]),
+        sex=parse_enum(Sex, data.get("sex", "MALE")),
+        glycogen_conc_g_kg=conc,
+        sport=parse_enum(SportType, data.get("sport", "CYCLING")),
+        liver_glycogen_g=float(data.get("liver_glycogen_g", 100.0)),
+        filling_factor=float(data.get("filling_factor", 1.0)),
+        uses_creatine=bool(data.get("uses_creatine", False)),
+        menstrual_phase=parse_enum(MenstrualPhase, data.get("menstrual_phase", "NONE")),
+        glucose_mg_dl=data.get("glucose_mg_dl"),
+        vo2max_absolute_l_min=float(vo2max_abs),
+        muscle_mass_kg=data.get("muscle_mass_kg"),
+    )
+
+
+def _parse_time(value):
+    if isinstance(value, datetime.time):
+        return value
+    return datetime.time.fromisoformat(value)
+
+
+def taper_days_from_dicts(days):
+    """
+    Converte i giorni del diario (date/orari come stringhe ISO) nel formato
+    atteso da `calculate_hourly_tapering`.
+    """
+    parsed = []
+    for day in days:
+        parsed.append({
+            "date_obj": datetime.date.fromisoformat(day["date"]) if isinstance(day["date"], str) else day["date"],
+            "type": day.get("type", "Riposo"),
+            "val": day.get("val", 0),
+            "duration": day.get("duration", 0),
+            "calculated_if": day.get("calculated_if", 0.0),
+            "cho_in": day.get("cho_in", 300),
+            "sleep_factor": day.get("sleep_factor", 0.95),
+            "sleep_start": _parse_time(day.get("sleep_start", "23:00")),
+            "sleep_end": _parse_time(day.get("sleep_end", "07:00")),
+            "workout_start": _parse_time(day.get("workout_start", "18:00")),
+        })
+    return parsed
+
+
+def race_kwargs(race):
+    """
+    Argomenti di `simulate_metabolism` (escluso il serbatoio e il soggetto).
+    """
+    activity = dict(race.get("activity", {}))
+    if "crossover_pct" in race:
+        # Il crossover di gara (es. quello stimato da glicogeno.calibration) vale per l'attività
+        activity["crossover_pct"] = race["crossover_pct"]
+    curve = activity.pop("metabolic_curve", None)
+    fit_curve = activity.pop("fit_curve", False)
+    lab_fit = activity.pop("metabolic_fit", None)
+    if lab_fit is not None:
+        activity["lab_curve"] = LabFit.from_dict(lab_fit).table()
+        activity.setdefault("use_lab_data", True)
+    elif curve is not None:
+        # Curva di laboratorio come lista di righe {"Watt": ..., "CHO": ..., "FAT": ...}
+        curve_df = pd.DataFrame(curve)
+        if fit_curve:
+            activity["lab_curve"] = fitted_curve(curve_df, activity.pop("metabolic_x_col", "Watt"))
+        else:
+            activity["metabolic_curve_df"] = curve_df
+        activity.setdefault("use_lab_data", True)
+    return {
+        "duration_min": race.get("duration_min", 120),
+        "constant_carb_intake_g_h": race.get("carb_intake_g_h", 60),
+        "cho_per_unit_g": race.get("cho_per_unit_g", 25),
+        "crossover_pct": None,
+        "tau_absorption": race.get("tau_absorption", 20.0),
+        "activity_params": ActivityParams.from_dict(activity),
+        "oxidation_efficiency_input": race.get("oxidation_efficiency", 0.80),
+        "custom_max_exo_rate": race.get("custom_max_exo_rate"),
+        "mix_type_input": parse_enum(ChoMixType, race.get("mix_type", "GLUCOSE_ONLY")),
+        "intensity_series": race.get("intensity_series"),
+        "feeding_plan": FeedingPlan.from_events(race["feeding_plan"]) if race.get("feeding_plan") else None,
+        "gut_model": gut_model_from(race.get("gut_model")),
+    }
+
+
+def gut_model_from(value):
+    """
+    null/false -> filtro del primo ordine, true -> GutParams di default, dizionario -> GutParams.
+    """
+    if not value:
+        return None
+    return GutParams() if value is True else GutParams.from_dict(value)
+
+
+def bonk_minute(df):
+    """
+    Primo minuto di crisi (fegato esaurito o muscolo <= 20 g), None se assente.
+    Stessa regola della sezione "Strategia & Timing" del Tab 3.
+    """
+    liver = df.loc[df["Residuo Epatico"] <= BONK_LIVER_G, "Time (min)"].min()
+    muscle = df.loc[df["Residuo Muscolare"] <= BONK_MUSCLE_G, "Time (min)"].min()
+    candidates = [v for v in (liver, muscle) if not np.isnan(v)]
+    return int(min(candidates)) if candidates else None
+
+
+def scenario_tank(subject, taper):
+    """
+    Serbatoio di partenza: fine del diario se presente, altrimenti calculate_tank.
+    Restituisce (serbatoio, totale finale del diario o None).
+    """
+    if taper and taper.get("days"):
+        df_taper, tank = calculate_hourly_tapering(
+            subject, taper_days_from_dicts(taper["days"]),
+            start_state_factor=float(taper.get("start_state_factor", 0.6)),
+        )
+        return tank, float(df_taper["Totale"].iloc[-1])
+    return calculate_tank(subject), None
+
+
+def run_scenario(scenario):
+    """
+    Esegue uno scenario e restituisce un dizionario serializzabile in JSON.
+    """
+    subject = subject_from_dict(scenario["subject"])
+    result = {"id": scenario.get("id")}
+
+    tank, taper_final_total = scenario_tank(subject, scenario.get("taper"))
+    if taper_final_total is not None:
+        result["taper_final_total"] = taper_final_total
+    result["tank"] = tank
+
+    race = scenario.get("race")
+    if race:
+        kwargs = race_kwargs(race)
+        df, stats = simulate_metabolism(
+            tank, kwargs.pop("duration_min"), kwargs.pop("constant_carb_intake_g_h"),
+            kwargs.pop("cho_per_unit_g"), kwargs.pop("crossover_pct"), kwargs.pop("tau_absorption"),
+            subject, kwargs.pop("activity_params"), **kwargs,
+        )
+        result["stats"] = stats
+        result["bonk_min"] = bonk_minute(df)
+        if scenario.get("output", {}).get("series"):
+            result["series"] = {col: df[col].tolist() for col in SERIES_COLUMNS}
+
+    stages = scenario.get("stages")
+    if stages:
+        kwargs = race_kwargs(race or {})
+        df_stages, _ = simulate_stage_race(
+            tank, subject, [stage_from_dict(s) for s in stages], kwargs["activity_params"],
+            IntakeParams(kwargs["constant_carb_intake_g_h"], kwargs["cho_per_unit_g"], kwargs["mix_type_input"]),
+            AbsorptionParams(kwargs["tau_absorption"], kwargs["oxidation_efficiency_input"],
+                             kwargs["custom_max_exo_rate"], kwargs["gut_model"]),
+        )
+        result["stages"] = stage_records(df_stages)
+
+    return result
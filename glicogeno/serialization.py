@@ -0,0 +1,87 @@
+"""
+Serializzazione di parametri e risultati (JSON stabile, DataFrame compattati in npz).
+
+Modulo senza dipendenze SQL: usato sia dall'archivio sia dalla cache.
+"""
+import dataclasses
+import datetime
+import io
+import json
+from enum import Enum
+
+import numpy as np
+import pandas as pd
+
+
+# --- SERIALIZZAZIONE PARAMETRI ---
+
+def _json_default(obj):
+    if isinstance(obj, Enum):
+        return obj.name
+    if dataclasses.is_dataclass(obj) and not isinstance(obj, type):
+        return dataclasses.asdict(obj)
+    if isinstance(obj, pd.DataFrame):
+        return obj.to_dict(orient="list")
+    if isinstance(obj, (pd.Timestamp, datetime.date, datetime.time)):
+        return obj.isoformat()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if hasattr(obj, "label") and hasattr(obj, "factor"):
+        # Stati semplici del Tab 2 (GlycogenStateSimple)
+        return {"label": obj.label, "factor": obj.factor}
+    # Niente str(obj) di ripiego: la repr di un oggetto sconosciuto non è stabile né
+    # completa, e due parametri diversi finirebbero sulla stessa chiave di cache
+    raise TypeError(f"Tipo non serializzabile: {type(obj).__name__}")
+
+
+def params_to_json(params):
+    return json.dumps(params, default=_json_default, sort_keys=True)
+
+
+# --- COMPATTAZIONE DEI RISULTATI ---
+
+def pack_frame(df, compact=True):
+    """
+    Serializza un DataFrame in forma compatta: numerici -> float32,
+    timestamp -> int64 (ns), testo -> codici + categorie. Compresso con npz.
+    Con compact=False i numerici mantengono il dtype originale (senza perdita).
+    """
+    arrays = {}
+    header = []
+    for i, col in enumerate(df.columns):
+        s = df[col]
+        key = f"c{i}"
+        if pd.api.types.is_datetime64_any_dtype(s):
+            arrays[key] = s.to_numpy(dtype="datetime64[ns]").astype(np.int64)
+            header.append([col, "datetime"])
+        elif pd.api.types.is_numeric_dtype(s):
+            arrays[key] = s.to_numpy(dtype=np.float32) if compact else s.to_numpy()
+            header.append([col, "float"])
+        else:
+            cat = pd.Categorical(s.astype(str))
+            arrays[key] = cat.codes.astype(np.int32)
+            arrays[key + "_cat"] = np.array(json.dumps(list(cat.categories)))
+            header.append([col, "category"])
+    arrays["__header__"] = np.array(json.dumps(header))
+
+    buf = io.BytesIO()
+    np.savez_compressed(buf, **arrays)
+    return buf.getvalue()
+
+
+def unpack_frame(payload):
+    with np.load(io.BytesIO(bytes(payload)), allow_pickle=False) as data:
+        header = json.loads(str(data["__header__"]))
+        columns = {}
+        for i, (col, kind) in enumerate(header):
+            values = data[f"c{i}"]
+            if kind == "datetime":
+                columns[col] = pd.to_datetime(values)
+            elif kind == "category":
+                categories = json.loads(str(data[f"c{i}_cat"]))
+                columns[col] = pd.Categorical.from_codes(values, categories).astype(str)
+            else:
+                columns[col] = values
+    return pd.DataFrame(columns)
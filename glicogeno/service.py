@@ -0,0 +1,435 @@
+"""
+Servizio HTTP/JSON locale per le previsioni di glicogeno (solo libreria standard).
+
+    python -m glicogeno.service --port 8765 --workers 4
+
+Endpoint:
+- POST /tank      {"subject": {...}}             -> serbatoio (calculate_tank)
+- POST /estimate  profilo tipico + gara          -> stima dalle tabelle di popolazione
+- POST /simulate  scenario (vedi glicogeno.scenario) -> risultato di run_scenario
+- POST /batch     [scenario, ...]                -> lista di risultati
+- GET  /stats     per endpoint: throughput, latenze p50/p95/p99, richieste rifiutate; coda e pool
+- GET  /health
+
+Le richieste /simulate singole vengono raggruppate dal batcher (fino a
+--max-batch scenari o --batch-window-ms) e inviate al pool di processi in un
+unico task. /tank e /estimate rispondono subito, senza passare dal pool.
+Oltre --max-pending scenari in attesa il servizio risponde 503
+con Retry-After invece di accodare senza limite; un /batch più grande di
+--max-pending non potrebbe mai entrare in coda e riceve 413. Se un worker muore
+il pool viene ricreato: falliscono solo gli scenari del batch in corso.
+"""
+import argparse
+import json
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from glicogeno.engine import calculate_tank
+from glicogeno.population import PopulationTable
+from glicogeno.scenario import run_scenario, subject_from_dict
+
+logger = logging.getLogger("glicogeno.service")
+
+DEFAULT_PORT = 8765
+DEFAULT_MAX_BATCH = 16
+DEFAULT_BATCH_WINDOW_MS = 5.0
+# Finestra (s) su cui si calcolano throughput e percentili
+STATS_WINDOW_S = 60.0
+# Endpoint con statistiche proprie: /tank e /estimate non passano dal pool
+POST_ENDPOINTS = ("/tank", "/estimate", "/simulate", "/batch")
+
+
+def run_many(scenarios):
+    """
+    Eseguito nel processo worker: un risultato (o errore) per scenario.
+    """
+    results = []
+    for scenario in scenarios:
+        try:
+            results.append(run_scenario(scenario))
+        except Exception as e:
+            results.append({"id": scenario.get("id"), "error": f"{type(e).__name__}: {e}"})
+    return results
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    k = min(len(sorted_values) - 1, max(0, int(round(q / 100.0 * (len(sorted_values) - 1)))))
+    return sorted_values[k]
+
+
+class ServiceStats:
+    """
+    Latenze e completamenti recenti di un endpoint (thread-safe).
+    """
+
+    def __init__(self, window_s=STATS_WINDOW_S):
+        self.window_s = window_s
+        self._samples = deque()  # (istante di completamento, latenza ms)
+        self._lock = threading.Lock()
+        self.started = time.monotonic()
+        self.completed = 0
+        self.rejected = 0
+        self.errors = 0
+
+    def _trim(self, now):
+        while self._samples and now - self._samples[0][0] > self.window_s:
+            self._samples.popleft()
+
+    def add(self, latency_ms, error=False):
+        now = time.monotonic()
+        with self._lock:
+            self._samples.append((now, latency_ms))
+            self._trim(now)
+            self.completed += 1
+            self.errors += error
+
+    def reject(self):
+        with self._lock:
+            self.rejected += 1
+
+    def snapshot(self):
+        now = time.monotonic()
+        with self._lock:
+            self._trim(now)
+            latencies = sorted(lat for _, lat in self._samples)
+            span = min(self.window_s, now - self.started)
+            return {
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "errors": self.errors,
+                "throughput_rps": len(latencies) / span if span > 0 else 0.0,
+                "latency_ms": {
+                    "p50": percentile(latencies, 50),
+                    "p95": percentile(latencies, 95),
+                    "p99": percentile(latencies, 99),
+                    "max": latencies[-1] if latencies else None,
+                },
+            }
+
+
+class SimulationService:
+    """
+    Pool di processi limitato con batcher e controllo della coda (backpressure).
+    """
+
+    def __init__(self, workers=2, max_batch=DEFAULT_MAX_BATCH,
+                 batch_window_ms=DEFAULT_BATCH_WINDOW_MS, max_pending=None):
+        self.workers = workers
+        self.max_batch = max_batch
+        self.batch_window_s = batch_window_ms / 1000.0
+        self.max_pending = max_pending or workers * max_batch * 4
+        self.pool = self._new_pool()
+        self.pool_restarts = 0
+        self.started = time.monotonic()
+        self.stats = {endpoint: ServiceStats() for endpoint in POST_ENDPOINTS}
+        self.batches = 0
+        self.batched_items = 0
+        # Tabelle di popolazione (None se assenti o non aggiornate al motore)
+        self.population = PopulationTable.load()
+        self._pending = threading.BoundedSemaphore(self.max_pending)
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._batcher = threading.Thread(target=self._batch_loop, name="glicogeno-batcher", daemon=True)
+        self._batcher.start()
+
+    # --- CODA ---
+
+    def _acquire(self, n):
+        """
+        Riserva n posti in coda; False (nessun posto riservato) se la coda è piena.
+        """
+        taken = 0
+        while taken < n:
+            if not self._pending.acquire(blocking=False):
+                for _ in range(taken):
+                    self._pending.release()
+                return False
+            taken += 1
+        with self._lock:
+            self._in_flight += n
+        return True
+
+    def _release(self, n):
+        with self._lock:
+            self._in_flight -= n
+        for _ in range(n):
+            self._pending.release()
+
+    @property
+    def in_flight(self):
+        return self._in_flight
+
+    # --- POOL ---
+
+    def _new_pool(self):
+        return ProcessPoolExecutor(max_workers=self.workers)
+
+    def _restart_pool(self, broken):
+        """
+        Sostituisce il pool rotto (una sola volta per istanza rotta).
+        """
+        with self._lock:
+            if broken is not self.pool:
+                return
+            self.pool = self._new_pool()
+            self.pool_restarts += 1
+        logger.warning("Pool di processi rotto (worker terminato): ricreato")
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    # --- BATCHER ---
+
+    def _batch_loop(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            items = [first]
+            deadline = time.monotonic() + self.batch_window_s
+            while len(items) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._queue.put(None)
+                    break
+                items.append(item)
+            self._dispatch(items)
+
+    def _dispatch(self, items):
+        with self._lock:
+            self.batches += 1
+            self.batched_items += len(items)
+        scenarios = [scenario for scenario, _ in items]
+        pool = self.pool
+        try:
+            try:
+                pool_future = pool.submit(run_many, scenarios)
+            except BrokenProcessPool:
+                # Il pool si è rotto prima che arrivasse la notifica: nuovo pool e un secondo tentativo
+                self._restart_pool(pool)
+                pool = self.pool
+                pool_future = pool.submit(run_many, scenarios)
+        except Exception as e:
+            for _, waiter in items:
+                waiter.set_exception(e)
+            return
+
+        def done(f):
+            try:
+                results = f.result()
+            except Exception as e:
+                if isinstance(e, BrokenProcessPool):
+                    self._restart_pool(pool)
+                for _, waiter in items:
+                    waiter.set_exception(e)
+            else:
+                for (_, waiter), result in zip(items, results):
+                    waiter.set_result(result)
+
+        pool_future.add_done_callback(done)
+
+    # --- API ---
+
+    def submit(self, scenarios):
+        """
+        Accoda gli scenari; lista di Future, oppure None se la coda è piena.
+        """
+        if not self._acquire(len(scenarios)):
+            return None
+        futures = []
+        for scenario in scenarios:
+            waiter = Future()
+            waiter.add_done_callback(lambda _: self._release(1))
+            self._queue.put((scenario, waiter))
+            futures.append(waiter)
+        return futures
+
+    def snapshot(self):
+        """
+        Statistiche per endpoint più stato di coda e pool (risposta di GET /stats).
+        """
+        with self._lock:
+            avg_batch = self.batched_items / self.batches if self.batches else None
+        return {
+            "uptime_s": time.monotonic() - self.started,
+            "endpoints": {endpoint: stats.snapshot() for endpoint, stats in self.stats.items()},
+            "avg_batch_size": avg_batch,
+            "in_flight": self.in_flight,
+            "max_pending": self.max_pending,
+            "workers": self.workers,
+            "pool_restarts": self.pool_restarts,
+        }
+
+    def close(self):
+        self._queue.put(None)
+        self._batcher.join(timeout=5)
+        self.pool.shutdown(cancel_futures=True)
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    service = None  # SimulationService, impostato da make_server
+    request_timeout_s = 120
+
+    def log_message(self, fmt, *args):
+        logger.debug(fmt, *args)
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload, default=float).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"null")
+
+    def _require_object(self, payload):
+        """
+        False (dopo aver risposto 400) se il corpo non è un oggetto JSON.
+        """
+        if isinstance(payload, dict):
+            return True
+        self._send_json(400, {"error": "atteso un oggetto JSON"})
+        return False
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._send_json(200, {"status": "ok"})
+        elif self.path == "/stats":
+            self._send_json(200, self.service.snapshot())
+        else:
+            self._send_json(404, {"error": "endpoint sconosciuto"})
+
+    def do_POST(self):
+        t0 = time.perf_counter()
+        try:
+            payload = self._read_json()
+        except (ValueError, UnicodeDecodeError) as e:
+            self._send_json(400, {"error": f"JSON non valido: {e}"})
+            return
+
+        if self.path == "/tank":
+            # Calcolo immediato: non passa dal pool
+            if not self._require_object(payload):
+                return
+            try:
+                tank = calculate_tank(subject_from_dict(payload["subject"]))
+            except (KeyError, TypeError, ValueError) as e:
+                self._send_json(400, {"error": f"{type(e).__name__}: {e}"})
+                return
+            self.service.stats["/tank"].add((time.perf_counter() - t0) * 1000.0)
+            self._send_json(200, tank)
+            return
+
+        if self.path == "/estimate":
+            if self.service.population is None:
+                self._send_json(503, {"error": "tabelle di popolazione non disponibili"})
+                return
+            if not self._require_object(payload):
+                return
+            try:
+                estimate = self.service.population.estimate(
+                    payload.get("sex", "MALE"), payload["training"], payload.get("sport", "CYCLING"),
+                    float(payload["weight_kg"]), float(payload["height_cm"]), float(payload["ftp_watts"]),
+                    float(payload["intensity_factor"]), float(payload.get("carb_intake_g_h", 60.0)),
+                    float(payload["duration_min"]), payload.get("mix_type", "GLUCOSE_ONLY"))
+            except (KeyError, TypeError, ValueError) as e:
+                self._send_json(400, {"error": f"{type(e).__name__}: {e}"})
+                return
+            self.service.stats["/estimate"].add((time.perf_counter() - t0) * 1000.0)
+            self._send_json(200, {**estimate, "table_built_at": self.service.population.meta["built_at"]})
+            return
+
+        if self.path == "/simulate":
+            scenarios = [payload]
+        elif self.path == "/batch":
+            scenarios = payload
+        else:
+            self._send_json(404, {"error": "endpoint sconosciuto"})
+            return
+        if not isinstance(scenarios, list) or not all(isinstance(s, dict) for s in scenarios):
+            self._send_json(400, {"error": "atteso un oggetto scenario (o una lista per /batch)"})
+            return
+        if len(scenarios) > self.service.max_pending:
+            # Non entrerebbe mai in coda: riprovare non serve, va diviso
+            self._send_json(413, {"error": f"batch di {len(scenarios)} scenari oltre il massimo in coda "
+                                           f"({self.service.max_pending}): dividerlo in batch più piccoli"})
+            return
+
+        stats = self.service.stats[self.path]
+        futures = self.service.submit(scenarios)
+        if futures is None:
+            stats.reject()
+            self._send_json(503, {"error": "servizio saturo, riprovare"}, {"Retry-After": "1"})
+            return
+        try:
+            results = [f.result(timeout=self.request_timeout_s) for f in futures]
+        except Exception as e:
+            stats.add((time.perf_counter() - t0) * 1000.0, error=True)
+            self._send_json(500, {"error": f"{type(e).__name__}: {e}"})
+            return
+
+        stats.add((time.perf_counter() - t0) * 1000.0, error=any("error" in r for r in results))
+        self._send_json(200, results[0] if self.path == "/simulate" else results)
+
+
+class ServiceHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Backlog del socket: con il default (5) i picchi di connessioni vengono rifiutati
+    # dal kernel prima che il controllo della coda possa rispondere 503
+    request_queue_size = 256
+
+
+def make_server(host="127.0.0.1", port=DEFAULT_PORT, **service_kwargs):
+    """
+    Crea server e servizio; il chiamante esegue serve_forever() e poi service.close().
+    """
+    service = SimulationService(**service_kwargs)
+    handler = type("BoundServiceHandler", (ServiceHandler,), {"service": service})
+    server = ServiceHTTPServer((host, port), handler)
+    return server, service
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m glicogeno.service", description="Servizio di simulazione locale")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--workers", type=int, default=2, help="processi del pool")
+    parser.add_argument("--max-batch", type=int, default=DEFAULT_MAX_BATCH)
+    parser.add_argument("--batch-window-ms", type=float, default=DEFAULT_BATCH_WINDOW_MS)
+    parser.add_argument("--max-pending", type=int, default=None, help="scenari in coda prima del 503")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(message)s")
+    server, service = make_server(args.host, args.port, workers=args.workers, max_batch=args.max_batch,
+                                  batch_window_ms=args.batch_window_ms, max_pending=args.max_pending)
+    logger.info("In ascolto su http://%s:%d (%d worker, coda max %d)",
+                args.host, args.port, service.workers, service.max_pending)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+"""
+Gare a tappe: giornate di gara (modello al minuto) e recupero serale/notturno
+(modello orario del diario) concatenati in un'unica simulazione. Lo stato di
+muscolo e fegato a fine tappa è il punto di partenza del recupero, e lo stato a
+fine recupero è il serbatoio della tappa successiva.
+
+    stages = [Stage(duration_min=300, start=datetime.time(12, 0), recovery_cho_g=800)] * 21
+    df_stages, df_timeline = simulate_stage_race(tank, subject, stages, activity, intake, absorption)
+
+La giornata di gara riproduce simulate_metabolism: domanda di CHO, ossidazione
+esogena e carico intestinale non dipendono dal glicogeno e sono calcolati come
+array numpy; resta sequenziale solo l'aggiornamento di muscolo e fegato.
+"""
+import datetime
+import math
+from dataclasses import dataclass, replace
+
+import numpy as np
+import pandas as pd
+
+from glicogeno.engine import (
+    BONK_LIVER_G, BONK_MUSCLE_G, AbsorptionParams, ActivityParams, FeedingPlan, IntakeParams,
+    constant_rate_kinetics, estimate_max_exogenous_oxidation, gut_load_series, muscle_exo_capacity,
+)
+from glicogeno.gut import compartment_kinetics
+from glicogeno.sweep import cho_demand_matrix
+
+# Costanti del modello orario (calculate_hourly_tapering)
+MAX_LIVER_G = 100.0
+LIVER_DRAIN_H = 4.0
+REFILL_MUSCLE_SHARE = 0.7
+
+DEFAULT_START = datetime.time(12, 0)
+DEFAULT_SLEEP_START = datetime.time(22, 30)
+DEFAULT_SLEEP_END = datetime.time(6, 30)
+
+
+@dataclass(frozen=True, slots=True)
+class Stage:
+    """
+    Una tappa e il recupero fino alla partenza della tappa successiva.
+    I parametri a None usano quelli comuni della gara.
+    """
+    duration_min: float = 240
+    start: datetime.time = DEFAULT_START
+    intensity_factor: float = None
+    intensity_series: tuple = None
+    carb_intake_g_h: float = None
+    recovery_cho_g: float = 600.0       # CHO dal traguardo alla partenza successiva
+    sleep_start: datetime.time = DEFAULT_SLEEP_START
+    sleep_end: datetime.time = DEFAULT_SLEEP_END
+    sleep_factor: float = 0.95
+
+
+def _hours(t):
+    return t.hour + t.minute / 60.0
+
+
+# --- GIORNATA DI GARA (AL MINUTO) ---
+
+def race_day(muscle_g, liver_g, subject_obj, duration_min, activity, intake, absorption, intensity_series=None):
+    """
+    Una giornata di gara a partire da (muscolo, fegato): serie al minuto e totali.
+    """
+    duration = int(duration_min)
+    if_series = np.full(duration + 1, float(activity.intensity_factor))
+    if intensity_series is not None:
+        n = min(len(intensity_series), duration + 1)
+        if_series[:n] = np.asarray(intensity_series[:n], dtype=float)
+
+    cho_g_min = cho_demand_matrix(activity, subject_obj, if_series[None, :], duration)[0]
+    if absorption.gut_model is not None:
+        plan = FeedingPlan.constant_rate(intake.carb_intake_g_h, intake.cho_per_unit_g, duration)
+        max_exo = muscle_exo_capacity(subject_obj, activity.ftp_watts, absorption.max_exo_rate_g_min)
+        intake_g, ox, gut, _ = compartment_kinetics(plan, duration, absorption.tau_min,
+                                                    absorption.oxidation_efficiency, max_exo, intake.mix_type,
+                                                    absorption.gut_model)
+    else:
+        if absorption.max_exo_rate_g_min is not None:
+            max_exo = absorption.max_exo_rate_g_min
+        else:
+            max_exo = estimate_max_exogenous_oxidation(subject_obj.height_cm, subject_obj.weight_kg,
+                                                       activity.ftp_watts, intake.mix_type)
+        intake_g, ox = constant_rate_kinetics(duration, intake.carb_intake_g_h, intake.cho_per_unit_g,
+                                              absorption.tau_min, absorption.oxidation_efficiency, max_exo)
+        gut = gut_load_series(intake_g, ox, absorption.oxidation_efficiency)
+
+    # Unica parte sequenziale: il consumo muscolare dipende dal riempimento corrente
+    muscle = np.empty(duration + 1)
+    liver = np.empty(duration + 1)
+    initial_muscle = muscle_g
+    muscle_used = liver_used = exo_used = 0.0
+    m, l = float(muscle_g), float(liver_g)
+    for i, (cho, ex) in enumerate(zip(cho_g_min.tolist(), ox.tolist())):
+        fill = m / initial_muscle if initial_muscle > 0 else 0
+        from_muscle = cho * math.pow(fill, 0.6) if m > 0 else 0.0
+        blood = cho - from_muscle
+        from_exo = min(blood, ex)
+        from_liver = min(blood - from_exo, 1.2) if l > 0 else 0.0
+        if i > 0:
+            m = max(m - from_muscle, 0.0)
+            l = max(l - from_liver, 0.0)
+            muscle_used += from_muscle
+            liver_used += from_liver
+            exo_used += from_exo
+        muscle[i] = m
+        liver[i] = l
+
+    crisis = np.flatnonzero((liver <= BONK_LIVER_G) | (muscle <= BONK_MUSCLE_G))
+    return {
+        "muscle": muscle,
+        "liver": liver,
+        "gut": gut,
+        "bonk_min": int(crisis[0]) if len(crisis) else None,
+        "muscle_used": muscle_used,
+        "liver_used": liver_used,
+        "exo_used": exo_used,
+    }
+
+
+# --- RECUPERO (ORARIO) ---
+
+def recovery(muscle_g, liver_g, max_muscle_g, weight_kg, end_h, hours, cho_g, sleep_start, sleep_end,
+             sleep_factor):
+    """
+    Recupero orario dal traguardo (ora end_h) per `hours` ore, con le regole di
+    calculate_hourly_tapering: veglia = CHO distribuiti + NEAT, sonno = solo fegato.
+    Restituisce (muscolo, fegato) dopo ogni ora e l'array "sonno".
+    """
+    hour_of_day = np.floor(end_h + np.arange(hours)) % 24
+    s0, s1 = _hours(sleep_start), _hours(sleep_end)
+    if s0 > s1:
+        sleeping = (hour_of_day >= s0) | (hour_of_day < s1)
+    else:
+        sleeping = (hour_of_day >= s0) & (hour_of_day < s1)
+    awake = ~sleeping
+    waking_hours = int(awake.sum())
+    cho_rate_h = cho_g / waking_hours if waking_hours > 0 else 0.0
+    neat_h = (1.0 * weight_kg) / 16.0
+
+    net = np.where(awake, cho_rate_h - (LIVER_DRAIN_H + neat_h), -LIVER_DRAIN_H)
+    muscle = np.empty(hours)
+    liver = np.empty(hours)
+    m, l = float(muscle_g), float(liver_g)
+    for i, flow in enumerate(net.tolist()):
+        if flow > 0:
+            stored = flow * sleep_factor
+            to_muscle = stored * REFILL_MUSCLE_SHARE
+            to_liver = stored * (1 - REFILL_MUSCLE_SHARE)
+            if m + to_muscle > max_muscle_g:
+                overflow = m + to_muscle - max_muscle_g
+                to_muscle -= overflow
+                to_liver += overflow
+            m = min(max_muscle_g, m + to_muscle)
+            l = min(MAX_LIVER_G, l + to_liver)
+        else:
+            l -= -flow * 0.8
+            m -= -flow * 0.2
+        m, l = max(0.0, m), max(0.0, l)
+        muscle[i] = m
+        liver[i] = l
+    return muscle, liver, sleeping
+
+
+# --- GARA A TAPPE ---
+
+def simulate_stage_race(subject_data, subject_obj, stages, activity, intake=IntakeParams(),
+                        absorption=AbsorptionParams()):
+    """
+    Simula le tappe in sequenza. Restituisce (riepilogo per tappa, timeline):
+    la timeline ha una riga per minuto di gara e una per ora di recupero.
+    """
+    activity = ActivityParams.coerce(activity)
+    max_muscle = subject_data['max_capacity_g'] - 100
+    muscle, liver = float(subject_data['muscle_glycogen_g']), float(subject_data['liver_glycogen_g'])
+
+    rows, timeline = [], []
+    clock_h = 0.0   # ore dalla partenza della prima tappa
+    for n, stage in enumerate(stages, start=1):
+        stage_activity = activity
+        if stage.intensity_factor is not None:
+            stage_activity = replace(activity, intensity_factor=stage.intensity_factor)
+        stage_intake = intake
+        if stage.carb_intake_g_h is not None:
+            stage_intake = IntakeParams(stage.carb_intake_g_h, intake.cho_per_unit_g, intake.mix_type)
+
+        start_muscle, start_liver = muscle, liver
+        day = race_day(muscle, liver, subject_obj, stage.duration_min, stage_activity, stage_intake,
+                       absorption, stage.intensity_series)
+        minutes = np.arange(len(day["muscle"]))
+        timeline.append(pd.DataFrame({
+            "Tappa": n, "Fase": "Gara", "Ore": clock_h + minutes / 60.0,
+            "Muscolare": day["muscle"], "Epatico": day["liver"],
+        }))
+        muscle, liver = float(day["muscle"][-1]), float(day["liver"][-1])
+        finish_muscle, finish_liver = muscle, liver
+
+        start_h = _hours(stage.start)
+        end_h = start_h + stage.duration_min / 60.0
+        clock_h += stage.duration_min / 60.0
+        recovery_hours = 0
+        if n < len(stages):
+            # Dal traguardo alla partenza della tappa successiva, il giorno dopo
+            gap_h = 24.0 + _hours(stages[n].start) - end_h
+            recovery_hours = max(int(round(gap_h)), 0)
+            rec_muscle, rec_liver, sleeping = recovery(
+                muscle, liver, max_muscle, subject_obj.weight_kg, end_h, recovery_hours,
+                stage.recovery_cho_g, stage.sleep_start, stage.sleep_end, stage.sleep_factor,
+            )
+            if recovery_hours:
+                timeline.append(pd.DataFrame({
+                    "Tappa": n, "Fase": np.where(sleeping, "Sonno", "Recupero"),
+                    "Ore": clock_h + np.arange(1, recovery_hours + 1),
+                    "Muscolare": rec_muscle, "Epatico": rec_liver,
+                }))
+                muscle, liver = float(rec_muscle[-1]), float(rec_liver[-1])
+            clock_h += gap_h
+
+        rows.append({
+            "Tappa": n,
+            "Durata (min)": int(stage.duration_min),
+            "IF": stage_activity.intensity_factor,
+            "Integrazione (g/h)": stage_intake.carb_intake_g_h,
+            "Muscolo Partenza": start_muscle,
+            "Fegato Partenza": start_liver,
+            "Muscolo Arrivo": finish_muscle,
+            "Fegato Arrivo": finish_liver,
+            "Crisi (min)": day["bonk_min"],
+            "Picco Gut Load": float(day["gut"].max()),
+            "CHO Esogeni Ossidati (g)": day["exo_used"],
+            "CHO Recupero (g)": stage.recovery_cho_g if n < len(stages) else 0.0,
+            "Ore Recupero": recovery_hours,
+            "Totale Fine Recupero": muscle + liver,
+        })
+
+    df_stages = pd.DataFrame(rows).astype({"Crisi (min)": "Int64"})
+    df_timeline = pd.concat(timeline, ignore_index=True)
+    df_timeline["Totale"] = df_timeline["Muscolare"] + df_timeline["Epatico"]
+    return df_stages, df_timeline
+
+
+def stage_records(df_stages):
+    """
+    Riepilogo per tappa come lista di dizionari JSON (crisi assente = None).
+    """
+    return df_stages.astype(object).where(df_stages.notna(), None).to_dict("records")
+
+
+def stage_race_result(*args, **kwargs):
+    """
+    simulate_stage_race nel formato (DataFrame, stats) della cache dei risultati:
+    la timeline come DataFrame, il riepilogo per tappa in stats["stages"].
+    """
+    df_stages, df_timeline = simulate_stage_race(*args, **kwargs)
+    return df_timeline, {"stages": stage_records(df_stages)}
+
+
+def stages_frame(records):
+    return pd.DataFrame(records).astype({"Crisi (min)": "Int64"})
+
+
+def stage_from_dict(data):
+    """
+    Tappa da dizionario JSON (orari come stringhe "HH:MM").
+    """
+    def time_of(key, default):
+        value = data.get(key)
+        if value is None:
+            return default
+        return value if isinstance(value, datetime.time) else datetime.time.fromisoformat(value)
+
+    series = data.get("intensity_series")
+    return Stage(
+        duration_min=float(data.get("duration_min", 240)),
+        start=time_of("start", DEFAULT_START),
+        intensity_factor=data.get("intensity_factor"),
+        intensity_series=tuple(series) if series is not None else None,
+        carb_intake_g_h=data.get("carb_intake_g_h"),
+        recovery_cho_g=float(data.get("recovery_cho_g", 600.0)),
+        sleep_start=time_of("sleep_start", DEFAULT_SLEEP_START),
+        sleep_end=time_of("sleep_end", DEFAULT_SLEEP_END),
+        sleep_factor=float(data.get("sleep_factor", 0.95)),
+    )
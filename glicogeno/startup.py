@@ -0,0 +1,62 @@
+"""
+Misure di avvio: tempo di import e del primo render (per processo e per sessione).
+
+Uso da riga di comando per misurare a freddo il costo di import delle dipendenze:
+
+    python -m glicogeno.startup
+"""
+import logging
+import subprocess
+import sys
+import time
+
+logger = logging.getLogger("glicogeno.startup")
+
+# Tempi registrati dal processo corrente (ms)
+TIMINGS = {}
+
+# Dipendenze misurate dal comando `python -m glicogeno.startup`
+MEASURED_MODULES = [
+    "streamlit", "pandas", "numpy", "altair", "sqlalchemy", "openpyxl",
+    "matplotlib.pyplot", "fitparse", "xml.etree.ElementTree",
+]
+
+
+def record(name, elapsed_ms, once=True):
+    """
+    Registra un tempo (ms). Con once=True conserva solo la prima misura del processo.
+    """
+    if once and name in TIMINGS:
+        return
+    TIMINGS[name] = elapsed_ms
+    logger.info("%s: %.1f ms", name, elapsed_ms)
+
+
+def since(t0):
+    return (time.perf_counter() - t0) * 1000.0
+
+
+def measure_cold_import(module, python=sys.executable):
+    """
+    Tempo di import (ms) di un modulo in un interprete nuovo; None se non installato.
+    """
+    code = (
+        "import time; t = time.perf_counter(); import " + module +
+        "; print((time.perf_counter() - t) * 1000)"
+    )
+    proc = subprocess.run([python, "-c", code], capture_output=True, text=True)
+    if proc.returncode != 0:
+        return None
+    return float(proc.stdout.strip().splitlines()[-1])
+
+
+def main():
+    print(f"{'Modulo':<26}{'Import a freddo':>16}")
+    for module in MEASURED_MODULES:
+        ms = measure_cold_import(module)
+        value = f"{ms:.0f} ms" if ms is not None else "non installato"
+        print(f"{module:<26}{value:>16}")
+
+
+if __name__ == "__main__":
+    main()
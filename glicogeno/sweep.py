@@ -0,0 +1,184 @@
+"""
+Mappa integrazione (g/h) x intensità (IF) calcolata in un'unica simulazione vettoriale.
+
+Ogni cella equivale a simulate_metabolism con carb_intake = g/h della riga e
+intensity_series costante = IF della colonna; invece di una chiamata per cella,
+il ciclo sui minuti aggiorna insieme tutte le celle della griglia. Tutto ciò che
+dipende solo da IF e tempo (domanda, quota CHO) è precalcolato in una matrice.
+Con `gut_model` l'ossidazione esogena e il carico intestinale di ogni riga vengono
+dal modello a compartimenti (glicogeno.gut), come in simulate_metabolism.
+"""
+import time
+
+import numpy as np
+import pandas as pd
+
+from glicogeno.engine import (
+    BONK_LIVER_G, BONK_MUSCLE_G, ActivityParams, ChoMixType, FeedingPlan, estimate_max_exogenous_oxidation,
+    muscle_exo_capacity, rer_polynomial,
+)
+from glicogeno.gut import compartment_kinetics
+
+
+def cho_demand_matrix(activity, subject_obj, if_values, duration_min):
+    """
+    CHO richiesti (g/min) per IF (righe) e minuto 0..duration (colonne), come simulate_metabolism.
+    `if_values` 1-D: un IF costante per riga; 2-D (righe, duration + 1): una serie di IF per riga.
+    """
+    t = np.arange(int(duration_min) + 1, dtype=float)[None, :]
+    ifs = np.asarray(if_values, dtype=float)
+    if ifs.ndim == 1:
+        ifs = ifs[:, None]
+    if_ref = activity.intensity_factor
+
+    if activity.use_lab_data:
+        curve = activity.lab_curve
+        if curve is None:
+            cho_rate = np.zeros_like(ifs)
+        else:
+            if curve.x_col == 'Watt':
+                x_val = ifs * activity.ftp_watts if activity.mode == 'cycling' else np.full_like(ifs, activity.avg_watts)
+            elif curve.x_col == 'HR':
+                x_val = activity.avg_hr * ifs / if_ref if if_ref > 0 else np.full_like(ifs, activity.avg_hr)
+            elif curve.x_col == 'Speed':
+                x_val = np.full_like(ifs, activity.speed_kmh)
+            else:
+                x_val = np.zeros_like(ifs)
+            cho_rate = np.interp(x_val, curve.x, curve.cho)
+        fatigue_drift = np.where(t > 60, 1.0 + (t - 60) * 0.001, 1.0)
+        return (cho_rate / 60.0) * fatigue_drift
+
+    if activity.mode == 'cycling':
+        eff = np.where(t > 60, np.maximum(15.0, activity.efficiency - (t - 60) * 0.02), activity.efficiency)
+        kcal = (ifs * activity.ftp_watts * 60) / 4184 / (eff / 100.0)
+    else:
+        if activity.mode == 'running':
+            kcal_base = 1.0 * subject_obj.weight_kg * activity.speed_kmh / 60.0
+        else:
+            kcal_base = subject_obj.vo2max_absolute_l_min * if_ref * 5.0
+        scaling = ifs / if_ref if if_ref > 0 else np.ones_like(ifs)
+        drift = np.where(t > 60, 1.0 + (t - 60) * 0.0005, 1.0)
+        kcal = kcal_base * drift * scaling
+
+    effective_if = np.maximum(ifs + (75.0 - activity.crossover_pct) / 100.0, 0.3)
+    rer = np.clip(rer_polynomial(effective_if), 0.70, 1.15)
+    ratio = np.clip((rer - 0.70) * 3.45, 0.0, 1.0)
+    shift = 0.05 * (np.maximum(t - 60, 0) / 60.0) ** 1.2
+    ratio = np.where((ifs < 0.85) & (t > 60), np.maximum(0.05, ratio - shift), ratio)
+    return kcal * ratio / 4.1
+
+
+def simulate_grid(subject_data, duration_min, intake_values, if_values, cho_per_unit_g, tau_absorption,
+                  subject_obj, activity, oxidation_efficiency=0.80, custom_max_exo_rate=None,
+                  mix_type=ChoMixType.GLUCOSE_ONLY, checkpoints=(), gut_model=None):
+    """
+    Simula tutte le combinazioni intake x IF. Restituisce array (n_intake, n_if):
+    minuto di crisi (NaN se assente), residuo totale finale, picco di carico intestinale.
+    Con `checkpoints` (minuti) anche il residuo totale in quei minuti, "total_at"
+    (n_intake, n_if, n_checkpoints).
+    """
+    activity = ActivityParams.coerce(activity)
+    duration = int(duration_min)
+    intake = np.asarray(intake_values, dtype=float)[:, None]
+    shape = (len(intake_values), len(if_values))
+
+    cho_g_min = cho_demand_matrix(activity, subject_obj, if_values, duration)   # (n_if, T+1)
+
+    # Modello intestinale: ossidazione esogena per riga (n_intake, T+1) calcolata in anticipo
+    ox_rows = None
+    if gut_model is not None:
+        capacity = muscle_exo_capacity(subject_obj, activity.ftp_watts, custom_max_exo_rate)
+        rows = [compartment_kinetics(FeedingPlan.constant_rate(g_h, cho_per_unit_g, duration), duration, tau_absorption,
+                                     oxidation_efficiency, capacity, mix_type, gut_model)
+                for g_h in intake_values]
+        ox_rows = np.array([r[1] for r in rows]).reshape(len(intake_values), duration + 1)
+        gut_rows = np.array([r[2] for r in rows]).reshape(len(intake_values), duration + 1)
+
+    if custom_max_exo_rate is not None:
+        max_exo = custom_max_exo_rate
+    else:
+        max_exo = estimate_max_exogenous_oxidation(subject_obj.height_cm, subject_obj.weight_kg,
+                                                   activity.ftp_watts, mix_type)
+    target = max_exo * oxidation_efficiency
+    alpha = 1 - np.exp(-1.0 / tau_absorption)
+
+    # Calendario delle porzioni: stessa regola di simulate_metabolism, per riga
+    units_per_hour = intake / cho_per_unit_g if cho_per_unit_g > 0 else np.zeros_like(intake)
+    interval = np.where(units_per_hour > 0, np.round(60 / np.where(units_per_hour > 0, units_per_hour, 1)),
+                        duration + 1).astype(int)
+    is_zero = intake == 0
+    dosing = ~is_zero & (interval <= duration)
+
+    initial_muscle = subject_data['muscle_glycogen_g']
+    muscle = np.full(shape, float(initial_muscle))
+    liver = np.full(shape, float(subject_data['liver_glycogen_g']))
+    ox = np.zeros((shape[0], 1))
+    gut = np.zeros((shape[0], 1))
+    gut_peak = np.zeros((shape[0], 1))
+    bonk = np.where((liver <= BONK_LIVER_G) | (muscle <= BONK_MUSCLE_G), 0.0, np.nan)
+    slots = {int(m): k for k, m in enumerate(checkpoints)}
+    total_at = np.full(shape + (len(slots),), np.nan)
+    if 0 in slots:
+        total_at[..., slots[0]] = muscle + liver
+
+    # L'assorbimento dipende solo dalla riga (intake): stato (n_intake, 1) in broadcast sulle colonne
+    for t in range(1, duration + 1):
+        if ox_rows is not None:
+            ox = ox_rows[:, t:t + 1]
+        else:
+            ox = np.where(is_zero, ox * (1 - alpha), ox + alpha * (target - ox))
+            np.maximum(ox, 0.0, out=ox)
+            dose = np.where(dosing & (t % interval == 0), cho_per_unit_g, 0.0)
+            gut = np.maximum(gut + dose * oxidation_efficiency - ox, 0.0)
+            np.maximum(gut_peak, gut, out=gut_peak)
+
+        cho = cho_g_min[:, t][None, :]
+        fill = muscle / initial_muscle if initial_muscle > 0 else np.zeros(shape)
+        muscle_rate = np.where(muscle > 0, cho * fill ** 0.6, 0.0)
+        blood = cho - muscle_rate
+        from_exo = np.minimum(blood, ox)
+        liver_rate = np.where(liver > 0, np.minimum(blood - from_exo, 1.2), 0.0)
+        muscle = np.maximum(muscle - muscle_rate, 0.0)
+        liver = np.maximum(liver - liver_rate, 0.0)
+
+        bonk[np.isnan(bonk) & ((liver <= BONK_LIVER_G) | (muscle <= BONK_MUSCLE_G))] = t
+        if t in slots:
+            total_at[..., slots[t]] = muscle + liver
+
+    if ox_rows is not None:
+        gut_peak = np.maximum(gut_rows[:, 1:].max(axis=1, initial=0.0), 0.0)[:, None]
+    result = {
+        "bonk_min": bonk,
+        "final_total": muscle + liver,
+        "gut_peak": np.broadcast_to(gut_peak, shape).copy(),
+    }
+    if slots:
+        result["total_at"] = total_at
+    return result
+
+
+def intake_intensity_sweep(subject_data, duration_min, intake_values, if_values, cho_per_unit_g, tau_absorption,
+                           subject_obj, activity, oxidation_efficiency=0.80, custom_max_exo_rate=None,
+                           mix_type=ChoMixType.GLUCOSE_ONLY, gut_model=None):
+    """
+    simulate_grid in formato lungo (una riga per cella) per heatmap e cache: (DataFrame, stats).
+    """
+    t0 = time.perf_counter()
+    grid = simulate_grid(subject_data, duration_min, intake_values, if_values, cho_per_unit_g, tau_absorption,
+                         subject_obj, activity, oxidation_efficiency, custom_max_exo_rate, mix_type,
+                         gut_model=gut_model)
+    intake_mesh, if_mesh = np.meshgrid(np.asarray(intake_values, dtype=float),
+                                       np.asarray(if_values, dtype=float), indexing="ij")
+    df = pd.DataFrame({
+        "Intake (g/h)": intake_mesh.ravel(),
+        "IF": if_mesh.ravel(),
+        "Tempo alla Crisi (min)": grid["bonk_min"].ravel(),
+        "Residuo Totale": grid["final_total"].ravel(),
+        "Picco Gut Load": grid["gut_peak"].ravel(),
+    })
+    stats = {
+        "cells": int(df.shape[0]),
+        "duration_min": int(duration_min),
+        "compute_ms": (time.perf_counter() - t0) * 1000.0,
+    }
+    return df, stats
@@ -1,13 +1,34 @@
-import re
+import time
+_SCRIPT_T0 = time.perf_counter()
+
+import functools
+import json
+import os
 import streamlit as st
-import pandas as pd
-import numpy as np
-import altair as alt
-from dataclasses import dataclass
-from enum import Enum
-import math
-import xml.etree.ElementTree as ET
-import io 
+from glicogeno import DB_URL_ENV, profiling, startup
+from glicogeno import lazy
+from glicogeno.lazy import lazy_import
+
+# Import eseguiti subito (al primo avvio del processo: costo reale, poi moduli già in memoria)
+startup.record("script_imports_ms", startup.since(_SCRIPT_T0))
+
+# Dipendenze pesanti caricate al primo utilizzo: la pagina di login e i rerun
+# che non le usano non pagano il loro import (XML, FIT ed Excel sono importati
+# direttamente nei rispettivi parser). pandas e numpy sono importati dopo il
+# login insieme al motore, che li usa subito.
+alt = lazy_import("altair")
+cache = lazy_import("glicogeno.cache")
+decimation = lazy_import("glicogeno.decimation")
+storage = lazy_import("glicogeno.storage")
+jobs = lazy_import("glicogeno.jobs")
+analyses = lazy_import("glicogeno.analyses")
+sweep = lazy_import("glicogeno.sweep")
+export = lazy_import("glicogeno.export")
+report = lazy_import("glicogeno.report")
+labfit = lazy_import("glicogeno.labfit")
+stagerace = lazy_import("glicogeno.stagerace")
+artifacts = lazy_import("glicogeno.artifacts")
+population = lazy_import("glicogeno.population")
 
 # --- 0. SISTEMA DI PROTEZIONE (LOGIN) ---
 def check_password():
@@ -36,1026 +57,187 @@ def check_password():
         return True
 
 if not check_password():
+    startup.record("login_render_ms", startup.since(_SCRIPT_T0))
     st.stop()
 
-# --- 1. PARAMETRI FISIOLOGICI ---
-
-class Sex(Enum):
-    MALE = "Uomo"
-    FEMALE = "Donna"
-
-class TrainingStatus(Enum):
-    SEDENTARY = (13.0, "Sedentario / Principiante")
-    RECREATIONAL = (16.0, "Attivo / Amatore")
-    TRAINED = (19.0, "Allenato (Intermedio)")
-    ADVANCED = (22.0, "Avanzato / Competitivo")
-    ELITE = (25.0, "Elite / Pro")
-
-    def __init__(self, val, label):
-        self.val = val
-        self.label = label
-
-class SportType(Enum):
-    CYCLING = (0.63, "Ciclismo (Prevalenza arti inferiori)")
-    RUNNING = (0.75, "Corsa (Arti inferiori + Core)")
-    TRIATHLON = (0.85, "Triathlon (Multidisciplinare)")
-    XC_SKIING = (0.95, "Sci di Fondo (Whole Body)")
-    SWIMMING = (0.80, "Nuoto (Arti sup. + inf.)")
-
-    def __init__(self, val, label):
-        self.val = val
-        self.label = label
-
-# --- PARAMETRI STATO FISIOLOGICO ---
-class DietType(Enum):
-    HIGH_CARB = (1.25, "Carico Carboidrati (Supercompensazione)", 8.0)
-    NORMAL = (1.00, "Regime Normocalorico Misto (Baseline)", 5.0)
-    LOW_CARB = (0.50, "Restrizione Glucidica / Low Carb", 2.5)
-
-    def __init__(self, factor, label, ref_value):
-        self.factor = factor
-        self.label = label
-        self.ref_value = ref_value
-
-class FatigueState(Enum):
-    RESTED = (1.0, "Riposo / Tapering (Pieno Recupero)")
-    ACTIVE = (0.9, "Carico di lavoro moderato (24h prec.)")
-    TIRED = (0.60, "Alto carico o Danno Muscolare (EIMD)")
-
-    def __init__(self, factor, label):
-        self.factor = factor
-        self.label = label
-
-class SleepQuality(Enum):
-    GOOD = (1.0, "Ottimale (>7h, ristoratore)")
-    AVERAGE = (0.95, "Sufficiente (6-7h)")
-    POOR = (0.85, "Insufficiente / Disturbato (<6h)")
-
-    def __init__(self, factor, label):
-        self.factor = factor
-        self.label = label
-
-class MenstrualPhase(Enum):
-    NONE = (1.0, "Non applicabile")
-    FOLLICULAR = (1.0, "Fase Follicolare")
-    LUTEAL = (0.95, "Fase Luteale (Premestruale)")
-
-    def __init__(self, factor, label):
-        self.factor = factor
-        self.label = label
-
-class ChoMixType(Enum):
-    GLUCOSE_ONLY = (1.0, 60.0, "Solo Glucosio/Maltodestrine (Standard)")
-    MIX_2_1 = (1.5, 90.0, "Mix 2:1 (Maltodestrine:Fruttosio)")
-    MIX_1_08 = (1.7, 105.0, "Mix 1:0.8 (High Frructose)")
-
-    def __init__(self, ox_factor, max_rate_gh, label):
-        self.ox_factor = ox_factor 
-        self.max_rate_gh = max_rate_gh 
-        self.label = label
-
-@dataclass
-class Subject:
-    weight_kg: float
-    height_cm: float 
-    body_fat_pct: float
-    sex: Sex
-    glycogen_conc_g_kg: float
-    sport: SportType
-    liver_glycogen_g: float = 100.0
-    filling_factor: float = 1.0 
-    uses_creatine: bool = False
-    menstrual_phase: MenstrualPhase = MenstrualPhase.NONE
-    glucose_mg_dl: float = None
-    vo2max_absolute_l_min: float = 3.5 
-    muscle_mass_kg: float = None 
-
-    @property
-    def lean_body_mass(self) -> float:
-        return self.weight_kg * (1.0 - self.body_fat_pct)
-
-    @property
-    def muscle_fraction(self) -> float:
-        base = 0.50 if self.sex == Sex.MALE else 0.42
-        if self.glycogen_conc_g_kg >= 22.0:
-            base += 0.03
-        return base
-
-# --- 2. LOGICA DI CALCOLO ---
-
-def calculate_hourly_tapering(subject, days_data, start_state_factor=0.6):
+# --- PROFILO DEL RERUN (SPAN DI TEMPO PER FASE) ---
+if 'perf_log' not in st.session_state:
+    st.session_state['perf_log'] = profiling.ProfileLog()
+st.session_state['perf_log'].begin("app")
+
+def perf_span(name, **meta):
     """
-    Simula l'andamento orario delle riserve per N giorni (Tapering Avanzato).
+    Misura una fase (tank, taper, simulate, chart, parse) nel profilo del rerun corrente.
     """
-    # 1. Inizializzazione Serbatoi
-    tank = calculate_tank(subject)
-    MAX_MUSCLE = tank['max_capacity_g'] - 100 
-    MAX_LIVER = 100.0
-    
-    # Start level basato sul fattore di input (es. Normale=0.6)
-    # Se start_state_factor è un Enum, estrai .factor, altrimenti usa float
-    try:
-        factor = start_state_factor.factor
-    except:
-        factor = start_state_factor if isinstance(start_state_factor, float) else 0.6
-
-    curr_muscle = min(MAX_MUSCLE * factor, MAX_MUSCLE)
-    curr_liver = min(MAX_LIVER * factor, MAX_LIVER)
-    
-    hourly_log = []
-    
-    # Costanti Fisiologiche Orarie
-    LIVER_DRAIN_H = 4.0 # Consumo cervello/organi (g/h)
-    NEAT_DRAIN_H = (1.0 * subject.weight_kg) / 16.0 # NEAT spalmato sulle 16h di veglia (g/h)
-    
-    # Ciclo sui Giorni
-    for day_idx, day in enumerate(days_data):
-        date_label = day['date_obj'].strftime("%d/%m")
-        
-        # Parsing Orari
-        sleep_start = day['sleep_start'].hour + (day['sleep_start'].minute/60)
-        sleep_end = day['sleep_end'].hour + (day['sleep_end'].minute/60)
-        
-        work_start = day['workout_start'].hour + (day['workout_start'].minute/60)
-        work_dur_h = day['duration'] / 60.0
-        work_end = work_start + work_dur_h
-        
-        total_cho_input = day['cho_in']
-        
-        # Calcolo Ore di Veglia (Feeding Window) per distribuire il cibo
-        waking_hours = 0
-        for h in range(24):
-            is_sleeping = False
-            if sleep_start > sleep_end: # Scavalca notte
-                if h >= sleep_start or h < sleep_end: is_sleeping = True
-            else:
-                if sleep_start <= h < sleep_end: is_sleeping = True
-            
-            is_working = (work_start <= h < work_end)
-            if not is_sleeping and not is_working:
-                waking_hours += 1
-        
-        cho_rate_h = total_cho_input / waking_hours if waking_hours > 0 else 0
-        
-        # Ciclo sulle 24 ore del giorno
-        for h in range(24):
-            status = "REST"
-            is_sleeping = False
-            
-            # Check Sonno
-            if sleep_start > sleep_end:
-                if h >= sleep_start or h < sleep_end: is_sleeping = True
-            else:
-                if sleep_start <= h < sleep_end: is_sleeping = True
-            
-            if is_sleeping: status = "SLEEP"
-            
-            # Check Allenamento
-            if work_start <= h < work_end:
-                status = "WORK"
-            
-            # --- BILANCIO ORARIO ---
-            hourly_in = 0
-            hourly_out_liver = LIVER_DRAIN_H # Sempre attivo (cervello)
-            hourly_out_muscle = 0
-            
-            if status == "SLEEP":
-                hourly_in = 0 
-            
-            elif status == "WORK":
-                hourly_in = 0 
-                # Calcolo consumo lavoro
-                intensity_if = day.get('calculated_if', 0)
-                # Stima Kcal/h lavoro
-                # Se ciclismo use 22% eff, se corsa 1kcal/kg/km approx
-                kcal_work = 600 * intensity_if # Fallback generico se non abbiamo watt
-                if day.get('val', 0) > 0 and day.get('type') == 'Ciclismo':
-                     kcal_work = (day.get('val') * 60) / 4.184 / 0.22
-                
-                # CHO usage durante lavoro
-                cho_pct = max(0, (intensity_if - 0.5) * 2.5) 
-                cho_pct = min(1.0, cho_pct)
-                g_cho_work = (kcal_work * cho_pct) / 4.1
-                
-                liver_share = 0.15 
-                hourly_out_muscle = g_cho_work * (1 - liver_share)
-                hourly_out_liver += g_cho_work * liver_share
-                
-            elif status == "REST":
-                hourly_in = cho_rate_h
-                hourly_out_muscle = NEAT_DRAIN_H 
-            
-            # --- CALCOLO NETTO ---
-            net_flow = hourly_in - (hourly_out_liver + hourly_out_muscle)
-            
-            # Applicazione ai serbatoi
-            if net_flow > 0:
-                # REFILLING
-                efficiency = day.get('sleep_factor', 0.95)
-                real_storage = net_flow * efficiency
-                
-                to_muscle = real_storage * 0.7
-                to_liver = real_storage * 0.3
-                
-                # Overflow
-                if curr_muscle + to_muscle > MAX_MUSCLE:
-                    overflow = (curr_muscle + to_muscle) - MAX_MUSCLE
-                    to_muscle -= overflow
-                    to_liver += overflow 
-                
-                curr_muscle = min(MAX_MUSCLE, curr_muscle + to_muscle)
-                curr_liver = min(MAX_LIVER, curr_liver + to_liver)
-                
-            else:
-                # DRAINING
-                abs_deficit = abs(net_flow)
-                
-                if status == "WORK":
-                    curr_liver -= (hourly_out_liver) # Il fegato paga il suo
-                    curr_muscle -= hourly_out_muscle # Il muscolo paga il suo
-                else:
-                    # Deficit a riposo (Liver drain + NEAT)
-                    curr_liver -= (abs_deficit * 0.8)
-                    curr_muscle -= (abs_deficit * 0.2)
-
-            # Clamping
-            curr_muscle = max(0, curr_muscle)
-            curr_liver = max(0, curr_liver)
-            
-            # Timestamp
-            ts = pd.Timestamp(day['date_obj']) + pd.Timedelta(hours=h)
-            
-            hourly_log.append({
-                "Timestamp": ts,
-                "Giorno": date_label,
-                "Ora": h,
-                "Status": status,
-                "Muscolare": curr_muscle,
-                "Epatico": curr_liver,
-                "Totale": curr_muscle + curr_liver
-            })
-
-    final_tank = tank.copy()
-    final_tank['muscle_glycogen_g'] = curr_muscle
-    final_tank['liver_glycogen_g'] = curr_liver
-    final_tank['actual_available_g'] = curr_muscle + curr_liver
-    final_tank['fill_pct'] = (curr_muscle + curr_liver) / (MAX_MUSCLE + MAX_LIVER) * 100
-    
-    return pd.DataFrame(hourly_log), final_tank
+    return st.session_state['perf_log'].span(name, **meta)
 
-def get_concentration_from_vo2max(vo2_max):
-    conc = 13.0 + (vo2_max - 30.0) * 0.24
-    if conc < 12.0: conc = 12.0
-    if conc > 26.0: conc = 26.0
-    return conc
+def profiled(name, **meta):
+    """
+    Decoratore per i fragment: nei rerun isolati la funzione diventa un profilo a sé.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with perf_span(name, **meta):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+# --- 1-2. PARAMETRI FISIOLOGICI E LOGICA DI CALCOLO ---
+# Il motore è nel pacchetto `glicogeno` (importabile senza Streamlit).
+# Importato dopo il login: la pagina di accesso non carica pandas/numpy.
+import numpy as np
+import pandas as pd
+from glicogeno.engine import (
+    Sex, TrainingStatus, SportType, MenstrualPhase, ChoMixType, Subject, ActivityParams,
+    IntakeParams, AbsorptionParams, FeedingPlan, GutParams, intake_interval_min, calculate_hourly_tapering, get_concentration_from_vo2max, calculate_tank, simulate_metabolism,
+    calculate_zones_cycling, calculate_zones_running_hr,
+)
+from glicogeno.parsers import parse_fit_file, parse_metabolic_report
+from glicogeno import parsers
 
-def calculate_depletion_factor(steps, activity_min, s_fatigue):
-    steps_base = 10000 
-    steps_factor = (steps - steps_base) / 5000 * 0.1 * 0.4
-    
-    activity_base = 120 
-    if activity_min < 60: 
-        activity_factor = (1 - (activity_min / 60)) * 0.05 * 0.6
-    else:
-        activity_factor = (activity_min - activity_base) / 60 * -0.1 * 0.6
-        
-    depletion_impact = steps_factor + activity_factor
-    
-    estimated_depletion_factor = max(0.6, min(1.0, 1.0 + depletion_impact))
+def parse_zwo_file(uploaded_file, ftp_watts, thr_hr, sport_type):
+    """
+    Parser ZWO con i messaggi mostrati nell'interfaccia.
+    """
+    def report(level, message):
+        if level == 'error':
+            st.error(message)
+        else:
+            st.warning(message)
     
-    if steps == 0 and activity_min == 0:
-        return s_fatigue.factor
-    else:
-        return estimated_depletion_factor
+    with perf_span("parse", format="zwo"):
+        return parsers.parse_zwo_file(uploaded_file, ftp_watts, thr_hr, sport_type,
+                                      max_hr=st.session_state.get('max_hr_input', 185), report=report)
 
-def calculate_filling_factor_from_diet(weight_kg, cho_day_minus_1_g, cho_day_minus_2_g, s_fatigue, s_sleep, steps_m1, min_act_m1, steps_m2, min_act_m2):
-    CHO_BASE_GK = 5.0
-    CHO_MAX_GK = 10.0
-    CHO_MIN_GK = 2.5
-    
-    cho_day_minus_1_g = max(cho_day_minus_1_g, 1.0) 
-    cho_day_minus_2_g = max(cho_day_minus_2_g, 1.0) 
-    
-    cho_day_minus_1_gk = cho_day_minus_1_g / weight_kg
-    cho_day_minus_2_gk = cho_day_minus_2_g / weight_kg
-    
-    depletion_m1_factor = calculate_depletion_factor(steps_m1, min_act_m1, s_fatigue)
-    depletion_m2_factor = calculate_depletion_factor(steps_m2, min_act_m2, s_fatigue)
-    
-    recovery_factor = (depletion_m1_factor * 0.7) + (depletion_m2_factor * 0.3)
-    
-    avg_cho_gk = (cho_day_minus_1_gk * 0.7) + (cho_day_minus_2_gk * 0.3)
-    
-    if avg_cho_gk >= CHO_MAX_GK:
-        diet_factor_base = 1.25
-    elif avg_cho_gk >= CHO_BASE_GK:
-        diet_factor_base = 1.0 + (avg_cho_gk - CHO_BASE_GK) * (0.25 / (CHO_MAX_GK - CHO_BASE_GK))
-    elif avg_cho_gk > CHO_MIN_GK:
-        diet_factor_base = 0.5 + (avg_cho_gk - CHO_MIN_GK) * (0.5 / (CHO_BASE_GK - CHO_MIN_GK))
-        diet_factor_base = max(0.5, diet_factor_base)
-    else: 
-        diet_factor_base = 0.5
-    
-    diet_factor_base = min(1.25, max(0.5, diet_factor_base)) 
-    
-    final_diet_depletion_factor = diet_factor_base * recovery_factor 
-    combined_filling = final_diet_depletion_factor * s_sleep.factor
-    
-    return combined_filling, final_diet_depletion_factor, avg_cho_gk, cho_day_minus_1_gk, cho_day_minus_2_gk
+# --- CACHE RISULTATI (MEMORIA + DATABASE CONDIVISO) ---
 
+def get_archive_engine():
+    # Archivio e cache condivisa sono attivi solo se è configurato GLICOGENO_DB_URL
+    return storage.get_engine() if os.environ.get(DB_URL_ENV) else None
 
-def calculate_tank(subject: Subject):
-    if subject.muscle_mass_kg is not None and subject.muscle_mass_kg > 0:
-        total_muscle = subject.muscle_mass_kg
-        muscle_source_note = "Massa Muscolare Totale (SMM) fornita dall'utente."
-    else:
-        lbm = subject.lean_body_mass
-        total_muscle = lbm * subject.muscle_fraction
-        muscle_source_note = "Massa Muscolare Totale stimata da Peso/BF/Sesso."
-
-    active_muscle = total_muscle * subject.sport.val
-    
-    creatine_multiplier = 1.10 if subject.uses_creatine else 1.0
-    base_muscle_glycogen = active_muscle * subject.glycogen_conc_g_kg
-    max_total_capacity = (base_muscle_glycogen * 1.25 * creatine_multiplier) + 100.0
-    
-    final_filling_factor = subject.filling_factor * subject.menstrual_phase.factor
-    current_muscle_glycogen = base_muscle_glycogen * creatine_multiplier * final_filling_factor
-    
-    max_physiological_limit = active_muscle * 35.0
-    if current_muscle_glycogen > max_physiological_limit:
-        current_muscle_glycogen = max_physiological_limit
-    
-    liver_fill_factor = 1.0
-    liver_correction_note = None
-    
-    if subject.filling_factor <= 0.6: 
-        liver_fill_factor = 0.6
-        
-    if subject.glucose_mg_dl is not None:
-        if subject.glucose_mg_dl < 70:
-            liver_fill_factor = 0.2
-            liver_correction_note = "Criticità Epatica (Glicemia < 70 mg/dL)"
-        elif subject.glucose_mg_dl < 85:
-            liver_fill_factor = min(liver_fill_factor, 0.5)
-            liver_correction_note = "Riduzione Epatica (Glicemia 70-85 mg/dL)"
-    
-    current_liver_glycogen = subject.liver_glycogen_g * liver_fill_factor
-    total_actual_glycogen = current_muscle_glycogen + current_liver_glycogen
-
-    return {
-        "active_muscle_kg": active_muscle,
-        "max_capacity_g": max_total_capacity,         
-        "actual_available_g": total_actual_glycogen,   
-        "muscle_glycogen_g": current_muscle_glycogen,
-        "liver_glycogen_g": current_liver_glycogen,
-        "concentration_used": subject.glycogen_conc_g_kg,
-        "fill_pct": (total_actual_glycogen / max_total_capacity) * 100 if max_total_capacity > 0 else 0,
-        "creatine_bonus": subject.uses_creatine,
-        "liver_note": liver_correction_note,
-        "muscle_source_note": muscle_source_note
-    }
+@st.cache_resource
+def get_result_cache():
+    # Un'istanza per processo; il livello DB è condiviso tra i worker
+    return cache.TieredResultCache(get_archive_engine())
 
-def estimate_max_exogenous_oxidation(height_cm, weight_kg, ftp_watts, mix_type: ChoMixType):
-    base_rate = 0.8 
-    
-    if height_cm > 170:
-        base_rate += (height_cm - 170) * 0.015
-    if ftp_watts > 200:
-        base_rate += (ftp_watts - 200) * 0.0015
-    
-    ox_factor = mix_type.ox_factor
-    max_rate_gh = mix_type.max_rate_gh
-    
-    estimated_rate_gh = base_rate * 60 * ox_factor
-    
-    final_rate_g_min = min(estimated_rate_gh / 60, max_rate_gh / 60)
-    
-    return final_rate_g_min
+@st.cache_resource
+def get_population_table():
+    # Tabelle di popolazione precalcolate (None se assenti o non aggiornate al motore)
+    return population.PopulationTable.load()
 
-def calculate_rer_polynomial(intensity_factor):
-    if_val = intensity_factor
-    rer = (
-        -0.000000149 * (if_val**6) + 
-        141.538462237 * (if_val**5) - 
-        565.128206259 * (if_val**4) + 
-        890.333333976 * (if_val**3) - 
-        691.67948706 * (if_val**2) + 
-        265.460857558 * if_val - 
-        39.525121144
-    )
-    return max(0.70, min(1.15, rer))
-
-def simulate_metabolism(
-    subject_data, 
-    duration_min, 
-    constant_carb_intake_g_h, 
-    cho_per_unit_g, 
-    crossover_pct, 
-    tau_absorption, 
-    subject_obj, 
-    activity_params,
-    oxidation_efficiency_input=0.80, 
-    custom_max_exo_rate=None,
-    mix_type_input=ChoMixType.GLUCOSE_ONLY,
-    intensity_series=None
-):
-    tank_g = subject_data['actual_available_g']
-    results = []
-    
-    initial_muscle_glycogen = subject_data['muscle_glycogen_g']
-    initial_liver_glycogen = subject_data['liver_glycogen_g']
-    
-    current_muscle_glycogen = initial_muscle_glycogen
-    current_liver_glycogen = initial_liver_glycogen
-    
-    mode = activity_params.get('mode', 'cycling')
-    gross_efficiency = activity_params.get('efficiency', 22.0)
-    
-    avg_power = activity_params.get('avg_watts', 200)
-    ftp_watts = activity_params.get('ftp_watts', 250) 
-    avg_hr = activity_params.get('avg_hr', 150)
-    max_hr = activity_params.get('max_hr', 185)
-    
-    intensity_factor_reference = activity_params.get('intensity_factor', 0.8)
-    
-    if mode == 'cycling':
-        kcal_per_min_base = (avg_power * 60) / 4184 / (gross_efficiency / 100.0)
-    elif mode == 'running':
-        speed_kmh = activity_params.get('speed_kmh', 10.0)
-        weight = subject_obj.weight_kg
-        kcal_per_hour = 1.0 * weight * speed_kmh
-        kcal_per_min_base = kcal_per_hour / 60.0
-    else:
-        vo2_operating = subject_obj.vo2max_absolute_l_min * intensity_factor_reference
-        kcal_per_min_base = vo2_operating * 5.0
-        
-    is_lab_data = activity_params.get('use_lab_data', False)
-    lab_cho_rate = activity_params.get('lab_cho_g_h', 0) / 60.0
-    lab_fat_rate = activity_params.get('lab_fat_g_h', 0) / 60.0
-    
-    crossover_pct = activity_params.get('crossover_pct', 70)
-    crossover_if = crossover_pct / 100.0
-    
-    if custom_max_exo_rate is not None:
-        max_exo_rate_g_min = custom_max_exo_rate 
-    else:
-        max_exo_rate_g_min = estimate_max_exogenous_oxidation(
-            subject_obj.height_cm, 
-            subject_obj.weight_kg, 
-            ftp_watts,
-            mix_type_input
-        )
-    
-    oxidation_efficiency = oxidation_efficiency_input
-    
-    total_fat_burned_g = 0.0
-    gut_accumulation_total = 0.0
-    current_exo_oxidation_g_min = 0.0 
-    
-    alpha = 1 - np.exp(-1.0 / tau_absorption)
-    
-    total_muscle_used = 0.0
-    total_liver_used = 0.0
-    total_exo_used = 0.0
-    
-    total_intake_cumulative = 0.0
-    total_exo_oxidation_cumulative = 0.0
-    
-    units_per_hour = constant_carb_intake_g_h / cho_per_unit_g if cho_per_unit_g > 0 else 0
-    intake_interval_min = round(60 / units_per_hour) if units_per_hour > 0 else duration_min + 1
-    
-    is_input_zero = constant_carb_intake_g_h == 0
-    
-    for t in range(int(duration_min) + 1):
-        
-        current_intensity_factor = intensity_factor_reference
-        if intensity_series is not None and t < len(intensity_series):
-            current_intensity_factor = intensity_series[t]
-        
-        current_kcal_demand = 0.0
-        
-        if mode == 'cycling':
-            instant_power = current_intensity_factor * ftp_watts
-            current_eff = gross_efficiency
-            if t > 60: 
-                loss = (t - 60) * 0.02
-                current_eff = max(15.0, gross_efficiency - loss)
-            current_kcal_demand = (instant_power * 60) / 4184 / (current_eff / 100.0)
-            
-        else: 
-            demand_scaling = current_intensity_factor / intensity_factor_reference if intensity_factor_reference > 0 else 1.0
-            
-            drift_factor = 1.0
-            if t > 60:
-                drift_factor += (t - 60) * 0.0005 
-            
-            current_kcal_demand = kcal_per_min_base * drift_factor * demand_scaling
-        
-        instantaneous_input_g_min = 0.0 
-        
-        if not is_input_zero and intake_interval_min <= duration_min and t > 0 and t % intake_interval_min == 0:
-            instantaneous_input_g_min = cho_per_unit_g 
-        
-        target_exo_oxidation_limit_g_min = max_exo_rate_g_min * oxidation_efficiency
-        
-        if t > 0:
-            if is_input_zero:
-                current_exo_oxidation_g_min *= (1 - alpha) 
-            else:
-                current_exo_oxidation_g_min += alpha * (target_exo_oxidation_limit_g_min - current_exo_oxidation_g_min)
-            
-            if current_exo_oxidation_g_min < 0:
-                current_exo_oxidation_g_min = 0.0
-        else:
-            current_exo_oxidation_g_min = 0.0
-            
-        if t > 0:
-            gut_accumulation_total += (instantaneous_input_g_min * oxidation_efficiency) - current_exo_oxidation_g_min
-            if gut_accumulation_total < 0: gut_accumulation_total = 0 
+def cached_call(fn, *args, **kwargs):
+    """
+    Esegue fn (simulate_metabolism / calculate_hourly_tapering) passando dalla cache a due livelli.
+    In caso di miss il calcolo gira nel pool di processi condiviso (coda equa per sessione).
+    """
+    key = cache.make_key(fn.__name__, *args, **kwargs)
+    return get_result_cache().get_or_compute(key, lambda: pool_call(fn, *args, **kwargs))
 
-            total_intake_cumulative += instantaneous_input_g_min 
-            total_exo_oxidation_cumulative += current_exo_oxidation_g_min
-        
-        if is_lab_data:
-            curve_df = activity_params.get('metabolic_curve_df')
-            x_col = activity_params.get('metabolic_x_col', 'Watt')
-            
-            # Determina il valore X corrente (Watt, HR o Speed)
-            current_x_val = 0
-            if x_col == 'Watt':
-                # Power corrente (se c'è una serie, usala, altrimenti usa la media)
-                current_x_val = current_intensity_factor * ftp_watts if mode == 'cycling' else avg_power
-            elif x_col == 'HR':
-                # Stima HR lineare se non abbiamo dati precisi, o usa avg
-                current_x_val = avg_hr * current_intensity_factor / intensity_factor_reference if intensity_factor_reference > 0 else avg_hr
-            elif x_col == 'Speed':
-                current_x_val = activity_params.get('speed_kmh', 10) # Fallback semplice
-            
-            # Interpola dalla curva caricata
-            cho_rate_now, fat_rate_now = interpolate_from_curve(current_x_val, curve_df, x_col)
-            
-            # Applica drift fatica se la durata è lunga (> 60 min)
-            fatigue_drift = 1.0 + ((t - 60) * 0.001) if t > 60 else 1.0
-            
-            total_cho_demand = (cho_rate_now / 60.0) * fatigue_drift # g/min
-            current_fat_g_min = (fat_rate_now / 60.0) # g/min
-            
-            kcal_cho_demand = total_cho_demand * 4.1
-            
-            # RER fittizio per output
-            tot_sub = total_cho_demand + current_fat_g_min
-            cho_ratio = total_cho_demand / tot_sub if tot_sub > 0 else 1.0
-            rer = 0.7 + (0.3 * cho_ratio) 
-        
-        else:
-            effective_if_for_rer = current_intensity_factor + ((75.0 - crossover_pct) / 100.0)
-            if effective_if_for_rer < 0.3: effective_if_for_rer = 0.3
-            
-            rer = calculate_rer_polynomial(effective_if_for_rer)
-            base_cho_ratio = (rer - 0.70) * 3.45
-            base_cho_ratio = max(0.0, min(1.0, base_cho_ratio))
-            
-            current_cho_ratio = base_cho_ratio
-            if current_intensity_factor < 0.85 and t > 60:
-                hours_past = (t - 60) / 60.0
-                metabolic_shift = 0.05 * (hours_past ** 1.2) 
-                current_cho_ratio = max(0.05, base_cho_ratio - metabolic_shift)
-            
-            cho_ratio = current_cho_ratio
-            fat_ratio = 1.0 - cho_ratio
-            
-            kcal_cho_demand = current_kcal_demand * cho_ratio
-        
-        total_cho_g_min = kcal_cho_demand / 4.1
-        kcal_from_exo = current_exo_oxidation_g_min * 3.75 
-        
-        muscle_fill_state = current_muscle_glycogen / initial_muscle_glycogen if initial_muscle_glycogen > 0 else 0
-        muscle_contribution_factor = math.pow(muscle_fill_state, 0.6) 
-        
-        muscle_usage_g_min = total_cho_g_min * muscle_contribution_factor
-        if current_muscle_glycogen <= 0: muscle_usage_g_min = 0
-        
-        blood_glucose_demand_g_min = total_cho_g_min - muscle_usage_g_min
-        
-        from_exogenous = min(blood_glucose_demand_g_min, current_exo_oxidation_g_min)
-        
-        remaining_blood_demand = blood_glucose_demand_g_min - from_exogenous
-        max_liver_output = 1.2 
-        from_liver = min(remaining_blood_demand, max_liver_output)
-        if current_liver_glycogen <= 0: from_liver = 0
-        
-        if t > 0:
-            current_muscle_glycogen -= muscle_usage_g_min
-            current_liver_glycogen -= from_liver
-            
-            if current_muscle_glycogen < 0: current_muscle_glycogen = 0
-            if current_liver_glycogen < 0: current_liver_glycogen = 0
-            
-            if not is_lab_data:
-                fat_ratio_used = 1.0 - cho_ratio
-                total_fat_burned_g += (current_kcal_demand * fat_ratio_used) / 9.0
-            else:
-                total_fat_burned_g += lab_fat_rate
-            
-            total_muscle_used += muscle_usage_g_min
-            total_liver_used += from_liver
-            total_exo_used += from_exogenous
-            
-        status_label = "Ottimale"
-        if current_liver_glycogen < 20: status_label = "CRITICO (Ipoglicemia)"
-        elif current_muscle_glycogen < 100: status_label = "Warning (Gambe Vuote)"
-            
-        exo_oxidation_g_h = from_exogenous * 60
-        
-        g_muscle = muscle_usage_g_min
-        g_liver = from_liver
-        g_exo = from_exogenous
-        fat_ratio_used_local = 1.0 - cho_ratio if not is_lab_data else (lab_fat_rate / 60 * 9.0) / current_kcal_demand if current_kcal_demand > 0 else 0.0
-        g_fat = (current_kcal_demand * fat_ratio_used_local / 9.0)
-        
-        total_g_min = g_muscle + g_liver + g_exo + g_fat
-        if total_g_min == 0: total_g_min = 1.0 
-        
-        results.append({
-            "Time (min)": t,
-            "Glicogeno Muscolare (g)": muscle_usage_g_min * 60, 
-            "Glicogeno Epatico (g)": from_liver * 60,
-            "Carboidrati Esogeni (g)": exo_oxidation_g_h, 
-            "Ossidazione Lipidica (g)": lab_fat_rate * 60 if is_lab_data else ((current_kcal_demand * (1.0 - cho_ratio)) / 9.0) * 60,
-            
-            "Pct_Muscle": f"{(g_muscle / total_g_min * 100):.1f}%",
-            "Pct_Liver": f"{(g_liver / total_g_min * 100):.1f}%",
-            "Pct_Exo": f"{(g_exo / total_g_min * 100):.1f}%",
-            "Pct_Fat": f"{(g_fat / total_g_min * 100):.1f}%",
-
-            "Residuo Muscolare": current_muscle_glycogen,
-            "Residuo Epatico": current_liver_glycogen,
-            "Residuo Totale": current_muscle_glycogen + current_liver_glycogen, 
-            "Target Intake (g/h)": constant_carb_intake_g_h, 
-            "Gut Load": gut_accumulation_total,
-            "Stato": status_label,
-            "CHO %": cho_ratio * 100,
-            "Intake Cumulativo (g)": total_intake_cumulative,
-            "Ossidazione Cumulativa (g)": total_exo_oxidation_cumulative,
-            "Intensity Factor (IF)": current_intensity_factor 
-        })
-        
-    total_kcal_final = current_kcal_demand * 60 
-    
-    final_total_glycogen = current_muscle_glycogen + current_liver_glycogen
-
-    stats = {
-        "final_muscle": current_muscle_glycogen,
-        "final_liver": current_liver_glycogen,
-        "final_glycogen": final_total_glycogen, 
-        "total_muscle_used": total_muscle_used,
-        "total_liver_used": total_liver_used,
-        "total_exo_used": total_exo_used,
-        "fat_total_g": total_fat_burned_g,
-        "kcal_total_h": total_kcal_final,
-        "gut_accumulation": (gut_accumulation_total / duration_min) * 60 if duration_min > 0 else 0,
-        "max_exo_capacity": max_exo_rate_g_min * 60,
-        "intensity_factor": intensity_factor_reference,
-        "avg_rer": rer,
-        "gross_efficiency": gross_efficiency,
-        "intake_g_h": constant_carb_intake_g_h,
-        "cho_pct": cho_ratio * 100
-    }
+# --- ARTEFATTI DI SESSIONE (BUDGET DI MEMORIA) ---
+# Frame e file interpretati non vivono in session_state: l'archivio li conta, scarta
+# i derivati oltre budget (per sessione e per processo) e li ricalcola alla lettura.
 
-    return pd.DataFrame(results), stats
+@st.cache_resource
+def get_artifact_store():
+    return artifacts.ArtifactStore.from_env()
 
-# --- LOGICA DI PARSING ZWO ---
+def _session_id():
+    return st.session_state['perf_log'].session_id
 
-def parse_zwo_file(uploaded_file, ftp_watts, thr_hr, sport_type):
-    
-    try:
-        xml_content = uploaded_file.getvalue().decode('utf-8')
-        root = ET.fromstring(xml_content)
-    except ET.ParseError:
-        st.error("Errore di parsing: il file ZWO non è un XML valido.")
-        return [], 0, 0, 0
-    except Exception as e:
-        st.error(f"Errore nella lettura del file: {e}")
-        return [], 0, 0, 0
-
-    zwo_sport_tag = root.findtext('sportType')
-    
-    if zwo_sport_tag:
-        if zwo_sport_tag.lower() == 'bike' and sport_type != SportType.CYCLING:
-            st.warning(f"⚠️ ATTENZIONE: Hai selezionato {sport_type.label} nel Tab 1, ma il file ZWO è per BICI. I calcoli useranno la soglia di {sport_type.label}, ma potrebbero essere imprecisi.")
-        elif zwo_sport_tag.lower() == 'run' and sport_type != SportType.RUNNING:
-            st.warning(f"⚠️ ATTENZIONE: Hai selezionato {sport_type.label} nel Tab 1, ma il file ZWO è per CORSA. I calcoli useranno la soglia di {sport_type.label}, ma potrebbero essere imprecisi.")
-
-    
-    intensity_series = [] 
-    total_duration_sec = 0
-    total_weighted_if = 0
-    
-    for steady_state in root.findall('.//SteadyState'):
-        try:
-            duration_sec = int(steady_state.get('Duration'))
-            power_ratio = float(steady_state.get('Power'))
-            
-            duration_min_segment = math.ceil(duration_sec / 60)
-            
-            intensity_factor = power_ratio 
-            
-            for _ in range(duration_min_segment):
-                intensity_series.append(intensity_factor)
-            
-            total_duration_sec += duration_sec
-            total_weighted_if += intensity_factor * (duration_sec / 60) 
+def artifact_get(name):
+    return get_artifact_store().get(_session_id(), name)
 
-        except Exception as e:
-            st.error(f"Errore durante l'analisi di un segmento SteadyState: {e}")
-            continue
+def artifact_put(name, value, recipe=None, key=None):
+    return get_artifact_store().put(_session_id(), name, value, key=key, recipe=recipe)
 
-    total_duration_min = math.ceil(total_duration_sec / 60)
-    
-    if total_duration_min > 0:
-        avg_if = total_weighted_if / total_duration_min
-        
-        if sport_type == SportType.CYCLING:
-            avg_power = avg_if * ftp_watts
-            avg_hr = 0
-        elif sport_type == SportType.RUNNING:
-            avg_hr = avg_if * thr_hr
-            avg_power = 0
-        else: 
-            avg_hr = avg_if * st.session_state.get('max_hr_input', 185) * 0.85 
-            avg_power = 0
-            
-        return intensity_series, total_duration_min, avg_power, avg_hr
-    
-    return [], 0, 0, 0
+def artifact_compute(name, key, fn, *args, **kwargs):
+    """
+    Derivato della sessione, ricalcolato solo se cambia la chiave degli input (o dopo uno scarto).
+    """
+    return get_artifact_store().get_or_compute(_session_id(), name, key, fn, *args, **kwargs)
 
-# --- PARSER METABOLICO (NUOVO) ---
-def parse_metabolic_report(uploaded_file):
+def track_upload(name, uploaded_file):
     """
-    Legge file CSV/Excel da metabolimetro (Versione Lite Fix).
+    Il file caricato è un input (mai scartato): contato nel budget senza copiarlo.
     """
-    import re
-    try:
-        df_raw = None
-        # Reset assoluto del puntatore (fondamentale in Streamlit)
-        uploaded_file.seek(0)
-        
-        filename = uploaded_file.name.lower()
-
-        # --- 1. LETTURA FILE ---
-        if filename.endswith(('.xls', '.xlsx')):
-            try:
-                # Forza engine openpyxl (richiede pip install openpyxl)
-                df_raw = pd.read_excel(uploaded_file, header=None, dtype=str, engine='openpyxl')
-            except ImportError:
-                # Fallback se manca openpyxl (prova default)
-                uploaded_file.seek(0)
-                df_raw = pd.read_excel(uploaded_file, header=None, dtype=str)
-            except Exception as e:
-                return None, None, f"Errore lettura Excel: {e}"
-        
-        elif filename.endswith(('.csv', '.txt')):
-            # Prova vari encoding e separatori
-            encodings = ['latin-1', 'utf-8', 'cp1252']
-            separators = [None, ';', ','] # None lascia fare a Python sniffer
-            
-            for enc in encodings:
-                for sep in separators:
-                    if df_raw is None:
-                        try:
-                            uploaded_file.seek(0)
-                            df_temp = pd.read_csv(uploaded_file, header=None, sep=sep, engine='python', encoding=enc, dtype=str)
-                            # Se ha più di 1 colonna, probabilmente è buono
-                            if df_temp.shape[1] > 1:
-                                df_raw = df_temp
-                                break
-                        except:
-                            continue
-                if df_raw is not None: break
-
-        if df_raw is None or df_raw.empty: 
-            return None, None, "File vuoto o formato sconosciuto."
-
-        # --- DEBUG VISIVO (Opzionale: togliere in produzione) ---
-        # Se vuoi vedere cosa legge lo script, scommenta la riga sotto:
-        # st.write("Anteprima dati grezzi:", df_raw.head(10))
-
-        # --- 2. RICERCA HEADER ---
-        header_idx = None
-        # Lista estesa e maiuscola
-        targets = ["CHO", "FAT", "CARBO", "LIPID", "VCO2", "VO2", "QCHO", "QFAT"]
-        intensities = ["WATT", "LOAD", "POWER", "POW", "WR", "HR", "BPM", "HEART", "FC", "SPEED", "VEL", "KM/H"]
-
-        for i, row in df_raw.head(300).iterrows():
-            # Crea una stringa pulita della riga
-            row_text = " ".join([str(x).upper() for x in row.values if pd.notna(x)])
-            
-            # Cerca intersezioni
-            has_metabolic = any(t in row_text for t in targets)
-            has_intensity = any(i in row_text for i in intensities)
-            
-            if has_metabolic and has_intensity:
-                header_idx = i
-                break
-        
-        if header_idx is None: 
-            # Mostra cosa ha letto per capire l'errore (utile per debug)
-            preview = df_raw.head(5).to_string()
-            return None, None, f"Intestazione non trovata. Prime righe lette:\n{preview}"
-
-        # --- 3. SLICING & CLEANING ---
-        df_raw.columns = df_raw.iloc[header_idx] 
-        df = df_raw.iloc[header_idx + 1:].reset_index(drop=True)
-        df.columns = [str(c).strip().upper() for c in df.columns]
-        
-        cols = df.columns.tolist()
-
-        def find_col(keys):
-            for col in cols:
-                for k in keys:
-                    if k == col or (k in col): return col
-            return None
-
-        c_cho = find_col(['CHO', 'CARBOHYDRATES', 'QCHO'])
-        c_fat = find_col(['FAT', 'LIPIDS', 'QFAT'])
-        
-        c_watt = find_col(['WATT', 'POWER', 'POW', 'LOAD', 'WR'])
-        c_hr = find_col(['HR', 'HEART', 'BPM', 'FC'])
-        c_speed = find_col(['SPEED', 'VEL', 'KM/H'])
-
-        if not (c_cho and c_fat): 
-            return None, None, f"Colonne CHO/FAT non trovate. Colonne rilevate: {cols}"
-
-        # --- 4. CONVERSIONE ---
-        def to_float(series):
-            s = series.astype(str)
-            s = s.str.replace(',', '.', regex=False)
-            # Regex robusta che cattura float anche dentro testo
-            s = s.str.extract(r'([-+]?\d*\.?\d+)')[0]
-            return pd.to_numeric(s, errors='coerce')
-
-        clean_df = pd.DataFrame()
-        clean_df['CHO'] = to_float(df[c_cho])
-        clean_df['FAT'] = to_float(df[c_fat])
-        
-        available_metrics = []
-        if c_watt: 
-            clean_df['Watt'] = to_float(df[c_watt])
-            if clean_df['Watt'].max() > 0: available_metrics.append('Watt')
-        if c_hr: 
-            clean_df['HR'] = to_float(df[c_hr])
-            if clean_df['HR'].max() > 0: available_metrics.append('HR')
-        if c_speed: 
-            clean_df['Speed'] = to_float(df[c_speed])
-            if clean_df['Speed'].max() > 0: available_metrics.append('Speed')
-
-        clean_df.dropna(subset=['CHO', 'FAT'], inplace=True)
-        
-        if not clean_df.empty and clean_df['CHO'].max() < 10.0:
-            clean_df['CHO'] *= 60
-            clean_df['FAT'] *= 60
-            
-        if not available_metrics: return None, None, "Nessun dato intensità valido."
-        
-        clean_df = clean_df.sort_values(by=available_metrics[0]).reset_index(drop=True)
+    if uploaded_file is None:
+        get_artifact_store().pop(_session_id(), name)
+        get_artifact_store().pop(_session_id(), f"{name}_parsed")
+    elif get_artifact_store().key(_session_id(), name) != uploaded_file.file_id:
+        artifact_put(name, uploaded_file, key=uploaded_file.file_id)
+
+def read_upload(parse_fn, uploaded_file):
+    # Il parsing gira nel pool: al processo arrivano nome e contenuto, non l'UploadedFile
+    return pool_call(parsers.parse_bytes, parse_fn, uploaded_file.name, uploaded_file.getvalue())
+
+def taper_frame(subject, days, start_state):
+    return cached_call(calculate_hourly_tapering, subject, days, start_state_factor=start_state)[0]
 
-        return clean_df, available_metrics, None
+# --- ESPORTAZIONE ---
 
-    except Exception as e: return None, None, str(e)
+EXPORT_LABELS = {"csv": "CSV", "parquet": "Parquet", "xlsx": "Excel"}
 
-def interpolate_from_curve(current_val, curve_df, x_col):
+@st.fragment
+def render_export(make_chunks, file_stem, key):
     """
-    Interpolazione lineare per trovare CHO/FAT a una data intensità.
+    Formato + download. Il file è generato a blocchi solo al click (dati differiti),
+    senza rieseguire la pagina.
     """
-    if curve_df is None or curve_df.empty: return 0, 0
-    
-    # Ordina per asse X
-    df = curve_df.sort_values(x_col)
-    
-    cho = np.interp(current_val, df[x_col], df['CHO'])
-    fat = np.interp(current_val, df[x_col], df['FAT'])
-    
-    return cho, fat # g/h
+    c_fmt, c_btn = st.columns([1, 2])
+    fmt = c_fmt.selectbox("Formato", export.FORMATS, format_func=EXPORT_LABELS.get, key=f"{key}_fmt",
+                          label_visibility="collapsed")
+    c_btn.download_button(f"⬇️ Esporta {EXPORT_LABELS[fmt]}", lambda: export.export_bytes(make_chunks(), fmt),
+                          file_name=f"{file_stem}.{fmt}", mime=export.MIME_TYPES[fmt], key=f"{key}_dl",
+                          on_click="ignore")
 
-# --- FUNZIONI PER LE ZONE DI ALLENAMENTO ---
+# --- JOB IN BACKGROUND (MONTE CARLO, SENSIBILITÀ DIARIO) ---
 
-def calculate_zones_cycling(ftp):
-    return [
-        {"Zona": "Z1 - Recupero Attivo", "Range %": "< 55%", "Valore": f"< {int(ftp*0.55)} W"},
-        {"Zona": "Z2 - Endurance (Fondo Lento)", "Range %": "56 - 75%", "Valore": f"{int(ftp*0.56)} - {int(ftp*0.75)} W"},
-        {"Zona": "Z3 - Tempo (Medio)", "Range %": "76 - 90%", "Valore": f"{int(ftp*0.76)} - {int(ftp*0.90)} W"},
-        {"Zona": "Z4 - Soglia (FTP)", "Range %": "91 - 105%", "Valore": f"{int(ftp*0.91)} - {int(ftp*1.05)} W"},
-        {"Zona": "Z5 - VO2max", "Range %": "106 - 120%", "Valore": f"{int(ftp*1.06)} - {int(ftp*1.20)} W"},
-        {"Zona": "Z6 - Capacità Anaerobica", "Range %": "121 - 150%", "Valore": f"{int(ftp*1.21)} - {int(ftp*1.50)} W"},
-        {"Zona": "Z7 - Potenza Neuromuscolare", "Range %": "> 150%", "Valore": f"> {int(ftp*1.50)} W"}
-    ]
+JOB_POLL_S = 1.0
 
-def calculate_zones_running_hr(thr):
-    return [
-        {"Zona": "Z1 - Recupero", "Range %": "< 85% LTHR", "Valore": f"< {int(thr*0.85)} bpm"},
-        {"Zona": "Z2 - Aerobico (Fondo Lento)", "Range %": "85 - 89% LTHR", "Valore": f"{int(thr*0.85)} - {int(thr*0.89)} bpm"},
-        {"Zona": "Z3 - Tempo (Medio)", "Range %": "90 - 94% LTHR", "Valore": f"{int(thr*0.90)} - {int(thr*0.94)} bpm"},
-        {"Zona": "Z4 - Sub-Soglia", "Range %": "95 - 99% LTHR", "Valore": f"{int(thr*0.95)} - {int(thr*0.99)} bpm"},
-        {"Zona": "Z5a - Super-Soglia (FTP)", "Range %": "100 - 102% LTHR", "Valore": f"{int(thr*1.00)} - {int(thr*1.02)} bpm"},
-        {"Zona": "Z5b - Capacità Aerobica", "Range %": "103 - 106% LTHR", "Valore": f"{int(thr*1.03)} - {int(thr*1.06)} bpm"},
-        {"Zona": "Z5c - Potenza Anaerobica", "Range %": "> 106% LTHR", "Valore": f"> {int(thr*1.06)} bpm"}
-    ]
+@st.cache_resource
+def get_job_runner():
+    # Event loop e pool di processi condivisi da tutte le sessioni del processo
+    return jobs.JobRunner(workers=max(1, (os.cpu_count() or 2) - 1))
 
-# --- FUNZIONE DI CALCOLO SETTIMANALE ---
-def calculate_weekly_balance(initial_muscle, initial_liver, max_muscle, max_liver, weekly_schedule, subject_weight, vo2max):
-    
-    LIVER_DRAIN_RATE = 4.5 
-    DAILY_NEAT_CHO = 1.2 * subject_weight
-    
-    SYNTHESIS_EFFICIENCY = 0.95
-    
-    daily_status = []
-    
-    current_muscle = initial_muscle
-    current_liver = initial_liver
-    
-    days = ["Lunedì", "Martedì", "Mercoledì", "Giovedì", "Venerdì", "Sabato", "Domenica"]
-    
-    for i, day in enumerate(days):
-        day_data = weekly_schedule[i]
-        
-        activity_type = day_data['activity']
-        duration = day_data['duration']
-        intensity = day_data['intensity'] 
-        cho_in = day_data['cho_in']
-        
-        total_basal_drain = (24 * LIVER_DRAIN_RATE) + DAILY_NEAT_CHO
-        
-        exercise_drain_muscle = 0
-        exercise_drain_liver = 0
-        
-        if activity_type != "Riposo" and duration > 0:
-            if intensity == "Bassa (Z1-Z2)":
-                rel_intensity = 0.5
-                cho_pct = 0.25 
-            elif intensity == "Media (Z3)":
-                rel_intensity = 0.7
-                cho_pct = 0.65 
-            else: 
-                rel_intensity = 0.85
-                cho_pct = 0.95 
-                
-            kcal_min = (vo2max * rel_intensity * subject_weight / 1000) * 5.0
-            total_kcal = kcal_min * duration
-            total_cho_burned = (total_kcal * cho_pct) / 4.0 
-            
-            liver_fraction = 0.15 
-            
-            exercise_drain_liver = total_cho_burned * liver_fraction
-            exercise_drain_muscle = total_cho_burned * (1 - liver_fraction)
-            
-        total_daily_consumption = total_basal_drain + exercise_drain_liver + exercise_drain_muscle
-        net_balance = cho_in * SYNTHESIS_EFFICIENCY - total_daily_consumption
-        
-        effective_input = cho_in * SYNTHESIS_EFFICIENCY
-        
-        drain_liver_total = total_basal_drain + exercise_drain_liver
-        drain_muscle_total = exercise_drain_muscle
-        
-        if effective_input >= drain_liver_total:
-            surplus_after_liver_needs = effective_input - drain_liver_total
-            current_liver = current_liver 
-            
-            liver_space = max_liver - current_liver
-            if surplus_after_liver_needs >= liver_space:
-                current_liver = max_liver
-                surplus_for_muscle = surplus_after_liver_needs - liver_space
-            else:
-                current_liver += surplus_after_liver_needs
-                surplus_for_muscle = 0
-                
-        else:
-            deficit = drain_liver_total - effective_input
-            current_liver -= deficit
-            surplus_for_muscle = 0 
-            
-        current_muscle -= drain_muscle_total 
-        current_muscle += surplus_for_muscle 
-        
-        if current_muscle > max_muscle: current_muscle = max_muscle
-        if current_liver > max_liver: current_liver = max_liver
-        
-        if current_muscle < 0: current_muscle = 0
-        if current_liver < 0: current_liver = 0
-            
-        daily_status.append({
-            "Giorno": day,
-            "Glicogeno Muscolare": round(current_muscle),
-            "Glicogeno Epatico": round(current_liver),
-            "Totale": round(current_muscle + current_liver),
-            "Allenamento": f"{activity_type} ({duration} min)" if activity_type != "Riposo" else "Riposo",
-            "CHO In": cho_in,
-            "Consumo Stimato": round(total_daily_consumption),
-            "Bilancio Netto": round(net_balance)
-        })
-        
-    return pd.DataFrame(daily_status)
+def pool_call(fn, *args, **kwargs):
+    """
+    Calcolo interattivo nel pool condiviso: attende il risultato solo questa sessione.
+    """
+    return get_job_runner().call(_session_id(), fn, *args, **kwargs)
+
+def render_job(job_key, render_results):
+    """
+    Progresso, annullamento e risultati parziali del job salvato in session_state[job_key].
+    Finché il job è attivo la vista è un fragment che si aggiorna ogni JOB_POLL_S secondi.
+    """
+    job_id = st.session_state.get(job_key)
+    job = get_job_runner().get(job_id) if job_id else None
+    if job is None:
+        return
+    was_active = not job.is_finished
+    st.fragment(_job_view, run_every=JOB_POLL_S if was_active else None)(job_key, render_results, was_active)
+
+def _job_view(job_key, render_results, was_active):
+    job = get_job_runner().get(st.session_state.get(job_key))
+    if job is None:
+        return
+    if not job.is_finished:
+        p1, p2 = st.columns([4, 1])
+        p1.progress(job.progress, text=f"{job.name}: {len(job.partials)}/{job.n_tasks} blocchi completati")
+        if p2.button("⏹️ Annulla", key=f"{job_key}_cancel"):
+            get_job_runner().cancel(job.id)
+    elif was_active:
+        # Job appena terminato: ridisegno senza polling
+        st.rerun()
+    elif job.status == jobs.CANCELLED:
+        st.warning(f"{job.name}: annullato ({len(job.partials)}/{job.n_tasks} blocchi completati).")
+    elif job.status == jobs.FAILED:
+        st.error(f"{job.name}: errore ({job.error}).")
+
+    results = job.results()
+    if results:
+        render_results(results, job)
 
 
 # --- 3. INTERFACCIA UTENTE ---
@@ -1065,6 +247,14 @@ st.set_page_config(page_title="Glycogen Simulator Pro", layout="wide")
 st.title("Glycogen Simulator Pro")
 st.markdown("Strumento di stima delle riserve energetiche e simulazione del metabolismo sotto sforzo.")
 
+# --- ARCHIVIO STORICO (OPZIONALE) ---
+# Attivo solo se è configurato GLICOGENO_DB_URL
+archive_engine = get_archive_engine()
+if archive_engine is not None:
+    st.sidebar.subheader("🗄️ Archivio Simulazioni")
+    st.sidebar.text_input("Atleta", value="Atleta", key='athlete_name',
+                          help="Nome con cui salvare e ricercare le simulazioni nello storico.")
+
 # --- NOTE TECNICHE REINTRODOTTE ---
 with st.expander("📘 Note Tecniche & Fonti Scientifiche"):
     st.info("""
@@ -1272,7 +462,8 @@ with tab1:
             muscle_mass_kg=muscle_mass_input 
         )
         
-        tank_data = calculate_tank(subject)
+        with perf_span("tank"):
+            tank_data = calculate_tank(subject)
         # Salviamo la struttura base e i dati del tank per il prossimo tab
         st.session_state['base_subject_struct'] = subject
         st.session_state['base_tank_data'] = tank_data 
@@ -1298,10 +489,33 @@ with tab1:
 # =============================================================================
 # TAB 2: DIARIO IBRIDO (LAYOUT LOGICO V4 - PORTING)
 # =============================================================================
-with tab2:
+# Moltiplicatori dei CHO giornalieri per l'analisi di sensibilità del diario
+CHO_SCALING_FACTORS = [round(0.5 + 0.05 * i, 2) for i in range(21)]
+
+def render_cho_scaling_results(results, job):
+    """
+    Riempimento finale al variare dei CHO del diario (aggiornato a ogni punto calcolato).
+    """
+    df_scaling = pd.DataFrame(results)
+    df_scaling['CHO (% del diario)'] = df_scaling['factor'] * 100
+    line = alt.Chart(df_scaling).mark_line(point=True).encode(
+        x=alt.X('CHO (% del diario)', scale=alt.Scale(domain=[50, 150])),
+        y=alt.Y('fill_pct', title='Riempimento Finale (%)', scale=alt.Scale(zero=False)),
+        tooltip=['CHO (% del diario)', alt.Tooltip('fill_pct', format='.1f'),
+                 alt.Tooltip('muscle_glycogen_g', format='.0f'), alt.Tooltip('liver_glycogen_g', format='.0f')]
+    ).properties(height=250)
+    st.altair_chart(line, use_container_width=True)
+
+@st.fragment
+@profiled("tab2")
+def render_diary():
+    """
+    Diario di avvicinamento. È un fragment: i widget dei giorni rieseguono solo
+    questa sezione; il Tab 3 viene ricalcolato solo quando cambia il serbatoio finale.
+    """
     if 'base_tank_data' not in st.session_state:
         st.warning("⚠️ Completa prima il Tab 1.")
-        st.stop()
+        return
         
     subj_base = st.session_state['base_subject_struct']
     # Recuperiamo o impostiamo default per FTP/THR se non ancora settati
@@ -1448,30 +662,61 @@ with tab2:
 
     st.markdown("---")
 
+    save_taper = False
+    if archive_engine is not None:
+        save_taper = st.checkbox("Salva la traiettoria nello storico", key='save_taper')
+
     # --- SIMULAZIONE ---
+    # Impronta degli input: permette di capire se il risultato mostrato è ancora valido
+    taper_inputs_key = cache.make_key("taper_inputs", subj_base, input_result_data, sel_state)
+    
     if st.button("🚀 Calcola Traiettoria Oraria", type="primary"):
         # Chiamata alla funzione logica integrata
-        df_hourly, final_tank = calculate_hourly_tapering(subj_base, input_result_data, start_state_factor=sel_state)
-        
-        # Salvataggio nel Session State globale (collegamento al Tab 3)
-        st.session_state['tank_data'] = final_tank
-        st.session_state['tank_g'] = final_tank['actual_available_g'] # Flag per sbloccare Tab 3
-        #st.session_state['subject_struct'] = subj_base
+        with perf_span("taper", days=len(input_result_data)):
+            df_hourly, final_tank = cached_call(calculate_hourly_tapering, subj_base, input_result_data, start_state_factor=sel_state.factor)
+
+        if save_taper:
+            taper_params = {"subject": subj_base, "days": input_result_data, "start_state": sel_state}
+            storage.save_runs(archive_engine, [
+                storage.make_run_record(st.session_state['athlete_name'], race_date, "Tapering", "taper",
+                                        taper_params, df_hourly, summary=final_tank)
+            ])
+        
+        # In session_state solo il riepilogo e gli input; la traiettoria è un derivato ricalcolabile
+        taper_args = (subj_base, input_result_data, sel_state.factor)
+        artifact_put("taper_hourly", df_hourly, recipe=(taper_frame, taper_args, {}), key=taper_inputs_key)
+        st.session_state['taper_result'] = (final_tank, taper_inputs_key, taper_args)
+        
+        # Salvataggio nel Session State globale (collegamento al Tab 3).
+        # Il resto dell'app viene rieseguito solo se il serbatoio di partenza è cambiato.
+        if st.session_state.get('tank_data') != final_tank:
+            st.session_state['tank_data'] = final_tank
+            st.session_state['tank_g'] = final_tank['actual_available_g'] # Flag per sbloccare Tab 3
+            st.rerun()
+        
+    if 'taper_result' in st.session_state:
+        final_tank, result_inputs_key, taper_args = st.session_state['taper_result']
+        # Dopo l'inattività l'archivio dimentica anche la ricetta: si ricalcola dagli input salvati
+        df_hourly = artifact_compute("taper_hourly", result_inputs_key, taper_frame, *taper_args)
+        
+        if result_inputs_key != taper_inputs_key:
+            st.info("✏️ Il diario è stato modificato: premi **Calcola** per aggiornare la traiettoria e la simulazione gara.")
         
         st.markdown("### 📈 Evoluzione Oraria Riserve (Timeline)")
         
         # Grafico Area Stacked (Fegato + Muscolo)
-        df_melt = df_hourly.melt('Timestamp', value_vars=['Muscolare', 'Epatico'], var_name='Riserva', value_name='Grammi')
-        c_range = ['#43A047', '#FB8C00'] 
-        
-        chart = alt.Chart(df_melt).mark_area(opacity=0.8).encode(
-            x=alt.X('Timestamp', title='Data/Ora', axis=alt.Axis(format='%d/%m %H:%M')),
-            y=alt.Y('Grammi', stack=True),
-            color=alt.Color('Riserva', scale=alt.Scale(domain=['Muscolare', 'Epatico'], range=c_range)),
-            tooltip=['Timestamp', 'Riserva', 'Grammi']
-        ).properties(height=350).interactive()
-        
-        st.altair_chart(chart, use_container_width=True)
+        with perf_span("chart", chart="taper"):
+            df_melt = df_hourly.melt('Timestamp', value_vars=['Muscolare', 'Epatico'], var_name='Riserva', value_name='Grammi')
+            c_range = ['#43A047', '#FB8C00'] 
+            
+            chart = alt.Chart(df_melt).mark_area(opacity=0.8).encode(
+                x=alt.X('Timestamp', title='Data/Ora', axis=alt.Axis(format='%d/%m %H:%M')),
+                y=alt.Y('Grammi', stack=True),
+                color=alt.Color('Riserva', scale=alt.Scale(domain=['Muscolare', 'Epatico'], range=c_range)),
+                tooltip=['Timestamp', 'Riserva', 'Grammi']
+            ).properties(height=350).interactive()
+            
+            st.altair_chart(chart, use_container_width=True)
         
         k1, k2, k3 = st.columns(3)
         pct = final_tank['fill_pct']
@@ -1481,646 +726,1175 @@ with tab2:
                   delta="Attenzione" if final_tank['liver_glycogen_g'] < 80 else "Ottimale", delta_color="normal")
         
         st.success("✅ Dati salvati. Puoi procedere al Tab 3 per la simulazione gara.")
+        render_export(lambda: export.frame_chunks(df_hourly), "diario_orario", key="export_taper")
+
+    with st.expander("📊 Sensibilità ai Carboidrati (in background)"):
+        st.caption("Ricalcola il diario con i CHO giornalieri dal 50% al 150% di quelli inseriti.")
+        if st.button("▶️ Avvia Analisi di Sensibilità"):
+            runner = get_job_runner()
+            if st.session_state.get('cho_scaling_job'):
+                runner.cancel(st.session_state['cho_scaling_job'])
+            job = runner.submit("Sensibilità CHO", analyses.cho_scaling_tasks(
+                subj_base, input_result_data, sel_state.factor, CHO_SCALING_FACTORS), session=_session_id())
+            st.session_state['cho_scaling_job'] = job.id
+        render_job('cho_scaling_job', render_cho_scaling_results)
 
+with tab2:
+    render_diary()
 
-# --- TAB 3: SIMULAZIONE & STRATEGIA ---
-with tab3:
-    if 'tank_g' not in st.session_state:
-        st.warning("Completare prima i Tab '1. Profilo Base & Capacità' e '2. Stato Pre-Evento (Riempimento)'.")
-        st.stop()
-    else:
-        # Recupero i dati completi
-        tank_data = st.session_state['tank_data']
-        start_tank = tank_data['actual_available_g']
-        subj = st.session_state.get('subject_struct', st.session_state.get('base_subject_struct', None))
-        
-        # Recupero i dati di soglia dal Tab 1
-        ftp_watts = st.session_state.get('ftp_watts_input', 250)
-        thr_hr = st.session_state.get('thr_hr_input', 170)
-        max_hr = st.session_state.get('max_hr_input', 185)
-        
-        
-        sport_mode = 'cycling'
-        if subj.sport == SportType.RUNNING:
-            sport_mode = 'running'
-        elif subj.sport in [SportType.SWIMMING, SportType.XC_SKIING, SportType.TRIATHLON]:
-            sport_mode = 'other' 
-            
-        col_param, col_meta = st.columns([1, 1])
-        
-        act_params = {'mode': sport_mode}
-        duration = 120 # Default
-        cho_per_unit = 25 # Default
-        carb_intake = 60  # Default
+
+# --- GRAFICI TAB 3 (FRAGMENT) ---
+# Ogni grafico è un fragment: i suoi widget ne rieseguono solo il disegno,
+# non la simulazione.
+
+RISK_THRESHOLD_DEFAULT = 30
+# Limite dei minuti nell'editor degli eventi (fisso: la configurazione fa parte dell'identità del widget)
+FEEDING_MAX_MIN = 1440
+
+@st.fragment
+@profiled("chart", chart="energy")
+def render_energy_balance_chart(df_sim):
+    st.markdown("### 📊 Bilancio Energetico: Richiesta vs. Fonti di Ossidazione")
+    
+    # Didascalia Esplicativa Aggiunta
+    st.caption("""
+    **Guida alla Lettura:** L'altezza totale del grafico (linea tratteggiata nera) rappresenta il consumo energetico orario (g/h) richiesto dallo sforzo. Le aree colorate mostrano come il corpo miscela i diversi substrati per soddisfare esattamente quella richiesta.
+    """)
+
+    color_map = {
+        'Glicogeno Epatico (g)': '#B71C1C',    # Rosso Scuro (1) - BASE
+        'Carboidrati Esogeni (g)': '#1976D2', # Blu (2)
+        'Ossidazione Lipidica (g)': '#FFC107', # Giallo Intenso (3)
+        'Glicogeno Muscolare (g)': '#E57373', # Rosso Tenue (4) - CIMA
+    }
+    
+    stack_order = [
+        'Glicogeno Epatico (g)',     # 1. BASE (indice 0)
+        'Carboidrati Esogeni (g)',   # 2. Sopra 1 (indice 1)
+        'Ossidazione Lipidica (g)',  # 3. Sopra 2 (indice 2)
+        'Glicogeno Muscolare (g)'      # 4. CIMA (indice 3)
+    ]
+    
+    # Decimazione min/max prima del melt (preserva crisi, picchi e gradini di intake)
+    df_chart = decimation.decimate_simulation(df_sim, stack_order, width_px=decimation.CHART_WIDTH_FULL_PX)
+    
+    df_long = df_chart.melt('Time (min)', value_vars=stack_order, 
+                            var_name='Source', value_name='Rate (g/h)')
+    
+    df_long_rich = pd.merge(df_long, df_chart[['Time (min)', 'Pct_Muscle', 'Pct_Liver', 'Pct_Exo', 'Pct_Fat', 'Scenario']], on='Time (min)')
+    
+    conditions = [
+        (df_long_rich['Source'] == 'Glicogeno Muscolare (g)'),
+        (df_long_rich['Source'] == 'Glicogeno Epatico (g)'),
+        (df_long_rich['Source'] == 'Carboidrati Esogeni (g)'),
+        (df_long_rich['Source'] == 'Ossidazione Lipidica (g)')
+    ]
+    choices = [df_long_rich['Pct_Muscle'], df_long_rich['Pct_Liver'], df_long_rich['Pct_Exo'], df_long_rich['Pct_Fat']]
+    df_long_rich['Percentuale'] = np.select(conditions, choices, default='0%')
+
+    
+    sort_map = {
+        'Glicogeno Epatico (g)': 0,
+        'Carboidrati Esogeni (g)': 1,
+        'Ossidazione Lipidica (g)': 2,
+        'Glicogeno Muscolare (g)': 3
+    }
+    df_long_rich['sort_index'] = df_long_rich['Source'].map(sort_map)
+    
+    color_domain = stack_order
+    color_range = [color_map[source] for source in stack_order]
+    
+    df_total_demand = df_chart.copy()
+    df_total_demand['Total Demand'] = df_total_demand['Glicogeno Muscolare (g)'] + df_total_demand['Glicogeno Epatico (g)'] + df_total_demand['Carboidrati Esogeni (g)'] + df_total_demand['Ossidazione Lipidica (g)']
+
+    chart_stack = alt.Chart(df_long_rich).mark_area().encode(
+        x=alt.X('Time (min)'),
+        y=alt.Y('Rate (g/h)', stack="zero"), # Usiamo stack="zero" per maggiore chiarezza
+        color=alt.Color('Source', 
+                        scale=alt.Scale(domain=color_domain,  
+                                        range=color_range),
+                        sort=alt.SortField(field='sort_index', order='ascending') 
+                       ),
+        tooltip=[
+            alt.Tooltip('Time (min)', title='Minuto'), 
+            alt.Tooltip('Source', title='Fonte'), 
+            alt.Tooltip('Rate (g/h)', title='Contributo (g/h)', format='.1f'),
+            alt.Tooltip('Percentuale', title='% del Totale')
+        ]
+    )
+    
+    line_demand = alt.Chart(df_total_demand).mark_line(color='black', strokeDash=[5,5], size=2).encode(
+        x='Time (min)',
+        y='Total Demand'
+    )
+
+    final_combo_chart = (chart_stack + line_demand).properties(
+        title="Bilancio Energetico: Richiesta vs. Fonti di Ossidazione" 
+    ).interactive()
+    
+    st.altair_chart(final_combo_chart, use_container_width=True)
+
+@st.fragment
+@profiled("chart", chart="reserves")
+def render_reserve_charts(combined_df, tank_data):
+    st.markdown("### 📉 Confronto Riserve Nette (Svuotamento Serbatio)")
+    
+    st.caption("Confronto: Deplezione Glicogeno Totale (Muscolo + Fegato) con Zone di Rischio")
+    
+    # --- LOGICA PER GRAFICO CON BANDE DI RISCHIO BASATO SU TOTALE GLICOGENO ---
+    
+    initial_total_glycogen = tank_data['muscle_glycogen_g'] + tank_data['liver_glycogen_g']
+    max_total = initial_total_glycogen * 1.05 # Max per l'asse Y
+    
+    # Definisce i campi da mostrare nel grafico a pila delle riserve
+    reserve_fields = ['Residuo Muscolare', 'Residuo Epatico']
+
+    # Decimazione per scenario (ogni grafico occupa mezza larghezza)
+    combined_df = pd.concat([
+        decimation.decimate_simulation(df_scenario, reserve_fields, width_px=decimation.CHART_WIDTH_HALF_PX)
+        for _, df_scenario in combined_df.groupby('Scenario', sort=False)
+    ])
+    
+    # Melt dei dati per la visualizzazione stacked
+    df_reserve_long = combined_df.melt(
+        id_vars=['Time (min)', 'Scenario', 'Stato'], 
+        value_vars=reserve_fields, 
+        var_name='Tipo Glicogeno', 
+        value_name='Residuo (g)'
+    )
+    
+    # Mappatura colori specifica per le riserve (chiaro per Muscolo, scuro per Fegato critico)
+    reserve_color_map = {
+        'Residuo Muscolare': '#E57373', # Rosso tenue
+        'Residuo Epatico': '#B71C1C',   # Rosso scuro/critico
+    }
+    
+    # 1. Definizione delle zone di rischio (Basato su Riserva Totale)
+    zones_df = pd.DataFrame({
+        'Zone': ['Sicurezza (Verde)', 'Warning (Giallo)', 'Critico (Rosso)'],
+        'Start': [initial_total_glycogen * 0.65, initial_total_glycogen * 0.30, 0],
+        'End': [initial_total_glycogen * 1.05, initial_total_glycogen * 0.65, initial_total_glycogen * 0.30],
+        'Color': ['#4CAF50', '#FFC107', '#F44336'], 
+    })
+    
+    # Creazione dei grafici affiancati utilizzando la divisione dei dati e la combinazione dei layer
+    
+    col_strat, col_digi = st.columns(2)
+
+    def create_reserve_chart(df_data, title, background_df):
         
-        # Inizializzazioni per la lettura del file
-        avg_w = 200
-        avg_hr = 150
-        intensity_series = None # Inizializzazione della serie IF
-        intensity_factor_reference = 0.8 # Inizializzazione IF di riferimento
+        # Layer Sfondo
+        background = alt.Chart(background_df).mark_rect(opacity=0.15).encode(
+            y=alt.Y('Start', title='Glicogeno Residuo (g)', axis=None),
+            y2=alt.Y2('End'),         
+            color=alt.Color('Color', scale=None), 
+            tooltip=['Zone']
+        ).properties(
+            title=title
+        )
+
+        # Layer Area Accatastata
+        area_chart = alt.Chart(df_data).mark_area().encode(
+            x=alt.X('Time (min)', title='Durata (min)'),
+            y=alt.Y('Residuo (g)', title='Glicogeno Residuo (g)', stack="zero", scale=alt.Scale(domain=[0, max_total])),
+            color=alt.Color('Tipo Glicogeno', scale=alt.Scale(domain=reserve_fields, range=[reserve_color_map[f] for f in reserve_fields])),
+            order=alt.Order('Tipo Glicogeno', sort='ascending'), # Epatico in basso, Muscolare sopra
+            tooltip=['Time (min)', 'Tipo Glicogeno', 'Residuo (g)', 'Stato']
+        ).interactive()
         
-        if sport_mode == 'cycling':
-            avg_w = 200
-            intensity_factor_reference = avg_w / ftp_watts if ftp_watts > 0 else 0.8
-        elif sport_mode == 'running':
-            avg_hr = 150
-            intensity_factor_reference = avg_hr / thr_hr if thr_hr > 0 else 0.8
-        elif sport_mode == 'other':
-            avg_hr = 150
-            intensity_factor_reference = avg_hr / max_hr if max_hr > 0 else 0.8
+        return alt.layer(background, area_chart).properties(height=350)
+        
+    # Grafico 1: Strategia con Integrazione
+    df_strat = df_reserve_long[df_reserve_long['Scenario'] == 'Con Integrazione (Strategia)']
+    chart_strat = create_reserve_chart(df_strat, 'Con Integrazione (Strategia)', zones_df)
+    
+    with col_strat:
+        st.altair_chart(chart_strat, use_container_width=True)
+
+    # Grafico 2: Senza Integrazione
+    df_digi = df_reserve_long[df_reserve_long['Scenario'] == 'Senza Integrazione (Digiuno)']
+    chart_digi = create_reserve_chart(df_digi, 'Senza Integrazione (Digiuno)', zones_df)
+    
+    with col_digi:
+        st.altair_chart(chart_digi, use_container_width=True)
+        
+    st.markdown(f"""
+    <p style='text-align: center; font-size: small; color: #666;'>
+    Il Glicogeno Epatico (<span style='color: #B71C1C;'>Rosso Scuro</span>) è alla base per evidenziare il rischio di Ipoglicemia (crisi del fegato).
+    </p>
+    """, unsafe_allow_html=True)
+    # --- FINE LOGICA GRAFICO RISERVE NETTE ---
+
+@st.fragment
+@profiled("chart", chart="gut")
+def render_gut_chart(df_sim, tau_absorption_input, allow_custom_risk):
+    st.markdown("### ⚠️ Accumulo Intestinale (Rischio GI) & Flusso CHO")
+    
+    risk_threshold_input = RISK_THRESHOLD_DEFAULT
+    if allow_custom_risk:
+        risk_threshold_input = st.slider(
+            "Soglia di Rischio GI (g)", 
+            10, 80, RISK_THRESHOLD_DEFAULT, 5, 
+            help="Massimo accumulo tollerabile prima che insorgano sintomi GI.",
+            key='gut_risk_threshold'
+        )
+    
+    st.caption(f"""
+    **Interpretazione:** La distanza verticale tra la Linea Blu (Ingerito) e la Linea Verde (Ossidato) crea l'**Accumulo CHO (g)**, ovvero il carico intestinale istantaneo. Se l'area supera la Soglia di Rischio GI ({risk_threshold_input} g), la strategia di assunzione è troppo aggressiva.
+    """)
 
+    with st.expander("Dettagli Modello Flusso CHO e Rischio GI"):
+        st.markdown(f"""
+        Questo grafico visualizza il **bilancio dinamico** tra ciò che ingerisci e ciò che il tuo corpo riesce ad ossidare (bruciare), indicando il rischio di *Distress Gastrointestinale (GI)*.
         
-        with col_param:
-            st.subheader(f"1. Parametri Sforzo ({sport_mode.capitalize()})")
-            
-            # NUOVA LOGICA: CARICAMENTO FILE O INSERIMENTO MANUALE
-            st.markdown("#### Caratteristiche dell'Attività")
-            
-            file_upload_method = st.radio(
-                "Fonte dati attività:", 
-                ["Manuale (Media)", "Carica File Strutturato (.zwo / .fit / .gpx / .csv)"],
-                key='file_upload_method'
-            )
-            
-            if file_upload_method == "Carica File Strutturato (.zwo / .fit / .gpx / .csv)":
-                st.info("I file .gpx/.fit/.csv devono contenere le colonne 'power' o 'heart_rate' per l'estrazione. I file .zwo calcolano automaticamente l'IF istantaneo.")
-                uploaded_file = st.file_uploader("Carica file attività", type=['gpx', 'csv', 'fit', 'zwo'])
-                
-                if uploaded_file is not None:
-                    try:
-                        filename = uploaded_file.name
-                        
-                        if filename.endswith('.zwo'):
-                            # Logica per ZWO (XML)
-                            st.info("Analisi di un allenamento strutturato ZWO (IF istantaneo calcolato).")
-                            intensity_series, duration, avg_w_calc, avg_hr_calc = parse_zwo_file(uploaded_file, ftp_watts, thr_hr, subj.sport)
-                            
-                            if subj.sport == SportType.CYCLING:
-                                st.success(f"Dati estratti: Potenza media: {avg_w_calc:.1f} W, Durata: {duration} min.")
-                                avg_w = avg_w_calc
-                            elif subj.sport == SportType.RUNNING:
-                                st.success(f"Dati estratti: FC media: {avg_hr_calc:.1f} BPM, Durata: {duration} min.")
-                                avg_hr = avg_hr_calc
-                            
-                        else:
-                            # Logica per CSV/GPX/FIT (lettura semplificata in CSV)
-                            df_activity = pd.read_csv(uploaded_file)
-                            
-                            # Simula l'estrazione di dati chiave (assumendo 5s per riga come proxy di risoluzione)
-                            duration_sec = df_activity.shape[0] * 5 
-                            duration = round(duration_sec / 60)
-                            
-                            if sport_mode == 'cycling':
-                                if 'power' in df_activity.columns:
-                                    avg_w = df_activity['power'].mean()
-                                    st.success(f"Dati estratti: Potenza media: {avg_w:.1f} W, Durata: {duration} min.")
-                                else:
-                                    st.error("Il file deve contenere la colonna 'power'.")
-                            
-                            elif sport_mode == 'running' or sport_mode == 'other':
-                                if 'heart_rate' in df_activity.columns:
-                                    avg_hr = df_activity['heart_rate'].mean()
-                                    st.success(f"Dati estratti: FC media: {avg_hr:.1f} BPM, Durata: {duration} min.")
-                                else:
-                                    st.error("Il file deve contenere la colonna 'heart_rate'.")
-                            
-                    except Exception as e:
-                        st.error(f"Errore nell'elaborazione del file: {e}")
-                        
-            # --- INPUT MANUALE / RIEPILOGO DATI ---
-            if sport_mode == 'cycling':
-                avg_w = st.number_input("Potenza Media Prevista [Watt]", 50, 600, int(avg_w), step=5)
-                act_params['ftp_watts'] = ftp_watts
-                act_params['avg_watts'] = avg_w
-                act_params['efficiency'] = st.slider("Efficienza Meccanica [%]", 16.0, 26.0, 22.0, 0.5)
-                duration = st.slider("Durata Attività (min)", 30, 420, int(duration), step=10)
-                
-                # Calcola IF di riferimento
-                intensity_factor_reference = avg_w / ftp_watts if ftp_watts > 0 else 0.8
-
-            elif sport_mode == 'running':
-                run_input_mode = st.radio("Modalità Obiettivo:", ["Imposta Passo & Distanza", "Imposta Tempo & Distanza"], horizontal=True)
-                c_dist, c_var = st.columns(2)
-                distance_km = c_dist.number_input("Distanza (km)", 1.0, 100.0, 21.1, 0.1)
-                paces_options = []
-                for m in range(2, 16): 
-                    for s in range(0, 60, 5):
-                        paces_options.append(f"{m}:{s:02d}")
-
-                if run_input_mode == "Imposta Passo & Distanza":
-                    pace_str = c_var.select_slider("Passo Obiettivo (min/km)", options=paces_options, value="5:00")
-                    pm, ps = map(int, pace_str.split(':'))
-                    pace_decimal = pm + ps/60.0
-                    duration = distance_km * pace_decimal
-                    speed_kmh = 60.0 / pace_decimal
-                    st.info(f"Tempo Stimato: **{int(duration // 60)}h {int(duration % 60)}m**")
-                else:
-                    target_h = c_var.number_input("Ore", 0, 24, 1)
-                    target_m = c_var.number_input("Minuti", 0, 59, 45)
-                    duration = (target_h * 60) + target_m
-                    if duration == 0: duration = 1
-                    pace_decimal = duration / distance_km
-                    speed_kmh = 60.0 / pace_decimal
-                    p_min = int(pace_decimal)
-                    p_sec = int((pace_decimal - p_min) * 60)
-                    st.info(f"Passo Richiesto: **{p_min}:{p_sec:02d} /km**")
-
-                act_params['speed_kmh'] = speed_kmh
-                
-                avg_hr = st.number_input("Frequenza Cardiaca Media", 80, 220, int(avg_hr), 1)
-                act_params['avg_hr'] = avg_hr
-                act_params['threshold_hr'] = thr_hr
-                
-                # Calcola IF di riferimento
-                intensity_factor_reference = avg_hr / thr_hr if thr_hr > 0 else 0.8
-                
-            else: 
-                avg_hr = st.number_input("Frequenza Cardiaca Media Gara", 80, 220, int(avg_hr), 1)
-                act_params['avg_hr'] = avg_hr
-                act_params['max_hr'] = max_hr
-                duration = st.slider("Durata Attività (min)", 30, 420, int(duration), step=10)
-                
-                # Calcola IF di riferimento (usiamo max HR come soglia)
-                intensity_factor_reference = avg_hr / max_hr if max_hr > 0 else 0.8
-            
-        with col_meta:
-            st.subheader("2. Strategia di Integrazione e Calibrazione")
-            
-            # NUTRIZIONE PRATICA
-            st.subheader("Gestione Nutrizione Pratica")
-            cho_per_unit = st.number_input("Contenuto CHO per Gel/Barretta (g)", 10, 100, 25, 5, help="Es. Un gel isotonico standard ha circa 22g, uno 'high carb' 40g.")
-            carb_intake = st.slider("Target Integrazione (g/h)", 0, 120, 60, step=10, help="Quantità media di CHO da assumere ogni ora.")
-            
-            if carb_intake > 0 and cho_per_unit > 0:
-                units_per_hour = carb_intake / cho_per_unit
-                if units_per_hour > 0:
-                    interval_min = 60 / units_per_hour
-                    st.caption(f"Protocollo: {units_per_hour:.1f} unità/h (1 ogni **{int(interval_min)} min**)")
+        **Linee Cumulative (Asse Destro):**
+        * **Linea Blu (Intake):** Apporto totale di CHO (a gradini, riflette le assunzioni discrete).
+        * **Linea Verde (Ossidazione):** CHO totale bruciato (curva smussata, limitata dalla cinetica di assorbimento).
+        
+        **Area di Rischio (Asse Sinistro):**
+        * L'area sottesa è l'**Accumulo Intestinale (Gut Load)**: $\\text{{Intake}} - \\text{{Ossidazione}}$.
+        * **τ Cinetica (Tempo di Smussamento):** {tau_absorption_input:.1f} min. Determina quanto velocemente la curva di Ossidazione (Verde) risponde all'Ingestione (Blu).
+        * **Soglia di Rischio GI:** {risk_threshold_input} g (Linea Rossa Tratteggiata). Superarla indica un alto rischio di sintomi GI.
+        """)
+    
+    RISK_THRESHOLD = risk_threshold_input
+    
+    df_sim = df_sim.copy()
+    df_sim['Rischio'] = np.where(df_sim['Gut Load'] >= RISK_THRESHOLD, 'Alto Rischio', 'Basso Rischio')
+    
+    max_gut_load = df_sim['Gut Load'].max()
+    max_gut_load_time = df_sim[df_sim['Gut Load'] == max_gut_load]['Time (min)'].iloc[0] if max_gut_load > 0 else 0
+    max_df = pd.DataFrame([{'Time (min)': max_gut_load_time, 'Gut Load': max_gut_load}])
+    
+    # Picco e gradini di intake sono preservati dalla decimazione
+    df_sim = decimation.decimate_simulation(df_sim, ['Gut Load', 'Intake Cumulativo (g)', 'Ossidazione Cumulativa (g)'],
+                                            width_px=decimation.CHART_WIDTH_FULL_PX)
+
+    gut_area = alt.Chart(df_sim).mark_area(opacity=0.8, color='#8D6E63').encode(
+        x=alt.X('Time (min)'), 
+        y=alt.Y('Gut Load', title='Accumulo CHO (g)', axis=alt.Axis(titleColor='#8D6E63')),
+        tooltip=['Time (min)', 'Gut Load', 'Rischio']
+    )
+    
+    risk_line = alt.Chart(pd.DataFrame({'y': [RISK_THRESHOLD]})).mark_rule(color='#F44336', strokeDash=[4,4], size=2).encode(
+        y=alt.Y('y', axis=None)
+    )
+    
+    max_point = alt.Chart(max_df).mark_circle(size=80, color='black').encode(
+        x=alt.X('Time (min)'), 
+        y=alt.Y('Gut Load'),
+        tooltip=[alt.Tooltip('Time (min)', title='Max Time'), alt.Tooltip('Gut Load', title='Max Accumulo')]
+    )
+    
+    gut_layer_base = alt.layer(gut_area, risk_line, max_point)
+
+    df_cumulative = df_sim.melt('Time (min)', value_vars=['Intake Cumulativo (g)', 'Ossidazione Cumulativa (g)'],
+                               var_name='Flusso', value_name='Grammi')
+
+    intake_oxidation_lines = alt.Chart(df_cumulative).mark_line(strokeWidth=3.5).encode(
+        x=alt.X('Time (min)'), 
+        y=alt.Y('Grammi', title='G Ingeriti/Ossidati (g)', axis=alt.Axis(titleColor='#1976D2')),
+        color=alt.Color('Flusso', 
+                        scale=alt.Scale(domain=['Intake Cumulativo (g)', 'Ossidazione Cumulativa (g)'],
+                                        range=['#1976D2', '#4CAF50'])
+                       ),
+        strokeDash=alt.condition(alt.datum.Flusso == 'Ossidazione Cumulativa (g)', alt.value([5, 5]), alt.value([0])),
+        tooltip=['Time (min)', 'Flusso', 'Grammi']
+    )
+
+    cumulative_layer = intake_oxidation_lines.encode(
+        y=alt.Y('Grammi', 
+                axis=alt.Axis(title='G Ingeriti/Ossidati (g)', titleColor='#1976D2', orient='right'), 
+                scale=alt.Scale(domain=[0, df_sim['Intake Cumulativo (g)'].max() * 1.1])
+                )
+    )
+    
+    final_gut_chart = alt.layer(
+        gut_layer_base,
+        cumulative_layer
+    ).resolve_scale(
+        y='independent'
+    ).properties(
+        title="Accumulo Intestinale vs Flusso CHO (Doppio Asse Y)"
+    )
+
+
+    st.altair_chart(final_gut_chart, use_container_width=True)
+
+
+@st.fragment
+def render_archive_panel(race_params, df_sim, stats, df_no_cho, stats_no_cho, default_scenario):
+    """
+    Salvataggio e confronto delle simulazioni archiviate (fragment indipendente).
+    """
+    with st.expander("🗄️ Archivio Simulazioni (Storico & Confronto)"):
+        athlete = st.session_state['athlete_name']
+        a_c1, a_c2 = st.columns(2)
+        event_date = a_c1.date_input("Data Evento", value=pd.Timestamp.today(), key='archive_event_date')
+        scenario_label = a_c2.text_input("Nome Scenario", value=default_scenario, key='archive_scenario')
+        
+        if st.button("💾 Salva simulazione nello storico"):
+            # Strategia e digiuno scritti in un'unica operazione bulk
+            n_saved = storage.save_runs(archive_engine, [
+                storage.make_run_record(athlete, event_date, scenario_label, "race", race_params, df_sim, summary=stats),
+                storage.make_run_record(athlete, event_date, f"{scenario_label} [Digiuno]", "race",
+                                        dict(race_params, carb_intake=0, feeding_plan=None), df_no_cho, summary=stats_no_cho),
+            ])
+            st.success(f"Salvate {n_saved} simulazioni per {athlete}.")
+        
+        history = storage.load_history(archive_engine, athlete, kind="race")
+        if history.empty:
+            st.caption("Nessuna simulazione salvata per questo atleta.")
+        else:
+            st.dataframe(history.drop(columns=['summary']), hide_index=True, use_container_width=True)
             
-            # NUOVO SELETTORE MIX CHO
-            mix_type_options = list(ChoMixType)
-            selected_mix_type = st.selectbox(
-                "Tipologia Mix Carboidrati", 
-                options=mix_type_options, 
-                format_func=lambda x: x.label,
-                index=0,
-                help="Il tipo di carboidrati influenza il tasso massimo di ossidazione esogena."
+            compare_ids = st.multiselect(
+                "Confronta simulazioni salvate", history['id'].tolist(),
+                format_func=lambda i: " | ".join(str(v) for v in history.loc[history['id'] == i, ['event_date', 'scenario']].iloc[0])
             )
+            if compare_ids:
+                runs = storage.load_runs(archive_engine, compare_ids)
+                frames = []
+                for run_id, (_, _, df_run) in runs.items():
+                    label = history.loc[history['id'] == run_id, 'scenario'].iloc[0]
+                    df_run = decimation.decimate_frame(df_run, ['Residuo Totale'], decimation.points_for_width(decimation.CHART_WIDTH_FULL_PX))
+                    frames.append(df_run[['Time (min)', 'Residuo Totale']].assign(Scenario=f"#{run_id} {label}"))
+                df_compare = pd.concat(frames)
+                
+                compare_chart = alt.Chart(df_compare).mark_line().encode(
+                    x=alt.X('Time (min)'),
+                    y=alt.Y('Residuo Totale', title='Glicogeno Residuo (g)'),
+                    color='Scenario',
+                    tooltip=['Scenario', 'Time (min)', 'Residuo Totale']
+                ).properties(height=300).interactive()
+                st.altair_chart(compare_chart, use_container_width=True)
+
+def render_monte_carlo_results(results, job):
+    """
+    Distribuzione degli esiti Monte Carlo (aggiornata a ogni blocco completato).
+    """
+    df_mc = pd.DataFrame([outcome for chunk in results for outcome in chunk])
+    if job.meta.get('inputs_key') != st.session_state.get('mc_inputs_key'):
+        st.info("✏️ I parametri della strategia sono cambiati dopo l'avvio dell'analisi.")
+    
+    bonk_share = df_mc['bonk_min'].notna().mean() * 100
+    q10, q50, q90 = df_mc['final_glycogen'].quantile([0.1, 0.5, 0.9])
+    mc1, mc2, mc3 = st.columns(3)
+    mc1.metric("Simulazioni", f"{len(df_mc)}")
+    mc2.metric("Probabilità di Crisi", f"{bonk_share:.0f}%")
+    mc3.metric("Glicogeno Residuo (P10-P50-P90)", f"{int(q10)} / {int(q50)} / {int(q90)} g")
+    
+    hist = alt.Chart(df_mc).mark_bar(opacity=0.8).encode(
+        x=alt.X('final_glycogen', bin=alt.Bin(maxbins=40), title='Glicogeno Residuo a Fine Gara (g)'),
+        y=alt.Y('count()', title='Simulazioni'),
+        color=alt.condition(alt.datum.final_glycogen <= 120, alt.value('#E53935'), alt.value('#1E88E5')),
+    ).properties(height=250)
+    st.altair_chart(hist, use_container_width=True)
+    
+    if df_mc['bonk_min'].notna().any():
+        st.caption(f"Minuto di crisi mediano (solo run con crisi): {int(df_mc['bonk_min'].median())} min")
+    render_export(lambda: export.record_chunks(outcome for chunk in results for outcome in chunk),
+                  "monte_carlo", key="export_mc")
+
+@st.fragment
+@profiled("chart", chart="sweep")
+def render_sweep_heatmap(sweep_args, duration, carb_intake, if_val):
+    """
+    Mappa integrazione x intensità: tutta la griglia in un'unica simulazione vettoriale.
+    """
+    sw1, sw2, sw3 = st.columns(3)
+    intake_range = sw1.slider("Intervallo Integrazione (g/h)", 0, 120, (0, 120), 10)
+    if_range = sw2.slider("Intervallo Intensità (IF)", 0.40, 1.20, (0.55, 1.00), 0.05)
+    resolution = sw3.select_slider("Risoluzione Griglia", options=[10, 20, 30, 40, 50, 60], value=50)
+    metric = st.radio("Mostra:", ["Tempo alla Crisi (min)", "Residuo Totale"], horizontal=True, key="sweep_metric")
+
+    intake_values = np.linspace(intake_range[0], intake_range[1], resolution).round(2).tolist()
+    if_values = np.linspace(if_range[0], if_range[1], resolution).round(4).tolist()
+    df_grid, grid_stats = cached_call(sweep.intake_intensity_sweep, sweep_args['tank'], duration,
+                                      intake_values, if_values, *sweep_args['args'], **sweep_args['kwargs'])
+
+    # Nessuna crisi = prova completata: la cella vale la durata della gara
+    df_grid = df_grid.assign(**{"Tempo alla Crisi (min)": df_grid["Tempo alla Crisi (min)"].fillna(duration)})
+    half_if = (if_values[1] - if_values[0]) / 2 if len(if_values) > 1 else 0.01
+    half_in = (intake_values[1] - intake_values[0]) / 2 if len(intake_values) > 1 else 1.0
+    df_grid = df_grid.assign(if_lo=df_grid["IF"] - half_if, if_hi=df_grid["IF"] + half_if,
+                             in_lo=df_grid["Intake (g/h)"] - half_in, in_hi=df_grid["Intake (g/h)"] + half_in)
+
+    heat = alt.Chart(df_grid).mark_rect().encode(
+        x=alt.X('if_lo:Q', title='Intensity Factor (IF)', scale=alt.Scale(domain=list(if_range))),
+        x2='if_hi:Q',
+        y=alt.Y('in_lo:Q', title='Integrazione (g/h)', scale=alt.Scale(domain=list(intake_range))),
+        y2='in_hi:Q',
+        color=alt.Color(f'{metric}:Q', title=metric, scale=alt.Scale(scheme='redyellowgreen')),
+        tooltip=['Intake (g/h)', alt.Tooltip('IF', format='.2f'), alt.Tooltip('Tempo alla Crisi (min)', format='.0f'),
+                 alt.Tooltip('Residuo Totale', format='.0f'), alt.Tooltip('Picco Gut Load', format='.0f')],
+    )
+    current = alt.Chart(pd.DataFrame({"IF": [if_val], "Intake (g/h)": [carb_intake]})).mark_point(
+        shape='diamond', size=120, filled=True, color='black'
+    ).encode(x='IF:Q', y='Intake (g/h):Q')
+    st.altair_chart((heat + current).properties(height=420), use_container_width=True)
+    st.caption(f"{grid_stats['cells']} combinazioni su {duration} min calcolate in {grid_stats['compute_ms']:.0f} ms. "
+               "◆ = strategia attuale.")
+
+@st.fragment
+@profiled("simulate", scenario="tappe")
+def render_stage_race(stage_args, duration, carb_intake, if_val):
+    """
+    Gara a tappe: ogni tappa parte dal glicogeno lasciato dal recupero della precedente.
+    """
+    g1, g2, g3 = st.columns(3)
+    n_stages = g1.number_input("Numero di Tappe", 2, 30, 3, 1)
+    sleep_start = g2.time_input("Inizio Sonno", stagerace.DEFAULT_SLEEP_START, key="stage_sleep_start")
+    sleep_end = g3.time_input("Fine Sonno", stagerace.DEFAULT_SLEEP_END, key="stage_sleep_end")
+
+    default_plan = pd.DataFrame({
+        "Durata (min)": [int(duration)] * n_stages,
+        "IF": [round(if_val, 2)] * n_stages,
+        "Integrazione (g/h)": [int(carb_intake)] * n_stages,
+        "Partenza": [stagerace.DEFAULT_START] * n_stages,
+        "CHO Recupero (g)": [600] * n_stages,
+    })
+    plan = st.data_editor(default_plan, hide_index=True, use_container_width=True, key=f"stage_plan_{n_stages}",
+                          column_config={
+                              "Durata (min)": st.column_config.NumberColumn(min_value=10, max_value=1440, step=10),
+                              "IF": st.column_config.NumberColumn(min_value=0.3, max_value=1.3, step=0.01, format="%.2f"),
+                              "Integrazione (g/h)": st.column_config.NumberColumn(min_value=0, max_value=150, step=5),
+                              "Partenza": st.column_config.TimeColumn(format="HH:mm", step=900),
+                              "CHO Recupero (g)": st.column_config.NumberColumn(
+                                  min_value=0, max_value=2000, step=50,
+                                  help="CHO dal traguardo alla partenza della tappa successiva"),
+                          })
+    plan = plan.fillna(default_plan)
+
+    stages = tuple(
+        stagerace.Stage(duration_min=float(row["Durata (min)"]), start=row["Partenza"],
+                        intensity_factor=float(row["IF"]), carb_intake_g_h=float(row["Integrazione (g/h)"]),
+                        recovery_cho_g=float(row["CHO Recupero (g)"]), sleep_start=sleep_start, sleep_end=sleep_end)
+        for _, row in plan.iterrows()
+    )
+    t0 = time.perf_counter()
+    df_timeline, stage_stats = cached_call(stagerace.stage_race_result, stage_args['tank'], stage_args['subject'],
+                                           stages, stage_args['activity'], stage_args['intake'],
+                                           stage_args['absorption'])
+    df_stages = stagerace.stages_frame(stage_stats["stages"])
+    elapsed_ms = (time.perf_counter() - t0) * 1000.0
+
+    df_long = df_timeline.melt(id_vars=["Ore", "Tappa", "Fase"], value_vars=["Totale", "Muscolare", "Epatico"],
+                               var_name="Riserva", value_name="Glicogeno (g)")
+    chart = alt.Chart(df_long).mark_line().encode(
+        x=alt.X("Ore:Q", title="Ore dalla partenza della prima tappa"),
+        y=alt.Y("Glicogeno (g):Q"),
+        color=alt.Color("Riserva:N", scale=alt.Scale(domain=["Totale", "Muscolare", "Epatico"],
+                                                     range=["#1E88E5", "#43A047", "#FB8C00"])),
+        tooltip=["Tappa", "Fase", alt.Tooltip("Ore", format=".1f"), "Riserva", alt.Tooltip("Glicogeno (g)", format=".0f")],
+    )
+    st.altair_chart(chart.properties(height=320), use_container_width=True)
 
-            st.markdown("---")
-            
-            # --- BLOCCO GESTIONE LAB DATA ---
-            st.markdown("---")
-            use_lab = st.checkbox("🔬 Usa Profilo Metabolico (Upload File)", help="Carica un file CSV/Excel esportato dal metabolimetro (Cosmed, Cortex, etc.)")
-            act_params['use_lab_data'] = use_lab
-            
-            curve_ready = False
+    crisis = df_stages["Crisi (min)"].dropna()
+    if len(crisis):
+        first = df_stages.loc[crisis.index[0]]
+        st.error(f"Prima crisi alla tappa {int(first['Tappa'])}, minuto {int(first['Crisi (min)'])}.")
+    else:
+        st.success("Nessuna crisi stimata su tutte le tappe.")
+    st.dataframe(df_stages.round(1), hide_index=True, use_container_width=True)
+    st.caption(f"{n_stages} tappe ({len(df_timeline)} passi tra minuti di gara e ore di recupero) "
+               f"calcolate in {elapsed_ms:.0f} ms.")
+    render_export(lambda: export.frame_chunks(df_stages), "gara_tappe", key="export_stages")
+
+@st.cache_resource
+def get_report_cache():
+    # Report renderizzati condivisi tra le sessioni, per hash dello scenario
+    return report.ReportCache()
+
+def _report_ready(results, job):
+    # Rendering terminato: il file entra nella cache condivisa
+    get_report_cache().put(job.meta['key'], results[0])
+    _report_download(job.meta['fmt'], results[0])
+
+def _report_download(fmt, content):
+    st.download_button(f"⬇️ Scarica Report {fmt.upper()}", content, file_name=f"report_gara.{fmt}",
+                       mime=report.MIME_TYPES[fmt], key="report_download", on_click="ignore")
+
+@st.fragment
+def render_race_report(report_data):
+    """
+    Report PDF/PNG renderizzato nel pool di processi; report identici non vengono rigenerati.
+    """
+    fmt = st.radio("Formato Report", report.FORMATS, format_func=str.upper, horizontal=True, key="report_fmt")
+    key = report.report_key(report_data, fmt)
+    reports = get_report_cache()
+
+    content = reports.get(key)
+    if content is not None:
+        _report_download(fmt, content)
+        return
+
+    runner = get_job_runner()
+    job_id = reports.pending(key)
+    job = runner.get(job_id) if job_id else None
+    if job is None or job.status in (jobs.CANCELLED, jobs.FAILED):
+        if job is not None:
+            reports.clear_pending(key)
+        if not st.button("📄 Genera Report"):
+            return
+        job = runner.submit("Report gara", report.report_tasks(report_data, fmt), meta={'key': key, 'fmt': fmt},
+                             session=_session_id())
+        reports.set_pending(key, job.id)
+    st.session_state['report_job'] = job.id
+    render_job('report_job', _report_ready)
+
+# --- TAB 3: SIMULAZIONE & STRATEGIA ---
+@st.fragment
+@profiled("tab3")
+def render_race_simulation():
+    """
+    Tab 3. Fragment: i widget della strategia rieseguono solo la simulazione gara;
+    i grafici sono a loro volta fragment indipendenti.
+    """
+    if 'tank_g' not in st.session_state:
+        st.warning("Completare prima i Tab '1. Profilo Base & Capacità' e '2. Stato Pre-Evento (Riempimento)'.")
+        return
+    
+    # Recupero i dati completi
+    tank_data = st.session_state['tank_data']
+    start_tank = tank_data['actual_available_g']
+    subj = st.session_state.get('subject_struct', st.session_state.get('base_subject_struct', None))
+    
+    # Recupero i dati di soglia dal Tab 1
+    ftp_watts = st.session_state.get('ftp_watts_input', 250)
+    thr_hr = st.session_state.get('thr_hr_input', 170)
+    max_hr = st.session_state.get('max_hr_input', 185)
+    
+    
+    sport_mode = 'cycling'
+    if subj.sport == SportType.RUNNING:
+        sport_mode = 'running'
+    elif subj.sport in [SportType.SWIMMING, SportType.XC_SKIING, SportType.TRIATHLON]:
+        sport_mode = 'other' 
+        
+    col_param, col_meta = st.columns([1, 1])
+    
+    act_params = {'mode': sport_mode}
+    duration = 120 # Default
+    cho_per_unit = 25 # Default
+    carb_intake = 60  # Default
+    
+    # Inizializzazioni per la lettura del file
+    avg_w = 200
+    avg_hr = 150
+    intensity_series = None # Inizializzazione della serie IF
+    
+    with col_param:
+        st.subheader(f"1. Parametri Sforzo ({sport_mode.capitalize()})")
+        
+        # NUOVA LOGICA: CARICAMENTO FILE O INSERIMENTO MANUALE
+        st.markdown("#### Caratteristiche dell'Attività")
+        
+        file_upload_method = st.radio(
+            "Fonte dati attività:", 
+            ["Manuale (Media)", "Carica File Strutturato (.zwo / .fit / .gpx / .csv)"],
+            key='file_upload_method'
+        )
+        
+        if file_upload_method == "Carica File Strutturato (.zwo / .fit / .gpx / .csv)":
+            st.info("I file .gpx/.fit/.csv devono contenere le colonne 'power' o 'heart_rate' per l'estrazione. I file .zwo calcolano automaticamente l'IF istantaneo.")
+            uploaded_file = st.file_uploader("Carica file attività", type=['gpx', 'csv', 'fit', 'zwo'])
+            track_upload("activity_upload", uploaded_file)
             
-            if use_lab:
-                st.info("Carica il report contenente almeno le colonne: **Watt/HR** e **CHO/FAT**.")
-                uploaded_report = st.file_uploader("Carica Report (.csv, .xlsx)", type=['csv', 'xlsx', 'txt'], key="meta_upl")
-                
-                if uploaded_report:
-                    df_curve, metrics, err = parse_metabolic_report(uploaded_report)
+            if uploaded_file is not None:
+                try:
+                    filename = uploaded_file.name
                     
-                    if df_curve is not None:
-                        st.success("✅ File interpretato correttamente!")
+                    if filename.endswith('.zwo'):
+                        # Logica per ZWO (XML)
+                        st.info("Analisi di un allenamento strutturato ZWO (IF istantaneo calcolato).")
+                        intensity_series, duration, avg_w_calc, avg_hr_calc = parse_zwo_file(uploaded_file, ftp_watts, thr_hr, subj.sport)
                         
-                        # Selettore Asse X (se il file ha sia Watt che HR)
-                        x_metric = metrics[0]
-                        if len(metrics) > 1:
-                            x_metric = st.radio("Seleziona parametro di riferimento (Asse X):", metrics, horizontal=True)
+                        if subj.sport == SportType.CYCLING:
+                            st.success(f"Dati estratti: Potenza media: {avg_w_calc:.1f} W, Durata: {duration} min.")
+                            avg_w = avg_w_calc
+                        elif subj.sport == SportType.RUNNING:
+                            st.success(f"Dati estratti: FC media: {avg_hr_calc:.1f} BPM, Durata: {duration} min.")
+                            avg_hr = avg_hr_calc
                         
-                        # Salvataggio parametri per la simulazione
-                        act_params['metabolic_curve_df'] = df_curve
-                        act_params['metabolic_x_col'] = x_metric
-                        
-                        # Anteprima Grafica Curva
-                        c_chart = alt.Chart(df_curve).mark_line(point=True).encode(
-                            x=alt.X(x_metric, title=f'Intensità ({x_metric})'),
-                            y=alt.Y('CHO', title='Grammi/Ora (g/h)'),
-                            color=alt.value('#FFA726'),
-                            tooltip=[x_metric, 'CHO', 'FAT']
-                        ) + alt.Chart(df_curve).mark_line(point=True).encode(
-                            x=x_metric, y='FAT', color=alt.value('#66BB6A')
-                        )
+                    else:
+                        if filename.endswith('.fit'):
+                            with perf_span("parse", format="fit"):
+                                df_activity = artifact_compute("activity_upload_parsed", uploaded_file.file_id,
+                                                               read_upload, parse_fit_file, uploaded_file)
+                            if 'timestamp' in df_activity.columns and len(df_activity) > 1:
+                                duration_sec = (df_activity['timestamp'].iloc[-1] - df_activity['timestamp'].iloc[0]).total_seconds()
+                            else:
+                                duration_sec = df_activity.shape[0] # Registrazione a 1 s
+                        else:
+                            # Logica per CSV/GPX (lettura semplificata in CSV)
+                            df_activity = artifact_compute("activity_upload_parsed", uploaded_file.file_id,
+                                                           read_upload, pd.read_csv, uploaded_file)
+                            
+                            # Simula l'estrazione di dati chiave (assumendo 5s per riga come proxy di risoluzione)
+                            duration_sec = df_activity.shape[0] * 5 
+                        duration = round(duration_sec / 60)
                         
-                        st.altair_chart(c_chart.properties(height=200, title="Curve Substrati (Arancio=CHO, Verde=FAT)"), use_container_width=True)
+                        if sport_mode == 'cycling':
+                            if 'power' in df_activity.columns:
+                                avg_w = df_activity['power'].mean()
+                                st.success(f"Dati estratti: Potenza media: {avg_w:.1f} W, Durata: {duration} min.")
+                            else:
+                                st.error("Il file deve contenere la colonna 'power'.")
                         
-                        curve_ready = True
-                        crossover = 75 # Dummy value, non usato col file
+                        elif sport_mode == 'running' or sport_mode == 'other':
+                            if 'heart_rate' in df_activity.columns:
+                                avg_hr = df_activity['heart_rate'].mean()
+                                st.success(f"Dati estratti: FC media: {avg_hr:.1f} BPM, Durata: {duration} min.")
+                            else:
+                                st.error("Il file deve contenere la colonna 'heart_rate'.")
                         
-                    else:
-                        st.error(f"Errore lettura: {err}")
-                else:
-                    st.caption("In attesa di file...")
-            
-            if not use_lab:
-                # Se non usa il lab, mostra il vecchio slider crossover
-                crossover = st.slider("Crossover Point (Soglia Aerobica) [% Soglia]", 50, 85, 70, 5,
-                                      help="Punto in cui il consumo di grassi e carboidrati è equivalente.")
-                if crossover > 75: st.caption("Profilo: Alta efficienza lipolitica (Diesel)")
-                elif crossover < 60: st.caption("Profilo: Prevalenza glicolitica (Turbo)")
-            
-            st.markdown("---")
-            st.subheader("3. Calibrazione Fisiologica (Utenti Esperti)")
-
-            # CHECKBOX PER PARAMETRI AVANZATI
-            use_custom_kinetic = st.checkbox(
-                "Usa parametri cinetici/fisiologici personalizzati",
-                help="Attiva questa opzione per calibrare τ (assorbimento), Rischio GI, Efficienza Ossidativa e Picco Ossidazione.",
-                value=False
-            )
-            
-            TAU_DEFAULT = 20.0
-            RISK_THRESHOLD_DEFAULT = 30
-            EFFICIENCY_DEFAULT = 0.80
-            
-            tau_absorption_input = TAU_DEFAULT
-            risk_threshold_input = RISK_THRESHOLD_DEFAULT
-            oxidation_efficiency_input = EFFICIENCY_DEFAULT
-            custom_max_exo_rate = None 
-
-            if use_custom_kinetic:
-                col_tau, col_risk = st.columns(2)
-                with col_tau:
-                    tau_absorption_input = st.slider(
-                        "Tau (τ) Cinetica Assorbimento (min)", 
-                        5.0, 60.0, TAU_DEFAULT, 2.5, 
-                        help="Tempo di 'smussamento'. Minore è il valore, più veloce è l'assorbimento."
-                    )
-                with col_risk:
-                    risk_threshold_input = st.slider(
-                        "Soglia di Rischio GI (g)", 
-                        10, 80, RISK_THRESHOLD_DEFAULT, 5, 
-                        help="Massimo accumulo tollerabile prima che insorgano sintomi GI."
-                    )
-                
-                st.markdown("#### Fisiologia Ossidativa")
-                oxidation_efficiency_input = st.slider(
-                    "Efficienza di Ossidazione (%)",
-                    0.50, 1.00, EFFICIENCY_DEFAULT, 0.01,
-                    format="%.2f",
-                    help="Percentuale di CHO ingeriti che viene effettivamente ossidata (Podlogar et al., 2025: 58-83%)."
-                )
-                
-                use_manual_peak = st.checkbox("Inserisci manualmente il Picco Ossidazione Esogena (g/min)")
-                if use_manual_peak:
-                    custom_max_exo_rate = st.slider(
-                        "Picco Ossidazione Esogena (g/min)",
-                        0.5, 2.0, 1.0, 0.1,
-                        help="Massimo tasso di ossidazione di glucosio esogeno (Standard: ~1.0 g/min)."
-                    )
+                except Exception as e:
+                    st.error(f"Errore nell'elaborazione del file: {e}")
+                    
+        # --- INPUT MANUALE / RIEPILOGO DATI ---
+        if sport_mode == 'cycling':
+            avg_w = st.number_input("Potenza Media Prevista [Watt]", 50, 600, int(avg_w), step=5)
+            act_params['ftp_watts'] = ftp_watts
+            act_params['avg_watts'] = avg_w
+            act_params['efficiency'] = st.slider("Efficienza Meccanica [%]", 16.0, 26.0, 22.0, 0.5)
+            duration = st.slider("Durata Attività (min)", 30, 420, int(duration), step=10)
 
+        elif sport_mode == 'running':
+            run_input_mode = st.radio("Modalità Obiettivo:", ["Imposta Passo & Distanza", "Imposta Tempo & Distanza"], horizontal=True)
+            c_dist, c_var = st.columns(2)
+            distance_km = c_dist.number_input("Distanza (km)", 1.0, 100.0, 21.1, 0.1)
+            paces_options = []
+            for m in range(2, 16): 
+                for s in range(0, 60, 5):
+                    paces_options.append(f"{m}:{s:02d}")
+
+            if run_input_mode == "Imposta Passo & Distanza":
+                pace_str = c_var.select_slider("Passo Obiettivo (min/km)", options=paces_options, value="5:00")
+                pm, ps = map(int, pace_str.split(':'))
+                pace_decimal = pm + ps/60.0
+                duration = distance_km * pace_decimal
+                speed_kmh = 60.0 / pace_decimal
+                st.info(f"Tempo Stimato: **{int(duration // 60)}h {int(duration % 60)}m**")
             else:
-                 st.caption(f"Utilizzo parametri standard: τ={TAU_DEFAULT:.0f}m, Rischio={RISK_THRESHOLD_DEFAULT}g, Eff={EFFICIENCY_DEFAULT*100:.0f}%")
+                target_h = c_var.number_input("Ore", 0, 24, 1)
+                target_m = c_var.number_input("Minuti", 0, 59, 45)
+                duration = (target_h * 60) + target_m
+                if duration == 0: duration = 1
+                pace_decimal = duration / distance_km
+                speed_kmh = 60.0 / pace_decimal
+                p_min = int(pace_decimal)
+                p_sec = int((pace_decimal - p_min) * 60)
+                st.info(f"Passo Richiesto: **{p_min}:{p_sec:02d} /km**")
+
+            act_params['speed_kmh'] = speed_kmh
+            
+            avg_hr = st.number_input("Frequenza Cardiaca Media", 80, 220, int(avg_hr), 1)
+            act_params['avg_hr'] = avg_hr
+            act_params['threshold_hr'] = thr_hr
+            
+        else: 
+            avg_hr = st.number_input("Frequenza Cardiaca Media Gara", 80, 220, int(avg_hr), 1)
+            act_params['avg_hr'] = avg_hr
+            act_params['max_hr'] = max_hr
+            duration = st.slider("Durata Attività (min)", 30, 420, int(duration), step=10)
+        
+    with col_meta:
+        st.subheader("2. Strategia di Integrazione e Calibrazione")
+        
+        # NUTRIZIONE PRATICA
+        st.subheader("Gestione Nutrizione Pratica")
+        cho_per_unit = st.number_input("Contenuto CHO per Gel/Barretta (g)", 10, 100, 25, 5, help="Es. Un gel isotonico standard ha circa 22g, uno 'high carb' 40g.")
+        carb_intake = st.slider("Target Integrazione (g/h)", 0, 120, 60, step=10, help="Quantità media di CHO da assumere ogni ora.")
+        
+        interval_min = intake_interval_min(carb_intake, cho_per_unit, duration)
+        if interval_min is not None:
+            st.caption(f"Protocollo: {carb_intake / cho_per_unit:.1f} unità/h (1 ogni **{interval_min} min**)")
+        
+        # NUOVO SELETTORE MIX CHO
+        mix_type_options = list(ChoMixType)
+        selected_mix_type = st.selectbox(
+            "Tipologia Mix Carboidrati", 
+            options=mix_type_options, 
+            format_func=lambda x: x.label,
+            index=0,
+            help="Il tipo di carboidrati influenza il tasso massimo di ossidazione esogena."
+        )
 
+        # PIANO A EVENTI (gel a minuti precisi, borracce a flusso continuo, mix diversi)
+        feeding_plan = None
+        plan_mode = st.radio("Piano di Integrazione", ["Costante (g/h)", "A eventi"], horizontal=True,
+                             key="feeding_mode",
+                             help="A eventi: ogni riga è una porzione (Durata 0) o un flusso continuo "
+                                  "distribuito sui minuti indicati (es. borraccia).")
+        if plan_mode == "A eventi":
+            mix_names = {m.label: m.name for m in ChoMixType}
+            # Chiave, dati e configurazione stabili: le modifiche dell'utente sopravvivono ai
+            # cambi di target g/h, unità o durata; il calendario si ricrea solo su richiesta
+            reseed = st.button("↺ Ricrea dal target g/h", key="feeding_events_reset",
+                               help="Sostituisce gli eventi con le porzioni dell'integrazione costante attuale.")
+            if reseed or 'feeding_events_seed' not in st.session_state:
+                st.session_state['feeding_events_seed'] = pd.DataFrame(
+                    [{"Minuto": int(e["minute"]), "Tipo": "Gel", "CHO (g)": e["grams"], "Durata (min)": 0,
+                      "Mix": selected_mix_type.label}
+                     for e in FeedingPlan.constant_rate(carb_intake, cho_per_unit, duration).to_events()],
+                    columns=["Minuto", "Tipo", "CHO (g)", "Durata (min)", "Mix"],
+                )
+                st.session_state.pop('feeding_events', None)
+            events = st.data_editor(
+                st.session_state['feeding_events_seed'], num_rows="dynamic", hide_index=True,
+                use_container_width=True, key="feeding_events",
+                column_config={
+                    "Minuto": st.column_config.NumberColumn(min_value=0, max_value=FEEDING_MAX_MIN, step=1),
+                    "Tipo": st.column_config.SelectboxColumn(options=["Gel", "Barretta", "Borraccia", "Altro"],
+                                                             default="Gel"),
+                    "CHO (g)": st.column_config.NumberColumn(min_value=0, max_value=500, step=5),
+                    "Durata (min)": st.column_config.NumberColumn(min_value=0, max_value=FEEDING_MAX_MIN, step=5,
+                                                                  default=0),
+                    # Vuoto = mix selezionato sopra
+                    "Mix": st.column_config.SelectboxColumn(options=list(mix_names)),
+                },
+            ).dropna(subset=["Minuto", "CHO (g)"])
+            feeding_plan = FeedingPlan.from_events([
+                {"minute": row["Minuto"], "grams": row["CHO (g)"], "duration_min": row["Durata (min)"],
+                 "mix": mix_names.get(row["Mix"]), "label": row["Tipo"]}
+                for _, row in events.iterrows()
+            ])
+            late = int((events["Minuto"] > duration).sum())
+            if late:
+                st.caption(f"{late} eventi oltre la durata dell'attività ({duration} min) sono ignorati.")
+            carb_intake = round(feeding_plan.average_g_h(duration))
+            st.caption(f"{len(events)} eventi, {feeding_plan.total_g:.0f} g totali (media {carb_intake} g/h). "
+                       "Il Monte Carlo perturba il piano; mappa e tappe usano la media oraria.")
+            st.caption("⚠️ Il piano a eventi ossida solo i CHO effettivamente assorbiti. La modalità costante usa il "
+                       "modello storico, che porta l'ossidazione esogena al massimo dal primo minuto: con lo stesso "
+                       "calendario prevede più CHO esogeni e più glicogeno residuo.")
 
-        h_cm = subj.height_cm 
-        
-        df_sim, stats = simulate_metabolism(
-            tank_data, duration, carb_intake, cho_per_unit, crossover, 
-            tau_absorption_input, subj, act_params,
-            oxidation_efficiency_input=oxidation_efficiency_input,
-            custom_max_exo_rate=custom_max_exo_rate,
-            mix_type_input=selected_mix_type,
-            intensity_series=intensity_series # Passa la serie IF istantanea
-        )
-        df_sim["Scenario"] = "Con Integrazione (Strategia)"
-        
-        df_no_cho, stats_no_cho = simulate_metabolism(
-            tank_data, duration, 0, cho_per_unit, crossover, 
-            tau_absorption_input, subj, act_params,
-            oxidation_efficiency_input=oxidation_efficiency_input,
-            custom_max_exo_rate=custom_max_exo_rate,
-            mix_type_input=selected_mix_type,
-            intensity_series=intensity_series # Passa la serie IF istantanea
-        )
-        df_no_cho["Scenario"] = "Senza Integrazione (Digiuno)"
-        
-        combined_df = pd.concat([df_sim, df_no_cho])
-        
         st.markdown("---")
-        st.subheader("Analisi Cinetica e Substrati")
-        
-        c_if, c_rer, c_mix, c_res = st.columns(4)
-        
-        if_val = stats['intensity_factor']
-        c_if.metric("Intensity Factor (IF)", f"{if_val:.2f}", help="Indice di intensità normalizzato sulla soglia.")
-        
-        rer_val = stats['avg_rer']
-        c_rer.metric("RER Stimato (RQ)", f"{rer_val:.2f}", help="Quoziente Respiratorio Metabolico.")
         
-        c_mix.metric("Ripartizione Substrati", f"{int(stats['cho_pct'])}% CHO",
-                      delta=f"{100-int(stats['cho_pct'])}% FAT", delta_color="off")
-        
-        c_res.metric("Glicogeno Residuo", f"{int(stats['final_glycogen'])} g", 
-                      delta=f"{int(stats['final_glycogen'] - start_tank)} g")
-
+        # --- BLOCCO GESTIONE LAB DATA ---
         st.markdown("---")
+        use_lab = st.checkbox("🔬 Usa Profilo Metabolico (Upload File)", help="Carica un file CSV/Excel esportato dal metabolimetro (Cosmed, Cortex, etc.)")
+        act_params['use_lab_data'] = use_lab
+        
+        if use_lab:
+            st.info("Carica il report contenente almeno le colonne: **Watt/HR** e **CHO/FAT**.")
+            uploaded_report = st.file_uploader("Carica Report (.csv, .xlsx)", type=['csv', 'xlsx', 'txt'], key="meta_upl")
+            track_upload("metabolic_upload", uploaded_report)
+            
+            if uploaded_report:
+                with perf_span("parse", format="metabolic"):
+                    df_curve, metrics, err = artifact_compute("metabolic_upload_parsed", uploaded_report.file_id,
+                                                              read_upload, parse_metabolic_report, uploaded_report)
+                
+                if df_curve is not None:
+                    st.success("✅ File interpretato correttamente!")
+                    
+                    # Selettore Asse X (se il file ha sia Watt che HR)
+                    x_metric = metrics[0]
+                    if len(metrics) > 1:
+                        x_metric = st.radio("Seleziona parametro di riferimento (Asse X):", metrics, horizontal=True)
+                    
+                    use_fit = st.checkbox("Smussa curva (fit robusto)", value=True,
+                                          help="Mediane per fascia di intensità, CHO crescente e FAT unimodale, "
+                                               "interpolazione monotona: riduce il rumore dei dati breath-by-breath.")
+                    sim_curve = df_curve
+                    if use_fit:
+                        with perf_span("lab_fit", points=len(df_curve)):
+                            lab_fit = labfit.fit_lab_curve(df_curve, x_metric)
+                        if lab_fit is not None:
+                            sim_curve = lab_fit.table().to_frame()
+                            st.caption(f"Fit: {lab_fit.n_samples} campioni → {len(lab_fit.x)} nodi, "
+                                       f"tabella di {len(sim_curve)} punti.")
+                    
+                    # Salvataggio parametri per la simulazione
+                    act_params['metabolic_curve_df'] = sim_curve
+                    act_params['metabolic_x_col'] = x_metric
+                    
+                    # Anteprima Grafica Curva (punti grezzi, linee della curva usata)
+                    c_chart = alt.Chart(sim_curve).mark_line(point=sim_curve is df_curve).encode(
+                        x=alt.X(x_metric, title=f'Intensità ({x_metric})'),
+                        y=alt.Y('CHO', title='Grammi/Ora (g/h)'),
+                        color=alt.value('#FFA726'),
+                        tooltip=[x_metric, 'CHO', 'FAT']
+                    ) + alt.Chart(sim_curve).mark_line(point=sim_curve is df_curve).encode(
+                        x=x_metric, y='FAT', color=alt.value('#66BB6A')
+                    )
+                    if sim_curve is not df_curve:
+                        raw = alt.Chart(df_curve).mark_circle(size=12, opacity=0.35)
+                        c_chart = (raw.encode(x=x_metric, y='CHO', color=alt.value('#FFA726'))
+                                   + raw.encode(x=x_metric, y='FAT', color=alt.value('#66BB6A')) + c_chart)
+                    
+                    st.altair_chart(c_chart.properties(height=200, title="Curve Substrati (Arancio=CHO, Verde=FAT)"), use_container_width=True)
+                    
+                    crossover = None # Con la curva il crossover non si applica
+                    
+                else:
+                    st.error(f"Errore lettura: {err}")
+            else:
+                st.caption("In attesa di file...")
         
-        m1, m2, m3 = st.columns(3)
-        m1.metric("Uso Glicogeno Muscolare", f"{int(stats['total_muscle_used'])} g", help="Totale svuotato dalle gambe")
-        m2.metric("Uso Glicogeno Epatico", f"{int(stats['total_liver_used'])} g", help="Totale prelevato dal fegato")
-        m3.metric("Uso CHO Esogeno", f"{int(stats['total_exo_used'])} g", help="Totale energia da integrazione")
-
-        
-        st.markdown("### 📊 Bilancio Energetico: Richiesta vs. Fonti di Ossidazione")
-        
-        # Didascalia Esplicativa Aggiunta
-        st.caption("""
-        **Guida alla Lettura:** L'altezza totale del grafico (linea tratteggiata nera) rappresenta il consumo energetico orario (g/h) richiesto dallo sforzo. Le aree colorate mostrano come il corpo miscela i diversi substrati per soddisfare esattamente quella richiesta.
-        """)
-
-        color_map = {
-            'Glicogeno Epatico (g)': '#B71C1C',    # Rosso Scuro (1) - BASE
-            'Carboidrati Esogeni (g)': '#1976D2', # Blu (2)
-            'Ossidazione Lipidica (g)': '#FFC107', # Giallo Intenso (3)
-            'Glicogeno Muscolare (g)': '#E57373', # Rosso Tenue (4) - CIMA
-        }
-        
-        stack_order = [
-            'Glicogeno Epatico (g)',     # 1. BASE (indice 0)
-            'Carboidrati Esogeni (g)',   # 2. Sopra 1 (indice 1)
-            'Ossidazione Lipidica (g)',  # 3. Sopra 2 (indice 2)
-            'Glicogeno Muscolare (g)'      # 4. CIMA (indice 3)
-        ]
-        
-        df_long = df_sim.melt('Time (min)', value_vars=stack_order, 
-                              var_name='Source', value_name='Rate (g/h)')
-        
-        df_long_rich = pd.merge(df_long, df_sim[['Time (min)', 'Pct_Muscle', 'Pct_Liver', 'Pct_Exo', 'Pct_Fat', 'Scenario']], on='Time (min)')
-        
-        conditions = [
-            (df_long_rich['Source'] == 'Glicogeno Muscolare (g)'),
-            (df_long_rich['Source'] == 'Glicogeno Epatico (g)'),
-            (df_long_rich['Source'] == 'Carboidrati Esogeni (g)'),
-            (df_long_rich['Source'] == 'Ossidazione Lipidica (g)')
-        ]
-        choices = [df_long_rich['Pct_Muscle'], df_long_rich['Pct_Liver'], df_long_rich['Pct_Exo'], df_long_rich['Pct_Fat']]
-        df_long_rich['Percentuale'] = np.select(conditions, choices, default='0%')
-
-        
-        sort_map = {
-            'Glicogeno Epatico (g)': 0,
-            'Carboidrati Esogeni (g)': 1,
-            'Ossidazione Lipidica (g)': 2,
-            'Glicogeno Muscolare (g)': 3
-        }
-        df_long_rich['sort_index'] = df_long_rich['Source'].map(sort_map)
-        
-        color_domain = stack_order
-        color_range = [color_map[source] for source in stack_order]
-        
-        df_total_demand = df_sim.copy()
-        df_total_demand['Total Demand'] = df_total_demand['Glicogeno Muscolare (g)'] + df_total_demand['Glicogeno Epatico (g)'] + df_total_demand['Carboidrati Esogeni (g)'] + df_total_demand['Ossidazione Lipidica (g)']
-
-        chart_stack = alt.Chart(df_long_rich).mark_area().encode(
-            x=alt.X('Time (min)'),
-            y=alt.Y('Rate (g/h)', stack="zero"), # Usiamo stack="zero" per maggiore chiarezza
-            color=alt.Color('Source', 
-                            scale=alt.Scale(domain=color_domain,  
-                                            range=color_range),
-                            sort=alt.SortField(field='sort_index', order='ascending') 
-                           ),
-            tooltip=[
-                alt.Tooltip('Time (min)', title='Minuto'), 
-                alt.Tooltip('Source', title='Fonte'), 
-                alt.Tooltip('Rate (g/h)', title='Contributo (g/h)', format='.1f'),
-                alt.Tooltip('Percentuale', title='% del Totale')
-            ]
-        )
-        
-        line_demand = alt.Chart(df_total_demand).mark_line(color='black', strokeDash=[5,5], size=2).encode(
-            x='Time (min)',
-            y='Total Demand'
-        )
-
-        final_combo_chart = (chart_stack + line_demand).properties(
-            title="Bilancio Energetico: Richiesta vs. Fonti di Ossidazione" 
-        ).interactive()
-        
-        st.altair_chart(final_combo_chart, use_container_width=True)
+        if not use_lab:
+            # Se non usa il lab, mostra il vecchio slider crossover
+            crossover = st.slider("Crossover Point (Soglia Aerobica) [% Soglia]", 50, 85, 70, 5,
+                                  help="Punto in cui il consumo di grassi e carboidrati è equivalente.")
+            act_params['crossover_pct'] = crossover
+            if crossover > 75: st.caption("Profilo: Alta efficienza lipolitica (Diesel)")
+            elif crossover < 60: st.caption("Profilo: Prevalenza glicolitica (Turbo)")
         
         st.markdown("---")
-        st.markdown("### 📉 Confronto Riserve Nette (Svuotamento Serbatio)")
-        
-        st.caption("Confronto: Deplezione Glicogeno Totale (Muscolo + Fegato) con Zone di Rischio")
-        
-        # --- LOGICA PER GRAFICO CON BANDE DI RISCHIO BASATO SU TOTALE GLICOGENO ---
-        
-        initial_total_glycogen = tank_data['muscle_glycogen_g'] + tank_data['liver_glycogen_g']
-        max_total = initial_total_glycogen * 1.05 # Max per l'asse Y
-        
-        # Definisce i campi da mostrare nel grafico a pila delle riserve
-        reserve_fields = ['Residuo Muscolare', 'Residuo Epatico']
+        st.subheader("3. Calibrazione Fisiologica (Utenti Esperti)")
 
-        # Melt dei dati per la visualizzazione stacked
-        df_reserve_long = combined_df.melt(
-            id_vars=['Time (min)', 'Scenario', 'Stato'], 
-            value_vars=reserve_fields, 
-            var_name='Tipo Glicogeno', 
-            value_name='Residuo (g)'
+        # CHECKBOX PER PARAMETRI AVANZATI
+        use_custom_kinetic = st.checkbox(
+            "Usa parametri cinetici/fisiologici personalizzati",
+            help="Attiva questa opzione per calibrare τ (assorbimento), Rischio GI, Efficienza Ossidativa e Picco Ossidazione.",
+            value=False
         )
         
-        # Mappatura colori specifica per le riserve (chiaro per Muscolo, scuro per Fegato critico)
-        reserve_color_map = {
-            'Residuo Muscolare': '#E57373', # Rosso tenue
-            'Residuo Epatico': '#B71C1C',   # Rosso scuro/critico
-        }
-        
-        # 1. Definizione delle zone di rischio (Basato su Riserva Totale)
-        zones_df = pd.DataFrame({
-            'Zone': ['Sicurezza (Verde)', 'Warning (Giallo)', 'Critico (Rosso)'],
-            'Start': [initial_total_glycogen * 0.65, initial_total_glycogen * 0.30, 0],
-            'End': [initial_total_glycogen * 1.05, initial_total_glycogen * 0.65, initial_total_glycogen * 0.30],
-            'Color': ['#4CAF50', '#FFC107', '#F44336'], 
-        })
-        
-        # Creazione dei grafici affiancati utilizzando la divisione dei dati e la combinazione dei layer
+        TAU_DEFAULT = 20.0
+        EFFICIENCY_DEFAULT = 0.80
         
-        col_strat, col_digi = st.columns(2)
+        tau_absorption_input = TAU_DEFAULT
+        oxidation_efficiency_input = EFFICIENCY_DEFAULT
+        custom_max_exo_rate = None 
 
-        def create_reserve_chart(df_data, title, background_df):
-            
-            # Layer Sfondo
-            background = alt.Chart(background_df).mark_rect(opacity=0.15).encode(
-                y=alt.Y('Start', title='Glicogeno Residuo (g)', axis=None),
-                y2=alt.Y2('End'),         
-                color=alt.Color('Color', scale=None), 
-                tooltip=['Zone']
-            ).properties(
-                title=title
+        if use_custom_kinetic:
+            tau_absorption_input = st.slider(
+                "Tau (τ) Cinetica Assorbimento (min)", 
+                5.0, 60.0, TAU_DEFAULT, 2.5, 
+                help="Tempo di 'smussamento'. Minore è il valore, più veloce è l'assorbimento."
+            )
+            # La Soglia di Rischio GI non influenza la simulazione: è nel fragment del grafico intestinale
+            st.caption("La Soglia di Rischio GI si regola direttamente sul grafico di Accumulo Intestinale.")
+            
+            st.markdown("#### Fisiologia Ossidativa")
+            oxidation_efficiency_input = st.slider(
+                "Efficienza di Ossidazione (%)",
+                0.50, 1.00, EFFICIENCY_DEFAULT, 0.01,
+                format="%.2f",
+                help="Percentuale di CHO ingeriti che viene effettivamente ossidata (Podlogar et al., 2025: 58-83%)."
             )
-
-            # Layer Area Accatastata
-            area_chart = alt.Chart(df_data).mark_area().encode(
-                x=alt.X('Time (min)', title='Durata (min)'),
-                y=alt.Y('Residuo (g)', title='Glicogeno Residuo (g)', stack="zero", scale=alt.Scale(domain=[0, max_total])),
-                color=alt.Color('Tipo Glicogeno', scale=alt.Scale(domain=reserve_fields, range=[reserve_color_map[f] for f in reserve_fields])),
-                order=alt.Order('Tipo Glicogeno', sort='ascending'), # Epatico in basso, Muscolare sopra
-                tooltip=['Time (min)', 'Tipo Glicogeno', 'Residuo (g)', 'Stato']
-            ).interactive()
-            
-            return alt.layer(background, area_chart).properties(height=350)
-            
-        # Grafico 1: Strategia con Integrazione
-        df_strat = df_reserve_long[df_reserve_long['Scenario'] == 'Con Integrazione (Strategia)']
-        chart_strat = create_reserve_chart(df_strat, 'Con Integrazione (Strategia)', zones_df)
-        
-        with col_strat:
-            st.altair_chart(chart_strat, use_container_width=True)
-
-        # Grafico 2: Senza Integrazione
-        df_digi = df_reserve_long[df_reserve_long['Scenario'] == 'Senza Integrazione (Digiuno)']
-        chart_digi = create_reserve_chart(df_digi, 'Senza Integrazione (Digiuno)', zones_df)
-        
-        with col_digi:
-            st.altair_chart(chart_digi, use_container_width=True)
-            
-        st.markdown(f"""
-        <p style='text-align: center; font-size: small; color: #666;'>
-        Il Glicogeno Epatico (<span style='color: #B71C1C;'>Rosso Scuro</span>) è alla base per evidenziare il rischio di Ipoglicemia (crisi del fegato).
-        </p>
-        """, unsafe_allow_html=True)
-        # --- FINE LOGICA GRAFICO RISERVE NETTE ---
-        
-        st.markdown("---")
-        
-        st.markdown("### ⚠️ Accumulo Intestinale (Rischio GI) & Flusso CHO")
-        
-        st.caption(f"""
-        **Interpretazione:** La distanza verticale tra la Linea Blu (Ingerito) e la Linea Verde (Ossidato) crea l'**Accumulo CHO (g)**, ovvero il carico intestinale istantaneo. Se l'area supera la Soglia di Rischio GI ({risk_threshold_input} g), la strategia di assunzione è troppo aggressiva.
-        """)
-
-        with st.expander("Dettagli Modello Flusso CHO e Rischio GI"):
-            st.markdown(f"""
-            Questo grafico visualizza il **bilancio dinamico** tra ciò che ingerisci e ciò che il tuo corpo riesce ad ossidare (bruciare), indicando il rischio di *Distress Gastrointestinale (GI)*.
-            
-            **Linee Cumulative (Asse Destro):**
-            * **Linea Blu (Intake):** Apporto totale di CHO (a gradini, riflette le assunzioni discrete).
-            * **Linea Verde (Ossidazione):** CHO totale bruciato (curva smussata, limitata dalla cinetica di assorbimento).
             
-            **Area di Rischio (Asse Sinistro):**
-            * L'area sottesa è l'**Accumulo Intestinale (Gut Load)**: $\\text{{Intake}} - \\text{{Ossidazione}}$.
-            * **τ Cinetica (Tempo di Smussamento):** {tau_absorption_input:.1f} min. Determina quanto velocemente la curva di Ossidazione (Verde) risponde all'Ingestione (Blu).
-            * **Soglia di Rischio GI:** {risk_threshold_input} g (Linea Rossa Tratteggiata). Superarla indica un alto rischio di sintomi GI.
-            """)
-        
-        RISK_THRESHOLD = risk_threshold_input
-        
-        df_sim['Rischio'] = np.where(df_sim['Gut Load'] >= RISK_THRESHOLD, 'Alto Rischio', 'Basso Rischio')
-        
-        max_gut_load = df_sim['Gut Load'].max()
-        max_gut_load_time = df_sim[df_sim['Gut Load'] == max_gut_load]['Time (min)'].iloc[0] if max_gut_load > 0 else 0
-        max_df = pd.DataFrame([{'Time (min)': max_gut_load_time, 'Gut Load': max_gut_load}])
+            use_manual_peak = st.checkbox("Inserisci manualmente il Picco Ossidazione Esogena (g/min)")
+            if use_manual_peak:
+                custom_max_exo_rate = st.slider(
+                    "Picco Ossidazione Esogena (g/min)",
+                    0.5, 2.0, 1.0, 0.1,
+                    help="Massimo tasso di ossidazione di glucosio esogeno (Standard: ~1.0 g/min)."
+                )
 
-        gut_area = alt.Chart(df_sim).mark_area(opacity=0.8, color='#8D6E63').encode(
-            x=alt.X('Time (min)'), 
-            y=alt.Y('Gut Load', title='Accumulo CHO (g)', axis=alt.Axis(titleColor='#8D6E63')),
-            tooltip=['Time (min)', 'Gut Load', 'Rischio']
+        else:
+             st.caption(f"Utilizzo parametri standard: τ={TAU_DEFAULT:.0f}m, Rischio={RISK_THRESHOLD_DEFAULT}g, Eff={EFFICIENCY_DEFAULT*100:.0f}%")
+
+        use_gut_model = st.checkbox(
+            "Modello intestinale a compartimenti (SGLT1/GLUT5)",
+            help="Stomaco, intestino, trasporto SGLT1 (glucosio) e GLUT5 (fruttosio), sangue e fegato, "
+                 "integrati con un solutore a passo adattivo. τ diventa il tempo di svuotamento gastrico e "
+                 "l'Accumulo Intestinale è il CHO non ancora assorbito.",
+            value=False, key="gut_model_enabled"
         )
-        
-        risk_line = alt.Chart(pd.DataFrame({'y': [RISK_THRESHOLD]})).mark_rule(color='#F44336', strokeDash=[4,4], size=2).encode(
-            y=alt.Y('y', axis=None)
+        gut_model = GutParams() if use_gut_model else None
+
+    # Parametri immutabili e hashabili (chiave di cache, archivio, Monte Carlo)
+    activity = ActivityParams.from_dict(act_params)
+
+    # Prima risposta immediata dalle tabelle di popolazione, sostituita dalla simulazione esatta
+    quick_estimate = st.empty()
+    population_table = get_population_table()
+    if population_table is not None and intensity_series is None and feeding_plan is None and gut_model is None:
+        guess = population_table.simulation_estimate(
+            tank_data, subj, duration, carb_intake, cho_per_unit, tau_absorption_input, activity,
+            oxidation_efficiency=oxidation_efficiency_input, custom_max_exo_rate=custom_max_exo_rate,
+            mix_type=selected_mix_type)
+        if guess is not None:
+            bonk_text = f"crisi a ~{guess['bonk_min']:.0f} min" if guess['bonk_min'] is not None else "nessuna crisi"
+            quick_estimate.info(f"⚡ Stima dalle tabelle di popolazione: {bonk_text}, residuo finale "
+                                f"~{guess['final_total_g']:.0f} g. Simulazione esatta in corso…")
+    
+    with perf_span("simulate", scenario="strategia", duration_min=duration):
+        df_sim, stats = cached_call(
+            simulate_metabolism, tank_data, duration, carb_intake, cho_per_unit, crossover, 
+            tau_absorption_input, subj, activity,
+            oxidation_efficiency_input=oxidation_efficiency_input,
+            custom_max_exo_rate=custom_max_exo_rate,
+            mix_type_input=selected_mix_type,
+            intensity_series=intensity_series, # Passa la serie IF istantanea
+            feeding_plan=feeding_plan,
+            gut_model=gut_model
         )
-        
-        max_point = alt.Chart(max_df).mark_circle(size=80, color='black').encode(
-            x=alt.X('Time (min)'), 
-            y=alt.Y('Gut Load'),
-            tooltip=[alt.Tooltip('Time (min)', title='Max Time'), alt.Tooltip('Gut Load', title='Max Accumulo')]
+    df_sim["Scenario"] = "Con Integrazione (Strategia)"
+    
+    with perf_span("simulate", scenario="digiuno", duration_min=duration):
+        df_no_cho, stats_no_cho = cached_call(
+            simulate_metabolism, tank_data, duration, 0, cho_per_unit, crossover, 
+            tau_absorption_input, subj, activity,
+            oxidation_efficiency_input=oxidation_efficiency_input,
+            custom_max_exo_rate=custom_max_exo_rate,
+            mix_type_input=selected_mix_type,
+            intensity_series=intensity_series, # Passa la serie IF istantanea
+            gut_model=gut_model
         )
-        
-        gut_layer_base = alt.layer(gut_area, risk_line, max_point)
+    df_no_cho["Scenario"] = "Senza Integrazione (Digiuno)"
+    quick_estimate.empty()
+    
+    combined_df = pd.concat([df_sim, df_no_cho])
+    render_export(lambda: export.frame_chunks(combined_df), "simulazione_minuto", key="export_sim")
+    
+    st.markdown("---")
+    st.subheader("Analisi Cinetica e Substrati")
+    
+    c_if, c_rer, c_mix, c_res = st.columns(4)
+    
+    if_val = stats['intensity_factor']
+    c_if.metric("Intensity Factor (IF)", f"{if_val:.2f}", help="Indice di intensità normalizzato sulla soglia.")
+    
+    rer_val = stats['avg_rer']
+    c_rer.metric("RER Stimato (RQ)", f"{rer_val:.2f}", help="Quoziente Respiratorio Metabolico.")
+    
+    c_mix.metric("Ripartizione Substrati", f"{int(stats['cho_pct'])}% CHO",
+                  delta=f"{100-int(stats['cho_pct'])}% FAT", delta_color="off")
+    
+    c_res.metric("Glicogeno Residuo", f"{int(stats['final_glycogen'])} g", 
+                  delta=f"{int(stats['final_glycogen'] - start_tank)} g")
 
-        df_cumulative = df_sim.melt('Time (min)', value_vars=['Intake Cumulativo (g)', 'Ossidazione Cumulativa (g)'],
-                                   var_name='Flusso', value_name='Grammi')
+    st.markdown("---")
+    
+    m1, m2, m3 = st.columns(3)
+    m1.metric("Uso Glicogeno Muscolare", f"{int(stats['total_muscle_used'])} g", help="Totale svuotato dalle gambe")
+    m2.metric("Uso Glicogeno Epatico", f"{int(stats['total_liver_used'])} g", help="Totale prelevato dal fegato")
+    m3.metric("Uso CHO Esogeno", f"{int(stats['total_exo_used'])} g", help="Totale energia da integrazione")
 
-        intake_oxidation_lines = alt.Chart(df_cumulative).mark_line(strokeWidth=3.5).encode(
-            x=alt.X('Time (min)'), 
-            y=alt.Y('Grammi', title='G Ingeriti/Ossidati (g)', axis=alt.Axis(titleColor='#1976D2')),
-            color=alt.Color('Flusso', 
-                            scale=alt.Scale(domain=['Intake Cumulativo (g)', 'Ossidazione Cumulativa (g)'],
-                                            range=['#1976D2', '#4CAF50'])
-                           ),
-            strokeDash=alt.condition(alt.datum.Flusso == 'Ossidazione Cumulativa (g)', alt.value([5, 5]), alt.value([0])),
-            tooltip=['Time (min)', 'Flusso', 'Grammi']
+    
+    render_energy_balance_chart(df_sim)
+    
+    st.markdown("---")
+    render_reserve_charts(combined_df, tank_data)
+    
+    st.markdown("---")
+    
+    render_gut_chart(df_sim, tau_absorption_input, use_custom_kinetic)
+    if "gut_model" in stats:
+        gut_stats = stats["gut_model"]
+        st.caption(f"Modello a compartimenti: {gut_stats['solver_steps']} passi adattivi "
+                   f"({gut_stats['rhs_evaluations']} valutazioni) su {gut_stats['segments']} tratti tra eventi · "
+                   f"assorbiti {gut_stats['absorbed_g']:.0f} g, stoccati senza ossidazione {gut_stats['stored_g']:.0f} g.")
+    
+    st.caption("Ossidazione Lipidica (Tasso Orario)")
+    with perf_span("chart", chart="lipid"):
+        df_fat_chart = decimation.decimate_simulation(df_sim, ['Ossidazione Lipidica (g)'],
+                                                      width_px=decimation.CHART_WIDTH_FULL_PX)
+        st.line_chart(df_fat_chart.set_index("Time (min)")["Ossidazione Lipidica (g)"], color="#FFA500")
+    
+    st.markdown("---")
+    
+    st.subheader("Strategia & Timing")
+    
+    liver_bonk_time = df_sim[df_sim['Residuo Epatico'] <= 0]['Time (min)'].min()
+    muscle_bonk_time = df_sim[df_sim['Residuo Muscolare'] <= 20]['Time (min)'].min()
+    bonk_time = min(filter(lambda x: not np.isnan(x), [liver_bonk_time, muscle_bonk_time]), default=None)
+    
+    s1, s2 = st.columns([2, 1])
+    with s1:
+        if bonk_time:
+            st.error(f"CRITICITÀ RILEVATA AL MINUTO {int(bonk_time)}")
+            if not np.isnan(liver_bonk_time) and liver_bonk_time == bonk_time:
+                st.write("Causa Primaria: **Esaurimento Glicogeno Epatico (Ipoglicemia)**.")
+            else:
+                st.write("Causa Primaria: **Esaurimento Glicogeno Muscolare**.")
+        else:
+            st.success("STRATEGIA SOSTENIBILE")
+            st.write("Il bilancio energetico stimato consente di completare la prova senza deplezione critica.")
+    
+    with s2:
+        if bonk_time:
+            st.metric("Tempo Limite Stimato", f"{int(bonk_time)} min", delta_color="inverse")
+        else:
+            st.metric("Buffer Energetico", "Adeguato")
+    
+    st.markdown("### 📋 Cronotabella di Integrazione")
+    
+    if feeding_plan is not None:
+        schedule = report.plan_schedule(feeding_plan)
+        if schedule:
+            st.table(pd.DataFrame(schedule))
+        else:
+            st.info("Nessun evento nel piano di integrazione.")
+    elif carb_intake > 0 and cho_per_unit > 0:
+        schedule = report.intake_schedule(duration, carb_intake, cho_per_unit)
+        if schedule:
+            st.table(pd.DataFrame(schedule))
+        else:
+            st.info("Durata troppo breve per l'intervallo di assunzione calcolato.")
+    else:
+        schedule = []
+        st.info("Nessuna integrazione pianificata.")
+
+    # --- REPORT STAMPABILE (RENDERING IN BACKGROUND) ---
+    with st.expander("🖨️ Report Gara Stampabile (PDF / PNG)"):
+        summary = [
+            f"Durata: {int(duration)} min  ·  IF: {if_val:.2f}  ·  Integrazione: {carb_intake} g/h "
+            + (f"(piano a eventi, {selected_mix_type.label})" if feeding_plan is not None
+               else f"({cho_per_unit} g per unità, {selected_mix_type.label})"),
+            f"Glicogeno di partenza: {int(start_tank)} g  ·  Residuo finale: {int(stats['final_glycogen'])} g  ·  "
+            + (f"Crisi stimata al minuto {int(bonk_time)}" if bonk_time else "Strategia sostenibile"),
+        ]
+        report_data = report.report_data(
+            "Report Gara - Glycogen Simulator Pro", summary, df_sim, df_no_cho, schedule,
+            st.session_state.get('gut_risk_threshold', RISK_THRESHOLD_DEFAULT),
         )
+        render_race_report(report_data)
+
+    # --- MONTE CARLO (JOB IN BACKGROUND) ---
+    mc_race = {
+        "duration": duration, "carb_intake": carb_intake, "cho_per_unit": cho_per_unit,
+        "crossover": crossover, "tau_absorption": tau_absorption_input,
+        "custom_max_exo_rate": custom_max_exo_rate, "mix_type": selected_mix_type,
+        "activity_params": activity, "intensity_series": intensity_series, "feeding_plan": feeding_plan,
+        "gut_model": gut_model,
+    }
+    st.session_state['mc_inputs_key'] = cache.make_key("monte_carlo", tank_data, subj, mc_race)
+    
+    with st.expander("🎲 Analisi Monte Carlo (in background)"):
+        st.caption("Ripete la simulazione variando intensità, CHO assunti, assorbimento, efficienza di ossidazione "
+                   "e serbatoio iniziale. Il calcolo procede in background: puoi continuare a usare l'app.")
+        mc_c1, mc_c2 = st.columns(2)
+        mc_runs = mc_c1.slider("Numero di Simulazioni", 100, 2000, 500, 100)
+        mc_seed = mc_c2.number_input("Seed", 0, 10**6, 0)
+        
+        if st.button("▶️ Avvia Monte Carlo"):
+            runner = get_job_runner()
+            if st.session_state.get('mc_job'):
+                runner.cancel(st.session_state['mc_job'])
+            job = runner.submit("Monte Carlo", analyses.monte_carlo_tasks(tank_data, subj, mc_race, mc_runs, seed=mc_seed),
+                                meta={'inputs_key': st.session_state['mc_inputs_key']}, session=_session_id())
+            st.session_state['mc_job'] = job.id
+        
+        render_job('mc_job', render_monte_carlo_results)
+
+    # --- MAPPA INTEGRAZIONE x INTENSITÀ ---
+    with st.expander("🗺️ Mappa Integrazione × Intensità"):
+        st.caption("Tempo alla crisi e glicogeno residuo per ogni combinazione di CHO/h e IF costante, "
+                   "a parità di tutti gli altri parametri.")
+        sweep_args = {
+            "tank": tank_data,
+            "args": (cho_per_unit, tau_absorption_input, subj, activity),
+            "kwargs": {"oxidation_efficiency": oxidation_efficiency_input,
+                       "custom_max_exo_rate": custom_max_exo_rate, "mix_type": selected_mix_type,
+                       "gut_model": gut_model},
+        }
+        render_sweep_heatmap(sweep_args, duration, carb_intake, if_val)
+
+    # --- GARA A TAPPE ---
+    with st.expander("🏁 Gara a Tappe (Recupero Notturno Incluso)"):
+        st.caption("Le tappe sono simulate al minuto, il recupero tra un arrivo e la partenza successiva "
+                   "ora per ora (stesso modello del Tab 2). Gli altri parametri sono quelli della strategia attuale.")
+        stage_args = {
+            "tank": tank_data, "subject": subj, "activity": activity,
+            "intake": IntakeParams(carb_intake, cho_per_unit, selected_mix_type),
+            "absorption": AbsorptionParams(tau_absorption_input, oxidation_efficiency_input, custom_max_exo_rate,
+                                           gut_model),
+        }
+        render_stage_race(stage_args, duration, carb_intake, if_val)
 
-        cumulative_layer = intake_oxidation_lines.encode(
-            y=alt.Y('Grammi', 
-                    axis=alt.Axis(title='G Ingeriti/Ossidati (g)', titleColor='#1976D2', orient='right'), 
-                    scale=alt.Scale(domain=[0, df_sim['Intake Cumulativo (g)'].max() * 1.1])
-                    )
-        )
-        
-        final_gut_chart = alt.layer(
-            gut_layer_base,
-            cumulative_layer
-        ).resolve_scale(
-            y='independent'
-        ).properties(
-            title="Accumulo Intestinale vs Flusso CHO (Doppio Asse Y)"
-        )
+    # --- ARCHIVIO STORICO ---
+    if archive_engine is not None:
+        st.markdown("---")
+        race_params = {
+            "subject": subj, "tank": tank_data, "duration": duration,
+            "carb_intake": carb_intake, "cho_per_unit": cho_per_unit, "crossover": crossover,
+            "tau_absorption": tau_absorption_input, "oxidation_efficiency": oxidation_efficiency_input,
+            "custom_max_exo_rate": custom_max_exo_rate, "mix_type": selected_mix_type,
+            "activity_params": activity, "intensity_series": intensity_series, "feeding_plan": feeding_plan,
+            "gut_model": gut_model,
+        }
+        render_archive_panel(race_params, df_sim, stats, df_no_cho, stats_no_cho,
+                             default_scenario=f"{int(carb_intake)} g/h - IF {if_val:.2f}")
 
+with tab3:
+    render_race_simulation()
 
-        st.altair_chart(final_gut_chart, use_container_width=True)
-        
-        st.caption("Ossidazione Lipidica (Tasso Orario)")
-        st.line_chart(df_sim.set_index("Time (min)")["Ossidazione Lipidica (g)"], color="#FFA500")
-        
-        st.markdown("---")
-        
-        st.subheader("Strategia & Timing")
-        
-        liver_bonk_time = df_sim[df_sim['Residuo Epatico'] <= 0]['Time (min)'].min()
-        muscle_bonk_time = df_sim[df_sim['Residuo Muscolare'] <= 20]['Time (min)'].min()
-        bonk_time = min(filter(lambda x: not np.isnan(x), [liver_bonk_time, muscle_bonk_time]), default=None)
-        
-        s1, s2 = st.columns([2, 1])
-        with s1:
-            if bonk_time:
-                st.error(f"CRITICITÀ RILEVATA AL MINUTO {int(bonk_time)}")
-                if not np.isnan(liver_bonk_time) and liver_bonk_time == bonk_time:
-                    st.write("Causa Primaria: **Esaurimento Glicogeno Epatico (Ipoglicemia)**.")
-                else:
-                    st.write("Causa Primaria: **Esaurimento Glicogeno Muscolare**.")
-            else:
-                st.success("STRATEGIA SOSTENIBILE")
-                st.write("Il bilancio energetico stimato consente di completare la prova senza deplezione critica.")
-        
-        with s2:
-            if bonk_time:
-                st.metric("Tempo Limite Stimato", f"{int(bonk_time)} min", delta_color="inverse")
-            else:
-                st.metric("Buffer Energetico", "Adeguato")
+# --- DEBUG PRESTAZIONI (OPZIONALE) ---
+# Pannello attivo con GLICOGENO_DEBUG=1 oppure aggiungendo ?debug=1 all'URL
+@st.fragment
+def render_perf_panel():
+    """
+    Tempi di avvio e di caricamento dei moduli differiti, span di tempo degli ultimi rerun
+    della sessione con esportazione JSONL, e occupazione dell'archivio degli artefatti di sessione.
+    """
+    perf_log = st.session_state['perf_log']
+    with st.expander("🛠️ Debug Prestazioni"):
+        st.button("🔄 Aggiorna", key='perf_refresh')
+        
+        mem = get_artifact_store().metrics()
+        mb = lambda n: f"{n / 2**20:.1f} MB" if n >= 2**20 else f"{n / 1024:.0f} KB"
+        st.markdown("**Memoria artefatti di sessione**")
+        m1, m2, m3, m4 = st.columns(4)
+        m1.metric("Questa sessione", mb(get_artifact_store().session_bytes(_session_id())),
+                  help=f"Budget per sessione: {mb(mem['session_budget'])}")
+        m2.metric("Tutte le sessioni", mb(mem['bytes']),
+                  help=f"Budget globale: {mb(mem['global_budget'])} · input {mb(mem['input_bytes'])}, "
+                       f"derivati {mb(mem['derived_bytes'])}")
+        m3.metric("Sessioni", mem['sessions'])
+        m4.metric("Scarti / Ricalcoli", f"{mem['evictions']} / {mem['recomputes']}")
+        
+        pool = get_job_runner().queue_stats()
+        st.markdown("**Pool di calcolo condiviso**")
+        q1, q2, q3, q4 = st.columns(4)
+        q1.metric("Worker occupati", f"{pool['in_flight']} / {pool['workers']}")
+        q2.metric("Task in coda", pool['queued'], help=f"Sessioni in attesa: {len(pool['waiting_sessions'])}")
+        q3.metric("Calcoli interattivi", pool['calls'])
+        q4.metric("Task completati / falliti", f"{pool['completed']} / {pool['failed']}",
+                  help=f"Pool ricreati dopo la perdita di un worker: {pool['pool_restarts']}")
+        
+        startup_record = {
+            "scope": "startup", "session_id": perf_log.session_id, "process": dict(startup.TIMINGS),
+            "session_first_render_ms": st.session_state.get('first_render_ms'),
+            "lazy_modules": lazy.load_report(),
+        }
+        st.markdown("**Avvio**")
+        s1, s2, s3, s4 = st.columns(4)
+        fmt_ms = lambda v: f"{v:.0f} ms" if v is not None else "—"
+        s1.metric("Import script", fmt_ms(startup.TIMINGS.get('script_imports_ms')),
+                  help="Import eseguiti subito dallo script, misurati al primo avvio del processo.")
+        s2.metric("Pagina di login", fmt_ms(startup.TIMINGS.get('login_render_ms')))
+        s3.metric("Primo render (processo)", fmt_ms(startup.TIMINGS.get('first_render_ms')))
+        s4.metric("Primo render (sessione)", fmt_ms(startup_record['session_first_render_ms']))
+        df_lazy = pd.DataFrame(startup_record['lazy_modules']).rename(
+            columns={"module": "Modulo", "state": "Stato", "first_use_ms": "Caricamento al primo uso (ms)"})
+        st.dataframe(df_lazy.round(1), hide_index=True, use_container_width=True)
+        
+        st.download_button("⬇️ Esporta JSONL", json.dumps(startup_record) + "\n" + perf_log.to_jsonl(),
+                           file_name=f"perf_{perf_log.session_id}.jsonl", mime="application/x-ndjson",
+                           help="La prima riga contiene i tempi di avvio, le successive gli span dei rerun.")
+        
+        records = perf_log.records()
+        if not records:
+            st.caption("Nessun rerun registrato.")
+            return
+        
+        rows = [
+            {"Rerun": r['started'], "Scope": r['scope'], "Totale (ms)": r['total_ms'],
+             "Fase": span['name'], "Dettaglio": " ".join(f"{k}={v}" for k, v in span.items()
+                                                         if k not in ('name', 'start_ms', 'duration_ms')),
+             "Inizio (ms)": span['start_ms'], "Durata (ms)": span['duration_ms']}
+            for r in reversed(records) for span in r['spans']
+        ]
+        df_spans = pd.DataFrame(rows)
         
-        st.markdown("### 📋 Cronotabella di Integrazione")
+        st.markdown("**Mediana per fase (ultimi rerun)**")
+        summary = df_spans.groupby(['Fase', 'Dettaglio'])['Durata (ms)'].agg(['count', 'median', 'max']).round(1)
+        st.dataframe(summary, use_container_width=True)
         
-        if carb_intake > 0 and cho_per_unit > 0:
-            units_per_hour = carb_intake / cho_per_unit
-            if units_per_hour > 0:
-                interval_min = 60 / units_per_hour
-                interval_int = int(interval_min)
-                
-                schedule = []
-                current_time = interval_int
-                total_cho_ingested = 0
-                
-                while current_time <= duration:
-                    total_cho_ingested += cho_per_unit
-                    schedule.append({
-                        "Minuto": current_time,
-                        "Azione": f"Assumere 1 unità ({cho_per_unit}g CHO)",
-                        "Totale Ingerito": f"{total_cho_ingested}g"
-                    })
-                    current_time += interval_int
-                
-                if schedule:
-                    st.table(pd.DataFrame(schedule))
-                else:
-                    st.info("Durata troppo breve per l'intervallo di assunzione calcolato.")
-            else:
-                st.warning("Verificare i parametri di integrazione.")
-        else:
-            st.info("Nessuna integrazione pianificata.")
+        st.markdown("**Dettaglio span**")
+        st.dataframe(df_spans.round(1), hide_index=True, use_container_width=True)
+
+# --- MISURE DI AVVIO ---
+# Primo render completo del processo (container appena avviato) e della sessione
+startup.record("first_render_ms", startup.since(_SCRIPT_T0))
+if 'first_render_ms' not in st.session_state:
+    st.session_state['first_render_ms'] = startup.since(_SCRIPT_T0)
+
+st.session_state['perf_log'].end("app")
+if os.environ.get("GLICOGENO_DEBUG") == "1" or st.query_params.get("debug") == "1":
+    render_perf_panel()
@@ -0,0 +1,30 @@
+import pytest
+
+from glicogeno import equivalence, reference
+
+
+def _within_tolerance(report):
+    return (report["max_abs"] <= equivalence.DEFAULT_ABS_TOL) | (report["max_rel"] <= equivalence.DEFAULT_REL_TOL)
+
+
+@pytest.mark.parametrize("target", sorted(equivalence.REFERENCES))
+def test_default_candidate_matches_reference(target):
+    candidate = equivalence.load_callable(equivalence.DEFAULT_CANDIDATES[target])
+    report, _, _ = equivalence.run_harness(target, candidate, n_cases=10, seed=1)
+    ok = _within_tolerance(report)
+    assert ok.all(), report[~ok]
+
+
+def test_harness_flags_a_deviating_candidate():
+    def candidate(*args, **kwargs):
+        df, stats = reference.simulate_metabolism(*args, **kwargs)
+        df["Residuo Muscolare"] = df["Residuo Muscolare"] + 0.5
+        return df, stats
+
+    report, _, _ = equivalence.run_harness("simulate", candidate, n_cases=3)
+    assert not _within_tolerance(report)["Residuo Muscolare"]
+    assert _within_tolerance(report)["Residuo Epatico"]
+
+
+def test_cli_exit_code():
+    assert equivalence.main(["--target", "taper", "--cases", "3"]) == 0
@@ -0,0 +1,49 @@
+import pandas as pd
+import pytest
+from openpyxl import load_workbook
+from streamlit.testing.v1 import AppTest
+
+from glicogeno import export
+
+
+def _frame(rows):
+    return pd.DataFrame({"Time (min)": range(rows), "Residuo Totale": [1.5] * rows, "Scenario": ["x"] * rows})
+
+
+def _download_app(fmt, rows):
+    import pandas as pd
+    import streamlit as st
+
+    from glicogeno import export
+
+    df = pd.DataFrame({"Time (min)": range(rows), "Residuo Totale": [1.5] * rows, "Scenario": ["x"] * rows})
+    st.download_button("Esporta", export.export_bytes(export.frame_chunks(df), fmt),
+                       file_name=f"test.{fmt}", mime=export.MIME_TYPES[fmt])
+
+
+@pytest.mark.parametrize("fmt", export.FORMATS)
+def test_download_button_accepts_every_format(fmt):
+    # Più di un blocco, come nelle esportazioni reali
+    at = AppTest.from_function(_download_app, args=(fmt, export.CHUNK_ROWS + 1)).run()
+    assert not at.exception
+
+
+@pytest.mark.parametrize("fmt", ["csv", "xlsx"])
+def test_chunks_round_trip(fmt, tmp_path):
+    df = _frame(export.CHUNK_ROWS * 2 + 3)
+    path = tmp_path / f"out.{fmt}"
+    with open(path, "wb") as out:
+        assert export.export_chunks(export.frame_chunks(df), fmt, out) == len(df)
+    back = pd.read_csv(path) if fmt == "csv" else pd.read_excel(path)
+    pd.testing.assert_frame_equal(back, df, check_dtype=False)
+
+
+def test_xlsx_row_limit_counts_header(tmp_path, monkeypatch):
+    monkeypatch.setattr(export, "EXCEL_MAX_ROWS", 10)
+    with open(tmp_path / "full.xlsx", "wb") as out:
+        # 9 righe di dati + intestazione = limite del foglio
+        assert export.write_xlsx(export.frame_chunks(_frame(9), 4), out) == 9
+    assert load_workbook(tmp_path / "full.xlsx")["Dati"].max_row == 10
+
+    with open(tmp_path / "over.xlsx", "wb") as out, pytest.raises(ValueError):
+        export.write_xlsx(export.frame_chunks(_frame(10), 4), out)
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+from glicogeno.bench import ACTIVITY_PARAMS, bench_subject
+from glicogeno.engine import AbsorptionParams, ActivityParams, IntakeParams, calculate_tank, simulate_metabolism
+from glicogeno.gut import GutParams
+from glicogeno.scenario import bonk_minute
+from glicogeno.stagerace import Stage, race_day, simulate_stage_race
+
+
+@pytest.fixture(scope="module")
+def athlete():
+    subject = bench_subject()
+    return subject, calculate_tank(subject)
+
+
+@pytest.mark.parametrize("mode", sorted(ACTIVITY_PARAMS))
+@pytest.mark.parametrize("intake_g_h", [0, 90])
+@pytest.mark.parametrize("variable_if", [False, True])
+@pytest.mark.parametrize("gut_model", [None, GutParams()], ids=["filtro", "compartimenti"])
+def test_race_day_matches_simulate_metabolism(athlete, mode, intake_g_h, variable_if, gut_model):
+    subject, tank = athlete
+    activity = ActivityParams.from_dict(ACTIVITY_PARAMS[mode])
+    series = np.clip(0.7 + 0.2 * np.sin(np.arange(300) / 17), 0.4, 1.1).tolist() if variable_if else None
+    df, stats = simulate_metabolism(tank, 300, intake_g_h, 25, None, 20.0, subject, activity,
+                                    intensity_series=series, gut_model=gut_model)
+    day = race_day(tank["muscle_glycogen_g"], tank["liver_glycogen_g"], subject, 300, activity,
+                   IntakeParams(intake_g_h, 25), AbsorptionParams(gut_model=gut_model), series)
+
+    np.testing.assert_allclose(day["muscle"], df["Residuo Muscolare"], atol=1e-9)
+    np.testing.assert_allclose(day["liver"], df["Residuo Epatico"], atol=1e-9)
+    np.testing.assert_allclose(day["gut"], df["Gut Load"], atol=1e-9)
+    assert day["bonk_min"] == bonk_minute(df)
+    assert day["exo_used"] == pytest.approx(stats["total_exo_used"], abs=1e-6)
+
+
+def test_stages_chain_through_recovery(athlete):
+    subject, tank = athlete
+    stages = [Stage(duration_min=240, recovery_cho_g=900)] * 3
+    df_stages, df_timeline = simulate_stage_race(tank, subject, stages, ACTIVITY_PARAMS["cycling"],
+                                                 IntakeParams(80, 25))
+    assert list(df_stages["Tappa"]) == [1, 2, 3]
+    # La tappa successiva parte dallo stato a fine recupero
+    np.testing.assert_allclose(df_stages["Muscolo Partenza"].iloc[1:] + df_stages["Fegato Partenza"].iloc[1:],
+                               df_stages["Totale Fine Recupero"].iloc[:-1])
+    assert df_stages["Muscolo Partenza"].iloc[0] == tank["muscle_glycogen_g"]
+    assert (df_timeline["Fase"] == "Gara").sum() == 3 * 241
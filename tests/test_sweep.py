@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+from glicogeno.engine import simulate_metabolism
+from glicogeno.equivalence import random_simulate_case
+from glicogeno.gut import GutParams
+from glicogeno.scenario import bonk_minute
+from glicogeno.sweep import intake_intensity_sweep, simulate_grid
+
+
+@pytest.mark.parametrize("gut_model", [None, GutParams()], ids=["filtro", "compartimenti"])
+@pytest.mark.parametrize("seed", range(4))
+def test_grid_matches_per_cell_simulation(seed, gut_model):
+    rng = np.random.default_rng(seed)
+    args, kwargs = random_simulate_case(rng)
+    tank, duration, _, unit, crossover, tau, subject, activity = args
+    intakes = [0.0, 45.0, float(rng.uniform(20, 120))]
+    ifs = [0.6, float(rng.uniform(0.5, 1.1))]
+
+    grid = simulate_grid(tank, duration, intakes, ifs, unit, tau, subject, activity,
+                         kwargs["oxidation_efficiency_input"], kwargs["custom_max_exo_rate"],
+                         kwargs["mix_type_input"], gut_model=gut_model)
+    for i, intake in enumerate(intakes):
+        for j, if_val in enumerate(ifs):
+            df, _ = simulate_metabolism(tank, duration, intake, unit, crossover, tau, subject, activity,
+                                        oxidation_efficiency_input=kwargs["oxidation_efficiency_input"],
+                                        custom_max_exo_rate=kwargs["custom_max_exo_rate"],
+                                        mix_type_input=kwargs["mix_type_input"],
+                                        intensity_series=[if_val] * (duration + 1), gut_model=gut_model)
+            assert grid["final_total"][i, j] == pytest.approx(df["Residuo Totale"].iloc[-1], abs=1e-6)
+            assert grid["gut_peak"][i, j] == pytest.approx(df["Gut Load"].iloc[1:].max(), abs=1e-6)
+            expected = bonk_minute(df)
+            assert np.isnan(grid["bonk_min"][i, j]) if expected is None else grid["bonk_min"][i, j] == expected
+
+
+def test_long_format_covers_every_cell():
+    args, kwargs = random_simulate_case(np.random.default_rng(0))
+    tank, duration, _, unit, _, tau, subject, activity = args
+    df, stats = intake_intensity_sweep(tank, duration, np.linspace(0, 120, 7), np.linspace(0.5, 1.0, 5),
+                                       unit, tau, subject, activity)
+    assert len(df) == stats["cells"] == 35